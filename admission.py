@@ -0,0 +1,389 @@
+"""Admission control: concurrency limits per operation class and report cost checks
+
+Operations are admitted through a gate per class: 'analytics' for analysis
+operations, 'oltp' for everything else. A gate runs at most `limit`
+operations at once; the rest wait in line up to a timeout, and when too
+many are already waiting a new one is refused at once. A burst of reports
+therefore queues behind a few analytics slots instead of taking connections
+and buffer pool from transfers.
+
+Report queries additionally go through a ReportPolicy. Before running, the
+query is EXPLAINed and the rows MySQL expects to examine are estimated; a
+report above the limit is refused, or, when an off-peak window is
+configured, queued in DeferredReports and run in the window by a
+ReportRunner. Reports that are admitted carry a MAX_EXECUTION_TIME hint, so
+one that the estimate underrated is stopped by the server.
+"""
+import datetime
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+CLASSES = ('oltp', 'analytics')
+
+# MySQL error raised when MAX_EXECUTION_TIME stops a query
+QUERY_TIMEOUT = 3024
+
+# Seconds between checks of the off-peak window and the deferred queue
+RUNNER_INTERVAL = 60.0
+
+REPORT_ID = re.compile(r'^[0-9]{14}-[0-9a-f]{8}$')
+
+# Lock file held by the one runner serving a queue directory
+RUNNER_LOCK = 'runner.lock'
+
+
+class Overloaded(Exception):
+    """Raised when an operation cannot be admitted now"""
+    pass
+
+
+class ReportDeferred(Overloaded):
+    """Raised when a report is too large to run outside the off-peak window"""
+
+    def __init__(self, estimate: int, report_id: str = None, window: tuple = None):
+        self.estimate = estimate
+        self.report_id = report_id
+        if report_id:
+            message = (f"Report estimated to examine {estimate:,} rows was deferred to the "
+                       f"off-peak queue ({window[0]:02d}:00-{window[1]:02d}:00) as "
+                       f"{report_id}; fetch it with report_status")
+        else:
+            message = f"Report estimated to examine {estimate:,} rows must run off-peak"
+        super().__init__(message)
+
+
+def operation_class(kind: str) -> str:
+    return 'analytics' if kind == 'analysis' else 'oltp'
+
+
+def parse_limits(spec: str) -> dict:
+    """Parse "oltp:64,analytics:2" into {class: limit}; 0 means unlimited"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, limit = item.partition(':')
+        if name not in CLASSES or not limit.isdigit():
+            raise ValueError(f"Concurrency limit must be {'|'.join(CLASSES)}:N, not {item}")
+        limits[name] = int(limit)
+    return limits
+
+
+def parse_window(spec: str) -> tuple:
+    """Parse an off-peak window of whole hours, "22-6", into (22, 6); empty gives None"""
+    if not spec:
+        return None
+    start, _, end = spec.partition('-')
+    if not (start.isdigit() and end.isdigit()) or int(start) > 23 or int(end) > 23 \
+            or int(start) == int(end):
+        raise ValueError(f"Off-peak window must be START-END hours, e.g. 22-6, not {spec}")
+    return int(start), int(end)
+
+
+def in_window(window: tuple, now: datetime.datetime = None) -> bool:
+    """Whether now falls in a (start, end) hour window, which may wrap past midnight"""
+    if window is None:
+        return False
+    hour = (now or datetime.datetime.now()).hour
+    start, end = window
+    return start <= hour < end if start < end else hour >= start or hour < end
+
+
+def time_limited(query: str, milliseconds: int) -> str:
+    """query with a MAX_EXECUTION_TIME optimizer hint on its outer SELECT"""
+    return re.sub(r'^(\s*SELECT)\b', rf'\1 /*+ MAX_EXECUTION_TIME({milliseconds}) */',
+                  query, count=1, flags=re.IGNORECASE)
+
+
+def estimate_rows(db, query: str, params) -> int:
+    """Rows MySQL expects to examine for query, from its EXPLAIN plan
+
+    Each plan row examines `rows` for every row reaching it, and passes on
+    `filtered` percent of them to the next table of its join.
+    """
+    db.cursor.execute("EXPLAIN " + query, params)
+    examined = 0
+    reaching = 1.0
+    for step in db.cursor.fetchall():
+        rows = float(step.get('rows') or 0)
+        examined += reaching * rows
+        reaching *= rows * float(step.get('filtered') or 100) / 100
+    return int(examined)
+
+
+class Gate:
+    """At most `limit` operations of one class at once; later ones wait their turn
+
+    Up to max_waiting operations wait, each for at most `timeout` seconds;
+    past either bound Overloaded is raised. A limit of 0 admits everything.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = self.waiting = 0
+        self.admitted = self.queued = self.rejected = self.timed_out = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def enter(self):
+        if self.limit <= 0:
+            yield
+            return
+
+        with self._condition:
+            if self.active >= self.limit:
+                if self.waiting >= self.max_waiting:
+                    self.rejected += 1
+                    raise Overloaded(f"Too many {self.name} operations waiting; "
+                                     f"try again later")
+                self.waiting += 1
+                self.queued += 1
+                try:
+                    if not self._condition.wait_for(lambda: self.active < self.limit,
+                                                    self.timeout):
+                        self.timed_out += 1
+                        raise Overloaded(f"No {self.name} capacity within "
+                                         f"{self.timeout:g}s; try again later")
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._condition.notify()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'limit': self.limit, 'active': self.active, 'waiting': self.waiting,
+                    'admitted': self.admitted, 'queued': self.queued,
+                    'rejected': self.rejected, 'timed_out': self.timed_out}
+
+
+class AdmissionGates:
+    """One Gate per operation class, shared by every session of a process"""
+
+    def __init__(self, limits: dict, max_waiting: int, timeout: float):
+        self.gates = {name: Gate(name, limits.get(name, 0), max_waiting, timeout)
+                      for name in CLASSES}
+
+    def admit(self, kind: str):
+        """Context manager holding a slot of the operation kind's class"""
+        return self.gates[operation_class(kind)].enter()
+
+    def stats(self) -> dict:
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+
+class ReportPolicy:
+    """Row estimate and time limits for report queries outside the off-peak window
+
+    max_rows and max_time_ms of 0 disable the estimate and the time limit.
+    """
+
+    def __init__(self, max_rows: int, max_time_ms: int, off_peak: tuple = None):
+        self.max_rows = max_rows
+        self.max_time_ms = max_time_ms
+        self.off_peak = off_peak
+
+    def run(self, db, query: str, params, off_peak: bool = False) -> list:
+        """Run a report query, refusing or deferring it when it is too large for now"""
+        with self.limited(db, query, params, off_peak) as query:
+            db.cursor.execute(query, params)
+            return db.cursor.fetchall()
+
+    @contextmanager
+    def limited(self, db, query: str, params, off_peak: bool = False):
+        """Check a report query and yield it with the time limit applied
+
+        For reports that run the query themselves, e.g. through a streaming
+        cursor: a query over the row estimate is refused or deferred before
+        the block runs, and the time limit stopping it inside the block
+        raises Overloaded.
+        """
+        if off_peak or in_window(self.off_peak):
+            yield query
+            return
+
+        if self.max_rows:
+            estimate = estimate_rows(db, query, params)
+            if estimate > self.max_rows:
+                logging.warning(f"Report over the row limit: {estimate} estimated, "
+                                f"{self.max_rows} allowed")
+                if self.off_peak:
+                    raise ReportDeferred(estimate)
+                raise Overloaded(f"Report estimated to examine {estimate:,} rows, over the "
+                                 f"{self.max_rows:,} row limit; narrow it")
+
+        if self.max_time_ms:
+            query = time_limited(query, self.max_time_ms)
+        try:
+            yield query
+        except Exception as e:
+            if e.args and e.args[0] == QUERY_TIMEOUT:
+                raise Overloaded(f"Report stopped after the {self.max_time_ms} ms time limit; "
+                                 f"narrow it or run it off-peak") from e
+            raise
+
+
+class DeferredReports:
+    """Queue of deferred reports as files in a directory
+
+    A report moves from <id>.queued to <id>.running (claimed by renaming,
+    so only one runner gets it) to <id>.done with its result, or <id>.failed.
+    Only the holder of the runner lock runs reports; the lock is released
+    when its process exits, however it exits.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, report_id: str, state: str) -> str:
+        return os.path.join(self.directory, f"{report_id}.{state}")
+
+    def _write(self, path: str, record: dict):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(record, f, default=str)
+        os.replace(path + '.tmp', path)
+
+    def submit(self, operation: str, params: dict) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        report_id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self._write(self._path(report_id, 'queued'), {
+            'operation': operation, 'params': params,
+            'submitted': datetime.datetime.now().isoformat(timespec='seconds')})
+        return report_id
+
+    def claim(self):
+        """(report_id, request) of the oldest queued report, or None"""
+        if not os.path.isdir(self.directory):
+            return None
+        for name in sorted(os.listdir(self.directory)):
+            report_id, _, state = name.partition('.')
+            if state != 'queued':
+                continue
+            try:
+                os.rename(self._path(report_id, 'queued'), self._path(report_id, 'running'))
+            except FileNotFoundError:
+                continue    # Claimed by another runner
+            with open(self._path(report_id, 'running')) as f:
+                return report_id, json.load(f)
+        return None
+
+    def finish(self, report_id: str, request: dict, result=None, error: str = None):
+        record = dict(request, completed=datetime.datetime.now().isoformat(timespec='seconds'))
+        if error is None:
+            self._write(self._path(report_id, 'done'), dict(record, result=result))
+        else:
+            self._write(self._path(report_id, 'failed'), dict(record, error=error))
+        os.remove(self._path(report_id, 'running'))
+
+    def lock_runner(self):
+        """Open file holding the runner lock, or None if another process holds it"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(os.path.join(self.directory, RUNNER_LOCK), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def requeue_running(self) -> int:
+        """Put reports left running by a stopped runner back in the queue
+
+        Only safe while holding the runner lock: any report still running
+        then belongs to a runner that is gone.
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        running = [name for name in os.listdir(self.directory) if name.endswith('.running')]
+        for name in running:
+            report_id = name.partition('.')[0]
+            os.rename(self._path(report_id, 'running'), self._path(report_id, 'queued'))
+        return len(running)
+
+    def status(self, report_id: str) -> dict:
+        if not REPORT_ID.match(report_id):
+            raise ValueError(f"Invalid report ID: {report_id}")
+        for state in ('done', 'failed', 'running', 'queued'):
+            try:
+                with open(self._path(report_id, state)) as f:
+                    record = json.load(f)
+            except FileNotFoundError:
+                continue
+            return dict(record, report_id=report_id, status=state)
+        raise ValueError(f"Report not found: {report_id}")
+
+
+class ReportRunner:
+    """Background thread running deferred reports during the off-peak window
+
+    Every process may start one, but only the runner holding the queue's
+    runner lock serves it; the others retry the lock every interval and take
+    over when its holder exits. On taking the lock, a runner requeues the
+    reports the previous holder left running.
+    """
+
+    def __init__(self, reports: DeferredReports, banking_system, window: tuple,
+                 interval: float = RUNNER_INTERVAL):
+        self.reports = reports
+        self.banking_system = banking_system
+        self.window = window
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="report-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._lock:
+            self._lock.close()
+            self._lock = None
+
+    def _acquire(self) -> bool:
+        """Whether this runner holds the runner lock, taking it if it is free"""
+        if self._lock is None:
+            self._lock = self.reports.lock_runner()
+            if self._lock is None:
+                return False
+            requeued = self.reports.requeue_running()
+            if requeued:
+                logging.warning(f"Requeued {requeued} interrupted deferred reports")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._acquire():
+                continue
+            while in_window(self.window) and not self._stop.is_set():
+                claimed = self.reports.claim()
+                if claimed is None:
+                    break
+                self.run_one(*claimed)
+
+    def run_one(self, report_id: str, request: dict):
+        try:
+            result = self.banking_system.execute(request['operation'], **request['params'])
+        except Exception as e:
+            logging.error(f"Error running deferred report {report_id}: {str(e)}")
+            self.reports.finish(report_id, request, error=str(e))
+            return
+        self.reports.finish(report_id, request, result=result)
+        logging.info(f"Deferred report {report_id} ({request['operation']}) completed")
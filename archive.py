@@ -0,0 +1,364 @@
+"""Cold storage of old transfers in compressed, sorted segment files
+
+archive_transactions moves transfers dated before a horizon out of
+Transaction1/Transaction2 into an immutable segment file, so the live tables
+only hold recent history. A segment stores every transfer twice, once under
+each account, as fixed-size records sorted by (account, transaction). The
+records are cut into blocks of BLOCK_RECORDS, each compressed with zlib, and
+a sparse index of the first account of every block sits at the end of the
+file. Segments are memory-mapped; looking up an account bisects the index
+and decompresses only the blocks that can hold it.
+
+Every transfer dated before a segment's cutoff is in that segment, so
+history reads take dates before the newest cutoff from the segments and
+later dates from the database.
+"""
+import bisect
+import datetime
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import namedtuple
+
+from money import Money, sql_cents
+
+SUFFIX = '.seg'
+MAGIC = b'TXSEG\x00\x00\x01'
+
+# magic, records, index offset, blocks, first day, last day, cutoff day, last
+# transaction ID; days are proleptic Gregorian ordinals
+HEADER = struct.Struct('<8sqqiiiii')
+
+# account, transaction ID, counterparty, day, seconds into the day, cents
+# (negative when the account sent the transfer)
+RECORD = struct.Struct('<iiiiiq')
+
+# Per block: first account, offset, compressed length, records
+INDEX = struct.Struct('<iqii')
+
+# Records per compressed block: larger compresses better, smaller reads less
+# per account lookup
+BLOCK_RECORDS = 256
+COMPRESSION_LEVEL = 6
+
+# Transfers deleted from the live tables per transaction
+DELETE_BATCH = 5000
+
+Movement = namedtuple('Movement', ['account', 'transaction_id', 'counterparty', 'date',
+                                   'seconds', 'cents'])
+
+# Both sides of every transfer to archive, in segment order
+ARCHIVED_MOVEMENTS = f"""
+    SELECT t1.SenderAccNum AS AccountNumber, t1.TransactionID,
+           t1.ReceiverAccNum AS Counterparty, t2.TransactionDate, t2.TransactionTime,
+           -{sql_cents('t2.Amount')} AS Cents
+    FROM Transaction1 t1
+    JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+    WHERE t2.TransactionDate < %(before)s AND t1.TransactionID <= %(last)s
+    UNION ALL
+    SELECT t1.ReceiverAccNum AS AccountNumber, t1.TransactionID,
+           t1.SenderAccNum AS Counterparty, t2.TransactionDate, t2.TransactionTime,
+           {sql_cents('t2.Amount')} AS Cents
+    FROM Transaction1 t1
+    JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+    WHERE t2.TransactionDate < %(before)s AND t1.TransactionID <= %(last)s
+    ORDER BY AccountNumber, TransactionID
+"""
+
+
+def horizon(days: int, today: datetime.date = None) -> datetime.date:
+    """Cutoff date for archiving transfers older than days
+
+    Never later than the first of the current month, whose transfers the
+    monthly limits count.
+    """
+    today = today or datetime.date.today()
+    return min(today - datetime.timedelta(days=days), today.replace(day=1))
+
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SegmentWriter:
+    """Write movements, in (account, transaction) order, to a new segment file
+
+    The file is written under a temporary name and renamed by finish(), so
+    a segment is either complete or absent.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path + '.tmp', 'wb')
+        self.file.write(bytes(HEADER.size))
+        self.records = 0
+        self.first_day = self.last_day = None
+        self._block = bytearray()
+        self._block_first = None
+        self._block_records = 0
+        self._index = []
+        self._last_key = None
+
+    def add(self, account: int, transaction_id: int, counterparty: int,
+            date: datetime.date, seconds: int, cents: int):
+        key = (account, transaction_id)
+        if self._last_key is not None and key < self._last_key:
+            raise ValueError("Segment movements must be sorted by account and transaction")
+        self._last_key = key
+
+        day = date.toordinal()
+        if self._block_records == 0:
+            self._block_first = account
+        self._block += RECORD.pack(account, transaction_id, counterparty, day, seconds, cents)
+        self._block_records += 1
+        self.records += 1
+        self.first_day = day if self.first_day is None else min(self.first_day, day)
+        self.last_day = day if self.last_day is None else max(self.last_day, day)
+        if self._block_records >= BLOCK_RECORDS:
+            self._flush_block()
+
+    def _flush_block(self):
+        data = zlib.compress(bytes(self._block), COMPRESSION_LEVEL)
+        self._index.append((self._block_first, self.file.tell(), len(data),
+                            self._block_records))
+        self.file.write(data)
+        self._block = bytearray()
+        self._block_records = 0
+
+    def finish(self, before: datetime.date, last_transaction: int) -> int:
+        """Write the index and header and move the file into place; returns its size"""
+        if self._block_records:
+            self._flush_block()
+        index_offset = self.file.tell()
+        for entry in self._index:
+            self.file.write(INDEX.pack(*entry))
+        size = self.file.tell()
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, self.records, index_offset, len(self._index),
+                                    self.first_day or 0, self.last_day or 0,
+                                    before.toordinal(), last_transaction))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+        _fsync_directory(os.path.dirname(self.path) or '.')
+        return size
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path + '.tmp')
+
+
+class Segment:
+    """A memory-mapped segment file and its in-memory sparse block index"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.records, index_offset, blocks, self.first_day, self.last_day,
+         before, self.last_transaction) = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"Not a transaction segment: {path}")
+        self.before = datetime.date.fromordinal(before)
+        index = list(INDEX.iter_unpack(
+            self._map[index_offset:index_offset + blocks * INDEX.size]))
+        self._firsts = [entry[0] for entry in index]
+        self._blocks = [(entry[1], entry[2]) for entry in index]
+
+    def overlaps(self, start: datetime.date = None, end: datetime.date = None) -> bool:
+        return (self.records > 0
+                and (start is None or self.last_day >= start.toordinal())
+                and (end is None or self.first_day <= end.toordinal()))
+
+    def movements(self, account_number: int):
+        """The account's records, in transaction order
+
+        A block can hold the account only if its first account is not
+        greater, and the one before the first block starting with it may
+        end with it.
+        """
+        low = max(bisect.bisect_left(self._firsts, account_number) - 1, 0)
+        high = bisect.bisect_right(self._firsts, account_number)
+        for offset, length in self._blocks[low:high]:
+            for record in RECORD.iter_unpack(zlib.decompress(self._map[offset:offset + length])):
+                if record[0] == account_number:
+                    yield record
+                elif record[0] > account_number:
+                    return
+
+    def close(self):
+        self._map.close()
+
+
+class TransactionArchive:
+    """The segments of one archive directory, opened on first use
+
+    The directory is listed again whenever it changes, so segments written by
+    another session or process are picked up by the next read.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._segments = {}
+        self._listed = None
+        self._lock = threading.Lock()
+
+    def segments(self) -> list:
+        """Open segments, oldest first"""
+        with self._lock:
+            try:
+                changed = os.stat(self.directory).st_mtime_ns
+            except FileNotFoundError:
+                return []
+            if changed != self._listed:
+                names = sorted(name for name in os.listdir(self.directory)
+                               if name.endswith(SUFFIX))
+                for name in names:
+                    if name not in self._segments:
+                        self._segments[name] = Segment(os.path.join(self.directory, name))
+                self._listed = changed
+            return [self._segments[name] for name in sorted(self._segments)]
+
+    def before(self) -> datetime.date:
+        """First date whose transfers are all still live, or None if nothing is archived"""
+        return max((segment.before for segment in self.segments()), default=None)
+
+    def last_transaction(self) -> int:
+        """Highest transaction ID any segment covers, or 0
+
+        New transaction IDs must stay above it even once the live tables no
+        longer hold the transfers that used it.
+        """
+        return max((segment.last_transaction for segment in self.segments()), default=0)
+
+    def movements(self, account_number: int, start: datetime.date = None,
+                  end: datetime.date = None):
+        """The account's archived movements between start and end, inclusive"""
+        for segment in self.segments():
+            if not segment.overlaps(start, end):
+                continue
+            for account, transaction_id, counterparty, day, seconds, cents \
+                    in segment.movements(account_number):
+                date = datetime.date.fromordinal(day)
+                if (start is None or date >= start) and (end is None or date <= end):
+                    yield Movement(account, transaction_id, counterparty, date, seconds, cents)
+
+    def transfers(self, account_numbers, start: datetime.date = None,
+                  end: datetime.date = None) -> list:
+        """Archived transfers sent or received by any of the accounts, once each
+
+        Rows have the columns of a Transaction1/Transaction2 join, newest first.
+        """
+        rows = {}
+        for account_number in account_numbers:
+            for movement in self.movements(account_number, start, end):
+                sent = movement.cents < 0
+                rows[movement.transaction_id] = {
+                    'TransactionID': movement.transaction_id,
+                    'TransactionDate': movement.date,
+                    'TransactionTime': datetime.timedelta(seconds=movement.seconds),
+                    'Amount': Money(abs(movement.cents)),
+                    'SenderAccount': movement.account if sent else movement.counterparty,
+                    'ReceiverAccount': movement.counterparty if sent else movement.account,
+                }
+        return sorted(rows.values(), reverse=True,
+                      key=lambda row: (row['TransactionDate'], row['TransactionTime']))
+
+    def net(self, account_number: int, include) -> Money:
+        """Net archived movement of an account over the movements include() accepts"""
+        return Money(sum(movement.cents for movement in self.movements(account_number)
+                         if include(movement)))
+
+    def archive(self, db, before: datetime.date) -> dict:
+        """Move every transfer dated before `before` from db into a new segment
+
+        Transfers already in a segment but still in the live tables, after a
+        run that stopped between writing and deleting, are deleted first.
+        References from TransferKeys and AppliedTransfers are cleared, so
+        their keys still deduplicate retries.
+        """
+        import pymysql.cursors
+
+        if before > datetime.date.today().replace(day=1):
+            raise ValueError("Transactions of the current month cannot be archived")
+        for segment in self.segments():
+            self._delete(db, segment.before, segment.last_transaction)
+        archived = self.before()
+        if archived and before <= archived:
+            return {'before': str(archived), 'transactions': 0, 'segment': None, 'bytes': 0}
+
+        os.makedirs(self.directory, exist_ok=True)
+        db.cursor.execute("SELECT COALESCE(MAX(TransactionID), 0) as max_id FROM Transaction1")
+        last = db.cursor.fetchone()['max_id']
+        db.connection.commit()
+
+        path = os.path.join(self.directory, f"{before:%Y%m%d}-{last:010d}{SUFFIX}")
+        writer = SegmentWriter(path)
+        cursor = db.connection.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute(ARCHIVED_MOVEMENTS, {'before': before, 'last': last})
+            for account, transaction_id, counterparty, date, time_of_day, cents in cursor:
+                writer.add(account, transaction_id, counterparty, date,
+                           int(time_of_day.total_seconds()), int(cents))
+        except Exception:
+            writer.abort()
+            raise
+        finally:
+            cursor.close()
+            db.connection.commit()
+
+        if not writer.records:
+            writer.abort()
+            return {'before': str(before), 'transactions': 0, 'segment': None, 'bytes': 0}
+        size = writer.finish(before, last)
+        transactions = self._delete(db, before, last)
+        return {'before': str(before), 'transactions': transactions, 'segment': path,
+                'bytes': size}
+
+    @staticmethod
+    def _delete(db, before: datetime.date, last: int) -> int:
+        """Delete archived transfers from the live tables in short transactions"""
+        deleted = 0
+        while True:
+            db.cursor.execute("""
+                SELECT TransactionID FROM Transaction2
+                WHERE TransactionDate < %s AND TransactionID <= %s
+                ORDER BY TransactionID
+                LIMIT %s
+            """, (before, last, DELETE_BATCH))
+            ids = [row['TransactionID'] for row in db.cursor.fetchall()]
+            if not ids:
+                db.connection.commit()
+                return deleted
+
+            placeholders = ', '.join(['%s'] * len(ids))
+            try:
+                for table in ('TransferKeys', 'AppliedTransfers'):
+                    db.cursor.execute(f"""
+                        UPDATE {table} SET TransactionID = NULL
+                        WHERE TransactionID IN ({placeholders})
+                    """, ids)
+                db.cursor.execute(
+                    f"DELETE FROM Transaction2 WHERE TransactionID IN ({placeholders})", ids)
+                db.cursor.execute(
+                    f"DELETE FROM Transaction1 WHERE TransactionID IN ({placeholders})", ids)
+                db.connection.commit()
+            except Exception:
+                db.connection.rollback()
+                raise
+            deleted += len(ids)
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments = {}
+            self._listed = None
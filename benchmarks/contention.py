@@ -0,0 +1,340 @@
+"""Closed-loop contention simulator for BankingSystem
+
+Runs a mix of operations from many concurrent sessions against one database
+and repeats it at increasing concurrency levels. Each session issues its
+next operation as soon as the previous one returns (plus --think ms), so
+throughput is whatever the database sustains. Accounts are picked with a
+Zipf distribution over a shuffled account list, so a few accounts are hot.
+
+Mix classes:
+  transfer   make_transaction of --amount between two Zipf-picked accounts
+  history    view_user_transactions of a Zipf-picked account's holder
+  balance    view_balance_at_date of a Zipf-picked account, as of today
+  profile    view_customer_profiles of a Zipf-picked account's holder
+  analytics  one of the analysis operations in turn
+
+For every level it reports throughput, p50/p95/p99/max latency per class,
+deadlocks (error 1213), lock wait timeouts (error 1205), transfers
+rejected by the account rules and the resulting rollback rate, with the
+server's row lock waits and deadlock counter over the same interval (those
+are server-wide, so run it on a quiet test database).
+
+Usage: python benchmarks/contention.py [--mix transfer=80,history=15,analytics=5]
+           [--levels 1,2,4,8,16,32] [--duration S] [--processes P] [--zipf S]
+           [--accounts N] [--amount A] [--think MS] [--cache] [--seed N]
+Needs TRANSAXION_DB_USER/TRANSAXION_DB_PASSWORD; transfers move real money,
+so use a test database.
+"""
+import bisect
+import datetime
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CLASSES = ('transfer', 'history', 'balance', 'profile', 'analytics')
+
+# MySQL errors for a transaction chosen as deadlock victim and a lock wait timeout
+DEADLOCK = 1213
+LOCK_WAIT_TIMEOUT = 1205
+
+
+def parse_mix(spec: str) -> list:
+    """"class=weight,..." -> [(class, weight)]"""
+    mix = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, weight = item.partition('=')
+        if name not in CLASSES:
+            raise ValueError(f"Unknown class {name}; choose from {', '.join(CLASSES)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+class Zipf:
+    """Index sampler where index r is picked with probability proportional to 1 / (r + 1)^s"""
+
+    def __init__(self, count: int, s: float):
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, count + 1):
+            total += rank ** -s
+            self.cumulative.append(total)
+
+    def pick(self, rng: random.Random) -> int:
+        return bisect.bisect_left(self.cumulative, rng.random() * self.cumulative[-1])
+
+
+def load_accounts(system, limit: int, seed: int) -> list:
+    """(AccountNumber, Nationality, NationalID) of up to limit accounts, shuffled by seed"""
+    query = """
+        SELECT AccountNumber, UserNationality, UserNationalID
+        FROM BankAccount
+        ORDER BY AccountNumber
+    """
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    system.db.cursor.execute(query)
+    accounts = [(row['AccountNumber'], row['UserNationality'], row['UserNationalID'])
+                for row in system.db.cursor.fetchall()]
+    system.db.connection.commit()
+    # Which accounts are hot should not follow account numbers
+    random.Random(seed).shuffle(accounts)
+    return accounts
+
+
+def request(name: str, rng: random.Random, zipf: Zipf, accounts: list, amount: Decimal,
+            turn: int):
+    """(operation, params) for one operation of a class"""
+    account_number, nationality, national_id = accounts[zipf.pick(rng)]
+    today = datetime.date.today()
+    if name == 'transfer':
+        receiver = account_number
+        while receiver == account_number and len(accounts) > 1:
+            receiver = accounts[zipf.pick(rng)][0]
+        return 'make_transaction', {'sender_acc': account_number, 'receiver_acc': receiver,
+                                    'amount': amount}
+    if name == 'history':
+        return 'view_user_transactions', {'nationality': nationality, 'national_id': national_id}
+    if name == 'balance':
+        return 'view_balance_at_date', {'account_number': account_number,
+                                        'as_of': today.isoformat()}
+    if name == 'profile':
+        return 'view_customer_profiles', {'customers': [f"{nationality}:{national_id}"]}
+
+    month_ago = (today - datetime.timedelta(days=30)).isoformat()
+    return [
+        ('analyze_transaction_patterns', {'min_transactions': 5, 'start_date': month_ago,
+                                          'end_date': today.isoformat()}),
+        ('analyze_expenditure_patterns', {'percentage': 50.0, 'group_by': 'country'}),
+        ('get_country_expenditure', {}),
+        ('view_bank_branch_count', {}),
+        ('find_max_balance', {}),
+    ][turn % 5]
+
+
+def outcome(error: Exception) -> str:
+    code = error.args[0] if error.args else None
+    if code == DEADLOCK:
+        return 'deadlock'
+    if code == LOCK_WAIT_TIMEOUT:
+        return 'lock_wait_timeout'
+    if isinstance(error, ValueError):
+        return 'rejected'
+    return 'error'
+
+
+def session(system, config: dict, accounts: list, seed: int, deadline: float,
+            latencies: dict, outcomes: dict, lock: threading.Lock):
+    rng = random.Random(seed)
+    zipf = Zipf(len(accounts), config['zipf'])
+    names = [name for name, _ in config['mix']]
+    weights = [weight for _, weight in config['mix']]
+    think = config['think'] / 1000
+    local_latencies = {name: [] for name in names}
+    local_outcomes = {name: Counter() for name in names}
+
+    turn = 0
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        operation, params = request(name, rng, zipf, accounts, config['amount'], turn)
+        turn += 1
+        start = time.perf_counter()
+        try:
+            system.execute(operation, **params)
+            local_outcomes[name]['ok'] += 1
+            local_latencies[name].append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            local_outcomes[name][outcome(e)] += 1
+        if think:
+            time.sleep(think)
+
+    with lock:
+        for name in names:
+            latencies[name].extend(local_latencies[name])
+            outcomes[name].update(local_outcomes[name])
+
+
+def run_sessions(threads: int, config: dict, seed: int) -> tuple:
+    """Run threads sessions in this process for config['duration'] seconds
+
+    Returns latencies and outcomes per class and the seconds the sessions ran.
+    """
+    sys.path.insert(0, ROOT)
+    from cli import connect
+    from main import BankingSystem
+
+    base = connect()
+    systems = []
+    try:
+        base.load_directory()
+        accounts = load_accounts(base, config['accounts'], config['seed'])
+        if len(accounts) < 2:
+            raise ValueError("Need at least two accounts")
+        for _ in range(threads):
+            system = BankingSystem(base.db.clone(), config['cache_size'])
+            system.share_directory(base)
+            systems.append(system)
+
+        latencies = {name: [] for name, _ in config['mix']}
+        outcomes = {name: Counter() for name, _ in config['mix']}
+        lock = threading.Lock()
+        start = time.perf_counter()
+        deadline = start + config['duration']
+        workers = [threading.Thread(target=session, args=(
+            system, config, accounts, seed * 1000 + index, deadline, latencies, outcomes, lock))
+            for index, system in enumerate(systems)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return latencies, outcomes, time.perf_counter() - start
+    finally:
+        for system in systems:
+            system.close()
+        base.close()
+
+
+def server_counters(system) -> dict:
+    """Server-wide row lock waits, lock wait time (ms) and deadlocks so far"""
+    system.db.cursor.execute("""
+        SHOW GLOBAL STATUS
+        WHERE Variable_name IN ('Innodb_row_lock_waits', 'Innodb_row_lock_time')
+    """)
+    counters = {row['Variable_name']: int(row['Value']) for row in system.db.cursor.fetchall()}
+    try:
+        system.db.cursor.execute("""
+            SELECT COUNT as Deadlocks FROM information_schema.INNODB_METRICS
+            WHERE NAME = 'lock_deadlocks'
+        """)
+        row = system.db.cursor.fetchone()
+        counters['deadlocks'] = row and row['Deadlocks']
+    except Exception:
+        counters['deadlocks'] = None
+    system.db.connection.commit()
+    return counters
+
+
+def run_level(level: int, processes: int, config: dict) -> tuple:
+    if processes <= 1:
+        return run_sessions(level, config, level)
+
+    # Spread the sessions over the processes as evenly as possible
+    shares = [level // processes + (index < level % processes) for index in range(processes)]
+    shares = [share for share in shares if share]
+    latencies = {name: [] for name, _ in config['mix']}
+    outcomes = {name: Counter() for name, _ in config['mix']}
+    elapsed = 0.0
+    with ProcessPoolExecutor(len(shares), mp_context=get_context('spawn')) as pool:
+        futures = [pool.submit(run_sessions, share, config, level * 100 + index)
+                   for index, share in enumerate(shares)]
+        for future in futures:
+            part_latencies, part_outcomes, part_elapsed = future.result()
+            for name in latencies:
+                latencies[name].extend(part_latencies[name])
+                outcomes[name].update(part_outcomes[name])
+            elapsed = max(elapsed, part_elapsed)
+    return latencies, outcomes, elapsed
+
+
+def report(level: int, elapsed: float, latencies: dict, outcomes: dict,
+           before: dict, after: dict) -> dict:
+    completed = sum(len(values) for values in latencies.values())
+    print(f"\n{level} sessions: {completed / elapsed:,.0f} ops/s completed")
+    for name, values in latencies.items():
+        ordered = sorted(values)
+        counts = outcomes[name]
+        line = f"  {name:<10} {len(ordered) / elapsed:>8,.0f}/s"
+        if ordered:
+            line += "".join(
+                f"  {label} {ordered[min(len(ordered) - 1, int(len(ordered) * quantile))]:.1f}"
+                for label, quantile in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)))
+            line += f"  max {ordered[-1]:.1f} ms"
+        failures = {key: value for key, value in counts.items() if key != 'ok'}
+        if failures:
+            line += f"  {failures}"
+        print(line)
+
+    transfers = outcomes.get('transfer', Counter())
+    attempted = sum(transfers.values())
+    rolled_back = attempted - transfers['ok']
+    waits = after['Innodb_row_lock_waits'] - before['Innodb_row_lock_waits']
+    wait_time = after['Innodb_row_lock_time'] - before['Innodb_row_lock_time']
+    deadlocks = sum(counts['deadlock'] for counts in outcomes.values())
+    timeouts = sum(counts['lock_wait_timeout'] for counts in outcomes.values())
+    print(f"  deadlocks {deadlocks}, lock wait timeouts {timeouts}, "
+          f"transfer rollbacks {rolled_back}/{attempted}"
+          + (f" ({rolled_back / attempted:.1%})" if attempted else ""))
+    server_deadlocks = (after['deadlocks'] - before['deadlocks']
+                        if after['deadlocks'] is not None else 'n/a')
+    print(f"  server: {waits} row lock waits, {wait_time / waits if waits else 0:.1f} ms avg, "
+          f"{server_deadlocks} deadlocks")
+
+    transfer_latencies = sorted(latencies.get('transfer', []))
+    return {
+        'level': level,
+        'throughput': completed / elapsed,
+        'transfers': transfers['ok'] / elapsed,
+        'transfer_p99': transfer_latencies[min(len(transfer_latencies) - 1,
+                                               int(len(transfer_latencies) * 0.99))]
+                        if transfer_latencies else None,
+        'rollback_rate': rolled_back / attempted if attempted else 0.0,
+        'lock_waits': waits,
+    }
+
+
+def main():
+    sys.path.insert(0, ROOT)
+    from cli import connect, parse_args
+    from main import CACHE_SIZE
+
+    _, options = parse_args(['bench'] + sys.argv[1:])
+    config = {
+        'mix': parse_mix(options.get('mix', 'transfer=80,history=15,analytics=5')),
+        'duration': float(options.get('duration', 10)),
+        'zipf': float(options.get('zipf', 1.1)),
+        'accounts': int(options.get('accounts', 0)),
+        'amount': Decimal(str(options.get('amount', '0.01'))),
+        'think': float(options.get('think', 0)),
+        # Cached reads would hide the database; --cache keeps the usual cache
+        'cache_size': CACHE_SIZE if options.get('cache') else 0,
+        'seed': int(options.get('seed', 1)),
+    }
+    levels = [int(level) for level in str(options.get('levels', '1,2,4,8,16,32')).split(',')]
+    processes = int(options.get('processes', 1))
+
+    print(f"Mix {', '.join(f'{name}={weight:g}' for name, weight in config['mix'])}; "
+          f"zipf s={config['zipf']}, {config['duration']:g} s per level, "
+          f"{processes} process(es)")
+    monitor = connect()
+    summary = []
+    try:
+        for level in levels:
+            before = server_counters(monitor)
+            latencies, outcomes, elapsed = run_level(level, processes, config)
+            after = server_counters(monitor)
+            summary.append(report(level, elapsed, latencies, outcomes, before, after))
+    finally:
+        monitor.close()
+
+    print(f"\n{'sessions':>8} {'ops/s':>10} {'transfers/s':>12} {'transfer p99':>13} "
+          f"{'rollbacks':>10} {'lock waits':>11}")
+    previous = None
+    for row in summary:
+        p99 = f"{row['transfer_p99']:.1f} ms" if row['transfer_p99'] is not None else '-'
+        # Flag levels where the added sessions bought under 10% more transfers
+        flat = previous and row['transfers'] < previous['transfers'] * 1.1
+        print(f"{row['level']:>8} {row['throughput']:>10,.0f} {row['transfers']:>12,.0f} "
+              f"{p99:>13} {row['rollback_rate']:>10.1%} {row['lock_waits']:>11}"
+              f"{'  <- transfers stopped scaling' if flat else ''}")
+        previous = row
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Contention benchmark for hot-account balance buckets
+
+Many threads, each on its own connection, credit the same account in short
+transactions that hold the credit's row lock for --hold milliseconds (the
+rest of a transfer's work). The run is repeated with the account as a
+single Balance row and split over --buckets bucket rows, reporting
+throughput and latency for each. Afterwards the buckets are folded, the
+balance is checked to have grown by exactly the credited total, and that
+total is taken back out so the account ends where it started.
+
+Usage: python benchmarks/hot_account.py --account N [--threads T]
+           [--credits C] [--buckets B] [--hold MS]
+Needs TRANSAXION_DB_USER/TRANSAXION_DB_PASSWORD; use a test database.
+"""
+import os
+import sys
+import threading
+import time
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AMOUNT = Decimal('0.01')
+
+
+def total_balance(system, account_number: int) -> Decimal:
+    system.db.cursor.execute("""
+        SELECT ba.Balance + COALESCE((
+                   SELECT SUM(Amount) FROM BalanceBuckets bb
+                   WHERE bb.AccountNumber = ba.AccountNumber
+               ), 0) as Total
+        FROM BankAccount ba
+        WHERE ba.AccountNumber = %s
+    """, (account_number,))
+    total = system.db.cursor.fetchone()['Total']
+    system.db.connection.commit()
+    return total
+
+
+def worker(system, account_number: int, credits: int, hold: float,
+           latencies: list, failures: list):
+    db = system.db
+    for _ in range(credits):
+        start = time.perf_counter()
+        try:
+            db.cursor.execute("START TRANSACTION")
+            system.credit_account(account_number, AMOUNT)
+            time.sleep(hold)
+            db.connection.commit()
+        except Exception as e:
+            db.connection.rollback()
+            failures.append(e)
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def run(base, systems: list, account_number: int, buckets: int, credits: int, hold: float):
+    # The sessions share base's hot-account flags
+    base.execute('flag_hot_account', account_number=account_number, buckets=buckets)
+
+    latencies, failures = [], []
+    threads = [threading.Thread(target=worker, args=(
+        system, account_number, credits, hold, latencies, failures)) for system in systems]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    label = f"{buckets} buckets" if buckets else "single row"
+    print(f"\n{label}: {len(ordered)} credits in {elapsed:.2f} s, "
+          f"{len(ordered) / elapsed:,.0f} credits/s")
+    if ordered:
+        for name, quantile in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+            print(f"{name}: {ordered[min(len(ordered) - 1, int(len(ordered) * quantile))]:.1f} ms")
+    if failures:
+        print(f"Failed: {len(failures)} (first: {failures[0]!r})")
+    return len(ordered)
+
+
+def main():
+    sys.path.insert(0, ROOT)
+    from cli import connect, parse_args
+    from main import BankingSystem
+
+    _, options = parse_args(['bench'] + sys.argv[1:])
+    if 'account' not in options:
+        sys.exit(__doc__)
+    account_number = int(options['account'])
+    threads = int(options.get('threads', 32))
+    credits = int(options.get('credits', 200))
+    buckets = int(options.get('buckets', 16))
+    hold = float(options.get('hold', 2)) / 1000
+
+    base = connect()
+    systems = []
+    try:
+        for _ in range(threads):
+            system = BankingSystem(base.db.clone())
+            system.share_directory(base)
+            systems.append(system)
+
+        before = total_balance(base, account_number)
+        print(f"{threads} threads x {credits} credits to account {account_number}, "
+              f"{hold * 1000:.0f} ms held per credit")
+        credited = sum(run(base, systems, account_number, count, credits, hold)
+                       for count in (0, buckets))
+
+        # Unflagging folds the buckets back into Balance
+        base.execute('flag_hot_account', account_number=account_number, buckets=0)
+        after = total_balance(base, account_number)
+        expected = before + credited * AMOUNT
+        print(f"\nBalance {before} -> {after}, expected {expected}: "
+              f"{'exact' if after == expected else 'MISMATCH'}")
+
+        base.db.cursor.execute("START TRANSACTION")
+        base.apply_balance_change(account_number, -(credited * AMOUNT))
+        base.db.connection.commit()
+    finally:
+        for system in systems:
+            system.close()
+        base.close()
+
+
+if __name__ == "__main__":
+    main()
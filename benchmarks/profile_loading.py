@@ -0,0 +1,151 @@
+"""Customer profile loading: set-based batches against per-entity queries
+
+For batches of 1 to 10,000 customers, loads every profile twice: with
+profiles.load_profiles (five IN-list queries per 1,000 customers) and with
+the naive approach of one query per person, email list, account, account
+subtype, budget and goal. Reports wall time and query count for each and
+checks that both produce the same profiles.
+
+Usage: python benchmarks/profile_loading.py [--sizes 1,10,100,1000,10000]
+Needs TRANSAXION_DB_USER/TRANSAXION_DB_PASSWORD.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SUBTYPES = (('current', 'CurrentAccount'), ('saving', 'SavingAccount'),
+            ('salary', 'SalaryAccount'), ('demat', 'DematAccount'),
+            ('fixeddeposit', 'FixedDepositAccount'))
+
+
+class CountingCursor:
+    """Cursor wrapper that counts round trips"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.queries = 0
+
+    def execute(self, query, params=None):
+        self.queries += 1
+        return self.cursor.execute(query, params)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def one(db, query: str, params: tuple):
+    db.cursor.execute(query, params)
+    return db.cursor.fetchone()
+
+
+def many(db, query: str, params: tuple) -> list:
+    db.cursor.execute(query, params)
+    return db.cursor.fetchall()
+
+
+def load_naive(db, customers: list) -> list:
+    """Profiles one entity at a time, as code without a loader would build them"""
+    from profiles import Account, CustomerProfile
+
+    profiles = []
+    for nationality, national_id in customers:
+        key = (nationality, national_id)
+        person = one(db, "SELECT * FROM Person1 WHERE Nationality = %s AND NationalID = %s", key)
+        if not person:
+            continue
+        names = one(db, "SELECT First, Middle, Last FROM Person2 "
+                        "WHERE Nationality = %s AND NationalID = %s", key) or {}
+        profile = CustomerProfile(dict(person, First=names.get('First'),
+                                       Middle=names.get('Middle'), Last=names.get('Last')))
+        profile.emails = [row['Email'] for row in many(
+            db, "SELECT Email FROM Person3 WHERE Nationality = %s AND NationalID = %s "
+                "ORDER BY Email", key)]
+
+        for row in many(db, "SELECT AccountNumber FROM BankAccount WHERE UserNationality = %s "
+                            "AND UserNationalID = %s ORDER BY AccountNumber", key):
+            account = one(db, "SELECT * FROM BankAccount WHERE AccountNumber = %s",
+                          (row['AccountNumber'],))
+            pending = one(db, "SELECT COALESCE(SUM(Amount), 0) as Pending FROM BalanceBuckets "
+                              "WHERE AccountNumber = %s", (row['AccountNumber'],))['Pending']
+            account = dict(account, Balance=account['Balance'] + pending, Kind=None)
+            for kind, table in SUBTYPES:
+                subtype = one(db, f"SELECT * FROM {table} WHERE AccountNumber = %s",
+                              (row['AccountNumber'],))
+                if subtype:
+                    account.update(subtype, Kind=kind)
+                    break
+            profile.accounts.append(Account(account))
+
+        for row in many(db, "SELECT Category FROM Budgets1 WHERE UserNationality = %s "
+                            "AND UserNationalID = %s ORDER BY Category", key):
+            budget = one(db, "SELECT * FROM Budgets1 WHERE Category = %s AND UserNationality = %s "
+                             "AND UserNationalID = %s", (row['Category'],) + key)
+            duration = one(db, "SELECT * FROM Budgets2 WHERE Category = %s "
+                               "AND UserNationality = %s AND UserNationalID = %s",
+                           (row['Category'],) + key) or {}
+            profile.budgets.append((budget['Category'], budget['BudgetLimit'],
+                                    budget['CurrentExpend'], duration.get('DurationDate'),
+                                    duration.get('DurationTime')))
+
+        for row in many(db, "SELECT GoalName FROM SavingsGoals1 WHERE UserNationality = %s "
+                            "AND UserNationalID = %s ORDER BY GoalName", key):
+            goal = one(db, "SELECT * FROM SavingsGoals1 WHERE GoalName = %s "
+                           "AND UserNationality = %s AND UserNationalID = %s",
+                       (row['GoalName'],) + key)
+            deadline = one(db, "SELECT * FROM SavingsGoals2 WHERE GoalName = %s "
+                               "AND UserNationality = %s AND UserNationalID = %s",
+                           (row['GoalName'],) + key) or {}
+            profile.goals.append((goal['GoalName'], goal['TargetAmount'],
+                                  goal['CurrentSaving'], deadline.get('DeadlineDate'),
+                                  deadline.get('DeadlineTime')))
+        profiles.append(profile)
+    return profiles
+
+
+def measure(db, load, customers: list) -> tuple:
+    counting = db.cursor = CountingCursor(db.cursor)
+    try:
+        start = time.perf_counter()
+        profiles = load(db, customers)
+        elapsed = time.perf_counter() - start
+    finally:
+        db.cursor = counting.cursor
+    db.connection.commit()
+    return [profile.to_dict() for profile in profiles], elapsed, counting.queries
+
+
+def main():
+    sys.path.insert(0, ROOT)
+    from cli import connect, parse_args
+    from profiles import load_profiles
+
+    _, options = parse_args(['bench'] + sys.argv[1:])
+    sizes = [int(size) for size in str(options.get('sizes', '1,10,100,1000,10000')).split(',')]
+
+    banking_system = connect()
+    db = banking_system.db
+    try:
+        db.cursor.execute(
+            "SELECT Nationality, NationalID FROM Person1 ORDER BY NationalID LIMIT %s",
+            (max(sizes),))
+        everyone = [(row['Nationality'], row['NationalID']) for row in db.cursor.fetchall()]
+        db.connection.commit()
+
+        print(f"{'customers':>10} {'batched':>12} {'queries':>8} "
+              f"{'naive':>12} {'queries':>8} {'speed-up':>9}")
+        for size in sizes:
+            customers = everyone[:size]
+            batched, batched_time, batched_queries = measure(db, load_profiles, customers)
+            naive, naive_time, naive_queries = measure(db, load_naive, customers)
+            status = '' if batched == naive else '  MISMATCH'
+            print(f"{len(customers):>10} {batched_time * 1000:>10.1f}ms {batched_queries:>8} "
+                  f"{naive_time * 1000:>10.1f}ms {naive_queries:>8} "
+                  f"{naive_time / batched_time:>8.1f}x{status}")
+    finally:
+        banking_system.close()
+
+
+if __name__ == "__main__":
+    main()
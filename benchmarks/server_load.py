@@ -0,0 +1,73 @@
+"""Concurrency benchmark for the TCP server (`transaxion serve`)
+
+Opens many client connections at once, each sending a command repeatedly
+and waiting for every reply, then reports throughput, reply latency and how
+many requests were refused (queue full) or timed out.
+
+Usage: python benchmarks/server_load.py [--clients N] [--requests M]
+           [--host H] [--port P] [--command CMD --param value ...]
+The default command is cache_stats, which never touches the database.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def client(host: str, port: int, request: bytes, count: int,
+                 latencies: list, outcomes: Counter):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append((time.perf_counter() - start) * 1000)
+            outcomes['ok' if response['ok'] else response['type']] += 1
+    finally:
+        writer.close()
+
+
+async def run(host: str, port: int, clients: int, requests: int, command: str, params: dict):
+    request = json.dumps({'command': command, 'params': params}).encode('utf-8') + b'\n'
+    latencies, outcomes = [], Counter()
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(client(host, port, request, requests, latencies, outcomes) for _ in range(clients)),
+        return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    failed = [result for result in results if isinstance(result, Exception)]
+    ordered = sorted(latencies)
+    print(f"{clients} clients x {requests} requests of {command}")
+    print(f"Elapsed: {elapsed:.2f} s, throughput {len(ordered) / elapsed:,.0f} requests/s")
+    if ordered:
+        for label, quantile in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+            print(f"{label}: {ordered[min(len(ordered) - 1, int(len(ordered) * quantile))]:.1f} ms")
+        print(f"max: {ordered[-1]:.1f} ms")
+    print(f"Outcomes: {dict(outcomes)}")
+    if failed:
+        print(f"Connections failed: {len(failed)} (first: {failed[0]!r})")
+
+
+def main():
+    sys.path.insert(0, ROOT)
+    from cli import parse_args
+
+    _, options = parse_args(['load'] + sys.argv[1:])
+    command = options.pop('command', 'cache_stats')
+    clients = int(options.pop('clients', 1000))
+    requests = int(options.pop('requests', 10))
+    host = options.pop('host', '127.0.0.1')
+    port = int(options.pop('port', 8765))
+    asyncio.run(run(host, port, clients, requests, command, options))
+
+
+if __name__ == "__main__":
+    main()
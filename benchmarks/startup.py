@@ -0,0 +1,70 @@
+"""Cold-start benchmark for the transaxion command line
+
+Times fresh interpreter processes so every run pays the full start-up cost:
+
+  import main        loading the banking system (the driver is not imported)
+  import pymysql     the cost the lazy driver import moves off the start-up path
+  transaxion list    a command that never touches the database
+  transaxion <cmd>   a real command, run in-process (connect per call) and,
+                     if an agent is listening, forwarded to the agent
+
+Usage: python benchmarks/startup.py [--runs N] [--command CMD --param value ...]
+Database commands need TRANSAXION_DB_USER/TRANSAXION_DB_PASSWORD.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY = os.path.join(ROOT, 'transaxion')
+
+
+def time_process(args: list, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=ROOT, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label: str, timings: list):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:<34} median {statistics.median(ordered):8.1f} ms"
+          f"   p95 {p95:8.1f} ms   min {ordered[0]:8.1f} ms")
+
+
+def main():
+    args = sys.argv[1:]
+    runs = 20
+    if args[:1] == ['--runs']:
+        runs, args = int(args[1]), args[2:]
+    command = []
+    if args[:1] == ['--command']:
+        command = args[1:]
+
+    python = sys.executable
+    report("python (empty interpreter)", time_process([python, '-c', 'pass'], runs))
+    report("import main", time_process([python, '-c', 'import main'], runs))
+    report("import pymysql", time_process([python, '-c', 'import pymysql'], runs))
+    report("transaxion list", time_process([python, ENTRY, 'list'], runs))
+
+    if command:
+        report(f"transaxion {command[0]} (in-process)",
+               time_process([python, ENTRY] + command + ['--no-agent'], runs))
+
+        from cli import SOCKET_PATH
+        if os.path.exists(SOCKET_PATH):
+            report(f"transaxion {command[0]} (agent)",
+                   time_process([python, ENTRY] + command, runs))
+        else:
+            print(f"(start `transaxion agent` to also time the agent path via {SOCKET_PATH})")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, ROOT)
+    main()
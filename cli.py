@@ -0,0 +1,290 @@
+"""Scriptable entry point: transaxion <command> [--param value ...]
+
+Runs one operation and prints its result as a single JSON object. When a
+`transaxion agent` is listening, commands are forwarded to it and reuse its
+open database connection; otherwise they connect in-process. The client
+path only imports the standard library modules below, so a forwarded
+command never pays for loading the banking system or the database driver.
+"""
+import json
+import os
+import socket
+import sys
+
+SOCKET_PATH = os.environ.get(
+    'TRANSAXION_AGENT_SOCKET', f"/tmp/transaxion-{os.getuid()}.sock")
+
+USAGE = """usage: transaxion <command> [--param value ...]
+       transaxion list           show commands and their parameters
+       transaxion agent          keep a database connection open for later commands
+       transaxion serve [--host H] [--port P] [--workers N] [--queue-size Q] [--timeout S]
+                                 serve commands to TCP clients as line-delimited JSON
+       transaxion replay --trace PATH [--speed 1|N|max] [--concurrency C]
+                         [--operations a,b] [--output FILE] [--baseline FILE]
+                                 re-run a captured workload and report its latencies
+
+Credentials are read from TRANSAXION_DB_USER and TRANSAXION_DB_PASSWORD."""
+
+
+def parse_args(args: list):
+    """Split argv into a command and a dict of --param values
+
+    A flag without a value is True; a repeated flag collects a list.
+    """
+    if not args:
+        raise ValueError("No command given")
+
+    command, params = args[0], {}
+    i = 1
+    while i < len(args):
+        if not args[i].startswith('--'):
+            raise ValueError(f"Unexpected argument: {args[i]}")
+        key = args[i][2:].replace('-', '_')
+        if i + 1 < len(args) and not args[i + 1].startswith('--'):
+            value = args[i + 1]
+            i += 2
+        else:
+            value = True
+            i += 1
+
+        if key in params:
+            if not isinstance(params[key], list):
+                params[key] = [params[key]]
+            params[key].append(value)
+        else:
+            params[key] = value
+    return command, params
+
+
+def to_json(value) -> str:
+    def default(obj):
+        # Decimal, date, datetime and the timedelta MySQL returns for TIME
+        if hasattr(obj, 'isoformat'):
+            return obj.isoformat()
+        return str(obj)
+
+    return json.dumps(value, default=default)
+
+
+def coerce_params(method, params: dict) -> dict:
+    """Convert string arguments to the types annotated on an operation method"""
+    import inspect
+    from decimal import Decimal
+
+    from money import Money
+
+    signature = inspect.signature(method)
+    coerced = {}
+    for key, value in params.items():
+        if key not in signature.parameters:
+            raise ValueError(f"Unknown parameter: --{key}")
+        annotation = signature.parameters[key].annotation
+
+        if annotation is list:
+            coerced[key] = value if isinstance(value, list) else [value]
+        elif annotation is bool:
+            coerced[key] = value is True or str(value).lower() in ('1', 'true', 'yes', 'y')
+        elif annotation is Decimal:
+            # Via str so a JSON number like 0.1 keeps its decimal value
+            coerced[key] = Decimal(str(value))
+        elif annotation is Money:
+            # Exact: "0.1" and 0.1 are both ten cents; sub-cent digits are refused
+            coerced[key] = Money.of(value)
+        elif annotation in (int, float):
+            coerced[key] = annotation(value)
+        else:
+            coerced[key] = value
+    return coerced
+
+
+def run_operation(banking_system, command: str, params: dict) -> dict:
+    """Execute one command and return the response envelope"""
+    from main import OPERATIONS
+
+    try:
+        if command not in OPERATIONS:
+            raise ValueError(f"Unknown command: {command}")
+        method = getattr(banking_system, OPERATIONS[command][0])
+        result = banking_system.execute(command, **coerce_params(method, params))
+        return {'ok': True, 'result': result}
+    except Exception as e:
+        return {'ok': False, 'error': str(e), 'type': type(e).__name__}
+
+
+def list_operations() -> dict:
+    import inspect
+
+    from main import OPERATIONS, BankingSystem
+
+    commands = {}
+    for command, (method, kind, _) in OPERATIONS.items():
+        parameters = inspect.signature(getattr(BankingSystem, method)).parameters
+        commands[command] = {
+            'kind': kind,
+            'params': {name: getattr(p.annotation, '__name__', 'str')
+                       for name, p in parameters.items() if name != 'self'},
+            'required': [name for name, p in parameters.items()
+                         if name != 'self' and p.default is p.empty],
+        }
+    return {'ok': True, 'result': commands}
+
+
+def connect():
+    """Open a BankingSystem session using credentials from the environment"""
+    from getpass import getpass
+
+    from main import SHARDS, BankingSystem
+
+    username = os.environ.get('TRANSAXION_DB_USER')
+    password = os.environ.get('TRANSAXION_DB_PASSWORD')
+    if username is None:
+        raise ConnectionError("TRANSAXION_DB_USER is not set")
+    if password is None:
+        password = getpass("Database Password: ")
+
+    banking_system = BankingSystem()
+    if not banking_system.db.connect(username, password):
+        raise ConnectionError("Failed to connect to database. Please check your credentials.")
+    if SHARDS:
+        try:
+            banking_system.enable_sharding(SHARDS)
+        except Exception:
+            banking_system.close()
+            raise
+    return banking_system
+
+
+def forward(command: str, params: dict):
+    """Send a command to a running agent; returns None if no agent is listening"""
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(SOCKET_PATH)
+    except OSError:
+        return None
+
+    with client:
+        client.sendall(json.dumps({'command': command, 'params': params}).encode('utf-8') + b'\n')
+        with client.makefile('rb') as reader:
+            return reader.readline().decode('utf-8').rstrip('\n')
+
+
+def serve():
+    """Hold one database connection open and run commands sent over a Unix socket"""
+    import logging
+
+    banking_system = connect()
+    banking_system.load_directory()
+    banking_system.start_consolidation()
+    banking_system.start_deferred_reports()
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET_PATH)
+    # The socket carries an authenticated database session
+    os.chmod(SOCKET_PATH, 0o600)
+    server.listen()
+    print(f"Agent listening on {SOCKET_PATH}", file=sys.stderr)
+
+    try:
+        while True:
+            client, _ = server.accept()
+            with client, client.makefile('rwb') as stream:
+                try:
+                    request = json.loads(stream.readline())
+                    # Reopen the connection if the server dropped it while idle
+                    banking_system.db.connection.ping(reconnect=True)
+                    response = run_operation(
+                        banking_system, request['command'], request.get('params', {}))
+                    # End the request's transaction so the next one sees later commits
+                    if response['ok']:
+                        banking_system.db.connection.commit()
+                    else:
+                        banking_system.db.connection.rollback()
+                except Exception as e:
+                    logging.error(f"Agent request error: {str(e)}")
+                    response = {'ok': False, 'error': str(e), 'type': type(e).__name__}
+                stream.write(to_json(response).encode('utf-8') + b'\n')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(SOCKET_PATH)
+        banking_system.close()
+
+
+def replay(trace: str = None, speed: str = '1', concurrency: str = '8',
+           operations: str = '', output: str = None, baseline: str = None) -> int:
+    """Replay a TRANSAXION_CAPTURE trace against the configured database
+
+    With --baseline, the report of an earlier replay (e.g. of another build)
+    saved with --output, latency changes per operation are added.
+    """
+    from workload import compare
+    from workload import replay as replay_trace
+
+    try:
+        if not trace:
+            raise ValueError("--trace is required")
+        report = replay_trace(trace, connect, 0.0 if speed == 'max' else float(speed),
+                              int(concurrency), set(filter(None, operations.split(','))))
+        if baseline:
+            with open(baseline) as f:
+                report['change_pct'] = compare(report, json.load(f)['result'])
+    except Exception as e:
+        print(json.dumps({'ok': False, 'error': str(e), 'type': type(e).__name__}))
+        return 1
+    text = to_json({'ok': True, 'result': report})
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0
+
+
+def main(argv: list = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help', 'help'):
+        print(USAGE)
+        return 0
+
+    try:
+        command, params = parse_args(argv)
+    except ValueError as e:
+        print(json.dumps({'ok': False, 'error': str(e), 'type': 'ValueError'}))
+        return 2
+
+    if command == 'agent':
+        serve()
+        return 0
+
+    if command == 'serve':
+        from server import serve as serve_tcp
+        serve_tcp(**params)
+        return 0
+
+    if command == 'replay':
+        return replay(**params)
+
+    if command == 'list':
+        print(to_json(list_operations()))
+        return 0
+
+    output = None if params.pop('no_agent', False) else forward(command, params)
+    if output is None:
+        try:
+            banking_system = connect()
+        except Exception as e:
+            print(json.dumps({'ok': False, 'error': str(e), 'type': type(e).__name__}))
+            return 1
+        try:
+            output = to_json(run_operation(banking_system, command, params))
+        finally:
+            banking_system.close()
+
+    print(output)
+    return 0 if output.startswith('{"ok": true') else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,7 @@ USE BankingSystem;
     AnnualExpenditure DECIMAL(15, 2),
     -- GoalsCount INT Derived Attribute,
     PRIMARY KEY (Nationality, NationalID),
+    INDEX idx_person1_income (AnnualIncome),
     FOREIGN KEY (CustodianNationality, CustodianNationalID) 
         REFERENCES Person1(Nationality, NationalID)
 );
@@ -104,6 +105,7 @@ CREATE TABLE IF NOT EXISTS BankAccount (
     BankID INT,
     Balance DECIMAL(15, 2),
     CreationDate DATE,
+    INDEX idx_bankaccount_balance (Balance),
     FOREIGN KEY (UserNationality, UserNationalID) 
         REFERENCES Person1(Nationality, NationalID),
     FOREIGN KEY (BranchCode, BankID) 
@@ -172,6 +174,7 @@ CREATE TABLE IF NOT EXISTS Transaction2 (
     TransactionTime TIME NOT NULL,
     Amount DECIMAL(15, 2) NOT NULL,
     PRIMARY KEY (TransactionID),
+    INDEX idx_transaction2_date (TransactionDate),
     FOREIGN KEY (TransactionID) REFERENCES Transaction1(TransactionID)
 );
 
@@ -222,3 +225,142 @@ CREATE TABLE IF NOT EXISTS SavingsGoals2 (
     FOREIGN KEY (GoalName, UserNationality, UserNationalID) 
         REFERENCES SavingsGoals1(GoalName, UserNationality, UserNationalID)
 );
+
+-- Applied Transfers (outcomes of journaled transfers, keyed for idempotent replay)
+CREATE TABLE IF NOT EXISTS AppliedTransfers (
+    TransferID VARCHAR(64) PRIMARY KEY,
+    TransactionID INT,
+    Status VARCHAR(16) NOT NULL,
+    Reason VARCHAR(255),
+    AppliedAt DATETIME NOT NULL,
+    FOREIGN KEY (TransactionID) REFERENCES Transaction1(TransactionID)
+);
+
+-- Transfer Keys (client-supplied idempotency keys of committed transfers; the
+-- primary key turns a retried transfer into a duplicate-key error)
+CREATE TABLE IF NOT EXISTS TransferKeys (
+    IdempotencyKey VARCHAR(64) PRIMARY KEY,
+    TransactionID INT,
+    SenderAccNum INT NOT NULL,
+    ReceiverAccNum INT NOT NULL,
+    Amount DECIMAL(15, 2) NOT NULL,
+    CreatedAt DATETIME NOT NULL,
+    FOREIGN KEY (TransactionID) REFERENCES Transaction1(TransactionID)
+);
+
+-- Balance Snapshots (daily checkpoints; Balance includes every transaction up to
+-- LastTransactionID and every posting up to LastPostingID)
+CREATE TABLE IF NOT EXISTS BalanceSnapshots (
+    AccountNumber INT,
+    SnapshotDate DATE,
+    Balance DECIMAL(15, 2) NOT NULL,
+    LastTransactionID INT NOT NULL,
+    LastPostingID BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (AccountNumber, SnapshotDate),
+    FOREIGN KEY (AccountNumber) REFERENCES BankAccount(AccountNumber)
+);
+
+-- Shard Map (home shard of every account; lives on the first shard only)
+CREATE TABLE IF NOT EXISTS AccountShards (
+    AccountNumber INT PRIMARY KEY,
+    ShardID INT NOT NULL,
+    Nationality VARCHAR(69) NOT NULL,
+    NationalID VARCHAR(69) NOT NULL,
+    INDEX idx_accountshards_customer (Nationality, NationalID)
+);
+
+-- Shard Sequences (last identifier handed out, unique across shards)
+CREATE TABLE IF NOT EXISTS ShardSequences (
+    Name VARCHAR(64) PRIMARY KEY,
+    LastValue BIGINT NOT NULL
+);
+
+-- Shard Reservations (transaction IDs handed out to transfers that have not finished)
+CREATE TABLE IF NOT EXISTS ShardReservations (
+    FirstID BIGINT PRIMARY KEY,
+    ReservedAt DATETIME NOT NULL
+);
+
+-- Shard Decisions (commit decisions of cross-shard transactions awaiting XA COMMIT)
+CREATE TABLE IF NOT EXISTS ShardDecisions (
+    GlobalID VARCHAR(64) PRIMARY KEY,
+    Decision VARCHAR(16) NOT NULL,
+    DecidedAt DATETIME NOT NULL
+);
+
+-- Postings (single-account ledger entries from period-end runs; credits positive)
+CREATE TABLE IF NOT EXISTS Postings (
+    PostingID BIGINT AUTO_INCREMENT PRIMARY KEY,
+    Period CHAR(7) NOT NULL,
+    AccountNumber INT NOT NULL,
+    Kind VARCHAR(16) NOT NULL,
+    Amount DECIMAL(15, 2) NOT NULL,
+    PostingDate DATE NOT NULL,
+    UNIQUE KEY uq_postings_period (Period, Kind, AccountNumber),
+    INDEX idx_postings_account (AccountNumber, PostingID),
+    FOREIGN KEY (AccountNumber) REFERENCES BankAccount(AccountNumber)
+);
+
+-- Period-End Runs (progress checkpoint and totals of each monthly run)
+CREATE TABLE IF NOT EXISTS PeriodEndRuns (
+    Period CHAR(7) PRIMARY KEY,
+    Phase VARCHAR(16) NOT NULL,
+    NextAccount INT NOT NULL,
+    InterestCount INT NOT NULL DEFAULT 0,
+    InterestTotal DECIMAL(15, 2) NOT NULL DEFAULT 0,
+    MaintenanceCount INT NOT NULL DEFAULT 0,
+    MaintenanceTotal DECIMAL(15, 2) NOT NULL DEFAULT 0,
+    MaturityCount INT NOT NULL DEFAULT 0,
+    MaturityTotal DECIMAL(15, 2) NOT NULL DEFAULT 0,
+    StartedAt DATETIME NOT NULL,
+    FinishedAt DATETIME
+);
+
+-- Balance Buckets (credits to hot accounts not yet folded into BankAccount.Balance;
+-- an account is hot while it has bucket rows, and its total is Balance + SUM(Amount))
+CREATE TABLE IF NOT EXISTS BalanceBuckets (
+    AccountNumber INT,
+    Bucket TINYINT UNSIGNED,
+    Amount DECIMAL(15, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (AccountNumber, Bucket),
+    FOREIGN KEY (AccountNumber) REFERENCES BankAccount(AccountNumber)
+);
+
+-- Branch Daily Rollups (transfer count, sum, min and max sent from and received
+-- into each branch's accounts per day; a branch-day is spread over Slot rows,
+-- so its totals are the sums (and min/max) over its slots)
+CREATE TABLE IF NOT EXISTS BranchDailyRollups (
+    BankID INT,
+    BranchCode INT,
+    Day DATE,
+    Slot TINYINT UNSIGNED,
+    SentCount INT NOT NULL DEFAULT 0,
+    SentAmount DECIMAL(20, 2) NOT NULL DEFAULT 0,
+    SentMin DECIMAL(15, 2),
+    SentMax DECIMAL(15, 2),
+    ReceivedCount INT NOT NULL DEFAULT 0,
+    ReceivedAmount DECIMAL(20, 2) NOT NULL DEFAULT 0,
+    ReceivedMin DECIMAL(15, 2),
+    ReceivedMax DECIMAL(15, 2),
+    PRIMARY KEY (BankID, BranchCode, Day, Slot),
+    INDEX idx_branchdailyrollups_day (Day),
+    FOREIGN KEY (BranchCode, BankID) REFERENCES BankBranch1(BranchCode, BankID)
+);
+
+-- Custodian Closure (every guardian-dependent pair of the Person1 custodian
+-- relation, at any distance; Depth 1 is the custodian itself, and each person
+-- is their own ancestor at Depth 0)
+CREATE TABLE IF NOT EXISTS CustodianClosure (
+    AncestorNationality VARCHAR(69),
+    AncestorNationalID VARCHAR(69),
+    DescendantNationality VARCHAR(69),
+    DescendantNationalID VARCHAR(69),
+    Depth INT NOT NULL,
+    PRIMARY KEY (AncestorNationality, AncestorNationalID,
+                 DescendantNationality, DescendantNationalID),
+    INDEX idx_custodianclosure_descendant (DescendantNationality, DescendantNationalID, Depth),
+    FOREIGN KEY (AncestorNationality, AncestorNationalID)
+        REFERENCES Person1(Nationality, NationalID),
+    FOREIGN KEY (DescendantNationality, DescendantNationalID)
+        REFERENCES Person1(Nationality, NationalID)
+);
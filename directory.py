@@ -0,0 +1,213 @@
+import bisect
+import threading
+from array import array
+
+from money import Money, to_cents
+
+# Account subtypes; the index is what the directory stores
+KINDS = (None, 'current', 'saving', 'salary', 'demat', 'fixeddeposit')
+
+# Stored in place of a NULL amount or limit
+MISSING = -(2 ** 63)
+
+ACCOUNT_METADATA = """
+    SELECT ba.AccountNumber, ba.UserNationality, ba.UserNationalID,
+           p2.First, p2.Middle, p2.Last,
+           CASE
+               WHEN ca.AccountNumber IS NOT NULL THEN 1
+               WHEN sa.AccountNumber IS NOT NULL THEN 2
+               WHEN sal.AccountNumber IS NOT NULL THEN 3
+               WHEN da.AccountNumber IS NOT NULL THEN 4
+               WHEN fd.AccountNumber IS NOT NULL THEN 5
+               ELSE 0
+           END as Kind,
+           COALESCE(ca.MinBalance, sa.MinBalance) as MinBalance,
+           COALESCE(ca.MonthlyTransactionLimit, sa.MonthlyWithdrawalLimit) as MonthlyLimit,
+           ba.BankID, ba.BranchCode
+    FROM BankAccount ba
+    LEFT JOIN Person2 p2 ON ba.UserNationality = p2.Nationality
+        AND ba.UserNationalID = p2.NationalID
+    LEFT JOIN CurrentAccount ca ON ba.AccountNumber = ca.AccountNumber
+    LEFT JOIN SavingAccount sa ON ba.AccountNumber = sa.AccountNumber
+    LEFT JOIN SalaryAccount sal ON ba.AccountNumber = sal.AccountNumber
+    LEFT JOIN DematAccount da ON ba.AccountNumber = da.AccountNumber
+    LEFT JOIN FixedDepositAccount fd ON ba.AccountNumber = fd.AccountNumber
+"""
+
+
+class AccountInfo:
+    """Immutable metadata of one account"""
+    __slots__ = ('account_number', 'nationality', 'national_id', 'first', 'middle',
+                 'last', 'kind', 'min_balance', 'monthly_limit', 'bank_id', 'branch_code')
+
+    def __init__(self, account_number, nationality, national_id, first, middle, last,
+                 kind, min_balance, monthly_limit, bank_id, branch_code):
+        self.account_number = account_number
+        self.nationality = nationality
+        self.national_id = national_id
+        self.first = first
+        self.middle = middle
+        self.last = last
+        self.kind = kind
+        self.min_balance = min_balance
+        self.monthly_limit = monthly_limit
+        self.bank_id = bank_id
+        self.branch_code = branch_code
+
+
+class PackedStrings:
+    """Append-only list of strings stored as one byte buffer plus offsets"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array('q', [0])
+
+    def append(self, value: str):
+        self._data += value.encode('utf-8')
+        self._offsets.append(len(self._data))
+
+    def __getitem__(self, index: int) -> str:
+        return self._data[self._offsets[index]:self._offsets[index + 1]].decode('utf-8')
+
+    def nbytes(self) -> int:
+        return len(self._data) + self._offsets.itemsize * len(self._offsets)
+
+
+class AccountDirectory:
+    """In-process directory of account metadata, keyed by AccountNumber
+
+    Holds the owner key, owner name, subtype, MinBalance, monthly limit and branch of
+    every account so transfer validation needs no metadata queries. Accounts
+    are stored column-wise in arrays sorted by account number; repeated
+    strings (nationalities, names) are kept once. Account metadata never
+    changes after creation, so the directory is loaded once and accounts
+    opened later are fetched individually on first use.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._clear()
+
+    def _clear(self):
+        self._numbers = array('q')
+        self._nationalities = array('i')
+        self._national_ids = PackedStrings()
+        self._names = array('i')
+        self._kinds = array('b')
+        self._min_balances = array('q')
+        self._limits = array('q')
+        self._branches = array('q')
+        self._strings = []
+        self._string_index = {}
+        self._extra = {}
+
+    def _intern(self, value) -> int:
+        if value is None:
+            return -1
+        index = self._string_index.get(value)
+        if index is None:
+            index = self._string_index[value] = len(self._strings)
+            self._strings.append(value)
+        return index
+
+    def _string(self, index: int):
+        return None if index < 0 else self._strings[index]
+
+    @staticmethod
+    def _cents(amount) -> int:
+        return MISSING if amount is None else to_cents(amount)
+
+    def _append(self, row):
+        account_number, nationality, national_id, first, middle, last, kind, \
+            min_balance, monthly_limit, bank_id, branch_code = row
+        self._numbers.append(account_number)
+        self._nationalities.append(self._intern(nationality))
+        self._national_ids.append(national_id)
+        self._names.extend((self._intern(first), self._intern(middle), self._intern(last)))
+        self._kinds.append(kind)
+        self._min_balances.append(self._cents(min_balance))
+        self._limits.append(MISSING if monthly_limit is None else monthly_limit)
+        self._branches.extend((MISSING if bank_id is None else bank_id,
+                               MISSING if branch_code is None else branch_code))
+
+    def load(self) -> int:
+        """Rebuild the directory from one streamed query; returns the number of accounts"""
+        import pymysql.cursors
+
+        cursor = self.db.connection.cursor(pymysql.cursors.SSCursor)
+        with self._lock:
+            self._clear()
+            try:
+                cursor.execute(ACCOUNT_METADATA + " ORDER BY ba.AccountNumber")
+                for row in cursor:
+                    self._append(row)
+            finally:
+                cursor.close()
+            self.loaded = True
+            return len(self._numbers)
+
+    def lookup(self, account_number: int, db=None):
+        """AccountInfo for an account, or None if it does not exist
+
+        Accounts opened since load() are fetched through db (default: the
+        loading connection) and kept.
+        """
+        with self._lock:
+            info = self._get(account_number)
+        if info is not None:
+            return info
+
+        db = db or self.db
+        db.cursor.execute(ACCOUNT_METADATA + " WHERE ba.AccountNumber = %s", (account_number,))
+        row = db.cursor.fetchone()
+        if not row:
+            return None
+        info = AccountInfo(row['AccountNumber'], row['UserNationality'], row['UserNationalID'],
+                           row['First'], row['Middle'], row['Last'], KINDS[row['Kind']],
+                           None if row['MinBalance'] is None else Money.of(row['MinBalance']),
+                           row['MonthlyLimit'],
+                           row['BankID'], row['BranchCode'])
+        with self._lock:
+            self._extra[account_number] = info
+        return info
+
+    def _get(self, account_number: int):
+        info = self._extra.get(account_number)
+        if info is not None:
+            return info
+        i = bisect.bisect_left(self._numbers, account_number)
+        if i == len(self._numbers) or self._numbers[i] != account_number or self._kinds[i] < 0:
+            return None
+
+        min_balance, limit = self._min_balances[i], self._limits[i]
+        bank_id, branch_code = self._branches[2 * i], self._branches[2 * i + 1]
+        return AccountInfo(
+            account_number, self._string(self._nationalities[i]), self._national_ids[i],
+            self._string(self._names[3 * i]), self._string(self._names[3 * i + 1]),
+            self._string(self._names[3 * i + 2]), KINDS[self._kinds[i]],
+            None if min_balance == MISSING else Money(min_balance),
+            None if limit == MISSING else limit,
+            None if bank_id == MISSING else bank_id,
+            None if branch_code == MISSING else branch_code)
+
+    def invalidate(self, account_number: int):
+        """Forget anything cached about an account number, e.g. once it is (re)created"""
+        with self._lock:
+            self._extra.pop(account_number, None)
+            i = bisect.bisect_left(self._numbers, account_number)
+            if i < len(self._numbers) and self._numbers[i] == account_number:
+                # Keep the arrays dense; a sentinel kind marks the slot stale
+                self._kinds[i] = -1
+
+    def stats(self) -> dict:
+        with self._lock:
+            columns = (self._numbers, self._nationalities, self._names, self._kinds,
+                       self._min_balances, self._limits, self._branches)
+            return {
+                'accounts': len(self._numbers) + len(self._extra),
+                'bytes': (sum(column.itemsize * len(column) for column in columns)
+                          + self._national_ids.nbytes()
+                          + sum(len(value) for value in self._strings)),
+            }
@@ -0,0 +1,159 @@
+"""Structured JSON logging written by a background thread
+
+Callers only put records on an in-memory queue; a QueueListener thread
+formats them as JSON lines and writes them to a rotating file, so disk
+latency never reaches the request path. If the writer falls behind by more
+than `capacity` records, new records are dropped (and counted) rather than
+making the caller wait.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_STANDARD = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_handler = None
+
+
+def parse_sampling(spec: str) -> dict:
+    """Parse "operation=N,..." into {operation: N}: keep one record in N"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        operation, _, rate = item.partition('=')
+        rates[operation.strip()] = max(1, int(rate))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, message and any extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+                    + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep one in N INFO records of the high-volume operations in rates
+
+    Records name their operation with extra={'operation': ...}; kept records
+    carry sample_rate so counts can be scaled back up. Warnings and errors
+    are always kept.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, 'operation', None))
+        if not rate or record.levelno > logging.INFO:
+            return True
+        key = (record.operation, getattr(record, 'event', None))
+        with self._lock:
+            seen = self._counters.get(key, 0)
+            self._counters[key] = seen + 1
+        if seen % rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: beyond capacity, records are dropped"""
+
+    def __init__(self, log_queue: queue.Queue, capacity: int):
+        super().__init__(log_queue)
+        self.capacity = capacity
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now; extra fields stay separate
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.qsize() >= self.capacity:
+            with self._lock:
+                self.dropped += 1
+            return
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            self.queue.put_nowait(self.prepare(logging.makeLogRecord({
+                'name': 'eventlog', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"Log writer behind: {dropped} records dropped", 'dropped': dropped})))
+        self.queue.put_nowait(record)
+
+
+def configure(filename: str, level: int = logging.INFO, max_bytes: int = 50 * 2**20,
+              backup_count: int = 5, rotate_when: str = '', sampling: dict = None,
+              capacity: int = 10000):
+    """Send the root logger's records through a queue to a JSON log file
+
+    The file is rotated once it reaches max_bytes or, when rotate_when is
+    given (e.g. 'midnight', 'H'), on that schedule instead; backup_count old
+    files are kept. Safe to call more than once: later calls do nothing.
+    """
+    global _listener, _handler
+    if _listener:
+        return
+
+    if rotate_when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            filename, when=rotate_when, backupCount=backup_count, delay=True)
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+    file_handler.setFormatter(JsonFormatter())
+
+    # Unbounded so the stop sentinel always fits; the handler enforces capacity
+    log_queue = queue.Queue()
+    _handler = DroppingQueueHandler(log_queue, capacity)
+    if sampling:
+        _handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """Write out every queued record and stop the writer thread"""
+    global _listener, _handler
+    if not _listener:
+        return
+    logging.getLogger().removeHandler(_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = _handler = None
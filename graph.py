@@ -0,0 +1,322 @@
+"""Transfer graph analytics over a compressed sparse row (CSR) structure
+
+Accounts are vertices and transfers edges; parallel transfers between the
+same two accounts are merged into one edge carrying their count and total.
+Every analysis is a vectorized pass over the NumPy arrays, so the cost grows
+with the number of edges rather than with Python-level loops over them.
+NumPy is only needed here and is imported on first use.
+"""
+from contextlib import nullcontext
+
+from money import Money, sql_cents
+
+# Rows fetched from the server per round trip while loading edges
+FETCH_SIZE = 100_000
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("Transfer graph analytics need NumPy (pip install numpy)") from None
+    return numpy
+
+
+class TransferGraph:
+    """Transfers of a date window as forward and reverse CSR adjacency arrays
+
+    `accounts[i]` is the account number of vertex i. Out-edges of vertex i are
+    `targets[out_ptr[i]:out_ptr[i + 1]]` with matching `out_counts` and
+    `out_cents`; `sources`/`in_ptr` are the same edges indexed by receiver.
+    """
+
+    def __init__(self, senders, receivers, cents):
+        np = _numpy()
+
+        self.accounts, inverse = np.unique(
+            np.concatenate((senders, receivers)), return_inverse=True)
+        n, m = len(self.accounts), len(senders)
+        src = inverse[:m].astype(np.int64)
+        dst = inverse[m:].astype(np.int64)
+
+        # Merge parallel transfers: one edge per (sender, receiver) pair
+        key = src * n + dst
+        order = np.argsort(key, kind='stable')
+        key, cents = key[order], cents[order]
+        starts = np.flatnonzero(np.r_[len(key) > 0, key[1:] != key[:-1]])
+        pairs = key[starts]
+        self.out_counts = np.diff(np.r_[starts, len(key)])
+        self.out_cents = np.add.reduceat(cents, starts) if len(key) else cents
+
+        src, dst = pairs // n, pairs % n
+        self.targets = dst.astype(np.int32)
+        self.out_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self.out_ptr[1:])
+
+        by_receiver = np.argsort(dst, kind='stable')
+        self.sources = src[by_receiver].astype(np.int32)
+        self.in_edges = by_receiver
+        self.in_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dst, minlength=n), out=self.in_ptr[1:])
+
+    @classmethod
+    def load(cls, db, start_date: str, end_date: str, limited=None):
+        """Stream every transfer dated in [start_date, end_date] into a graph
+
+        limited(query, params), if given, is a context yielding the query to
+        run, e.g. ReportPolicy.limited.
+        """
+        import pymysql.cursors
+
+        np = _numpy()
+        query = f"""
+            SELECT t1.SenderAccNum, t1.ReceiverAccNum, {sql_cents('t2.Amount')}
+            FROM Transaction2 t2
+            JOIN Transaction1 t1 ON t2.TransactionID = t1.TransactionID
+            WHERE t2.TransactionDate BETWEEN %s AND %s
+        """
+        params = (start_date, end_date)
+        chunks = []
+        with limited(query, params) if limited else nullcontext(query) as query:
+            cursor = db.connection.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(FETCH_SIZE)
+                    if not rows:
+                        break
+                    chunks.append(np.array(rows, dtype=np.int64))
+            finally:
+                cursor.close()
+
+        edges = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.int64)
+        return cls(edges[:, 0], edges[:, 1], edges[:, 2])
+
+    @property
+    def vertex_count(self) -> int:
+        return len(self.accounts)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    def vertices(self, account_numbers):
+        """Vertex indices of the given accounts that appear in the graph"""
+        np = _numpy()
+        if len(self.accounts) == 0:
+            return np.empty(0, dtype=np.int64)
+        wanted = np.asarray(list(account_numbers), dtype=np.int64)
+        positions = np.searchsorted(self.accounts, wanted)
+        positions = np.minimum(positions, len(self.accounts) - 1)
+        found = self.accounts[positions] == wanted
+        return np.unique(positions[found])
+
+    @staticmethod
+    def _amount(cents) -> Money:
+        return Money(int(cents))
+
+    def _expand(self, ptr, neighbors, frontier):
+        """All (neighbor, origin) pairs of the frontier vertices, without a Python loop"""
+        np = _numpy()
+        starts, counts = ptr[frontier], ptr[frontier + 1] - ptr[frontier]
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return neighbors[offsets], np.repeat(frontier, counts)
+
+    # Rankings
+    def top_fan(self, k: int, direction: str = 'out') -> list:
+        """Accounts with the most distinct counterparties, sending ('out') or receiving ('in')"""
+        np = _numpy()
+        ptr, weights = (self.out_ptr, self.out_cents) if direction == 'out' else \
+            (self.in_ptr, self.out_cents[self.in_edges])
+        counts = self.out_counts if direction == 'out' else self.out_counts[self.in_edges]
+        degree = np.diff(ptr)
+        if not len(degree):
+            return []
+
+        starts = ptr[:-1]
+        nonempty = degree > 0
+        amounts = np.zeros(len(degree), dtype=np.int64)
+        transfers = np.zeros(len(degree), dtype=np.int64)
+        amounts[nonempty] = np.add.reduceat(weights, starts[nonempty])
+        transfers[nonempty] = np.add.reduceat(counts, starts[nonempty])
+
+        k = min(k, len(degree))
+        candidates = np.argpartition(-degree, k - 1)[:k]
+        # Ties on the k-th degree stay in: rank all of them by degree, then amount
+        candidates = np.flatnonzero(degree >= degree[candidates].min())
+        ranked = candidates[np.lexsort((-amounts[candidates], -degree[candidates]))]
+        return [{'AccountNumber': int(self.accounts[v]),
+                 'Counterparties': int(degree[v]),
+                 'Transfers': int(transfers[v]),
+                 'Amount': self._amount(amounts[v])} for v in ranked[:k]]
+
+    # Flow between customers
+    def direct_flow(self, from_vertices, to_vertices) -> tuple:
+        """(transfers, amount) sent directly from one vertex set to another"""
+        np = _numpy()
+        if not len(from_vertices) or not len(to_vertices):
+            return 0, Money()
+        targets, _ = self._expand(self.out_ptr, self.targets, from_vertices)
+        edge_ids, _ = self._expand(self.out_ptr, np.arange(self.edge_count), from_vertices)
+        hits = np.isin(targets, to_vertices)
+        edges = edge_ids[hits]
+        return int(self.out_counts[edges].sum()), self._amount(self.out_cents[edges].sum())
+
+    def shortest_path(self, from_vertices, to_vertices, max_hops: int = 6):
+        """Fewest-hop chain of accounts from one vertex set to another, or None
+
+        Breadth-first over whole frontiers at a time.
+        """
+        np = _numpy()
+        if not len(from_vertices) or not len(to_vertices):
+            return None
+        parent = np.full(self.vertex_count, -2, dtype=np.int64)
+        parent[from_vertices] = -1
+        goal = np.zeros(self.vertex_count, dtype=bool)
+        goal[to_vertices] = True
+        frontier = np.asarray(from_vertices, dtype=np.int64)
+
+        for _ in range(max_hops):
+            neighbors, origins = self._expand(self.out_ptr, self.targets, frontier)
+            fresh = parent[neighbors] == -2
+            neighbors, origins = neighbors[fresh], origins[fresh]
+            neighbors, first = np.unique(neighbors, return_index=True)
+            if not len(neighbors):
+                return None
+            parent[neighbors] = origins[first]
+
+            reached = neighbors[goal[neighbors]]
+            if len(reached):
+                path, vertex = [], int(reached[0])
+                while vertex != -1:
+                    path.append(int(self.accounts[vertex]))
+                    vertex = int(parent[vertex])
+                return path[::-1]
+            frontier = neighbors
+        return None
+
+    # Round-tripping
+    def cycles(self, limit: int = 100, sample: int = 50) -> list:
+        """Groups of accounts that money can circulate through, largest volume first
+
+        Vertices with no incoming or no outgoing edge cannot be on a cycle and
+        are peeled off in vectorized rounds; strongly connected components of
+        what remains (usually a small core) are found with Tarjan's algorithm.
+        Each group lists up to `sample` of its accounts.
+        """
+        np = _numpy()
+        alive = np.ones(self.vertex_count, dtype=bool)
+        src = np.repeat(np.arange(self.vertex_count), np.diff(self.out_ptr))
+        dst = self.targets.astype(np.int64)
+        while True:
+            live = alive[src] & alive[dst]
+            has_out = np.bincount(src[live], minlength=self.vertex_count) > 0
+            has_in = np.bincount(dst[live], minlength=self.vertex_count) > 0
+            keep = alive & has_out & has_in
+            if keep.sum() == alive.sum():
+                break
+            alive = keep
+
+        core = np.flatnonzero(alive[src] & alive[dst])
+        labels = np.full(self.vertex_count, -1, dtype=np.int64)
+        components = self._strong_components(src[core], dst[core], np.flatnonzero(alive))
+        for label, members in enumerate(components):
+            labels[members] = label
+
+        # Edges inside a component carry its circulating money; a single
+        # account only forms a cycle through a transfer to itself
+        inside = core[labels[src[core]] == labels[dst[core]]]
+        owner = labels[src[inside]]
+        transfers = np.zeros(len(components), dtype=np.int64)
+        cents = np.zeros(len(components), dtype=np.int64)
+        np.add.at(transfers, owner, self.out_counts[inside])
+        np.add.at(cents, owner, self.out_cents[inside])
+
+        groups = [label for label in np.flatnonzero(transfers)]
+        groups.sort(key=lambda label: cents[label], reverse=True)
+        return [{
+            'Size': len(components[label]),
+            'Accounts': sorted(int(account) for account in
+                               self.accounts[components[label]])[:sample],
+            'Transfers': int(transfers[label]),
+            'Amount': self._amount(cents[label]),
+        } for label in groups[:limit]]
+
+    @staticmethod
+    def _strong_components(src, dst, vertices) -> list:
+        """Iterative Tarjan over an edge list restricted to `vertices`"""
+        adjacency = {int(v): [] for v in vertices}
+        for s, d in zip(src.tolist(), dst.tolist()):
+            adjacency[s].append(d)
+
+        index, low, on_stack, stack, components = {}, {}, set(), [], []
+        counter = 0
+        for root in adjacency:
+            if root in index:
+                continue
+            work = [(root, 0)]
+            while work:
+                vertex, i = work.pop()
+                if i == 0:
+                    index[vertex] = low[vertex] = counter
+                    counter += 1
+                    stack.append(vertex)
+                    on_stack.add(vertex)
+                neighbors = adjacency[vertex]
+                if i < len(neighbors):
+                    work.append((vertex, i + 1))
+                    neighbor = neighbors[i]
+                    if neighbor not in index:
+                        work.append((neighbor, 0))
+                    elif neighbor in on_stack:
+                        low[vertex] = min(low[vertex], index[neighbor])
+                    continue
+
+                if low[vertex] == index[vertex]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == vertex:
+                            break
+                    components.append(component)
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[vertex])
+        return components
+
+    # Connectivity
+    def components(self, k: int = 10, sample: int = 20) -> dict:
+        """Weakly connected components: how many, and the k largest with sample accounts
+
+        Label propagation with pointer jumping; converges in a few passes
+        over the edges.
+        """
+        np = _numpy()
+        labels = np.arange(self.vertex_count)
+        src = np.repeat(np.arange(self.vertex_count), np.diff(self.out_ptr))
+        dst = self.targets.astype(np.int64)
+        while True:
+            low = np.minimum(labels[src], labels[dst])
+            high = np.maximum(labels[src], labels[dst])
+            before = labels.copy()
+            np.minimum.at(labels, high, low)
+            while True:
+                jumped = labels[labels]
+                if np.array_equal(jumped, labels):
+                    break
+                labels = jumped
+            if np.array_equal(before, labels):
+                break
+
+        roots, sizes = np.unique(labels, return_counts=True)
+        largest = np.argsort(-sizes, kind='stable')[:k]
+        return {
+            'Components': len(roots),
+            'Largest': [{
+                'Size': int(sizes[i]),
+                'Accounts': [int(account) for account in
+                             self.accounts[np.flatnonzero(labels == roots[i])[:sample]]],
+            } for i in largest],
+        }
@@ -0,0 +1,162 @@
+import logging
+import random
+import threading
+from decimal import Decimal
+
+# Bucket rows given to an account flagged hot unless told otherwise
+DEFAULT_BUCKETS = 8
+
+# Credits waiting in buckets, per account; add to Balance for the exact total
+PENDING_CREDITS = """
+    SELECT AccountNumber, SUM(Amount) as Pending
+    FROM BalanceBuckets
+    GROUP BY AccountNumber
+"""
+
+
+class HotAccounts:
+    """Split balances for accounts that receive many concurrent credits
+
+    A credit to a hot account adds to one of its BalanceBuckets rows, picked
+    at random, instead of BankAccount.Balance, so concurrent credits lock
+    different rows. Debits still update Balance; buckets only ever hold
+    credits, so whenever Balance alone covers a debit the total does too, and
+    otherwise fold() moves the buckets into Balance first for an exact check.
+
+    The set of hot accounts is a per-process routing hint: a session that
+    does not know an account is hot simply credits Balance, which is always
+    correct.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> int:
+        """Read which accounts are hot; returns how many"""
+        self.db.cursor.execute("""
+            SELECT AccountNumber, COUNT(*) as Buckets
+            FROM BalanceBuckets
+            GROUP BY AccountNumber
+        """)
+        buckets = {row['AccountNumber']: row['Buckets'] for row in self.db.cursor.fetchall()}
+        with self._lock:
+            self._buckets = buckets
+        return len(buckets)
+
+    def buckets(self, account_number: int) -> int:
+        return self._buckets.get(account_number, 0)
+
+    def credit(self, db, account_number: int, amount: Decimal) -> bool:
+        """Add a credit to a random bucket in db's open transaction
+
+        Returns False, leaving the credit to the caller, when the account is
+        not (or no longer) hot.
+        """
+        count = self.buckets(account_number)
+        if not count:
+            return False
+        db.cursor.execute("""
+            UPDATE BalanceBuckets
+            SET Amount = Amount + %s
+            WHERE AccountNumber = %s AND Bucket = %s
+        """, (amount, account_number, random.randrange(count)))
+        if db.cursor.rowcount:
+            return True
+
+        # Buckets were changed by another session; re-read this account
+        db.cursor.execute(
+            "SELECT COUNT(*) as Buckets FROM BalanceBuckets WHERE AccountNumber = %s",
+            (account_number,))
+        self.remember(account_number, db.cursor.fetchone()['Buckets'])
+        return self.credit(db, account_number, amount)
+
+    def fold(self, db, account_number: int) -> Decimal:
+        """Move an account's bucketed credits into Balance in db's open transaction
+
+        Returns the amount moved. Locks the buckets, then the account row.
+        """
+        db.cursor.execute("""
+            SELECT COALESCE(SUM(Amount), 0) as Pending
+            FROM BalanceBuckets
+            WHERE AccountNumber = %s
+            FOR UPDATE
+        """, (account_number,))
+        pending = db.cursor.fetchone()['Pending']
+        if pending:
+            db.cursor.execute("""
+                UPDATE BankAccount
+                SET Balance = Balance + %s
+                WHERE AccountNumber = %s
+            """, (pending, account_number))
+            db.cursor.execute("""
+                UPDATE BalanceBuckets
+                SET Amount = 0
+                WHERE AccountNumber = %s AND Amount <> 0
+            """, (account_number,))
+        return pending
+
+    def flag(self, db, account_number: int, buckets: int = DEFAULT_BUCKETS):
+        """Make an account hot with the given number of buckets (0: not hot)
+
+        Pending credits are folded into Balance first. Runs in db's open
+        transaction.
+        """
+        if not 0 <= buckets <= 255:
+            raise ValueError("Buckets must be between 0 and 255")
+        self.fold(db, account_number)
+        db.cursor.execute("DELETE FROM BalanceBuckets WHERE AccountNumber = %s", (account_number,))
+        if buckets:
+            db.cursor.executemany("""
+                INSERT INTO BalanceBuckets (AccountNumber, Bucket, Amount)
+                VALUES (%s, %s, 0)
+            """, [(account_number, bucket) for bucket in range(buckets)])
+
+    def consolidate(self, db) -> dict:
+        """Fold every account's buckets, one short transaction per account"""
+        db.cursor.execute("""
+            SELECT DISTINCT AccountNumber FROM BalanceBuckets WHERE Amount <> 0
+        """)
+        accounts = [row['AccountNumber'] for row in db.cursor.fetchall()]
+        db.connection.commit()
+
+        total = Decimal('0.00')
+        for account_number in accounts:
+            try:
+                total += self.fold(db, account_number)
+                db.connection.commit()
+            except Exception:
+                db.connection.rollback()
+                raise
+        return {'accounts': len(accounts), 'amount': total}
+
+    def remember(self, account_number: int, buckets: int):
+        """Record an account's bucket count once a change to it has committed"""
+        with self._lock:
+            if buckets:
+                self._buckets[account_number] = buckets
+            else:
+                self._buckets.pop(account_number, None)
+
+
+class BucketConsolidator(threading.Thread):
+    """Background worker that folds bucketed credits into balances every interval"""
+
+    def __init__(self, hot_accounts: HotAccounts, db, interval: float = 5.0):
+        super().__init__(name='bucket-consolidator', daemon=True)
+        self.hot_accounts = hot_accounts
+        self.db = db
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.hot_accounts.consolidate(self.db)
+            except Exception as e:
+                logging.error(f"Bucket consolidation error: {str(e)}")
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        self.join(timeout)
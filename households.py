@@ -0,0 +1,126 @@
+from money import Money
+
+# Rows written per statement when rebuilding the closure
+REBUILD_BATCH = 1000
+
+INSERT = """
+    INSERT INTO CustodianClosure (AncestorNationality, AncestorNationalID,
+                                  DescendantNationality, DescendantNationalID, Depth)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+def link(db, nationality: str, national_id: str, custodian_nationality: str = None,
+         custodian_national_id: str = None):
+    """Add a new person's closure rows in db's open transaction
+
+    A person is their own ancestor at depth 0, their custodian's at depth 1,
+    and every guardian of the custodian's one level further up. Guardians
+    above the custodian are only found when the custodian's own rows are on
+    db.
+    """
+    db.cursor.execute(INSERT, (nationality, national_id, nationality, national_id, 0))
+    if not (custodian_nationality and custodian_national_id):
+        return
+    db.cursor.execute(INSERT, (custodian_nationality, custodian_national_id,
+                               nationality, national_id, 1))
+    db.cursor.execute("""
+        INSERT INTO CustodianClosure (AncestorNationality, AncestorNationalID,
+                                      DescendantNationality, DescendantNationalID, Depth)
+        SELECT AncestorNationality, AncestorNationalID, %s, %s, Depth + 1
+        FROM CustodianClosure
+        WHERE DescendantNationality = %s AND DescendantNationalID = %s AND Depth > 0
+    """, (nationality, national_id, custodian_nationality, custodian_national_id))
+
+
+def closure(custodians: dict) -> list:
+    """Closure rows of {(Nationality, NationalID): custodian key or None}
+
+    A custodian missing from the mapping ends the chain; a cycle, which the
+    foreign key cannot prevent in data loaded by hand, raises ValueError.
+    """
+    rows = []
+    for person in custodians:
+        rows.append(person + person + (0,))
+        seen, guardian, depth = {person}, custodians[person], 1
+        while guardian is not None:
+            if guardian in seen:
+                raise ValueError(f"Custodian cycle through {guardian[0]}-{guardian[1]}")
+            seen.add(guardian)
+            rows.append(guardian + person + (depth,))
+            guardian, depth = custodians.get(guardian), depth + 1
+    return rows
+
+
+def custodians(db) -> dict:
+    """{(Nationality, NationalID): custodian key or None} of everyone on db"""
+    db.cursor.execute("""
+        SELECT Nationality, NationalID, CustodianNationality, CustodianNationalID
+        FROM Person1
+    """)
+    return {
+        (row['Nationality'], row['NationalID']):
+            (row['CustodianNationality'], row['CustodianNationalID'])
+            if row['CustodianNationality'] and row['CustodianNationalID'] else None
+        for row in db.cursor.fetchall()
+    }
+
+
+def write(db, rows: list):
+    """Replace the whole closure with rows, in one transaction"""
+    try:
+        db.cursor.execute("START TRANSACTION")
+        db.cursor.execute("DELETE FROM CustodianClosure")
+        for start in range(0, len(rows), REBUILD_BATCH):
+            db.cursor.executemany(INSERT, rows[start:start + REBUILD_BATCH])
+        db.connection.commit()
+    except Exception:
+        db.connection.rollback()
+        raise
+
+
+def dependents(db, nationality: str, national_id: str) -> list:
+    """Everyone in a guardian's care, directly or through other dependents"""
+    db.cursor.execute("""
+        SELECT c.DescendantNationality as Nationality, c.DescendantNationalID as NationalID,
+               c.Depth, p2.First, p2.Middle, p2.Last
+        FROM CustodianClosure c
+        LEFT JOIN Person2 p2 ON p2.Nationality = c.DescendantNationality
+            AND p2.NationalID = c.DescendantNationalID
+        WHERE c.AncestorNationality = %s AND c.AncestorNationalID = %s AND c.Depth > 0
+        ORDER BY c.Depth, c.DescendantNationality, c.DescendantNationalID
+    """, (nationality, national_id))
+    return db.cursor.fetchall()
+
+
+def guardians(db, nationality: str, national_id: str) -> list:
+    """A person's custodian, their custodian's custodian and so on, nearest first"""
+    db.cursor.execute("""
+        SELECT c.AncestorNationality as Nationality, c.AncestorNationalID as NationalID,
+               c.Depth, p2.First, p2.Middle, p2.Last
+        FROM CustodianClosure c
+        LEFT JOIN Person2 p2 ON p2.Nationality = c.AncestorNationality
+            AND p2.NationalID = c.AncestorNationalID
+        WHERE c.DescendantNationality = %s AND c.DescendantNationalID = %s AND c.Depth > 0
+        ORDER BY c.Depth
+    """, (nationality, national_id))
+    return db.cursor.fetchall()
+
+
+def balance(db, nationality: str, national_id: str) -> dict:
+    """Members, accounts and total balance of a guardian and all their dependents"""
+    db.cursor.execute("""
+        SELECT COUNT(DISTINCT c.DescendantNationality, c.DescendantNationalID) as Members,
+               COUNT(ba.AccountNumber) as Accounts,
+               COALESCE(SUM(ba.Balance + COALESCE((
+                   SELECT SUM(bb.Amount) FROM BalanceBuckets bb
+                   WHERE bb.AccountNumber = ba.AccountNumber
+               ), 0)), 0) as Balance
+        FROM CustodianClosure c
+        LEFT JOIN BankAccount ba ON ba.UserNationality = c.DescendantNationality
+            AND ba.UserNationalID = c.DescendantNationalID
+        WHERE c.AncestorNationality = %s AND c.AncestorNationalID = %s
+    """, (nationality, national_id))
+    row = db.cursor.fetchone()
+    return {'Members': row['Members'], 'Accounts': row['Accounts'],
+            'Balance': Money.of(row['Balance'])}
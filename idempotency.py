@@ -0,0 +1,150 @@
+import threading
+from collections import OrderedDict
+
+from money import Money
+
+# MySQL error raised when an insert repeats a primary or unique key
+DUPLICATE_KEY = 1062
+
+# Longest key accepted; matches TransferKeys.IdempotencyKey and AppliedTransfers.TransferID
+MAX_KEY_LENGTH = 64
+
+
+class DuplicateKey(Exception):
+    """Raised by claim() when a transfer with the key has already committed"""
+    pass
+
+
+class IdempotencyKeys:
+    """Client-supplied transfer keys, so a retried transfer is posted only once
+
+    A keyed transfer first inserts its TransferKeys row in its own
+    transaction (for a journaled transfer, the applier's); the primary key
+    makes a second insert of the key fail (or wait for the first transfer to
+    commit and then fail) before any balance is touched. Outcomes of recent keys are also kept in an in-process LRU,
+    so most retries are answered without a database round trip. A Bloom
+    filter would be smaller but cannot return the original outcome.
+    """
+
+    def __init__(self, capacity: int = 100000):
+        self.capacity = capacity
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    @staticmethod
+    def validate(key: str):
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise ValueError(f"Idempotency key must be 1 to {MAX_KEY_LENGTH} characters")
+
+    def recent(self, key: str, sender_acc: int, receiver_acc: int, amount: Money) -> dict:
+        """Outcome of a key seen recently by this process, or None"""
+        with self._lock:
+            outcome = self._recent.get(key)
+            if outcome is None:
+                return None
+            self._recent.move_to_end(key)
+            self.hits += 1
+        return self._duplicate(key, outcome, sender_acc, receiver_acc, amount)
+
+    def remember(self, key: str, outcome: dict):
+        """Record a key's outcome once its transfer has committed or been journaled"""
+        if not self.capacity:
+            return
+        with self._lock:
+            self._remember(key, outcome)
+
+    def _remember(self, key: str, outcome: dict):
+        self._recent[key] = outcome
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.capacity:
+            self._recent.popitem(last=False)
+
+    def remember_first(self, key: str, outcome: dict, sender_acc: int, receiver_acc: int,
+                       amount: Money) -> dict:
+        """Remember outcome unless the key already has one, which is then returned as recent() does
+
+        Used for journaled transfers, which have no TransferKeys row to
+        serialize on until they are applied.
+        """
+        if not self.capacity:
+            return None
+        with self._lock:
+            earlier = self._recent.get(key)
+            if earlier is None:
+                self._remember(key, outcome)
+                return None
+            self._recent.move_to_end(key)
+            self.hits += 1
+        return self._duplicate(key, earlier, sender_acc, receiver_acc, amount)
+
+    def forget(self, key: str, transfer_id: str = None):
+        """Drop a key's outcome, if given only while it is that journaled transfer's"""
+        with self._lock:
+            outcome = self._recent.get(key)
+            if outcome is not None and transfer_id in (None, outcome.get('transfer_id')):
+                del self._recent[key]
+
+    def claim(self, db, key: str, sender_acc: int, receiver_acc: int, amount: Money):
+        """Insert the key in db's open transaction; raises DuplicateKey if it is taken"""
+        try:
+            db.cursor.execute("""
+                INSERT INTO TransferKeys (IdempotencyKey, SenderAccNum, ReceiverAccNum,
+                                          Amount, CreatedAt)
+                VALUES (%s, %s, %s, %s, NOW())
+            """, (key, sender_acc, receiver_acc, amount))
+        except Exception as e:
+            if e.args and e.args[0] == DUPLICATE_KEY:
+                raise DuplicateKey(key) from e
+            raise
+
+    def complete(self, db, key: str, transaction_id: int):
+        """Attach the posted transaction to a claimed key, in the same transaction"""
+        db.cursor.execute("""
+            UPDATE TransferKeys SET TransactionID = %s WHERE IdempotencyKey = %s
+        """, (transaction_id, key))
+
+    def fetch(self, db, key: str) -> dict:
+        """Committed outcome of a key from TransferKeys, or None; reads in db's transaction"""
+        db.cursor.execute("""
+            SELECT TransactionID, SenderAccNum, ReceiverAccNum, Amount
+            FROM TransferKeys
+            WHERE IdempotencyKey = %s
+        """, (key,))
+        row = db.cursor.fetchone()
+        if row is None:
+            return None
+        return {
+            'status': 'completed',
+            'transaction_id': row['TransactionID'],
+            'sender_acc': row['SenderAccNum'],
+            'receiver_acc': row['ReceiverAccNum'],
+            'amount': Money.of(row['Amount']),
+        }
+
+    def lookup(self, db, key: str, sender_acc: int, receiver_acc: int, amount: Money) -> dict:
+        """Outcome of a key that has committed, as recent() returns it, or None
+
+        Call outside a transaction.
+        """
+        outcome = self.fetch(db, key)
+        db.connection.commit()
+        if outcome is None:
+            return None
+        self.remember(key, outcome)
+        return self._duplicate(key, outcome, sender_acc, receiver_acc, amount)
+
+    def stored(self, db, key: str, sender_acc: int, receiver_acc: int, amount: Money) -> dict:
+        """Outcome of a key that has already committed; call outside a transaction"""
+        outcome = self.lookup(db, key, sender_acc, receiver_acc, amount)
+        if outcome is None:
+            raise ValueError(f"Idempotency key {key} could not be read back")
+        return outcome
+
+    @staticmethod
+    def _duplicate(key: str, outcome: dict, sender_acc: int, receiver_acc: int,
+                   amount: Money) -> dict:
+        if (outcome['sender_acc'], outcome['receiver_acc'], outcome['amount']) != (
+                sender_acc, receiver_acc, amount):
+            raise ValueError(f"Idempotency key {key} was already used for a different transfer")
+        return dict(outcome, idempotency_key=key, duplicate=True)
@@ -0,0 +1,270 @@
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from idempotency import DuplicateKey
+from money import Money
+
+# Every record is a big-endian (payload length, CRC32 of payload) header
+# followed by a UTF-8 JSON payload.
+RECORD_HEADER = struct.Struct('>II')
+
+
+class TransferJournal:
+    """Append-only, checksummed file of transfers awaiting database commit
+
+    One journal file has one writer: the journal holds an exclusive lock on
+    it while open, since another instance's truncation after applying would
+    wipe transfers this one acknowledged but has not yet applied.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._file.close()
+            raise ValueError(f"Journal {path} is already in use by another session") from None
+        self._size = self._recover()
+
+    def _recover(self) -> int:
+        """Find the end of the last intact record and cut off any torn tail"""
+        records, offset = self._scan(0, None)
+        actual_size = os.path.getsize(self.path)
+        if offset < actual_size:
+            logging.warning(f"Journal {self.path}: discarding {
+                actual_size - offset} bytes of incomplete data")
+            self._file.truncate(offset)
+            self._sync()
+        if records:
+            logging.info(f"Journal {self.path}: {
+                len(records)} transfers pending replay")
+        return offset
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _scan(self, offset: int, max_records):
+        records = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while max_records is None or len(records) < max_records:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, checksum = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+                record = json.loads(payload)
+                record['amount'] = Money.of(record['amount'])
+                record.setdefault('idempotency_key', None)
+                records.append(record)
+                offset += RECORD_HEADER.size + length
+        return records, offset
+
+    def append(self, sender_acc: int, receiver_acc: int, amount: Money,
+               transfer_id: str = None, idempotency_key: str = None) -> str:
+        """Durably record a transfer and return its transfer ID"""
+        return self.append_many(
+            [(sender_acc, receiver_acc, amount, transfer_id, idempotency_key)])[0]
+
+    def append_many(self, transfers) -> list:
+        """Durably record several (sender, receiver, amount, transfer ID, idempotency key)
+        transfers with a single fsync; a missing transfer ID is generated"""
+        transfer_ids = []
+        chunks = []
+        for sender_acc, receiver_acc, amount, transfer_id, idempotency_key in transfers:
+            transfer_id = transfer_id or uuid.uuid4().hex
+            payload = json.dumps({
+                'transfer_id': transfer_id,
+                'idempotency_key': idempotency_key,
+                'sender_acc': sender_acc,
+                'receiver_acc': receiver_acc,
+                'amount': str(amount),
+                'accepted_at': time.time()
+            }).encode('utf-8')
+            chunks.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+            chunks.append(payload)
+            transfer_ids.append(transfer_id)
+
+        data = b''.join(chunks)
+        with self._lock:
+            self._file.write(data)
+            self._sync()
+            self._size += len(data)
+        return transfer_ids
+
+    def read(self, offset: int, max_records: int):
+        """Return up to max_records records from offset and the offset after them"""
+        with self._lock:
+            if offset >= self._size:
+                return [], offset
+        return self._scan(offset, max_records)
+
+    @property
+    def end_offset(self) -> int:
+        with self._lock:
+            return self._size
+
+    def discard_through(self, offset: int) -> bool:
+        """Truncate the journal once everything up to offset has been applied"""
+        with self._lock:
+            if offset < self._size:
+                return False
+            self._file.truncate(0)
+            self._sync()
+            self._size = 0
+            return True
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class JournalApplier(threading.Thread):
+    """Background worker that group-commits journaled transfers
+
+    Replays are caught by the AppliedTransfers row of each transfer ID. A
+    transfer with an idempotency key also claims the key in TransferKeys, so
+    it is posted at most once across direct and journaled transfers.
+    """
+
+    def __init__(self, journal: TransferJournal, banking_system,
+                 batch_size: int = 500, flush_interval: float = 0.05):
+        super().__init__(name='journal-applier', daemon=True)
+        self.journal = journal
+        self.banking_system = banking_system
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.offset = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            records, next_offset = self.journal.read(self.offset, self.batch_size)
+            if not records:
+                if self._stop_event.is_set():
+                    break
+                self._stop_event.wait(self.flush_interval)
+                continue
+
+            try:
+                self.apply_batch(records)
+            except Exception as e:
+                logging.error(f"Journal apply error: {str(e)}")
+                if self._stop_event.is_set():
+                    break
+                time.sleep(1)
+                continue
+
+            self.offset = next_offset
+            if self.journal.discard_through(self.offset):
+                self.offset = 0
+
+    def apply_batch(self, records: list):
+        """Apply a batch of journaled transfers in one database transaction"""
+        db = self.banking_system.db
+        keys = self.banking_system.idempotency_keys
+        try:
+            db.cursor.execute("START TRANSACTION")
+
+            placeholders = ', '.join(['%s'] * len(records))
+            db.cursor.execute(f"""
+                SELECT TransferID FROM AppliedTransfers
+                WHERE TransferID IN ({placeholders})
+            """, [record['transfer_id'] for record in records])
+            seen = {row['TransferID'] for row in db.cursor.fetchall()}
+
+            applied = rejected = 0
+            transfers = []
+            outcomes = []
+            for record in records:
+                if record['transfer_id'] in seen:
+                    continue
+                seen.add(record['transfer_id'])
+
+                db.cursor.execute("SAVEPOINT journal_entry")
+                key = record['idempotency_key']
+                try:
+                    if key is not None:
+                        keys.claim(db, key, record['sender_acc'], record['receiver_acc'],
+                                   record['amount'])
+                    result = self.banking_system.post_transfer(
+                        record['sender_acc'], record['receiver_acc'], record['amount'])
+                    if key is not None:
+                        keys.complete(db, key, result['transaction_id'])
+                    transfers.append(result)
+                    transaction_id, status, reason = result['transaction_id'], 'applied', None
+                    applied += 1
+                except DuplicateKey:
+                    db.cursor.execute("ROLLBACK TO SAVEPOINT journal_entry")
+                    transaction_id, status, reason, result = self._duplicate(db, record)
+                    if status == 'rejected':
+                        rejected += 1
+                except ValueError as e:
+                    db.cursor.execute("ROLLBACK TO SAVEPOINT journal_entry")
+                    transaction_id, status, reason, result = None, 'rejected', str(e), None
+                    rejected += 1
+                outcomes.append((record['transfer_id'], result))
+
+                db.cursor.execute("""
+                    INSERT INTO AppliedTransfers (TransferID, TransactionID, Status, Reason, AppliedAt)
+                    VALUES (%s, %s, %s, %s, NOW())
+                """, (record['transfer_id'], transaction_id, status, reason))
+
+            db.connection.commit()
+            self._settle_velocity(records, outcomes)
+            # A key whose transfer did not post may be used again
+            posted = {transfer_id for transfer_id, result in outcomes if result}
+            for record in records:
+                if record['idempotency_key'] is not None and record['transfer_id'] not in posted:
+                    keys.forget(record['idempotency_key'], record['transfer_id'])
+            self.banking_system.notify_transfers(transfers)
+            logging.info(f"Journal batch committed: {applied} applied, {
+                rejected} rejected, {len(records) - applied - rejected} already applied")
+
+        except Exception:
+            db.connection.rollback()
+            raise
+
+    def _duplicate(self, db, record: dict) -> tuple:
+        """Outcome of a transfer whose idempotency key another transfer already committed"""
+        key = record['idempotency_key']
+        earlier = self.banking_system.idempotency_keys.fetch(db, key)
+        if earlier and (earlier['sender_acc'], earlier['receiver_acc'], earlier['amount']) == (
+                record['sender_acc'], record['receiver_acc'], record['amount']):
+            return earlier['transaction_id'], 'duplicate', None, None
+        reason = f"Idempotency key {key} was already used for a different transfer"
+        return None, 'rejected', reason, None
+
+    def _settle_velocity(self, records: list, outcomes: list):
+        """Resolve the velocity reservations made when the batch was journaled
+
+        A rejected transfer gives its reservation back. One applied without
+        a reservation, journaled before a restart, is counted now.
+        """
+        velocity = self.banking_system.velocity
+        for transfer_id, transfer in outcomes:
+            reservation = velocity.take(transfer_id)
+            if transfer is None:
+                velocity.release(reservation)
+            elif reservation is None:
+                velocity.record_transfer(transfer)
+        # Replays of transfers an earlier batch applied were counted back then
+        for record in records:
+            velocity.take(record['transfer_id'])
+
+    def stop(self, timeout: float = None):
+        """Drain the remaining journal and stop the worker"""
+        self._stop_event.set()
+        self.join(timeout)
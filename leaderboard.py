@@ -0,0 +1,252 @@
+import heapq
+import threading
+import time
+
+from hotaccounts import PENDING_CREDITS
+from money import Money
+
+
+class BalanceLeaderboard:
+    """Bounded in-process cache of the highest account balances
+
+    Holds up to `capacity` accounts in a min-heap keyed by balance, plus a
+    floor: an upper bound on the balance of every account outside the cache.
+    A top-K answer is served from memory while its K-th balance is strictly
+    above the floor; otherwise the cache is reloaded from the Balance index.
+    Balances include the credits pending in hot accounts' buckets; the few
+    hot accounts are read alongside the index.
+
+    One leaderboard can serve several sessions of a process: each passes its
+    own connection to top(), which otherwise defaults to `db`.
+    """
+
+    def __init__(self, db, capacity: int = 1000, max_age: float = 300, hot_accounts=None):
+        self.db = db
+        self.hot_accounts = hot_accounts
+        self.capacity = capacity
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._balances = {}
+        self._heap = []
+        self._floor = None
+        self._loaded_at = None
+
+    def load(self, db=None):
+        """Rebuild the cache from the top of the Balance index"""
+        db = db or self.db
+        db.cursor.execute("""
+            SELECT AccountNumber, Balance FROM BankAccount
+            WHERE Balance IS NOT NULL
+            ORDER BY Balance DESC
+            LIMIT %s
+        """, (self.capacity + 1,))
+        rows = db.cursor.fetchall()
+        db.cursor.execute(f"""
+            SELECT ba.AccountNumber, ba.Balance + pc.Pending as Balance
+            FROM ({PENDING_CREDITS}) pc
+            JOIN BankAccount ba ON pc.AccountNumber = ba.AccountNumber
+        """)
+        hot = db.cursor.fetchall()
+
+        balances = {row['AccountNumber']: Money.of(row['Balance'])
+                    for row in rows[:self.capacity] + hot}
+        ranked = sorted(balances.items(), key=lambda item: (-item[1], item[0]))
+        # Accounts past the index's top hold at most its next balance, and
+        # hot accounts ranked out of the cache at most the best of them
+        floor = (Money.of(rows[self.capacity]['Balance'])
+                 if len(rows) > self.capacity else None)
+        if len(ranked) > self.capacity:
+            dropped = ranked[self.capacity][1]
+            floor = dropped if floor is None else max(floor, dropped)
+
+        with self._lock:
+            self._balances = dict(ranked[:self.capacity])
+            self._heap = [(balance, account)
+                          for account, balance in self._balances.items()]
+            heapq.heapify(self._heap)
+            self._floor = floor
+            self._loaded_at = time.time()
+
+    def invalidate(self):
+        """Force a reload on the next read, e.g. after a bulk balance update"""
+        with self._lock:
+            self._loaded_at = None
+
+    def record_balance(self, account_number: int, balance):
+        """Track a committed balance change for one account"""
+        balance = Money.of(balance)
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._record(account_number, balance)
+
+    def record_change(self, account_number: int, delta):
+        """Track a committed change of an account whose full balance is not known"""
+        delta = Money.of(delta)
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if account_number in self._balances:
+                self._record(account_number, self._balances[account_number] + delta)
+            elif self._floor is None:
+                # Every account was tracked; this one is new
+                self._loaded_at = None
+            elif delta > 0:
+                # It held at most the floor, so now at most the floor plus delta
+                self._floor += delta
+
+    def record_movement(self, account_number: int, balance, delta):
+        """Track one side of a transfer: balance is the account's new Balance column
+
+        A hot account's credits may sit in its buckets, so Balance is not its
+        full balance; only the change is applied to it.
+        """
+        if self.hot_accounts and self.hot_accounts.buckets(account_number):
+            self.record_change(account_number, delta)
+        else:
+            self.record_balance(account_number, balance)
+
+    def _record(self, account_number: int, balance: Money):
+        if account_number in self._balances:
+            if self._floor is not None and balance <= self._floor:
+                # It may now rank below accounts we are not tracking
+                del self._balances[account_number]
+                return
+        elif self._floor is not None and balance <= self._floor:
+            return
+        elif len(self._balances) >= self.capacity and balance <= self._minimum():
+            self._floor = balance if self._floor is None else max(self._floor, balance)
+            return
+
+        self._balances[account_number] = balance
+        heapq.heappush(self._heap, (balance, account_number))
+
+        while len(self._balances) > self.capacity:
+            evicted_balance, evicted = heapq.heappop(self._heap)
+            if self._balances.get(evicted) == evicted_balance:
+                del self._balances[evicted]
+                self._floor = (evicted_balance if self._floor is None
+                               else max(self._floor, evicted_balance))
+
+    def record_transfer(self, transfer: dict):
+        self.record_movement(transfer['sender_acc'], transfer['sender_balance'],
+                             -transfer['amount'])
+        self.record_movement(transfer['receiver_acc'], transfer['receiver_balance'],
+                             transfer['amount'])
+
+    def _minimum(self):
+        # Drop heap entries superseded by later updates or evictions
+        while self._heap and self._balances.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0]
+
+    def _from_cache(self, k: int):
+        with self._lock:
+            if self._loaded_at is None or time.time() - self._loaded_at > self.max_age:
+                return None
+            if k > len(self._balances):
+                return None
+
+            ranked = sorted(self._balances.items(), key=lambda item: (-item[1], item[0]))
+            kth_balance = ranked[k - 1][1]
+            if self._floor is not None and kth_balance <= self._floor:
+                return None
+            return [item for item in ranked if item[1] >= kth_balance]
+
+    def _top_from_index(self, k: int, db) -> list:
+        # Pending credits only raise a balance, so no account below the K-th
+        # Balance of the index ranks in the top K unless it is hot
+        db.cursor.execute(f"""
+            SELECT c.AccountNumber, c.Balance + COALESCE(pc.Pending, 0) as Balance
+            FROM (
+                SELECT AccountNumber, Balance FROM BankAccount
+                WHERE Balance >= COALESCE((
+                    SELECT Balance FROM BankAccount
+                    WHERE Balance IS NOT NULL
+                    ORDER BY Balance DESC
+                    LIMIT 1 OFFSET %s
+                ), (SELECT MIN(Balance) FROM BankAccount))
+                UNION
+                SELECT AccountNumber, Balance FROM BankAccount
+                WHERE AccountNumber IN (SELECT AccountNumber FROM BalanceBuckets)
+            ) c
+            LEFT JOIN ({PENDING_CREDITS}) pc ON c.AccountNumber = pc.AccountNumber
+        """, (k - 1,))
+        ranked = sorted(((row['AccountNumber'], Money.of(row['Balance']))
+                         for row in db.cursor.fetchall() if row['Balance'] is not None),
+                        key=lambda item: (-item[1], item[0]))
+        if len(ranked) <= k:
+            return ranked
+        kth_balance = ranked[k - 1][1]
+        return [item for item in ranked if item[1] >= kth_balance]
+
+    def top(self, k: int, db=None) -> list:
+        """Return the K richest accounts as (AccountNumber, Balance), ties included"""
+        db = db or self.db
+        if k > self.capacity:
+            return self._top_from_index(k, db)
+
+        ranked = self._from_cache(k)
+        if ranked is None:
+            self.load(db)
+            ranked = self._from_cache(k)
+        if ranked is None:
+            # Fewer than K accounts, or ties straddle the cache boundary
+            ranked = self._top_from_index(k, db)
+        return ranked
+
+
+def largest_senders(db, start_date: str, end_date: str, k: int, run=None) -> list:
+    """Customers ranked by total amount sent in a date window, ties included
+
+    run(query, params), if given, runs the query instead of db's cursor.
+    """
+    query = """
+        SELECT * FROM (
+            SELECT ba.UserNationality, ba.UserNationalID,
+                   p2.First, p2.Middle, p2.Last,
+                   COUNT(*) as TransactionCount,
+                   SUM(t2.Amount) as TotalSent,
+                   RANK() OVER (ORDER BY SUM(t2.Amount) DESC) as Position
+            FROM Transaction2 t2
+            JOIN Transaction1 t1 ON t2.TransactionID = t1.TransactionID
+            JOIN BankAccount ba ON t1.SenderAccNum = ba.AccountNumber
+            JOIN Person2 p2 ON ba.UserNationality = p2.Nationality
+                AND ba.UserNationalID = p2.NationalID
+            WHERE t2.TransactionDate BETWEEN %s AND %s
+            GROUP BY ba.UserNationality, ba.UserNationalID, p2.First, p2.Middle, p2.Last
+        ) ranked
+        WHERE Position <= %s
+        ORDER BY Position, UserNationality, UserNationalID
+    """
+    params = (start_date, end_date, k)
+    if run:
+        return run(query, params)
+    db.cursor.execute(query, params)
+    return db.cursor.fetchall()
+
+
+def highest_incomes(db, k: int, run=None) -> list:
+    """Users ranked by annual income via the AnnualIncome index, ties included
+
+    run(query, params), if given, runs the query instead of db's cursor.
+    """
+    query = """
+        SELECT p1.Nationality, p1.NationalID, p1.AnnualIncome,
+               p2.First, p2.Middle, p2.Last
+        FROM Person1 p1
+        JOIN Person2 p2 ON p1.Nationality = p2.Nationality
+            AND p1.NationalID = p2.NationalID
+        WHERE p1.AnnualIncome >= COALESCE((
+            SELECT AnnualIncome FROM Person1
+            WHERE AnnualIncome IS NOT NULL
+            ORDER BY AnnualIncome DESC
+            LIMIT 1 OFFSET %s
+        ), (SELECT MIN(AnnualIncome) FROM Person1))
+        ORDER BY p1.AnnualIncome DESC, p1.Nationality, p1.NationalID
+    """
+    params = (k - 1,)
+    if run:
+        return run(query, params)
+    db.cursor.execute(query, params)
+    return db.cursor.fetchall()
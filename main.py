@@ -1,19 +1,50 @@
+import datetime
 import logging
 import os
-import subprocess as sp
 import time
+import uuid
 from decimal import Decimal
 from getpass import getpass
 
-import pymysql
-import pymysql.cursors
+import archive
+import eventlog
+import households
+import money
+import rollups
+import statements
+from admission import (AdmissionGates, DeferredReports, ReportDeferred, ReportPolicy,
+                       ReportRunner, parse_limits, parse_window)
+from archive import TransactionArchive
+from directory import AccountDirectory
+from graph import TransferGraph
+from hotaccounts import DEFAULT_BUCKETS, BucketConsolidator, HotAccounts
+from idempotency import DuplicateKey, IdempotencyKeys
+from journal import JournalApplier, TransferJournal
+from leaderboard import BalanceLeaderboard, highest_incomes, largest_senders
+from money import Money
+from periodend import PeriodEndJob
+from profiles import load_profiles
+from resultcache import ResultCache
+from routing import ReplicaRouter, is_connection_error, parse_replicas
+from sharding import ShardedBank, parse_shards
+from snapshots import BalanceLedger
+from velocity import VelocityRules, parse_rules
+from workload import recorder
+
+# Log rotation: at LOG_MAX_BYTES, or on the TRANSAXION_LOG_ROTATE_WHEN
+# schedule ('midnight', 'H', ...) when set, keeping LOG_BACKUPS old files
+LOG_FILE = os.environ.get('TRANSAXION_LOG_FILE', 'banking_system.log')
+LOG_MAX_BYTES = int(os.environ.get('TRANSAXION_LOG_MAX_BYTES', str(50 * 2**20)))
+LOG_BACKUPS = int(os.environ.get('TRANSAXION_LOG_BACKUPS', '5'))
+LOG_ROTATE_WHEN = os.environ.get('TRANSAXION_LOG_ROTATE_WHEN', '')
+
+# High-volume operations logged one record in N, as "operation=N,..."
+LOG_SAMPLING = eventlog.parse_sampling(
+    os.environ.get('TRANSAXION_LOG_SAMPLING', 'make_transaction=10'))
 
 # Configure logging
-logging.basicConfig(
-    filename='banking_system.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+eventlog.configure(LOG_FILE, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUPS,
+                   rotate_when=LOG_ROTATE_WHEN, sampling=LOG_SAMPLING)
 
 
 class SecurityException(Exception):
@@ -21,45 +52,543 @@ class SecurityException(Exception):
     pass
 
 
+class ConfirmationRequired(Exception):
+    """Raised when an operation needs explicit confirmation to proceed"""
+    pass
+
+
+# Maximum number of cached read results per session; 0 disables the cache
+CACHE_SIZE = int(os.environ.get('TRANSAXION_CACHE_SIZE', '256'))
+
+# Read replicas as "host[:port],..." and the largest replica delay, in
+# seconds, at which reads are still sent to a replica
+REPLICAS = parse_replicas(os.environ.get('TRANSAXION_REPLICAS', ''))
+MAX_REPLICA_LAG = float(os.environ.get('TRANSAXION_MAX_REPLICA_LAG', '5'))
+
+# Customer shards as "host[:port][/database],..."; empty runs unsharded
+SHARDS = os.environ.get('TRANSAXION_SHARDS', '')
+
+# Seconds between background folds of hot-account buckets into balances;
+# 0 leaves it to debits and explicit consolidate_balances runs
+HOT_CONSOLIDATE_INTERVAL = float(os.environ.get('TRANSAXION_HOT_CONSOLIDATE_INTERVAL', '5'))
+
+# Binary trace file every executed operation is appended to; empty disables
+# capture. Replay it with `transaxion replay --trace PATH`
+CAPTURE = os.environ.get('TRANSAXION_CAPTURE', '')
+
+# Recent transfer idempotency keys remembered per process; 0 always asks the database
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('TRANSAXION_IDEMPOTENCY_CACHE_SIZE', '100000'))
+
+# Per-account transfer limits as "count|amount|receivers:WINDOW:LIMIT,...",
+# e.g. "count:1m:10,amount:24h:50000,receivers:24h:20"; empty disables them
+VELOCITY_RULES = os.environ.get('TRANSAXION_VELOCITY_RULES', '')
+
+# Directory of archived transaction segments (one subdirectory per shard);
+# empty disables archival. archive_transactions moves transactions older
+# than ARCHIVE_AFTER_DAYS days there
+ARCHIVE_DIR = os.environ.get('TRANSAXION_ARCHIVE_DIR', '')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('TRANSAXION_ARCHIVE_AFTER_DAYS', '365'))
+
+# Operations run at once per process and class, as "oltp:N,analytics:N" (0:
+# unlimited); more wait up to ADMISSION_TIMEOUT seconds, at most
+# ADMISSION_QUEUE of them per class
+CONCURRENCY_LIMITS = parse_limits(
+    os.environ.get('TRANSAXION_CONCURRENCY', 'oltp:64,analytics:2'))
+ADMISSION_TIMEOUT = float(os.environ.get('TRANSAXION_ADMISSION_TIMEOUT', '10'))
+ADMISSION_QUEUE = int(os.environ.get('TRANSAXION_ADMISSION_QUEUE', '100'))
+
+# Outside the off-peak window ("START-END" hours, e.g. "22-6"), reports whose
+# EXPLAIN estimate exceeds REPORT_MAX_ROWS rows are refused, or deferred to
+# the window when one is set, and reports are stopped after
+# REPORT_MAX_TIME_MS; 0 disables either limit
+REPORT_MAX_ROWS = int(os.environ.get('TRANSAXION_REPORT_MAX_ROWS', '10000000'))
+REPORT_MAX_TIME_MS = int(os.environ.get('TRANSAXION_REPORT_MAX_TIME_MS', '30000'))
+OFF_PEAK = parse_window(os.environ.get('TRANSAXION_OFF_PEAK', ''))
+DEFERRED_REPORTS_DIR = os.environ.get('TRANSAXION_DEFERRED_REPORTS_DIR', 'deferred_reports')
+
+# Tables written by a committed transfer
+TRANSFER_TABLES = ('BankAccount', 'Transaction1', 'Transaction2', 'BalanceBuckets',
+                   'BranchDailyRollups')
+
+ACCOUNT_TABLES = ('BankAccount', 'CurrentAccount', 'SavingAccount', 'SalaryAccount',
+                  'DematAccount', 'FixedDepositAccount', 'BalanceSnapshots')
+
+# Operation name -> (BankingSystem method, kind, tables). Every operation,
+# whether it comes from the menu or the command line, runs through
+# BankingSystem.execute. For reads the tables are those the result depends
+# on (None: never cached); for writes they are the tables modified.
+OPERATIONS = {
+    'add_location': ('create_location', 'write', ('Locations',)),
+    'add_bank': ('create_bank', 'write', ('RegisteredBank1', 'RegisteredBank2')),
+    'add_branch': ('create_branch', 'write', ('BankBranch1', 'BankBranch2')),
+    'add_person': ('create_person', 'write',
+                   ('Person1', 'Person2', 'Person3', 'CustodianClosure')),
+    'add_bank_account': ('create_bank_account', 'write', ACCOUNT_TABLES),
+    'add_budget': ('create_budget', 'write', ('Budgets1', 'Budgets2')),
+    'add_savings_goal': ('create_savings_goal', 'write', ('SavingsGoals1', 'SavingsGoals2')),
+    'view_user_transactions': ('fetch_user_transactions', 'read',
+                               ('BankAccount', 'Transaction1', 'Transaction2')),
+    'view_branch_accounts': ('fetch_branch_accounts', 'read',
+                             ('BankAccount', 'BalanceBuckets', 'Person1', 'Person2',
+                              'BankBranch1')),
+    'view_high_income_users': ('fetch_high_income_users', 'read', ('Person1', 'Person2')),
+    'view_bank_branch_count': ('fetch_bank_branch_counts', 'read',
+                               ('RegisteredBank1', 'BankBranch1')),
+    'calculate_user_transactions': ('fetch_user_transaction_total', 'read',
+                                    ('BankAccount', 'Transaction1', 'Transaction2')),
+    'find_max_balance': ('fetch_max_balance_accounts', 'read',
+                         ('BankAccount', 'BalanceBuckets', 'Person2')),
+    'get_country_expenditure': ('fetch_country_expenditure', 'read', ('Person1',)),
+    'search_users': ('fetch_users_by_name', 'read', ('Person1', 'Person2')),
+    'view_customer_profiles': ('fetch_customer_profiles', 'read',
+                               ('Person1', 'Person2', 'Person3', 'Budgets1', 'Budgets2',
+                                'SavingsGoals1', 'SavingsGoals2', 'BalanceBuckets')
+                               + ACCOUNT_TABLES),
+    'view_dependents': ('fetch_dependents', 'read', ('CustodianClosure', 'Person2')),
+    'view_guardians': ('fetch_guardians', 'read', ('CustodianClosure', 'Person2')),
+    'view_household_balance': ('fetch_household_balance', 'read',
+                               ('CustodianClosure', 'BankAccount', 'BalanceBuckets')),
+    'search_banks': ('fetch_banks', 'read',
+                     ('RegisteredBank1', 'RegisteredBank2', 'BankBranch1',
+                      'BankBranch2', 'Locations')),
+    'analyze_expenditure_patterns': ('fetch_expenditure_patterns', 'analysis',
+                                     ('Person1', 'BankAccount', 'BankBranch2', 'Locations')),
+    'analyze_transaction_patterns': ('fetch_transaction_patterns', 'analysis',
+                                     ('Person1', 'Person2', 'BankAccount',
+                                      'Transaction1', 'Transaction2')),
+    'update_budget_limit': ('set_budget_limit', 'write', ('Budgets1',)),
+    'remove_expired_goals': ('purge_expired_goals', 'write', ('SavingsGoals1', 'SavingsGoals2')),
+    'rebuild_households': ('rebuild_custodian_closure', 'write', ('CustodianClosure',)),
+    'make_transaction': ('transfer', 'transfer', TRANSFER_TABLES),
+    # Journaled transfers are applied in the background, so never cached
+    'transfer_status': ('fetch_transfer_status', 'read', None),
+    'take_balance_snapshot': ('snapshot_balances', 'write', ('BalanceSnapshots',)),
+    'view_balance_at_date': ('fetch_balance_at', 'read',
+                             ('BankAccount', 'BalanceSnapshots', 'Transaction1', 'Transaction2',
+                              'Postings', 'BalanceBuckets')),
+    # Whole-bank passes that read every account by design, streamed in flat
+    # memory: only the analytics gate applies, as a row estimate would refuse
+    # them at any size and a time limit would stop them part-way
+    'verify_balances': ('reconcile_balances', 'analysis', None),
+    'generate_statements': ('write_statements', 'analysis', None),
+    'run_period_end': ('apply_period_end', 'write',
+                       TRANSFER_TABLES + ('Postings', 'PeriodEndRuns')),
+    'flag_hot_account': ('set_hot_account', 'write', ('BalanceBuckets',)),
+    'consolidate_balances': ('consolidate_hot_accounts', 'write',
+                             ('BankAccount', 'BalanceBuckets')),
+    'view_leaderboards': ('fetch_leaderboard', 'analysis',
+                          ('BankAccount', 'BalanceBuckets', 'Person1', 'Person2',
+                           'Transaction1', 'Transaction2')),
+    'analyze_transfer_graph': ('fetch_transfer_graph', 'analysis',
+                               ('BankAccount', 'Transaction1', 'Transaction2')),
+    'view_branch_activity': ('fetch_branch_activity', 'analysis', ('BranchDailyRollups',)),
+    'backfill_branch_activity': ('backfill_branch_rollups', 'write', ('BranchDailyRollups',)),
+    'archive_transactions': ('archive_old_transactions', 'write',
+                             ('Transaction1', 'Transaction2', 'TransferKeys', 'AppliedTransfers')),
+    'cache_stats': ('fetch_cache_stats', 'read', None),
+    # Finishes cross-shard transfers a crash left prepared; sharding only
+    'recover_shards': ('recover_cross_shard', 'write', TRANSFER_TABLES),
+    # Deferred reports complete in the background, so never cached
+    'report_status': ('fetch_report_status', 'read', None),
+}
+
+
 class DatabaseConnection:
-    def __init__(self):
+    def __init__(self, replicas: list = None, max_replica_lag: float = MAX_REPLICA_LAG,
+                 host: str = 'localhost', port: int = 3306, database: str = 'BankingSystem'):
+        self.host = host
+        self.port = port
+        self.database = database
         self.connection = None
         self.cursor = None
+        self.credentials = None
+        replicas = REPLICAS if replicas is None else replicas
+        self.router = ReplicaRouter(replicas, max_replica_lag) if replicas else None
+        self.pinned_until = 0.0
+
+    def _open(self, host: str, port: int, username: str, password: str, autocommit: bool = False):
+        # Imported on first connect so commands that never reach the
+        # database do not pay for loading the driver
+        import pymysql
+        import pymysql.cursors
+
+        return pymysql.connect(
+            host=host,
+            port=port,
+            user=username,
+            password=password,
+            db=self.database,
+            cursorclass=pymysql.cursors.DictCursor,
+            autocommit=autocommit,
+            # Money parameters are sent as exact decimal literals
+            conv=money.encoders()
+        )
+
+    def _open_replica(self, host: str, port: int):
+        # Autocommit so each read sees the replica's latest applied state
+        # rather than a snapshot held open since the previous read
+        return self._open(host, port, *self.credentials, autocommit=True)
 
     def connect(self, username: str, password: str) -> bool:
         try:
-            self.connection = pymysql.connect(
-                host='localhost',
-                port=3306,
-                user=username,
-                password=password,
-                db='BankingSystem',
-                cursorclass=pymysql.cursors.DictCursor
-            )
+            self.connection = self._open(self.host, self.port, username, password)
             self.cursor = self.connection.cursor()
-            return True
+            self.credentials = (username, password)
         except Exception as e:
             logging.error(f"Database connection error: {str(e)}")
             return False
 
+        if self.router:
+            self.router.connect(self._open_replica)
+        return True
+
+    def clone(self):
+        """Open a second connection to the primary with the same credentials"""
+        db = DatabaseConnection(replicas=[], host=self.host, port=self.port,
+                                database=self.database)
+        if not self.credentials or not db.connect(*self.credentials):
+            raise ConnectionError("Could not open an additional database connection")
+        return db
+
+    def run_read(self, read):
+        """Call read() with cursor and connection pointing at a replica when possible
+
+        Falls back to the primary when no replica is healthy and fresh enough,
+        while the session is pinned after its own writes, or when the chosen
+        replica's connection fails mid-read.
+        """
+        if not self.router or time.time() < self.pinned_until:
+            return self._read_primary(read)
+
+        replica = self.router.choose(self._open_replica)
+        if replica is None:
+            return self._read_primary(read)
+
+        primary = (self.connection, self.cursor)
+        self.connection, self.cursor = replica.connection, replica.cursor
+        try:
+            return read()
+        except Exception as e:
+            if not is_connection_error(e):
+                raise
+            logging.warning(f"Replica {replica} failed, retrying on primary: {str(e)}")
+            self.router.mark_down(replica)
+        finally:
+            self.connection, self.cursor = primary
+        return self._read_primary(read)
+
+    def _read_primary(self, read):
+        """Call read() on the primary, then end its transaction
+
+        Otherwise the session would keep reading the REPEATABLE READ snapshot
+        of its first read and never see later commits of other sessions.
+        """
+        try:
+            result = read()
+        except Exception:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+        return result
+
+    def record_write(self):
+        """Pin reads to the primary until replicas within the lag bound have the write"""
+        if self.router:
+            # Replica lag is reported in whole seconds
+            self.pinned_until = time.time() + self.router.max_lag + 1
+
     def disconnect(self):
         if self.cursor:
             self.cursor.close()
         if self.connection:
             self.connection.close()
+        if self.router:
+            self.router.close()
 
 
 class BankingSystem:
-    def __init__(self):
-        self.db = DatabaseConnection()
+    def __init__(self, db: DatabaseConnection = None, cache_size: int = CACHE_SIZE):
+        self.db = db or DatabaseConnection()
         self.last_activity = time.time()
         self.SESSION_TIMEOUT = 300  # 5 minutes
+        self.journal = None
+        self.journal_applier = None
+        self.archive = TransactionArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+        self.ledger = BalanceLedger(self.db, self.archive)
+        self.directory = AccountDirectory(self.db)
+        self.hot_accounts = HotAccounts(self.db)
+        self.leaderboard = BalanceLeaderboard(self.db, hot_accounts=self.hot_accounts)
+        self.idempotency_keys = IdempotencyKeys(IDEMPOTENCY_CACHE_SIZE)
+        self.velocity = VelocityRules(parse_rules(VELOCITY_RULES))
+        self.consolidator = None
+        self.result_cache = ResultCache(cache_size)
+        self.transfer_listeners = [self.leaderboard.record_transfer,
+                                   self.invalidate_transfer]
+        self.shards = None
+        # Set on shard sessions: reserve_transaction_ids(count) allocates IDs
+        # unique across the shards, release_transaction_ids(first) marks them
+        # finished once their transaction commits or rolls back
+        self.reserve_transaction_ids = self.release_transaction_ids = None
+        # (start_date, end_date, TransferGraph) of the last graph analysis
+        self.transfer_graph = None
+        self.recorder = recorder(CAPTURE) if CAPTURE else None
+        self.gates = AdmissionGates(CONCURRENCY_LIMITS, ADMISSION_QUEUE, ADMISSION_TIMEOUT)
+        self.report_policy = ReportPolicy(REPORT_MAX_ROWS, REPORT_MAX_TIME_MS, OFF_PEAK)
+        self.deferred_reports = DeferredReports(DEFERRED_REPORTS_DIR)
+        # Set on the session running deferred reports, whose reports are never limited
+        self.off_peak_worker = False
+        self.report_runner = None
 
     def check_session_timeout(self):
         if time.time() - self.last_activity > self.SESSION_TIMEOUT:
             raise SecurityException("Session timed out. Please log in again.")
         self.last_activity = time.time()
 
+    def execute(self, operation: str, **params):
+        """Run a named operation with keyword parameters and return its result"""
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {operation}")
+
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            result = self._execute(operation, params)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            if self.recorder:
+                self.recorder.record(operation, params, started, elapsed, False)
+            logging.info(f"{operation} failed", extra={
+                'operation': operation, 'event': 'executed', 'status': 'failed',
+                'duration_ms': round(elapsed * 1000, 3), 'error': str(e)})
+            raise
+        elapsed = time.perf_counter() - start
+        if self.recorder:
+            self.recorder.record(operation, params, started, elapsed, True)
+        logging.info(f"{operation} completed", extra={
+            'operation': operation, 'event': 'executed', 'status': 'ok',
+            'duration_ms': round(elapsed * 1000, 3), 'rows': row_count(result)})
+        return result
+
+    def _execute(self, operation: str, params: dict):
+        kind = OPERATIONS[operation][1]
+        try:
+            if self.gates is None:
+                return self._dispatch(operation, params)
+            with self.gates.admit(kind):
+                return self._dispatch(operation, params)
+        except ReportDeferred as e:
+            if self.deferred_reports is None or e.report_id:
+                raise
+            report_id = self.deferred_reports.submit(operation, params)
+            logging.info(f"{operation} deferred to the off-peak queue as {report_id}")
+            raise ReportDeferred(e.estimate, report_id, OFF_PEAK) from None
+
+    def _dispatch(self, operation: str, params: dict):
+        method, kind, tables = OPERATIONS[operation]
+
+        if self.shards:
+            return self.shards.execute(operation, **params)
+
+        if kind in ('read', 'analysis'):
+            key = ResultCache.key(operation, params) if tables else None
+            if key is None:
+                return self.db.run_read(lambda: getattr(self, method)(**params))
+
+            hit, result = self.result_cache.get(key)
+            if hit:
+                return result
+            versions = self.result_cache.versions(tables)
+            result = self.db.run_read(lambda: getattr(self, method)(**params))
+            self.result_cache.put(key, result, tables, versions)
+            return result
+
+        # Writes and transfers always run on the primary
+        result = getattr(self, method)(**params)
+        self.db.record_write()
+        # Transfers invalidate through the transfer listeners once committed,
+        # which also covers journaled transfers applied in the background
+        if kind == 'write':
+            self.result_cache.invalidate(tables)
+        return result
+
+    def invalidate_transfer(self, transfer: dict):
+        self.result_cache.invalidate(TRANSFER_TABLES)
+        self.transfer_graph = None
+
+    def notify_transfers(self, transfers: list):
+        """Feed committed transfers to in-process caches and indexes"""
+        for listener in self.transfer_listeners:
+            for transfer in transfers:
+                listener(transfer)
+
+    def enable_journal(self, path: str, batch_size: int = 500, flush_interval: float = 0.05):
+        """Accept transfers into a local journal and group-commit them in the background"""
+        if self.shards:
+            raise ValueError("The transfer journal is not supported with sharding")
+        if self.journal:
+            raise ValueError("The transfer journal is already enabled")
+        journal = TransferJournal(path)
+        applier_system = BankingSystem(self.db.clone())
+        applier_system.share_directory(self)
+        self.journal = journal
+        # Keys still waiting in the journal are answered as duplicates until applied
+        for record in journal.read(0, None)[0]:
+            if record['idempotency_key'] is not None:
+                self.idempotency_keys.remember(record['idempotency_key'], {
+                    'status': 'journaled', 'transfer_id': record['transfer_id'],
+                    'sender_acc': record['sender_acc'], 'receiver_acc': record['receiver_acc'],
+                    'amount': record['amount']})
+        self.journal_applier = JournalApplier(
+            self.journal, applier_system, batch_size, flush_interval)
+        self.journal_applier.start()
+
+    def enable_sharding(self, spec: str):
+        """Spread customers over the shards in spec; the first shard also holds the shard map"""
+        if self.journal:
+            raise ValueError("The transfer journal is not supported with sharding")
+
+        shards = []
+        try:
+            for index, (host, port, database) in enumerate(parse_shards(spec)):
+                db = DatabaseConnection(replicas=[], host=host, port=port, database=database)
+                if not db.connect(*self.db.credentials):
+                    raise ConnectionError(f"Could not connect to shard {host}:{port}/{database}")
+                shard = BankingSystem(db, self.result_cache.max_entries)
+                # The operation is captured, and transfers limited, once, by this session
+                shard.recorder = None
+                shard.velocity = VelocityRules([])
+                # ...and admitted, and its oversized reports queued, once
+                shard.gates = shard.deferred_reports = None
+                shard.report_policy = self.report_policy
+                shard.off_peak_worker = self.off_peak_worker
+                if ARCHIVE_DIR:
+                    shard.archive = shard.ledger.archive = TransactionArchive(
+                        os.path.join(ARCHIVE_DIR, f"shard-{index}"))
+                shards.append(shard)
+            catalog = shards[0].db.clone()
+        except Exception:
+            for shard in shards:
+                shard.close()
+            raise
+
+        self.shards = ShardedBank(shards, catalog, OPERATIONS)
+        self.shards.idempotency_keys = self.idempotency_keys
+        self.shards.velocity = self.velocity
+        self.shards.deferred_reports = self.deferred_reports
+        # Period-end payouts on a shard take their IDs from the catalog sequence,
+        # and snapshots stop below the transfers still running
+        for shard in shards:
+            shard.reserve_transaction_ids = self.shards.reserve_transaction_ids
+            shard.release_transaction_ids = self.shards.release_transaction_ids
+            shard.ledger.settled_transaction_id = self.shards.settled_transaction_id
+
+    def load_directory(self) -> int:
+        """Warm the account directory(ies), hot-account flags and velocity windows
+
+        Returns the number of accounts loaded.
+        """
+        if self.shards:
+            for shard in self.shards.shards:
+                self.velocity.load(shard.db)
+            return sum(shard.load_directory() for shard in self.shards.shards)
+        self.hot_accounts.load()
+        self.velocity.load(self.db)
+        return self.directory.load()
+
+    def share_directory(self, other):
+        """Use other's account directory and caches, e.g. between connections of one process
+
+        Transfers committed by either session then update and invalidate the
+        same result cache and leaderboard, and drop both sessions' transfer graphs.
+        """
+        self.directory = other.directory
+        self.hot_accounts = other.hot_accounts
+        self.idempotency_keys = other.idempotency_keys
+        self.velocity = other.velocity
+        self.gates = other.gates
+        self.result_cache = other.result_cache
+        self.leaderboard = other.leaderboard
+        self.transfer_listeners = other.transfer_listeners
+        if self.invalidate_transfer not in self.transfer_listeners:
+            self.transfer_listeners.append(self.invalidate_transfer)
+        if self.shards:
+            self.shards.idempotency_keys = other.idempotency_keys
+            self.shards.velocity = other.velocity
+        if self.shards and other.shards:
+            for shard, other_shard in zip(self.shards.shards, other.shards.shards):
+                shard.share_directory(other_shard)
+
+    def start_consolidation(self, interval: float = HOT_CONSOLIDATE_INTERVAL):
+        """Fold hot-account buckets into balances every interval seconds in the background
+
+        An interval of 0 turns background consolidation off; a second call
+        does nothing.
+        """
+        if interval <= 0 or self.consolidator:
+            return
+        if self.shards:
+            for shard in self.shards.shards:
+                shard.start_consolidation(interval)
+            return
+        self.consolidator = BucketConsolidator(self.hot_accounts, self.db.clone(), interval)
+        self.consolidator.start()
+
+    def account_holders(self, account_numbers: list) -> dict:
+        """Look up holder names for a handful of accounts by primary key"""
+        if not account_numbers:
+            return {}
+        placeholders = ', '.join(['%s'] * len(account_numbers))
+        self.db.cursor.execute(f"""
+            SELECT ba.AccountNumber, p2.First, p2.Middle, p2.Last
+            FROM BankAccount ba
+            JOIN Person2 p2 ON ba.UserNationality = p2.Nationality
+                AND ba.UserNationalID = p2.NationalID
+            WHERE ba.AccountNumber IN ({placeholders})
+        """, list(account_numbers))
+        return {row['AccountNumber']: row for row in self.db.cursor.fetchall()}
+
+    def start_deferred_reports(self):
+        """Run the deferred report queue in the off-peak window, when one is set"""
+        if not OFF_PEAK or self.report_runner:
+            return
+        worker = BankingSystem(self.db.clone())
+        worker.off_peak_worker = True
+        if self.shards:
+            worker.enable_sharding(SHARDS)
+        worker.share_directory(self)
+        self.report_runner = ReportRunner(self.deferred_reports, worker, OFF_PEAK)
+        self.report_runner.start()
+
+    def run_report(self, query: str, params) -> list:
+        """Run an analytics query within the report row estimate and time limits"""
+        return self.report_policy.run(self.db, query, params, self.off_peak_worker)
+
+    def limited_report(self, query: str, params):
+        """Context yielding an analytics query to run within the report limits"""
+        return self.report_policy.limited(self.db, query, params, self.off_peak_worker)
+
+    def close(self):
+        """Drain background work and close the database connection"""
+        if self.report_runner:
+            self.report_runner.stop()
+            self.report_runner.banking_system.close()
+            self.report_runner = None
+        if self.shards:
+            self.shards.close()
+            self.shards = None
+        if self.consolidator:
+            self.consolidator.stop()
+            self.consolidator.db.disconnect()
+            self.consolidator = None
+        if self.journal_applier:
+            self.journal_applier.stop()
+            self.journal_applier.banking_system.db.disconnect()
+            self.journal.close()
+            self.journal = self.journal_applier = None
+        if self.archive:
+            self.archive.close()
+        self.db.disconnect()
+
     # Selection Queries
     def view_user_transactions(self):
         """Retrieve all transactions for a specific user"""
@@ -67,21 +596,8 @@ class BankingSystem:
             nationality = input("Enter user nationality: ").strip()
             national_id = input("Enter national ID: ").strip()
 
-            query = """
-                SELECT t1.TransactionID, t2.TransactionDate, t2.TransactionTime, 
-                       t2.Amount, ba1.AccountNumber as SenderAccount, 
-                       ba2.AccountNumber as ReceiverAccount
-                FROM Transaction1 t1
-                JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
-                JOIN BankAccount ba1 ON t1.SenderAccNum = ba1.AccountNumber
-                JOIN BankAccount ba2 ON t1.ReceiverAccNum = ba2.AccountNumber
-                WHERE ba1.UserNationality = %s AND ba1.UserNationalID = %s
-                   OR ba2.UserNationality = %s AND ba2.UserNationalID = %s
-                ORDER BY t2.TransactionDate DESC, t2.TransactionTime DESC
-            """
-            self.db.cursor.execute(
-                query, (nationality, national_id, nationality, national_id))
-            transactions = self.db.cursor.fetchall()
+            transactions = self.execute(
+                'view_user_transactions', nationality=nationality, national_id=national_id)
 
             if transactions:
                 print("\nTransaction History:")
@@ -99,30 +615,47 @@ class BankingSystem:
             logging.error(f"Error viewing transactions: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_user_transactions(self, nationality: str, national_id: str) -> list:
+        archived = self.archive.before() if self.archive else None
+        query = f"""
+            SELECT t1.TransactionID, t2.TransactionDate, t2.TransactionTime,
+                   t2.Amount, ba1.AccountNumber as SenderAccount,
+                   ba2.AccountNumber as ReceiverAccount
+            FROM Transaction1 t1
+            JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+            LEFT JOIN BankAccount ba1 ON t1.SenderAccNum = ba1.AccountNumber
+            LEFT JOIN BankAccount ba2 ON t1.ReceiverAccNum = ba2.AccountNumber
+            WHERE (ba1.UserNationality = %s AND ba1.UserNationalID = %s
+               OR ba2.UserNationality = %s AND ba2.UserNationalID = %s)
+               {"AND t2.TransactionDate >= %s" if archived else ""}
+            ORDER BY t2.TransactionDate DESC, t2.TransactionTime DESC
+        """
+        self.db.cursor.execute(query, (nationality, national_id, nationality, national_id)
+                               + ((archived,) if archived else ()))
+        transactions = self.db.cursor.fetchall()
+        if not archived:
+            return transactions
+
+        # Older history comes from the archive, after everything live
+        accounts = self.user_accounts(nationality, national_id)
+        return list(transactions) + self.archive.transfers(
+            accounts, end=archived - datetime.timedelta(days=1))
+
+    def user_accounts(self, nationality: str, national_id: str) -> list:
+        self.db.cursor.execute("""
+            SELECT AccountNumber FROM BankAccount
+            WHERE UserNationality = %s AND UserNationalID = %s
+        """, (nationality, national_id))
+        return [row['AccountNumber'] for row in self.db.cursor.fetchall()]
+
     def view_branch_accounts(self):
         """Retrieve all accounts under a specific branch"""
         try:
             branch_code = input("Enter branch code: ").strip()
             bank_id = input("Enter bank ID: ").strip()
 
-            query = """
-                SELECT ba.AccountNumber, ba.Balance, 
-                       p2.First, p2.Middle, p2.Last,
-                       p1.Phone, bb1.BranchManagerNationality,
-                       p3.First as ManagerFirst, p3.Last as ManagerLast
-                FROM BankAccount ba
-                JOIN Person1 p1 ON ba.UserNationality = p1.Nationality 
-                    AND ba.UserNationalID = p1.NationalID
-                JOIN Person2 p2 ON p1.Nationality = p2.Nationality 
-                    AND p1.NationalID = p2.NationalID
-                JOIN BankBranch1 bb1 ON ba.BranchCode = bb1.BranchCode 
-                    AND ba.BankID = bb1.BankID
-                JOIN Person2 p3 ON bb1.BranchManagerNationality = p3.Nationality 
-                    AND bb1.BranchManagerNationalID = p3.NationalID
-                WHERE ba.BranchCode = %s AND ba.BankID = %s
-            """
-            self.db.cursor.execute(query, (branch_code, bank_id))
-            accounts = self.db.cursor.fetchall()
+            accounts = self.execute(
+                'view_branch_accounts', branch_code=int(branch_code), bank_id=int(bank_id))
 
             if accounts:
                 print(f"\nAccounts at Branch {branch_code}:")
@@ -140,23 +673,37 @@ class BankingSystem:
             logging.error(f"Error viewing branch accounts: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_branch_accounts(self, branch_code: int, bank_id: int) -> list:
+        query = """
+            SELECT ba.AccountNumber,
+                   ba.Balance + COALESCE((
+                       SELECT SUM(bb.Amount) FROM BalanceBuckets bb
+                       WHERE bb.AccountNumber = ba.AccountNumber
+                   ), 0) as Balance,
+                   p2.First, p2.Middle, p2.Last,
+                   p1.Phone, bb1.BranchManagerNationality,
+                   p3.First as ManagerFirst, p3.Last as ManagerLast
+            FROM BankAccount ba
+            JOIN Person1 p1 ON ba.UserNationality = p1.Nationality
+                AND ba.UserNationalID = p1.NationalID
+            JOIN Person2 p2 ON p1.Nationality = p2.Nationality
+                AND p1.NationalID = p2.NationalID
+            JOIN BankBranch1 bb1 ON ba.BranchCode = bb1.BranchCode
+                AND ba.BankID = bb1.BankID
+            LEFT JOIN Person2 p3 ON bb1.BranchManagerNationality = p3.Nationality
+                AND bb1.BranchManagerNationalID = p3.NationalID
+            WHERE ba.BranchCode = %s AND ba.BankID = %s
+        """
+        self.db.cursor.execute(query, (branch_code, bank_id))
+        return self.db.cursor.fetchall()
+
     # Projection Queries
     def view_high_income_users(self):
         """List users with income above threshold"""
         try:
             threshold = float(input("Enter income threshold: ").strip())
 
-            query = """
-                SELECT p2.First, p2.Middle, p2.Last, p1.AnnualIncome, 
-                       p1.Nationality, p1.Phone
-                FROM Person1 p1
-                JOIN Person2 p2 ON p1.Nationality = p2.Nationality 
-                    AND p1.NationalID = p2.NationalID
-                WHERE p1.AnnualIncome > %s
-                ORDER BY p1.AnnualIncome DESC
-            """
-            self.db.cursor.execute(query, (threshold,))
-            users = self.db.cursor.fetchall()
+            users = self.execute('view_high_income_users', threshold=threshold)
 
             if users:
                 print(f"\nUsers with annual income above ${threshold:,.2f}:")
@@ -173,18 +720,23 @@ class BankingSystem:
             logging.error(f"Error viewing high income users: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_high_income_users(self, threshold: float) -> list:
+        query = """
+            SELECT p2.First, p2.Middle, p2.Last, p1.AnnualIncome,
+                   p1.Nationality, p1.Phone
+            FROM Person1 p1
+            JOIN Person2 p2 ON p1.Nationality = p2.Nationality
+                AND p1.NationalID = p2.NationalID
+            WHERE p1.AnnualIncome > %s
+            ORDER BY p1.AnnualIncome DESC
+        """
+        self.db.cursor.execute(query, (threshold,))
+        return self.db.cursor.fetchall()
+
     def view_bank_branch_count(self):
         """Retrieve banks and their branch counts"""
         try:
-            query = """
-                SELECT rb1.BankName, COUNT(bb1.BranchCode) as BranchCount
-                FROM RegisteredBank1 rb1
-                LEFT JOIN BankBranch1 bb1 ON rb1.BankID = bb1.BankID
-                GROUP BY rb1.BankID, rb1.BankName
-                ORDER BY BranchCount DESC
-            """
-            self.db.cursor.execute(query)
-            banks = self.db.cursor.fetchall()
+            banks = self.execute('view_bank_branch_count')
 
             if banks:
                 print("\nBank Branch Statistics:")
@@ -198,6 +750,17 @@ class BankingSystem:
             logging.error(f"Error viewing bank branch counts: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_bank_branch_counts(self) -> list:
+        query = """
+            SELECT rb1.BankName, COUNT(bb1.BranchCode) as BranchCount
+            FROM RegisteredBank1 rb1
+            LEFT JOIN BankBranch1 bb1 ON rb1.BankID = bb1.BankID
+            GROUP BY rb1.BankID, rb1.BankName
+            ORDER BY BranchCount DESC
+        """
+        self.db.cursor.execute(query)
+        return self.db.cursor.fetchall()
+
     # Aggregate Functions
     def calculate_user_transactions(self):
         """Calculate sum of transactions for a user in a period"""
@@ -207,17 +770,9 @@ class BankingSystem:
             start_date = input("Enter start date (YYYY-MM-DD): ").strip()
             end_date = input("Enter end date (YYYY-MM-DD): ").strip()
 
-            query = """
-                SELECT SUM(t2.Amount) as TotalAmount
-                FROM Transaction1 t1
-                JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
-                JOIN BankAccount ba ON t1.SenderAccNum = ba.AccountNumber
-                WHERE ba.UserNationality = %s AND ba.UserNationalID = %s
-                AND t2.TransactionDate BETWEEN %s AND %s
-            """
-            self.db.cursor.execute(
-                query, (nationality, national_id, start_date, end_date))
-            result = self.db.cursor.fetchone()
+            result = self.execute(
+                'calculate_user_transactions', nationality=nationality,
+                national_id=national_id, start_date=start_date, end_date=end_date)
 
             print(f"\nTotal transactions between {start_date} and {end_date}:")
             print(f"${result['TotalAmount']:,.2f}" if result['TotalAmount'] else "$0.00")
@@ -226,28 +781,50 @@ class BankingSystem:
             logging.error(f"Error calculating user transactions: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_user_transaction_total(self, nationality: str, national_id: str,
+                                     start_date: str, end_date: str) -> dict:
+        archived = self.archive.before() if self.archive else None
+        query = f"""
+            SELECT SUM(t2.Amount) as TotalAmount
+            FROM Transaction1 t1
+            JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+            JOIN BankAccount ba ON t1.SenderAccNum = ba.AccountNumber
+            WHERE ba.UserNationality = %s AND ba.UserNationalID = %s
+            AND t2.TransactionDate BETWEEN %s AND %s
+            {"AND t2.TransactionDate >= %s" if archived else ""}
+        """
+        self.db.cursor.execute(query, (nationality, national_id, start_date, end_date)
+                               + ((archived,) if archived else ()))
+        result = self.db.cursor.fetchone()
+        start = datetime.date.fromisoformat(str(start_date))
+        if not archived or start >= archived:
+            return result
+
+        # Amounts the user's accounts sent in the archived part of the period
+        end = min(datetime.date.fromisoformat(str(end_date)),
+                  archived - datetime.timedelta(days=1))
+        sent = [-movement.cents
+                for account_number in self.user_accounts(nationality, national_id)
+                for movement in self.archive.movements(account_number, start, end)
+                if movement.cents < 0]
+        if sent:
+            result = dict(result, TotalAmount=Money(sum(sent))
+                          + Money.of(result['TotalAmount'] or 0))
+        return result
+
     def find_max_balance(self):
         """Find maximum balance across all accounts"""
         try:
-            query = """
-                SELECT ba.AccountNumber, ba.Balance,
-                       p2.First, p2.Middle, p2.Last
-                FROM BankAccount ba
-                JOIN Person1 p1 ON ba.UserNationality = p1.Nationality 
-                    AND ba.UserNationalID = p1.NationalID
-                JOIN Person2 p2 ON p1.Nationality = p2.Nationality 
-                    AND p1.NationalID = p2.NationalID
-                WHERE ba.Balance = (SELECT MAX(Balance) FROM BankAccount)
-            """
-            self.db.cursor.execute(query)
-            account = self.db.cursor.fetchone()
-
-            if account:
-                print("\nAccount with Maximum Balance:")
-                print(f"Account Number: {account['AccountNumber']}")
-                print(f"Holder: {account['First']} {
-                      account['Middle'] or ''} {account['Last']}")
-                print(f"Balance: ${account['Balance']:,.2f}")
+            accounts = self.execute('find_max_balance')
+
+            if accounts:
+                print("\nAccount with Maximum Balance:" if len(accounts) == 1
+                      else "\nAccounts with Maximum Balance:")
+                for account in accounts:
+                    print(f"Account Number: {account['AccountNumber']}")
+                    print(f"Holder: {account.get('First')} {
+                          account.get('Middle') or ''} {account.get('Last')}")
+                    print(f"Balance: ${account['Balance']:,.2f}")
             else:
                 print("\nNo accounts found.")
 
@@ -255,19 +832,13 @@ class BankingSystem:
             logging.error(f"Error finding max balance: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_max_balance_accounts(self) -> list:
+        return self.fetch_leaderboard('richest', 1)
+
     def get_country_expenditure(self):
         """Calculate average expenditure by country"""
         try:
-            query = """
-                SELECT Nationality, 
-                       AVG(AnnualExpenditure) as AvgExpenditure,
-                       COUNT(*) as UserCount
-                FROM Person1
-                GROUP BY Nationality
-                ORDER BY AvgExpenditure DESC
-            """
-            self.db.cursor.execute(query)
-            results = self.db.cursor.fetchall()
+            results = self.execute('get_country_expenditure')
 
             if results:
                 print("\nAverage Annual Expenditure by Country:")
@@ -283,23 +854,116 @@ class BankingSystem:
             logging.error(f"Error calculating country expenditure: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_country_expenditure(self) -> list:
+        query = """
+            SELECT Nationality,
+                   AVG(AnnualExpenditure) as AvgExpenditure,
+                   SUM(AnnualExpenditure) as TotalExpenditure,
+                   COUNT(*) as UserCount
+            FROM Person1
+            GROUP BY Nationality
+            ORDER BY AvgExpenditure DESC
+        """
+        self.db.cursor.execute(query)
+        return self.db.cursor.fetchall()
+
+    def view_customer_profile(self):
+        """Show everything held about one customer"""
+        try:
+            nationality = input("Enter nationality: ").strip()
+            national_id = input("Enter national ID: ").strip()
+
+            profiles = self.execute('view_customer_profiles',
+                                    customers=[f"{nationality}:{national_id}"])
+            if not profiles:
+                print("\nCustomer not found.")
+                return
+
+            profile = profiles[0]
+            print(f"\n{profile['First']} {profile['Middle'] or ''} {profile['Last']}")
+            print(f"Date of Birth: {profile['DateOfBirth']}")
+            print(f"Phone: {profile['Phone']}")
+            print(f"Emails: {', '.join(profile['Emails']) or '-'}")
+            print(f"Annual Income: ${profile['AnnualIncome'] or 0:,.2f}")
+            print(f"Annual Expenditure: ${profile['AnnualExpenditure'] or 0:,.2f}")
+            if profile['Custodian']:
+                print(f"Custodian: {profile['Custodian']['Nationality']}-"
+                      f"{profile['Custodian']['NationalID']}")
+
+            print("\nAccounts:")
+            for account in profile['Accounts']:
+                print(f"  {account['AccountNumber']} ({account['Type'] or 'basic'}): "
+                      f"${account['Balance']:,.2f}")
+            print("\nBudgets:")
+            for budget in profile['Budgets']:
+                print(f"  {budget['Category']}: ${budget['CurrentExpend']:,.2f} "
+                      f"of ${budget['BudgetLimit']:,.2f}")
+            print("\nSavings Goals:")
+            for goal in profile['Goals']:
+                print(f"  {goal['GoalName']}: ${goal['CurrentSaving']:,.2f} "
+                      f"of ${goal['TargetAmount']:,.2f} by {goal['DeadlineDate']}")
+
+        except Exception as e:
+            logging.error(f"Error viewing customer profile: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def fetch_customer_profiles(self, customers: list) -> list:
+        """Profiles of customers given as "Nationality:NationalID", in a fixed number of queries"""
+        keys = []
+        for customer in customers:
+            nationality, separator, national_id = customer.partition(':')
+            if not separator:
+                raise ValueError(f"Customer must be given as Nationality:NationalID, not {customer}")
+            keys.append((nationality, national_id))
+        return [profile.to_dict() for profile in load_profiles(self.db, keys)]
+
+    def view_household(self):
+        """Show a person's guardians, dependents and household balance"""
+        try:
+            nationality = input("Enter nationality: ").strip()
+            national_id = input("Enter national ID: ").strip()
+            customer = {'nationality': nationality, 'national_id': national_id}
+
+            print("\nGuardians:")
+            for person in self.execute('view_guardians', **customer):
+                self._print_relative(person)
+            print("\nDependents:")
+            for person in self.execute('view_dependents', **customer):
+                self._print_relative(person)
+
+            household = self.execute('view_household_balance', **customer)
+            print(f"\nHousehold: {household['Members']} members, "
+                  f"{household['Accounts']} accounts, ${household['Balance']:,.2f}")
+
+        except Exception as e:
+            logging.error(f"Error viewing household: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    @staticmethod
+    def _print_relative(person: dict):
+        name = ' '.join(filter(None, (person['First'], person['Middle'], person['Last'])))
+        print(f"  {'  ' * (person['Depth'] - 1)}{person['Nationality']}-"
+              f"{person['NationalID']} {name}".rstrip())
+
+    def fetch_dependents(self, nationality: str, national_id: str) -> list:
+        """Everyone a guardian is responsible for, at any depth, nearest first"""
+        return households.dependents(self.db, nationality, national_id)
+
+    def fetch_guardians(self, nationality: str, national_id: str) -> list:
+        """A person's chain of custodians, nearest first"""
+        return households.guardians(self.db, nationality, national_id)
+
+    def fetch_household_balance(self, nationality: str, national_id: str) -> dict:
+        """Total balance of a guardian's and all their dependents' accounts"""
+        return households.balance(self.db, nationality, national_id)
+
     # Search Queries
     def search_users(self):
         """Search users by name pattern"""
         try:
             pattern = input("Enter name pattern to search: ").strip()
 
-            query = """
-                SELECT p2.First, p2.Middle, p2.Last, 
-                       p1.Nationality, p1.Phone, p1.AnnualIncome
-                FROM Person2 p2
-                JOIN Person1 p1 ON p2.Nationality = p1.Nationality 
-                    AND p2.NationalID = p1.NationalID
-                WHERE CONCAT(p2.First, ' ', COALESCE(p2.Middle, ''), ' ', p2.Last) 
-                    LIKE %s
-            """
-            self.db.cursor.execute(query, (f"%{pattern}%",))
-            users = self.db.cursor.fetchall()
+            users = self.execute('search_users', pattern=pattern)
 
             if users:
                 print("\nMatching Users:")
@@ -316,6 +980,19 @@ class BankingSystem:
             logging.error(f"Error searching users: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_users_by_name(self, pattern: str) -> list:
+        query = """
+            SELECT p2.First, p2.Middle, p2.Last,
+                   p1.Nationality, p1.Phone, p1.AnnualIncome
+            FROM Person2 p2
+            JOIN Person1 p1 ON p2.Nationality = p1.Nationality
+                AND p2.NationalID = p1.NationalID
+            WHERE CONCAT(p2.First, ' ', COALESCE(p2.Middle, ''), ' ', p2.Last)
+                LIKE %s
+        """
+        self.db.cursor.execute(query, (f"%{pattern}%",))
+        return self.db.cursor.fetchall()
+
     def search_banks(self):
         """Search banks by name or branch address"""
         try:
@@ -323,35 +1000,13 @@ class BankingSystem:
                 "Search by (1) Bank Name or (2) Branch Address? ").strip()
             pattern = input("Enter search pattern: ").strip()
 
-            if search_type == '1':
-                query = """
-                    SELECT rb1.BankName, rb2.Country, rb2.Pincode,
-                           COUNT(bb1.BranchCode) as BranchCount
-                    FROM RegisteredBank1 rb1
-                    JOIN RegisteredBank2 rb2 ON rb1.BankID = rb2.BankID
-                    LEFT JOIN BankBranch1 bb1 ON rb1.BankID = bb1.BankID
-                    WHERE rb1.BankName LIKE %s
-                    GROUP BY rb1.BankID, rb1.BankName, rb2.Country, rb2.Pincode
-                """
-            else:
-                query = """
-                    SELECT rb1.BankName, l.Country, l.State, l.City, l.Pincode
-                    FROM RegisteredBank1 rb1
-                    JOIN BankBranch1 bb1 ON rb1.BankID = bb1.BankID
-                    JOIN BankBranch2 bb2 ON bb1.BranchCode = bb2.BranchCode 
-                        AND bb1.BankID = bb2.BankID
-                    JOIN Locations l ON bb2.Country = l.Country 
-                        AND bb2.Pincode = l.Pincode
-                    WHERE CONCAT(l.City, ' ', l.State, ' ', l.Country) LIKE %s
-                """
-
-            self.db.cursor.execute(query, (f"%{pattern}%",))
-            results = self.db.cursor.fetchall()
+            by = 'name' if search_type == '1' else 'address'
+            results = self.execute('search_banks', by=by, pattern=pattern)
 
             if results:
                 print("\nSearch Results:")
                 for result in results:
-                    if search_type == '1':
+                    if by == 'name':
                         print(f"\nBank: {result['BankName']}")
                         print(f"Location: {result['Country']}")
                         print(f"Pincode: {result['Pincode']}")
@@ -368,6 +1023,33 @@ class BankingSystem:
             logging.error(f"Error searching banks: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_banks(self, by: str, pattern: str) -> list:
+        """Search by bank name (by='name') or branch address (by='address')"""
+        if by == 'name':
+            query = """
+                SELECT rb1.BankName, rb2.Country, rb2.Pincode,
+                       COUNT(bb1.BranchCode) as BranchCount
+                FROM RegisteredBank1 rb1
+                JOIN RegisteredBank2 rb2 ON rb1.BankID = rb2.BankID
+                LEFT JOIN BankBranch1 bb1 ON rb1.BankID = bb1.BankID
+                WHERE rb1.BankName LIKE %s
+                GROUP BY rb1.BankID, rb1.BankName, rb2.Country, rb2.Pincode
+            """
+        else:
+            query = """
+                SELECT rb1.BankName, l.Country, l.State, l.City, l.Pincode
+                FROM RegisteredBank1 rb1
+                JOIN BankBranch1 bb1 ON rb1.BankID = bb1.BankID
+                JOIN BankBranch2 bb2 ON bb1.BranchCode = bb2.BranchCode
+                    AND bb1.BankID = bb2.BankID
+                JOIN Locations l ON bb2.Country = l.Country
+                    AND bb2.Pincode = l.Pincode
+                WHERE CONCAT(l.City, ' ', l.State, ' ', l.Country) LIKE %s
+            """
+
+        self.db.cursor.execute(query, (f"%{pattern}%",))
+        return self.db.cursor.fetchall()
+
     # Analysis Functions
     def analyze_expenditure_patterns(self):
         """Analyze users with high expenditure relative to income"""
@@ -376,37 +1058,9 @@ class BankingSystem:
                 input("Enter expenditure percentage threshold (e.g., 75): ").strip())
             grouping = input("Group by (1) Country or (2) City? ").strip()
 
-            if grouping == '1':
-                query = """
-                    SELECT p1.Nationality as Location, 
-                           COUNT(*) as UserCount,
-                           AVG(p1.AnnualExpenditure/p1.AnnualIncome * 100) as AvgExpendPercent
-                    FROM Person1 p1
-                    WHERE (p1.AnnualExpenditure/p1.AnnualIncome * 100) > %s
-                    GROUP BY p1.Nationality
-                    ORDER BY UserCount DESC
-                """
-                params = (percentage,)
-            else:
-                query = """
-                    SELECT l.City as Location, 
-                           COUNT(*) as UserCount,
-                           AVG(p1.AnnualExpenditure/p1.AnnualIncome * 100) as AvgExpendPercent
-                    FROM Person1 p1
-                    JOIN BankAccount ba ON p1.Nationality = ba.UserNationality 
-                        AND p1.NationalID = ba.UserNationalID
-                    JOIN BankBranch2 bb2 ON ba.BranchCode = bb2.BranchCode 
-                        AND ba.BankID = bb2.BankID
-                    JOIN Locations l ON bb2.Country = l.Country 
-                        AND bb2.Pincode = l.Pincode
-                    WHERE (p1.AnnualExpenditure/p1.AnnualIncome * 100) > %s
-                    GROUP BY l.City
-                    ORDER BY UserCount DESC
-                """
-                params = (percentage,)
-
-            self.db.cursor.execute(query, params)
-            results = self.db.cursor.fetchall()
+            results = self.execute(
+                'analyze_expenditure_patterns', percentage=percentage,
+                group_by='country' if grouping == '1' else 'city')
 
             if results:
                 print(f"\nUsers with expenditure exceeding {
@@ -423,6 +1077,39 @@ class BankingSystem:
             logging.error(f"Error analyzing expenditure: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_expenditure_patterns(self, percentage: float, group_by: str) -> list:
+        """Group users spending over a share of income by 'country' or 'city'"""
+        if group_by == 'country':
+            query = """
+                SELECT p1.Nationality as Location,
+                       COUNT(*) as UserCount,
+                       AVG(p1.AnnualExpenditure/p1.AnnualIncome * 100) as AvgExpendPercent,
+                       SUM(p1.AnnualExpenditure/p1.AnnualIncome * 100) as TotalExpendPercent
+                FROM Person1 p1
+                WHERE (p1.AnnualExpenditure/p1.AnnualIncome * 100) > %s
+                GROUP BY p1.Nationality
+                ORDER BY UserCount DESC
+            """
+        else:
+            query = """
+                SELECT l.City as Location,
+                       COUNT(*) as UserCount,
+                       AVG(p1.AnnualExpenditure/p1.AnnualIncome * 100) as AvgExpendPercent,
+                       SUM(p1.AnnualExpenditure/p1.AnnualIncome * 100) as TotalExpendPercent
+                FROM Person1 p1
+                JOIN BankAccount ba ON p1.Nationality = ba.UserNationality
+                    AND p1.NationalID = ba.UserNationalID
+                JOIN BankBranch2 bb2 ON ba.BranchCode = bb2.BranchCode
+                    AND ba.BankID = bb2.BankID
+                JOIN Locations l ON bb2.Country = l.Country
+                    AND bb2.Pincode = l.Pincode
+                WHERE (p1.AnnualExpenditure/p1.AnnualIncome * 100) > %s
+                GROUP BY l.City
+                ORDER BY UserCount DESC
+            """
+
+        return self.run_report(query, (percentage,))
+
     def analyze_transaction_patterns(self):
         """Analyze transaction patterns for users"""
         try:
@@ -431,26 +1118,9 @@ class BankingSystem:
             start_date = input("Enter start date (YYYY-MM-DD): ").strip()
             end_date = input("Enter end date (YYYY-MM-DD): ").strip()
 
-            query = """
-                SELECT p2.First, p2.Middle, p2.Last,
-                       COUNT(t1.TransactionID) as TransactionCount,
-                       SUM(t2.Amount) as TotalAmount,
-                       AVG(t2.Amount) as AvgAmount
-                FROM Person1 p1
-                JOIN Person2 p2 ON p1.Nationality = p2.Nationality 
-                    AND p1.NationalID = p2.NationalID
-                JOIN BankAccount ba ON p1.Nationality = ba.UserNationality 
-                    AND p1.NationalID = ba.UserNationalID
-                JOIN Transaction1 t1 ON ba.AccountNumber = t1.SenderAccNum
-                JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
-                WHERE t2.TransactionDate BETWEEN %s AND %s
-                GROUP BY p1.Nationality, p1.NationalID, p2.First, p2.Middle, p2.Last
-                HAVING COUNT(t1.TransactionID) >= %s
-                ORDER BY TransactionCount DESC
-            """
-            self.db.cursor.execute(
-                query, (start_date, end_date, min_transactions))
-            results = self.db.cursor.fetchall()
+            results = self.execute(
+                'analyze_transaction_patterns', min_transactions=min_transactions,
+                start_date=start_date, end_date=end_date)
 
             if results:
                 print(f"\nTransaction Analysis ({start_date} to {end_date}):")
@@ -468,6 +1138,177 @@ class BankingSystem:
             logging.error(f"Error analyzing transactions: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_transaction_patterns(self, min_transactions: int,
+                                   start_date: str, end_date: str) -> list:
+        query = """
+            SELECT p2.First, p2.Middle, p2.Last,
+                   COUNT(t1.TransactionID) as TransactionCount,
+                   SUM(t2.Amount) as TotalAmount,
+                   AVG(t2.Amount) as AvgAmount
+            FROM Person1 p1
+            JOIN Person2 p2 ON p1.Nationality = p2.Nationality
+                AND p1.NationalID = p2.NationalID
+            JOIN BankAccount ba ON p1.Nationality = ba.UserNationality
+                AND p1.NationalID = ba.UserNationalID
+            JOIN Transaction1 t1 ON ba.AccountNumber = t1.SenderAccNum
+            JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+            WHERE t2.TransactionDate BETWEEN %s AND %s
+            GROUP BY p1.Nationality, p1.NationalID, p2.First, p2.Middle, p2.Last
+            HAVING COUNT(t1.TransactionID) >= %s
+            ORDER BY TransactionCount DESC
+        """
+        self.require_live(datetime.date.fromisoformat(start_date),
+                          "transaction patterns can only be analyzed")
+        return self.run_report(query, (start_date, end_date, min_transactions))
+
+    def analyze_transfer_graph(self):
+        """Analyze the network of transfers between accounts"""
+        try:
+            analysis = input(
+                "Analysis: (1) Fan-Out, (2) Fan-In, (3) Flow Between Customers, "
+                "(4) Round-Tripping or (5) Connected Groups? ").strip()
+            start_date = input("Enter start date (YYYY-MM-DD): ").strip()
+            end_date = input("Enter end date (YYYY-MM-DD): ").strip()
+
+            if analysis in ('1', '2'):
+                k = int(input("How many entries (K)? ").strip())
+                direction = 'out' if analysis == '1' else 'in'
+                accounts = self.execute(
+                    'analyze_transfer_graph', analysis=f'fan_{direction}',
+                    start_date=start_date, end_date=end_date, k=k)
+                print(f"\nTop {k} Accounts by Distinct "
+                      f"{'Receivers' if direction == 'out' else 'Senders'}:")
+                for position, account in enumerate(accounts, 1):
+                    print(f"\n#{position} Account {account['AccountNumber']}")
+                    print(f"Counterparties: {account['Counterparties']}")
+                    print(f"Transactions: {account['Transfers']}")
+                    print(f"Amount: ${account['Amount']:,.2f}")
+
+            elif analysis == '3':
+                from_nationality = input("Enter sending customer's nationality: ").strip()
+                from_national_id = input("Enter sending customer's national ID: ").strip()
+                to_nationality = input("Enter receiving customer's nationality: ").strip()
+                to_national_id = input("Enter receiving customer's national ID: ").strip()
+                flow = self.execute(
+                    'analyze_transfer_graph', analysis='flow',
+                    start_date=start_date, end_date=end_date,
+                    from_nationality=from_nationality, from_national_id=from_national_id,
+                    to_nationality=to_nationality, to_national_id=to_national_id)
+                print(f"\nDirect Transfers: {flow['Transfers']}, ${flow['Amount']:,.2f}")
+                print(f"Returned Directly: {flow['ReturnTransfers']}, "
+                      f"${flow['ReturnAmount']:,.2f}")
+                if flow['Path']:
+                    print(f"Shortest Chain: {' -> '.join(map(str, flow['Path']))}")
+                else:
+                    print("No chain of transfers connects the two customers.")
+
+            elif analysis == '4':
+                groups = self.execute(
+                    'analyze_transfer_graph', analysis='cycles',
+                    start_date=start_date, end_date=end_date)
+                if not groups:
+                    print("\nNo circular money flows found.")
+                for group in groups:
+                    print(f"\n{group['Size']} Accounts: {', '.join(map(str, group['Accounts']))}")
+                    print(f"Transactions: {group['Transfers']}, "
+                          f"Amount: ${group['Amount']:,.2f}")
+
+            else:
+                summary = self.execute(
+                    'analyze_transfer_graph', analysis='components',
+                    start_date=start_date, end_date=end_date)
+                print(f"\nConnected Groups of Accounts: {summary['Components']}")
+                for group in summary['Largest']:
+                    print(f"\nSize: {group['Size']} accounts, e.g. "
+                          f"{', '.join(map(str, group['Accounts'][:5]))}")
+
+        except Exception as e:
+            logging.error(f"Error analyzing transfer graph: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def fetch_transfer_graph(self, analysis: str, start_date: str, end_date: str, k: int = 10,
+                             from_nationality: str = None, from_national_id: str = None,
+                             to_nationality: str = None, to_national_id: str = None):
+        """Run one analysis ('fan_out', 'fan_in', 'flow', 'cycles' or 'components')
+        on the graph of transfers dated in [start_date, end_date]"""
+        if self.transfer_graph and self.transfer_graph[:2] == (start_date, end_date):
+            graph = self.transfer_graph[2]
+        else:
+            self.require_live(datetime.date.fromisoformat(start_date),
+                              "the transfer network can only be analyzed")
+            graph = TransferGraph.load(self.db, start_date, end_date, self.limited_report)
+            self.transfer_graph = (start_date, end_date, graph)
+            logging.info(f"Transfer graph {start_date} to {end_date}: "
+                         f"{graph.vertex_count} accounts, {graph.edge_count} edges")
+
+        if analysis in ('fan_out', 'fan_in'):
+            if k <= 0:
+                raise ValueError("K must be positive")
+            return graph.top_fan(k, analysis[4:])
+        if analysis == 'flow':
+            sender = graph.vertices(self.customer_accounts(from_nationality, from_national_id))
+            receiver = graph.vertices(self.customer_accounts(to_nationality, to_national_id))
+            transfers, amount = graph.direct_flow(sender, receiver)
+            returns, return_amount = graph.direct_flow(receiver, sender)
+            return {'Transfers': transfers, 'Amount': amount,
+                    'ReturnTransfers': returns, 'ReturnAmount': return_amount,
+                    'Path': graph.shortest_path(sender, receiver)}
+        if analysis == 'cycles':
+            return graph.cycles()
+        if analysis == 'components':
+            return graph.components()
+        raise ValueError(f"Unknown graph analysis: {analysis}")
+
+    def customer_accounts(self, nationality: str, national_id: str) -> list:
+        self.db.cursor.execute("""
+            SELECT AccountNumber FROM BankAccount
+            WHERE UserNationality = %s AND UserNationalID = %s
+        """, (nationality, national_id))
+        accounts = [row['AccountNumber'] for row in self.db.cursor.fetchall()]
+        if not accounts:
+            raise ValueError(f"No accounts found for customer {nationality}/{national_id}")
+        return accounts
+
+    def view_branch_activity(self):
+        """Daily, weekly or monthly transfer volume and value per branch"""
+        try:
+            choice = input("Roll up by (1) Day, (2) Week or (3) Month? ").strip()
+            period = {'1': 'day', '2': 'week', '3': 'month'}.get(choice)
+            if not period:
+                raise ValueError("Invalid choice")
+            start_date = input("Enter start date (YYYY-MM-DD): ").strip()
+            end_date = input("Enter end date (YYYY-MM-DD): ").strip()
+            bank_id = input("Enter bank ID (blank for all banks): ").strip()
+            branch_code = input("Enter branch code (blank for all branches): ").strip()
+
+            rows = self.execute(
+                'view_branch_activity', period=period, start_date=start_date, end_date=end_date,
+                bank_id=int(bank_id) if bank_id else None,
+                branch_code=int(branch_code) if branch_code else None)
+
+            if not rows:
+                print("\nNo activity recorded for this range.")
+            for row in rows:
+                print(f"\nBank {row['BankID']}, Branch {row['BranchCode']}, "
+                      f"{period} of {row['PeriodStart']}:")
+                for side in ('Sent', 'Received'):
+                    if row[f'{side}Count']:
+                        print(f"{side}: {row[f'{side}Count']} transfers, "
+                              f"${row[f'{side}Amount']:,.2f} "
+                              f"(min ${row[f'{side}Min']:,.2f}, max ${row[f'{side}Max']:,.2f})")
+                    else:
+                        print(f"{side}: none")
+
+        except Exception as e:
+            logging.error(f"Error viewing branch activity: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def fetch_branch_activity(self, period: str, start_date: str, end_date: str,
+                              bank_id: int = None, branch_code: int = None) -> list:
+        """Per-branch transfer totals by 'day', 'week' or 'month' from the daily rollups"""
+        return rollups.series(self.db, period, start_date, end_date, bank_id, branch_code,
+                              self.run_report)
+
     # Modification Functions
     def add_bank_account(self):
         """Add a new bank account for an existing user"""
@@ -476,39 +1317,93 @@ class BankingSystem:
             nationality = input("Enter user nationality: ").strip()
             national_id = input("Enter national ID: ").strip()
 
+            account_type = input(
+                "Enter account type (Current/Saving/Salary/Demat/FixedDeposit): ").strip().lower()
+            branch_code = input("Enter branch code: ").strip()
+            bank_id = input("Enter bank ID: ").strip()
+            initial_balance = float(input("Enter initial balance: ").strip())
+
+            # Collect the account type specific details up front so no
+            # transaction is held open while waiting for input
+            details = {}
+            if account_type == 'current':
+                details['min_balance'] = float(
+                    input("Enter minimum balance requirement: ").strip())
+                details['monthly_transaction_limit'] = int(
+                    input("Enter monthly transaction limit: "))
+
+            elif account_type == 'saving':
+                details['min_balance'] = float(input("Enter minimum balance: "))
+                details['interest_rate'] = float(input("Enter interest rate: "))
+                details['monthly_withdrawal_limit'] = int(
+                    input("Enter monthly withdrawal limit: "))
+
+            elif account_type == 'salary':
+                details['organisation_id'] = input("Enter organisation ID: ")
+                details['employee_id'] = input("Enter employee ID: ")
+
+            elif account_type == 'demat':
+                details['dp_id'] = input("Enter DP ID: ")
+                details['trading_account_link'] = input(
+                    "Enter trading account link: ")
+                details['maintenance_charges'] = float(
+                    input("Enter maintenance charges: "))
+
+            elif account_type == 'fixeddeposit':
+                details['lockin_period'] = input(
+                    "Enter lock-in period (YYYY-MM-DD): ")
+                details['maturity_date'] = input(
+                    "Enter maturity date (YYYY-MM-DD): ")
+                details['premature_penalty'] = float(
+                    input("Enter premature penalty: "))
+
+            account_number = self.execute(
+                'add_bank_account', nationality=nationality, national_id=national_id,
+                account_type=account_type, branch_code=int(branch_code),
+                bank_id=int(bank_id), initial_balance=initial_balance, **details)
+
+            print(f"\nAccount created successfully! Account Number: {
+                  account_number}")
+
+        except Exception as e:
+            logging.error(f"Error creating account: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def create_bank_account(self, nationality: str, national_id: str, account_type: str,
+                            branch_code: int, bank_id: int, initial_balance: float,
+                            min_balance: float = None, monthly_transaction_limit: int = None,
+                            interest_rate: float = None, monthly_withdrawal_limit: int = None,
+                            organisation_id: str = None, employee_id: str = None,
+                            dp_id: str = None, trading_account_link: str = None,
+                            maintenance_charges: float = None, lockin_period: str = None,
+                            maturity_date: str = None, premature_penalty: float = None,
+                            account_number: int = None) -> int:
+        """Open an account of the given type and return its account number"""
+        account_type = account_type.lower()
+        try:
             # Verify user exists
             self.db.cursor.execute("""
-                SELECT AnnualIncome FROM Person1 
+                SELECT AnnualIncome FROM Person1
                 WHERE Nationality = %s AND NationalID = %s
             """, (nationality, national_id))
             user = self.db.cursor.fetchone()
 
             if not user:
-                print("\nUser not found.")
-                return
-
-            account_type = input(
-                "Enter account type (Current/Saving/Salary/Demat/FixedDeposit): ").strip().lower()
-            branch_code = input("Enter branch code: ").strip()
-            bank_id = input("Enter bank ID: ").strip()
-            initial_balance = float(input("Enter initial balance: ").strip())
+                raise ValueError("User not found")
 
             # Check minimum balance requirement based on account type
-            if account_type == 'current':
-                min_balance = float(
-                    input("Enter minimum balance requirement: ").strip())
-                if initial_balance < min_balance:
-                    print(
-                        "\nInitial balance does not meet minimum balance requirement.")
-                    return
+            if account_type == 'current' and initial_balance < min_balance:
+                raise ValueError(
+                    "Initial balance does not meet minimum balance requirement")
 
             self.db.cursor.execute("START TRANSACTION")
 
-            # Generate new account number
-            self.db.cursor.execute(
-                "SELECT MAX(AccountNumber) as max_acc FROM BankAccount")
-            result = self.db.cursor.fetchone()
-            account_number = (result['max_acc'] or 0) + 1
+            # Generate new account number unless one was allocated up front
+            if account_number is None:
+                self.db.cursor.execute(
+                    "SELECT MAX(AccountNumber) as max_acc FROM BankAccount")
+                result = self.db.cursor.fetchone()
+                account_number = (result['max_acc'] or 0) + 1
 
             # Insert into BankAccount
             self.db.cursor.execute("""
@@ -524,63 +1419,48 @@ class BankingSystem:
                     INSERT INTO CurrentAccount (
                         AccountNumber, MinBalance, MonthlyTransactionLimit
                     ) VALUES (%s, %s, %s)
-                """, (account_number, min_balance, input("Enter monthly transaction limit: ")))
+                """, (account_number, min_balance, monthly_transaction_limit))
 
             elif account_type == 'saving':
                 self.db.cursor.execute("""
                     INSERT INTO SavingAccount (
                         AccountNumber, MinBalance, InterestRate, MonthlyWithdrawalLimit
                     ) VALUES (%s, %s, %s, %s)
-                """, (
-                    account_number,
-                    float(input("Enter minimum balance: ")),
-                    float(input("Enter interest rate: ")),
-                    int(input("Enter monthly withdrawal limit: "))
-                ))
+                """, (account_number, min_balance, interest_rate, monthly_withdrawal_limit))
 
             elif account_type == 'salary':
                 self.db.cursor.execute("""
                     INSERT INTO SalaryAccount (
                         AccountNumber, OrganisationID, EmployeeID
                     ) VALUES (%s, %s, %s)
-                """, (
-                    account_number,
-                    input("Enter organisation ID: "),
-                    input("Enter employee ID: ")
-                ))
+                """, (account_number, organisation_id, employee_id))
 
             elif account_type == 'demat':
                 self.db.cursor.execute("""
                     INSERT INTO DematAccount (
                         AccountNumber, DPID, TradingAccountLink, MaintenanceCharges
                     ) VALUES (%s, %s, %s, %s)
-                """, (
-                    account_number,
-                    input("Enter DP ID: "),
-                    input("Enter trading account link: "),
-                    float(input("Enter maintenance charges: "))
-                ))
+                """, (account_number, dp_id, trading_account_link, maintenance_charges))
 
             elif account_type == 'fixeddeposit':
                 self.db.cursor.execute("""
                     INSERT INTO FixedDepositAccount (
                         AccountNumber, LockinPeriod, MaturityDate, PrematurePenalty
                     ) VALUES (%s, %s, %s, %s)
-                """, (
-                    account_number,
-                    input("Enter lock-in period (YYYY-MM-DD): "),
-                    input("Enter maturity date (YYYY-MM-DD): "),
-                    float(input("Enter premature penalty: "))
-                ))
+                """, (account_number, lockin_period, maturity_date, premature_penalty))
+
+            self.ledger.record_opening_balance(account_number, initial_balance)
 
             self.db.connection.commit()
-            print(f"\nAccount created successfully! Account Number: {
-                  account_number}")
 
-        except Exception as e:
+        except Exception:
             self.db.connection.rollback()
-            logging.error(f"Error creating account: {str(e)}")
-            print(f"\nError: {str(e)}")
+            raise
+
+        self.directory.invalidate(account_number)
+        self.leaderboard.record_balance(
+            account_number, Decimal(str(initial_balance)))
+        return account_number
 
     def update_budget_limit(self):
         """Update budget limit for a user"""
@@ -590,59 +1470,65 @@ class BankingSystem:
             category = input("Enter budget category: ").strip()
             new_limit = float(input("Enter new budget limit: ").strip())
 
+            params = dict(nationality=nationality, national_id=national_id,
+                          category=category, new_limit=new_limit)
+            try:
+                updated = self.execute('update_budget_limit', **params)
+            except ConfirmationRequired as warning:
+                print(f"\nWarning: {str(warning)}!")
+                if input("Continue anyway? (y/n): ").lower() != 'y':
+                    return
+                updated = self.execute(
+                    'update_budget_limit', allow_above_income=True, **params)
+
+            if updated:
+                print("\nBudget limit updated successfully!")
+            else:
+                print("\nNo matching budget found.")
+
+        except Exception as e:
+            logging.error(f"Error updating budget: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def set_budget_limit(self, nationality: str, national_id: str, category: str,
+                         new_limit: float, allow_above_income: bool = False) -> bool:
+        """Change a budget limit; returns False if no such budget exists"""
+        try:
             # Verify user and their income
             self.db.cursor.execute("""
-                SELECT AnnualIncome FROM Person1 
+                SELECT AnnualIncome FROM Person1
                 WHERE Nationality = %s AND NationalID = %s
             """, (nationality, national_id))
             user = self.db.cursor.fetchone()
 
             if not user:
-                print("\nUser not found.")
-                return
+                raise ValueError("User not found")
 
             # Check if new limit is reasonable compared to annual income
-            if new_limit > user['AnnualIncome']:
-                print("\nWarning: Budget limit exceeds annual income!")
-                if input("Continue anyway? (y/n): ").lower() != 'y':
-                    return
+            if new_limit > user['AnnualIncome'] and not allow_above_income:
+                raise ConfirmationRequired("Budget limit exceeds annual income")
 
             self.db.cursor.execute("""
-                UPDATE Budgets1 
+                UPDATE Budgets1
                 SET BudgetLimit = %s
-                WHERE Category = %s 
-                    AND UserNationality = %s 
+                WHERE Category = %s
+                    AND UserNationality = %s
                     AND UserNationalID = %s
             """, (new_limit, category, nationality, national_id))
 
             if self.db.cursor.rowcount > 0:
                 self.db.connection.commit()
-                print("\nBudget limit updated successfully!")
-            else:
-                print("\nNo matching budget found.")
+                return True
+            return False
 
-        except Exception as e:
+        except Exception:
             self.db.connection.rollback()
-            logging.error(f"Error updating budget: {str(e)}")
-            print(f"\nError: {str(e)}")
+            raise
 
     def remove_expired_goals(self):
         """Remove expired savings goals"""
         try:
-            self.db.cursor.execute("START TRANSACTION")
-
-            # Find expired goals
-            self.db.cursor.execute("""
-                SELECT sg1.GoalName, sg1.UserNationality, sg1.UserNationalID,
-                       sg1.TargetAmount, sg1.CurrentSaving, sg2.DeadlineDate
-                FROM SavingsGoals1 sg1
-                JOIN SavingsGoals2 sg2 ON sg1.GoalName = sg2.GoalName
-                    AND sg1.UserNationality = sg2.UserNationality
-                    AND sg1.UserNationalID = sg2.UserNationalID
-                WHERE sg2.DeadlineDate < CURDATE()
-                    AND sg1.CurrentSaving < sg1.TargetAmount
-            """)
-            expired_goals = self.db.cursor.fetchall()
+            expired_goals = self.fetch_expired_goals()
 
             if not expired_goals:
                 print("\nNo expired goals found.")
@@ -658,34 +1544,60 @@ class BankingSystem:
                 print(f"Deadline: {goal['DeadlineDate']}")
 
             if input("\nProceed with removal? (y/n): ").lower() == 'y':
-                for goal in expired_goals:
-                    # Remove from SavingsGoals2 first (due to foreign key)
-                    self.db.cursor.execute("""
-                        DELETE FROM SavingsGoals2
-                        WHERE GoalName = %s 
-                            AND UserNationality = %s 
-                            AND UserNationalID = %s
-                    """, (goal['GoalName'], goal['UserNationality'], goal['UserNationalID']))
-
-                    # Then remove from SavingsGoals1
-                    self.db.cursor.execute("""
-                        DELETE FROM SavingsGoals1
-                        WHERE GoalName = %s 
-                            AND UserNationality = %s 
-                            AND UserNationalID = %s
-                    """, (goal['GoalName'], goal['UserNationality'], goal['UserNationalID']))
-
-                self.db.connection.commit()
+                self.execute('remove_expired_goals')
                 print("\nExpired goals removed successfully!")
             else:
-                self.db.connection.rollback()
                 print("\nOperation cancelled.")
 
         except Exception as e:
-            self.db.connection.rollback()
             logging.error(f"Error removing expired goals: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def fetch_expired_goals(self) -> list:
+        self.db.cursor.execute("""
+            SELECT sg1.GoalName, sg1.UserNationality, sg1.UserNationalID,
+                   sg1.TargetAmount, sg1.CurrentSaving, sg2.DeadlineDate
+            FROM SavingsGoals1 sg1
+            JOIN SavingsGoals2 sg2 ON sg1.GoalName = sg2.GoalName
+                AND sg1.UserNationality = sg2.UserNationality
+                AND sg1.UserNationalID = sg2.UserNationalID
+            WHERE sg2.DeadlineDate < CURDATE()
+                AND sg1.CurrentSaving < sg1.TargetAmount
+        """)
+        return self.db.cursor.fetchall()
+
+    def purge_expired_goals(self) -> list:
+        """Delete every expired, unmet savings goal and return the removed goals"""
+        try:
+            self.db.cursor.execute("START TRANSACTION")
+
+            # Find expired goals
+            expired_goals = self.fetch_expired_goals()
+
+            for goal in expired_goals:
+                # Remove from SavingsGoals2 first (due to foreign key)
+                self.db.cursor.execute("""
+                    DELETE FROM SavingsGoals2
+                    WHERE GoalName = %s
+                        AND UserNationality = %s
+                        AND UserNationalID = %s
+                """, (goal['GoalName'], goal['UserNationality'], goal['UserNationalID']))
+
+                # Then remove from SavingsGoals1
+                self.db.cursor.execute("""
+                    DELETE FROM SavingsGoals1
+                    WHERE GoalName = %s
+                        AND UserNationality = %s
+                        AND UserNationalID = %s
+                """, (goal['GoalName'], goal['UserNationality'], goal['UserNationalID']))
+
+            self.db.connection.commit()
+            return expired_goals
+
+        except Exception:
+            self.db.connection.rollback()
+            raise
+
     def add_person(self):
         """Add a new person to the database"""
         try:
@@ -708,9 +1620,6 @@ class BankingSystem:
                     'custodian_nationality': input("Custodian Nationality: ").strip(),
                     'custodian_national_id': input("Custodian National ID: ").strip()
                 })
-            else:
-                person_data['custodian_nationality'] = None
-                person_data['custodian_national_id'] = None
 
             # Collect Person2 data
             person_data.update({
@@ -732,6 +1641,23 @@ class BankingSystem:
                 emails.append(
                     input("At least one email address is required: ").strip())
 
+            self.execute('add_person', emails=emails, **person_data)
+            print("\nPerson added successfully!")
+
+        except Exception as e:
+            logging.error(f"Error adding person: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def create_person(self, nationality: str, national_id: str, password: str, dob: str,
+                      phone: str, annual_income: float, annual_expenditure: float,
+                      first_name: str, last_name: str, emails: list,
+                      middle_name: str = None, custodian_nationality: str = None,
+                      custodian_national_id: str = None):
+        """Insert a person with their name and email addresses"""
+        if not emails:
+            raise ValueError("At least one email address is required")
+
+        try:
             # Start transaction
             self.db.cursor.execute("START TRANSACTION")
 
@@ -739,27 +1665,23 @@ class BankingSystem:
             self.db.cursor.execute("""
                 INSERT INTO Person1 (
                     Nationality, NationalID, Password, CustodianNationality,
-                    CustodianNationalID, DateOfBirth, Phone, 
+                    CustodianNationalID, DateOfBirth, Phone,
                     AnnualIncome, AnnualExpenditure
                 ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (
-                person_data['nationality'], person_data['national_id'],
-                person_data['password'], person_data['custodian_nationality'],
-                person_data['custodian_national_id'], person_data['dob'],
-                person_data['phone'], person_data['annual_income'],
-                person_data['annual_expenditure']
+                nationality, national_id, password, custodian_nationality,
+                custodian_national_id, dob, phone, annual_income,
+                annual_expenditure
             ))
+            households.link(self.db, nationality, national_id,
+                            custodian_nationality, custodian_national_id)
 
             # Insert into Person2
             self.db.cursor.execute("""
                 INSERT INTO Person2 (
                     Nationality, NationalID, First, Middle, Last
                 ) VALUES (%s, %s, %s, %s, %s)
-            """, (
-                person_data['nationality'], person_data['national_id'],
-                person_data['first_name'], person_data['middle_name'],
-                person_data['last_name']
-            ))
+            """, (nationality, national_id, first_name, middle_name, last_name))
 
             # Insert into Person3 (multiple email addresses)
             for email in emails:
@@ -767,19 +1689,14 @@ class BankingSystem:
                     INSERT INTO Person3 (
                         Email, Nationality, NationalID
                     ) VALUES (%s, %s, %s)
-                """, (
-                    email, person_data['nationality'], person_data['national_id']
-                ))
+                """, (email, nationality, national_id))
 
             self.db.connection.commit()
-            print("\nPerson added successfully!")
-            logging.info(f"New person added: {
-                person_data['nationality']}-{person_data['national_id']}")
+            logging.info(f"New person added: {nationality}-{national_id}")
 
-        except Exception as e:
+        except Exception:
             self.db.connection.rollback()
-            logging.error(f"Error adding person: {str(e)}")
-            print(f"\nError: {str(e)}")
+            raise
 
     def add_location(self):
         """Add a new location to the database"""
@@ -792,19 +1709,25 @@ class BankingSystem:
                 'city': input("City: ").strip()
             }
 
+            self.execute('add_location', **location_data)
+            print("\nLocation added successfully!")
+
+        except Exception as e:
+            logging.error(f"Error adding location: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def create_location(self, country: str, pincode: str, state: str, city: str):
+        try:
             self.db.cursor.execute("""
                 INSERT INTO Locations (Country, Pincode, State, City)
                 VALUES (%s, %s, %s, %s)
-            """, (location_data['country'], location_data['pincode'],
-                  location_data['state'], location_data['city']))
+            """, (country, pincode, state, city))
 
             self.db.connection.commit()
-            print("\nLocation added successfully!")
 
-        except Exception as e:
+        except Exception:
             self.db.connection.rollback()
-            logging.error(f"Error adding location: {str(e)}")
-            print(f"\nError: {str(e)}")
+            raise
 
     def add_bank(self):
         """Add a new bank to the database"""
@@ -818,6 +1741,17 @@ class BankingSystem:
                 'pincode': input("Bank Pincode: ").strip()
             }
 
+            bank_id = self.execute('add_bank', **bank_data)
+            print(f"\nBank added successfully! Bank ID: {bank_id}")
+
+        except Exception as e:
+            logging.error(f"Error adding bank: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def create_bank(self, bank_name: str, head_nationality: str, head_national_id: str,
+                    country: str, pincode: str) -> int:
+        """Register a bank and return its new bank ID"""
+        try:
             self.db.cursor.execute("START TRANSACTION")
 
             # Generate new bank ID
@@ -830,22 +1764,20 @@ class BankingSystem:
             self.db.cursor.execute("""
                 INSERT INTO RegisteredBank1 (BankID, BankName, GlobalHeadNationality, GlobalHeadNationalID)
                 VALUES (%s, %s, %s, %s)
-            """, (bank_id, bank_data['bank_name'],
-                  bank_data['head_nationality'], bank_data['head_national_id']))
+            """, (bank_id, bank_name, head_nationality, head_national_id))
 
             # Insert into RegisteredBank2
             self.db.cursor.execute("""
                 INSERT INTO RegisteredBank2 (BankID, Country, Pincode)
                 VALUES (%s, %s, %s)
-            """, (bank_id, bank_data['country'], bank_data['pincode']))
+            """, (bank_id, country, pincode))
 
             self.db.connection.commit()
-            print(f"\nBank added successfully! Bank ID: {bank_id}")
+            return bank_id
 
-        except Exception as e:
+        except Exception:
             self.db.connection.rollback()
-            logging.error(f"Error adding bank: {str(e)}")
-            print(f"\nError: {str(e)}")
+            raise
 
     def add_branch(self):
         """Add a new bank branch"""
@@ -859,14 +1791,25 @@ class BankingSystem:
                 'pincode': input("Branch Pincode: ").strip()
             }
 
+            branch_code = self.execute('add_branch', **branch_data)
+            print(f"\nBranch added successfully! Branch Code: {branch_code}")
+
+        except Exception as e:
+            logging.error(f"Error adding branch: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def create_branch(self, bank_id: int, manager_nationality: str, manager_national_id: str,
+                      country: str, pincode: str) -> int:
+        """Open a branch of a bank and return its new branch code"""
+        try:
             self.db.cursor.execute("START TRANSACTION")
 
             # Generate new branch code
             self.db.cursor.execute("""
-                SELECT MAX(BranchCode) as max_code 
-                FROM BankBranch1 
+                SELECT MAX(BranchCode) as max_code
+                FROM BankBranch1
                 WHERE BankID = %s
-            """, (branch_data['bank_id'],))
+            """, (bank_id,))
             result = self.db.cursor.fetchone()
             branch_code = (result['max_code'] or 0) + 1
 
@@ -874,23 +1817,20 @@ class BankingSystem:
             self.db.cursor.execute("""
                 INSERT INTO BankBranch1 (BranchCode, BankID, BranchManagerNationality, BranchManagerNationalID)
                 VALUES (%s, %s, %s, %s)
-            """, (branch_code, branch_data['bank_id'],
-                  branch_data['manager_nationality'], branch_data['manager_national_id']))
+            """, (branch_code, bank_id, manager_nationality, manager_national_id))
 
             # Insert into BankBranch2
             self.db.cursor.execute("""
                 INSERT INTO BankBranch2 (BranchCode, BankID, Country, Pincode)
                 VALUES (%s, %s, %s, %s)
-            """, (branch_code, branch_data['bank_id'],
-                  branch_data['country'], branch_data['pincode']))
+            """, (branch_code, bank_id, country, pincode))
 
             self.db.connection.commit()
-            print(f"\nBranch added successfully! Branch Code: {branch_code}")
+            return branch_code
 
-        except Exception as e:
+        except Exception:
             self.db.connection.rollback()
-            logging.error(f"Error adding branch: {str(e)}")
-            print(f"\nError: {str(e)}")
+            raise
 
     def add_budget(self):
         """Add a new budget for a user"""
@@ -905,30 +1845,35 @@ class BankingSystem:
                 'duration_time': input("Duration Time (HH:MM:SS): ").strip()
             }
 
+            self.execute('add_budget', **budget_data)
+            print("\nBudget added successfully!")
+
+        except Exception as e:
+            logging.error(f"Error adding budget: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def create_budget(self, category: str, user_nationality: str, user_national_id: str,
+                      budget_limit: float, duration_date: str, duration_time: str):
+        try:
             self.db.cursor.execute("START TRANSACTION")
 
             # Insert into Budgets1
             self.db.cursor.execute("""
                 INSERT INTO Budgets1 (Category, UserNationality, UserNationalID, BudgetLimit, CurrentExpend)
                 VALUES (%s, %s, %s, %s, 0)
-            """, (budget_data['category'], budget_data['user_nationality'],
-                  budget_data['user_national_id'], budget_data['budget_limit']))
+            """, (category, user_nationality, user_national_id, budget_limit))
 
             # Insert into Budgets2
             self.db.cursor.execute("""
                 INSERT INTO Budgets2 (Category, UserNationality, UserNationalID, DurationDate, DurationTime)
                 VALUES (%s, %s, %s, %s, %s)
-            """, (budget_data['category'], budget_data['user_nationality'],
-                  budget_data['user_national_id'], budget_data['duration_date'],
-                  budget_data['duration_time']))
+            """, (category, user_nationality, user_national_id, duration_date, duration_time))
 
             self.db.connection.commit()
-            print("\nBudget added successfully!")
 
-        except Exception as e:
+        except Exception:
             self.db.connection.rollback()
-            logging.error(f"Error adding budget: {str(e)}")
-            print(f"\nError: {str(e)}")
+            raise
 
     def add_savings_goal(self):
         """Add a new savings goal for a user"""
@@ -943,30 +1888,35 @@ class BankingSystem:
                 'deadline_time': input("Deadline Time (HH:MM:SS): ").strip()
             }
 
+            self.execute('add_savings_goal', **goal_data)
+            print("\nSavings goal added successfully!")
+
+        except Exception as e:
+            logging.error(f"Error adding savings goal: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def create_savings_goal(self, goal_name: str, user_nationality: str, user_national_id: str,
+                            target_amount: float, deadline_date: str, deadline_time: str):
+        try:
             self.db.cursor.execute("START TRANSACTION")
 
             # Insert into SavingsGoals1
             self.db.cursor.execute("""
                 INSERT INTO SavingsGoals1 (GoalName, UserNationality, UserNationalID, TargetAmount, CurrentSaving)
                 VALUES (%s, %s, %s, %s, 0)
-            """, (goal_data['goal_name'], goal_data['user_nationality'],
-                  goal_data['user_national_id'], goal_data['target_amount']))
+            """, (goal_name, user_nationality, user_national_id, target_amount))
 
             # Insert into SavingsGoals2
             self.db.cursor.execute("""
                 INSERT INTO SavingsGoals2 (GoalName, UserNationality, UserNationalID, DeadlineDate, DeadlineTime)
                 VALUES (%s, %s, %s, %s, %s)
-            """, (goal_data['goal_name'], goal_data['user_nationality'],
-                  goal_data['user_national_id'], goal_data['deadline_date'],
-                  goal_data['deadline_time']))
+            """, (goal_name, user_nationality, user_national_id, deadline_date, deadline_time))
 
             self.db.connection.commit()
-            print("\nSavings goal added successfully!")
 
-        except Exception as e:
+        except Exception:
             self.db.connection.rollback()
-            logging.error(f"Error adding savings goal: {str(e)}")
-            print(f"\nError: {str(e)}")
+            raise
 
     def make_transaction(self):
         """Execute a transaction between two bank accounts"""
@@ -975,146 +1925,788 @@ class BankingSystem:
             sender_acc = int(input("Enter Sender's Account Number: ").strip())
             receiver_acc = int(
                 input("Enter Receiver's Account Number: ").strip())
-            amount = Decimal(
-                float(input("Enter Transaction Amount: ").strip()))
+            amount = Money.of(input("Enter Transaction Amount: ").strip())
+
+            result = self.execute(
+                'make_transaction', sender_acc=sender_acc,
+                receiver_acc=receiver_acc, amount=amount)
 
-            if amount <= 0:
-                print("\nError: Amount must be positive")
+            if result['status'] == 'journaled':
+                print("\nTransaction accepted for processing!")
+                print(f"Transfer ID: {result['transfer_id']}")
                 return
 
-            self.db.cursor.execute("START TRANSACTION")
+            sender, receiver = result['sender'], result['receiver']
+            print("\nTransaction completed successfully!")
+            print(f"Transaction ID: {result['transaction_id']}")
+            print(f"From: {sender['First']} {
+                sender['Last']} (Account: {sender_acc})")
+            print(f"To: {receiver['First']} {
+                receiver['Last']} (Account: {receiver_acc})")
+            print(f"Amount: ${amount:,.2f}")
 
-            # Verify sender's account and check balance
-            self.db.cursor.execute("""
-                SELECT ba.AccountNumber, ba.Balance, ba.UserNationality, ba.UserNationalID,
-                    p2.First, p2.Last
-                FROM BankAccount ba
-                JOIN Person2 p2 ON ba.UserNationality = p2.Nationality 
-                    AND ba.UserNationalID = p2.NationalID
-                WHERE ba.AccountNumber = %s
-            """, (sender_acc,))
-            sender = self.db.cursor.fetchone()
-
-            if not sender:
-                raise ValueError("Sender account not found")
-
-            if sender['Balance'] < amount:
-                raise ValueError("Insufficient funds")
-
-            # Verify receiver's account
-            self.db.cursor.execute("""
-                SELECT ba.AccountNumber, ba.UserNationality, ba.UserNationalID,
-                    p2.First, p2.Last
-                FROM BankAccount ba
-                JOIN Person2 p2 ON ba.UserNationality = p2.Nationality 
-                    AND ba.UserNationalID = p2.NationalID
-                WHERE ba.AccountNumber = %s
-            """, (receiver_acc,))
-            receiver = self.db.cursor.fetchone()
-
-            if not receiver:
-                raise ValueError("Receiver account not found")
-
-            # Check account type restrictions
-            # For Savings Account
-            self.db.cursor.execute("""
-                SELECT MonthlyWithdrawalLimit 
-                FROM SavingAccount 
-                WHERE AccountNumber = %s
-            """, (sender_acc,))
-            saving_acc = self.db.cursor.fetchone()
-
-            if saving_acc:
-                # Check monthly withdrawal limit
-                self.db.cursor.execute("""
-                    SELECT COUNT(*) as transaction_count
-                    FROM Transaction1 t1
-                    JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
-                    WHERE t1.SenderAccNum = %s
-                    AND MONTH(t2.TransactionDate) = MONTH(CURRENT_DATE())
-                    AND YEAR(t2.TransactionDate) = YEAR(CURRENT_DATE())
-                """, (sender_acc,))
-                monthly_transactions = self.db.cursor.fetchone()
-
-                if monthly_transactions['transaction_count'] >= saving_acc['MonthlyWithdrawalLimit']:
-                    raise ValueError(
-                        "Monthly withdrawal limit exceeded for savings account")
-
-            # For Current Account
-            self.db.cursor.execute("""
-                SELECT MinBalance, MonthlyTransactionLimit 
-                FROM CurrentAccount 
-                WHERE AccountNumber = %s
-            """, (sender_acc,))
-            current_acc = self.db.cursor.fetchone()
-
-            if current_acc:
-                if (sender['Balance'] - amount) < current_acc['MinBalance']:
-                    raise ValueError(
-                        "Transaction would breach minimum balance requirement")
-
-                # Check monthly transaction limit
-                self.db.cursor.execute("""
-                    SELECT COUNT(*) as transaction_count
-                    FROM Transaction1 t1
-                    JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
-                    WHERE t1.SenderAccNum = %s
-                    AND MONTH(t2.TransactionDate) = MONTH(CURRENT_DATE())
-                    AND YEAR(t2.TransactionDate) = YEAR(CURRENT_DATE())
-                """, (sender_acc,))
-                monthly_transactions = self.db.cursor.fetchone()
-
-                if monthly_transactions['transaction_count'] >= current_acc['MonthlyTransactionLimit']:
-                    raise ValueError(
-                        "Monthly transaction limit exceeded for current account")
-
-            # Generate new transaction ID
+        except Exception as e:
+            logging.error(f"Transaction error: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def transfer(self, sender_acc: int, receiver_acc: int, amount: Money,
+                 idempotency_key: str = None) -> dict:
+        """Move money between accounts, or journal the transfer in ingestion mode
+
+        A retry carrying the idempotency_key of a transfer that already went
+        through returns that transfer's outcome, marked duplicate, instead of
+        posting it again.
+        """
+        amount = Money.of(amount)
+        if amount <= 0:
+            raise ValueError("Amount must be positive")
+
+        keys = self.idempotency_keys
+        if idempotency_key is not None:
+            keys.validate(idempotency_key)
+            outcome = keys.recent(idempotency_key, sender_acc, receiver_acc, amount)
+            if outcome:
+                return outcome
+
+        if self.journal:
+            transfer_id = uuid.uuid4().hex
+            if idempotency_key is not None:
+                # Committed directly, or journaled and applied since it left the cache
+                outcome = keys.lookup(self.db, idempotency_key, sender_acc, receiver_acc, amount)
+                if outcome:
+                    return outcome
+                # The applier claims the key, so it is posted at most once
+                outcome = keys.remember_first(idempotency_key, {
+                    'status': 'journaled', 'transfer_id': transfer_id, 'sender_acc': sender_acc,
+                    'receiver_acc': receiver_acc, 'amount': amount},
+                    sender_acc, receiver_acc, amount)
+                if outcome:
+                    return outcome
+            try:
+                # Counted now, so a burst queued ahead of the applier is still limited
+                reservation = self.velocity.reserve(
+                    sender_acc, receiver_acc, amount, key=transfer_id)
+                try:
+                    self.journal.append(sender_acc, receiver_acc, amount, transfer_id,
+                                        idempotency_key)
+                except Exception:
+                    self.velocity.release(reservation)
+                    raise
+            except Exception:
+                if idempotency_key is not None:
+                    keys.forget(idempotency_key)
+                raise
+            logging.info(f"Transaction journaled: Transfer {transfer_id}, From {
+                sender_acc} to {receiver_acc}, Amount ${amount:,.2f}",
+                extra={'operation': 'make_transaction', 'event': 'journaled',
+                       'transfer_id': transfer_id})
+            return {'status': 'journaled', 'transfer_id': transfer_id}
+
+        reservation = None
+        try:
+            self.db.cursor.execute("START TRANSACTION")
+            if idempotency_key is not None:
+                keys.claim(self.db, idempotency_key, sender_acc, receiver_acc, amount)
+            # After the claim, so a retry of a committed transfer is never refused
+            reservation = self.velocity.reserve(sender_acc, receiver_acc, amount)
+            transfer = self.post_transfer(sender_acc, receiver_acc, amount)
+            if idempotency_key is not None:
+                keys.complete(self.db, idempotency_key, transfer['transaction_id'])
+            self.db.connection.commit()
+        except DuplicateKey:
+            self.db.connection.rollback()
+            return keys.stored(self.db, idempotency_key, sender_acc, receiver_acc, amount)
+        except Exception:
+            self.db.connection.rollback()
+            self.velocity.release(reservation)
+            raise
+
+        if idempotency_key is not None:
+            keys.remember(idempotency_key, {
+                'status': 'completed', 'transaction_id': transfer['transaction_id'],
+                'sender_acc': sender_acc, 'receiver_acc': receiver_acc, 'amount': amount})
+        self.notify_transfers([transfer])
+        logging.info(f"Transaction completed: ID {transfer['transaction_id']}, From {
+            sender_acc} to {receiver_acc}, Amount ${amount:,.2f}",
+            extra={'operation': 'make_transaction', 'event': 'completed',
+                   'transaction_id': transfer['transaction_id']})
+        return dict(transfer, status='completed')
+
+    def post_transfer(self, sender_acc: int, receiver_acc: int, amount: Money,
+                      transaction_id: int = None) -> dict:
+        """Validate and write a transfer inside the caller's open transaction
+
+        Raises ValueError when the transfer is not allowed. Committing or
+        rolling back is left to the caller so transfers can be batched.
+        """
+        sender = self.validate_debit(sender_acc, amount)
+
+        # Verify receiver's account
+        receiver = self.find_account(receiver_acc)
+
+        if not receiver:
+            raise ValueError("Receiver account not found")
+
+        if transaction_id is None:
+            transaction_id = self.next_transaction_id()
+
+        # Update balances
+        self.apply_balance_change(sender_acc, -amount)
+        self.credit_account(receiver_acc, amount)
+
+        self.record_transaction(transaction_id, sender_acc, receiver_acc, amount)
+        rollups.record(self.db, transaction_id, amount, sender, receiver)
+
+        return {
+            'transaction_id': transaction_id,
+            'sender_acc': sender_acc,
+            'receiver_acc': receiver_acc,
+            'sender': sender,
+            'receiver': receiver,
+            'sender_balance': sender['Balance'] - amount,
+            'receiver_balance': receiver['Balance'] + amount,
+            'amount': amount
+        }
+
+    def find_account(self, account_number: int) -> dict:
+        """Balance and holder of an account, or None if it does not exist"""
+        if self.directory.loaded:
+            info = self.directory.lookup(account_number, self.db)
+            if info is None:
+                return None
+            # Only the balance changes, so only the balance is read
             self.db.cursor.execute(
-                "SELECT MAX(TransactionID) as max_id FROM Transaction1")
-            result = self.db.cursor.fetchone()
-            transaction_id = (result['max_id'] or 0) + 1
+                "SELECT Balance FROM BankAccount WHERE AccountNumber = %s", (account_number,))
+            row = self.db.cursor.fetchone()
+            return row and {
+                'AccountNumber': account_number,
+                'Balance': Money.of(row['Balance']),
+                'UserNationality': info.nationality,
+                'UserNationalID': info.national_id,
+                'First': info.first,
+                'Last': info.last,
+                'BankID': info.bank_id,
+                'BranchCode': info.branch_code
+            }
 
-            # Update balances
-            self.db.cursor.execute("""
-                UPDATE BankAccount
-                SET Balance = Balance - %s
-                WHERE AccountNumber = %s
-            """, (amount, sender_acc))
+        self.db.cursor.execute("""
+            SELECT ba.AccountNumber, ba.Balance, ba.UserNationality, ba.UserNationalID,
+                p2.First, p2.Last, ba.BankID, ba.BranchCode
+            FROM BankAccount ba
+            JOIN Person2 p2 ON ba.UserNationality = p2.Nationality
+                AND ba.UserNationalID = p2.NationalID
+            WHERE ba.AccountNumber = %s
+        """, (account_number,))
+        account = self.db.cursor.fetchone()
+        if account:
+            account['Balance'] = Money.of(account['Balance'])
+        return account
+
+    def account_rules(self, account_number: int) -> tuple:
+        """(SavingAccount limits, CurrentAccount limits) of an account, None where not that type"""
+        if self.directory.loaded:
+            info = self.directory.lookup(account_number, self.db)
+            if info is None:
+                return None, None
+            if info.kind == 'saving':
+                return {'MonthlyWithdrawalLimit': info.monthly_limit}, None
+            if info.kind == 'current':
+                # A NULL MinBalance means no minimum, as on the query path below
+                return None, {'MinBalance': Money.of(info.min_balance or 0),
+                              'MonthlyTransactionLimit': info.monthly_limit}
+            return None, None
+
+        self.db.cursor.execute("""
+            SELECT MonthlyWithdrawalLimit
+            FROM SavingAccount
+            WHERE AccountNumber = %s
+        """, (account_number,))
+        saving_acc = self.db.cursor.fetchone()
+
+        self.db.cursor.execute("""
+            SELECT MinBalance, MonthlyTransactionLimit
+            FROM CurrentAccount
+            WHERE AccountNumber = %s
+        """, (account_number,))
+        current_acc = self.db.cursor.fetchone()
+        if current_acc:
+            current_acc['MinBalance'] = Money.of(current_acc['MinBalance'] or 0)
+        return saving_acc, current_acc
+
+    def monthly_send_count(self, account_number: int) -> int:
+        self.db.cursor.execute("""
+            SELECT COUNT(*) as transaction_count
+            FROM Transaction1 t1
+            JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+            WHERE t1.SenderAccNum = %s
+            AND MONTH(t2.TransactionDate) = MONTH(CURRENT_DATE())
+            AND YEAR(t2.TransactionDate) = YEAR(CURRENT_DATE())
+        """, (account_number,))
+        return self.db.cursor.fetchone()['transaction_count']
+
+    def validate_debit(self, sender_acc: int, amount: Money) -> dict:
+        """Check the sender can send amount under its account type rules; returns the sender"""
+        # Verify sender's account and check balance
+        sender = self.find_account(sender_acc)
+
+        if not sender:
+            raise ValueError("Sender account not found")
+
+        # Check account type restrictions
+        saving_acc, current_acc = self.account_rules(sender_acc)
+
+        # A hot account's credits may still sit in buckets: when Balance
+        # alone falls short, fold them in so the checks see the exact total
+        required = amount + (current_acc['MinBalance'] if current_acc else 0)
+        if sender['Balance'] < required and self.hot_accounts.buckets(sender_acc):
+            sender['Balance'] += Money.of(self.hot_accounts.fold(self.db, sender_acc))
+
+        if sender['Balance'] < amount:
+            raise ValueError("Insufficient funds")
+
+        # For Savings Account: monthly withdrawal limit
+        if saving_acc:
+            if self.monthly_send_count(sender_acc) >= saving_acc['MonthlyWithdrawalLimit']:
+                raise ValueError(
+                    "Monthly withdrawal limit exceeded for savings account")
+
+        # For Current Account
+        if current_acc:
+            if (sender['Balance'] - amount) < current_acc['MinBalance']:
+                raise ValueError(
+                    "Transaction would breach minimum balance requirement")
+
+            # Check monthly transaction limit
+            if self.monthly_send_count(sender_acc) >= current_acc['MonthlyTransactionLimit']:
+                raise ValueError(
+                    "Monthly transaction limit exceeded for current account")
+
+        return sender
+
+    def next_transaction_id(self) -> int:
+        # Generate new transaction ID, above any archived one
+        self.db.cursor.execute(
+            "SELECT MAX(TransactionID) as max_id FROM Transaction1")
+        result = self.db.cursor.fetchone()
+        return max(result['max_id'] or 0, self.archived_transaction_id()) + 1
+
+    def archived_transaction_id(self) -> int:
+        """Highest transaction ID moved to the archive, or 0"""
+        return self.archive.last_transaction() if self.archive else 0
+
+    def apply_balance_change(self, account_number: int, delta: Money):
+        self.db.cursor.execute("""
+            UPDATE BankAccount
+            SET Balance = Balance + %s
+            WHERE AccountNumber = %s
+        """, (delta, account_number))
+
+    def credit_account(self, account_number: int, amount: Money):
+        """Credit an account, through a random bucket if it is hot"""
+        if not self.hot_accounts.credit(self.db, account_number, amount):
+            self.apply_balance_change(account_number, amount)
+
+    def record_transaction(self, transaction_id: int, sender_acc: int, receiver_acc: int,
+                           amount: Money):
+        # Record transaction
+        self.db.cursor.execute("""
+            INSERT INTO Transaction1 (TransactionID, SenderAccNum, ReceiverAccNum)
+            VALUES (%s, %s, %s)
+        """, (transaction_id, sender_acc, receiver_acc))
+
+        self.db.cursor.execute("""
+            INSERT INTO Transaction2 (TransactionID, TransactionDate, TransactionTime, Amount)
+            VALUES (%s, CURDATE(), CURTIME(), %s)
+        """, (transaction_id, amount))
+
+    def transfer_status(self):
+        """Look up the outcome of a journaled transfer"""
+        try:
+            transfer_id = input("Enter transfer ID: ").strip()
 
-            self.db.cursor.execute("""
-                UPDATE BankAccount 
-                SET Balance = Balance + %s 
-                WHERE AccountNumber = %s
-            """, (amount, receiver_acc))
+            result = self.execute('transfer_status', transfer_id=transfer_id)
 
-            # Record transaction
-            self.db.cursor.execute("""
-                INSERT INTO Transaction1 (TransactionID, SenderAccNum, ReceiverAccNum)
-                VALUES (%s, %s, %s)
-            """, (transaction_id, sender_acc, receiver_acc))
+            if result:
+                print(f"\nStatus: {result['Status']}")
+                if result['TransactionID']:
+                    print(f"Transaction ID: {result['TransactionID']}")
+                if result['Reason']:
+                    print(f"Reason: {result['Reason']}")
+                print(f"Processed At: {result['AppliedAt']}")
+            else:
+                print("\nTransfer is pending or unknown.")
 
-            self.db.cursor.execute("""
-                INSERT INTO Transaction2 (TransactionID, TransactionDate, TransactionTime, Amount)
-                VALUES (%s, CURDATE(), CURTIME(), %s)
-            """, (transaction_id, amount))
+        except Exception as e:
+            logging.error(f"Error checking transfer status: {str(e)}")
+            print(f"\nError: {str(e)}")
 
-            self.db.connection.commit()
-            print("\nTransaction completed successfully!")
-            print(f"Transaction ID: {transaction_id}")
-            print(f"From: {sender['First']} {
-                sender['Last']} (Account: {sender_acc})")
-            print(f"To: {receiver['First']} {
-                receiver['Last']} (Account: {receiver_acc})")
-            print(f"Amount: ${amount:,.2f}")
+    def fetch_transfer_status(self, transfer_id: str) -> dict:
+        self.db.cursor.execute("""
+            SELECT TransactionID, Status, Reason, AppliedAt
+            FROM AppliedTransfers
+            WHERE TransferID = %s
+        """, (transfer_id,))
+        return self.db.cursor.fetchone()
+
+    def view_leaderboards(self):
+        """Show top-K rankings of accounts, senders or earners"""
+        try:
+            board = input(
+                "Leaderboard: (1) Richest Accounts, (2) Largest Senders or (3) Highest Incomes? ").strip()
+            k = int(input("How many entries (K)? ").strip())
+
+            if board == '1':
+                accounts = self.execute('view_leaderboards', board='richest', k=k)
+                print(f"\nTop {k} Accounts by Balance:")
+                for position, account in enumerate(accounts, 1):
+                    print(f"\n#{position} Account {account['AccountNumber']}: {account.get('First')} {
+                          account.get('Middle') or ''} {account.get('Last')}")
+                    print(f"Balance: ${account['Balance']:,.2f}")
+
+            elif board == '2':
+                start_date = input("Enter start date (YYYY-MM-DD): ").strip()
+                end_date = input("Enter end date (YYYY-MM-DD): ").strip()
+                senders = self.execute(
+                    'view_leaderboards', board='senders', k=k,
+                    start_date=start_date, end_date=end_date)
+                print(f"\nTop {k} Senders ({start_date} to {end_date}):")
+                for sender in senders:
+                    print(f"\n#{sender['Position']} {sender['First']} {
+                          sender['Middle'] or ''} {sender['Last']}")
+                    print(f"Transactions: {sender['TransactionCount']}")
+                    print(f"Total Sent: ${sender['TotalSent']:,.2f}")
+
+            else:
+                users = self.execute('view_leaderboards', board='incomes', k=k)
+                print(f"\nTop {k} Users by Annual Income:")
+                for position, user in enumerate(users, 1):
+                    print(f"\n#{position} {user['First']} {
+                          user['Middle'] or ''} {user['Last']}")
+                    print(f"Nationality: {user['Nationality']}")
+                    print(f"Annual Income: ${user['AnnualIncome']:,.2f}")
+
+        except Exception as e:
+            logging.error(f"Error viewing leaderboards: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def fetch_leaderboard(self, board: str, k: int,
+                          start_date: str = None, end_date: str = None) -> list:
+        """Top-K 'richest' accounts, 'senders' in a window, or 'incomes', ties included"""
+        if k <= 0:
+            raise ValueError("K must be positive")
+
+        if board == 'richest':
+            accounts = self.leaderboard.top(k, self.db)
+            holders = self.account_holders([acc for acc, _ in accounts])
+            return [dict(holders.get(account_number, {}),
+                         AccountNumber=account_number, Balance=balance)
+                    for account_number, balance in accounts]
+        if board == 'senders':
+            self.require_live(datetime.date.fromisoformat(start_date),
+                              "senders can only be ranked")
+            return largest_senders(self.db, start_date, end_date, k, self.run_report)
+        if board == 'incomes':
+            return highest_incomes(self.db, k, self.run_report)
+        raise ValueError(f"Unknown leaderboard: {board}")
+
+    def report_status(self):
+        """Look up a report deferred to the off-peak queue"""
+        try:
+            report_id = input("Enter report ID: ").strip()
+
+            report = self.execute('report_status', report_id=report_id)
+
+            print(f"\nReport {report['report_id']} ({report['operation']}): {report['status']}")
+            print(f"Submitted At: {report['submitted']}")
+            if report['status'] == 'failed':
+                print(f"Error: {report['error']}")
+            elif report['status'] == 'done':
+                print(f"Completed At: {report['completed']}")
+                rows = report['result']
+                for row in rows if isinstance(rows, list) else [rows]:
+                    print(", ".join(f"{key}: {value}" for key, value in row.items()))
+
+        except Exception as e:
+            logging.error(f"Error checking report status: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def fetch_report_status(self, report_id: str) -> dict:
+        return self.deferred_reports.status(report_id)
+
+    # Ledger Functions
+    def take_balance_snapshot(self):
+        """Checkpoint today's balance for every account"""
+        try:
+            rows = self.execute('take_balance_snapshot')
+            print(f"\nBalance snapshot taken for {rows} account rows.")
+
+        except Exception as e:
+            logging.error(f"Error taking balance snapshot: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def snapshot_balances(self) -> int:
+        rows = self.ledger.take_snapshot()
+        logging.info(f"Balance snapshot taken: {rows} rows")
+        return rows
+
+    def view_balance_at_date(self):
+        """Show an account's balance as of a past date"""
+        try:
+            account_number = int(input("Enter account number: ").strip())
+            as_of = input("Enter date (YYYY-MM-DD): ").strip()
+
+            balance = self.execute(
+                'view_balance_at_date', account_number=account_number, as_of=as_of)
+
+            if balance is None:
+                print(f"\nAccount {account_number} did not exist on {as_of}.")
+            else:
+                print(f"\nBalance of account {account_number} at end of {as_of}:")
+                print(f"${balance:,.2f}")
+
+        except Exception as e:
+            logging.error(f"Error viewing historical balance: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def fetch_balance_at(self, account_number: int, as_of: str):
+        return self.ledger.balance_at(account_number, as_of)
+
+    def verify_balances(self):
+        """Reconcile every account balance against the ledger"""
+        try:
+            summary = self.execute('verify_balances')
+
+            for mismatch in summary['mismatches']:
+                print(f"\nAccount {mismatch['AccountNumber']}: balance ${
+                      mismatch['Balance']:,.2f}, ledger ${mismatch['Expected']:,.2f}")
+
+            print("\nBalance Verification Summary:")
+            print(f"Accounts Checked: {summary['checked']}")
+            print(f"Mismatches: {summary['mismatched']}")
+            print(f"Without Snapshot (not verifiable): {summary['unverified']}")
+
+        except Exception as e:
+            logging.error(f"Error verifying balances: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def reconcile_balances(self, max_reported: int = 1000) -> dict:
+        """Verify all balances; lists up to max_reported mismatching accounts"""
+        mismatches = []
+
+        def report(account_number, balance, expected):
+            logging.warning(f"Balance mismatch on account {account_number}: {
+                balance} vs ledger {expected}")
+            if len(mismatches) < max_reported:
+                mismatches.append({'AccountNumber': account_number,
+                                   'Balance': balance, 'Expected': expected})
+
+        summary = self.ledger.verify_balances(report)
+        summary['mismatches'] = mismatches
+        return summary
+
+    def generate_statements(self):
+        """Write a month's statement for every account"""
+        try:
+            period = input(
+                "Enter period (YYYY-MM, or press Enter for last month): ").strip() or None
+            directory = input(
+                "Output directory (or press Enter for statements/<period>): ").strip() or None
+            file_format = input("Format (csv or jsonl, default csv): ").strip() or 'csv'
+
+            result = self.execute('generate_statements', period=period, directory=directory,
+                                  file_format=file_format)
+            print(f"\nWrote {result['accounts']} statements with {result['entries']} "
+                  f"entries to {result['directory']}.")
+
+        except Exception as e:
+            logging.error(f"Error generating statements: {str(e)}")
+            print(f"\nError: {str(e)}")
 
-            logging.info(f"Transaction completed: ID {transaction_id}, From {
-                sender_acc} to {receiver_acc}, Amount ${amount:,.2f}")
+    def write_statements(self, period: str = None, directory: str = None,
+                         file_format: str = 'csv', writers: int = statements.WRITERS) -> dict:
+        """Write every account's statement of a month (default last month) to files"""
+        if period is None:
+            period = (datetime.date.today().replace(day=1)
+                      - datetime.timedelta(days=1)).strftime('%Y-%m')
+        start, end = statements.month_bounds(period)
+        self.require_live(start, "statements can only be generated")
+        directory = directory or os.path.join('statements', period)
+        result = statements.generate(self.db, start, end, directory, file_format, writers)
+        logging.info(f"Statements for {period} written to {directory}: "
+                     f"{result['accounts']} accounts, {result['entries']} entries")
+        return dict(result, period=period, directory=directory)
+
+    def run_period_end(self):
+        """Credit interest, debit maintenance charges and pay out matured deposits"""
+        try:
+            period = input(
+                "Enter period (YYYY-MM, or press Enter for this month): ").strip() or None
+
+            summary = self.execute('run_period_end', period=period)
+
+            print(f"\nPeriod-end run for {summary['Period']} complete:")
+            print(f"Interest credited: {summary['InterestCount']} accounts, "
+                  f"${summary['InterestTotal']:,.2f}")
+            print(f"Maintenance charged: {summary['MaintenanceCount']} accounts, "
+                  f"${-summary['MaintenanceTotal']:,.2f}")
+            print(f"Deposits paid out: {summary['MaturityCount']} accounts, "
+                  f"${summary['MaturityTotal']:,.2f}")
 
         except Exception as e:
+            logging.error(f"Error running period end: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def apply_period_end(self, period: str = None) -> dict:
+        """Run (or resume) the period-end job for a month, by default the current one"""
+        # Interest and charges are computed on Balance, so fold buckets in first
+        self.hot_accounts.consolidate(self.db)
+        job = PeriodEndJob(self.db, id_floor=self.archived_transaction_id(),
+                           reserve_ids=self.reserve_transaction_ids,
+                           release_ids=self.release_transaction_ids)
+        summary = job.run(period or time.strftime('%Y-%m'))
+        # Balances moved outside transfer(), so rebuild the cached rankings
+        self.leaderboard.invalidate()
+        self.transfer_graph = None
+        logging.info(f"Period-end run {summary['Period']}: {summary['InterestCount']} interest, "
+                     f"{summary['MaintenanceCount']} charges, {summary['MaturityCount']} payouts")
+        return summary
+
+    def manage_hot_accounts(self):
+        """Flag accounts that receive many concurrent credits, or fold their buckets"""
+        try:
+            action = input(
+                "(1) Flag Hot Account, (2) Unflag Hot Account or (3) Consolidate Now? ").strip()
+
+            if action in ('1', '2'):
+                account_number = int(input("Enter account number: ").strip())
+                buckets = 0
+                if action == '1':
+                    buckets = int(input(
+                        f"Number of balance buckets (default {DEFAULT_BUCKETS}): ").strip()
+                        or DEFAULT_BUCKETS)
+                self.execute('flag_hot_account', account_number=account_number, buckets=buckets)
+                if buckets:
+                    print(f"\nAccount {account_number} now takes credits in {buckets} buckets.")
+                else:
+                    print(f"\nAccount {account_number} is no longer a hot account.")
+            else:
+                result = self.execute('consolidate_balances')
+                print(f"\nFolded ${result['amount']:,.2f} of pending credits "
+                      f"into {result['accounts']} accounts.")
+
+        except Exception as e:
+            logging.error(f"Error managing hot accounts: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def set_hot_account(self, account_number: int, buckets: int = DEFAULT_BUCKETS):
+        """Split an account's credits over buckets rows (0: back to a single balance)"""
+        try:
+            self.db.cursor.execute("START TRANSACTION")
+            self.db.cursor.execute(
+                "SELECT AccountNumber FROM BankAccount WHERE AccountNumber = %s",
+                (account_number,))
+            if not self.db.cursor.fetchone():
+                raise ValueError("Account not found")
+            self.hot_accounts.flag(self.db, account_number, buckets)
+            self.db.connection.commit()
+        except Exception:
             self.db.connection.rollback()
-            logging.error(f"Transaction error: {str(e)}")
+            raise
+        self.hot_accounts.remember(account_number, buckets)
+        logging.info(f"Hot account {account_number}: {buckets} buckets")
+
+    def consolidate_hot_accounts(self) -> dict:
+        return self.hot_accounts.consolidate(self.db)
+
+    def backfill_branch_activity(self):
+        """Rebuild the branch activity rollups of past days from the transactions"""
+        try:
+            start_date = input("Enter start date (YYYY-MM-DD): ").strip()
+            end_date = input("Enter end date (YYYY-MM-DD, blank for yesterday): ").strip()
+
+            result = self.execute('backfill_branch_activity', start_date=start_date,
+                                  end_date=end_date or None)
+            print(f"\nRebuilt {result['days']} days: {result['branch_days']} branch-days "
+                  f"with activity.")
+
+        except Exception as e:
+            logging.error(f"Error backfilling branch activity: {str(e)}")
             print(f"\nError: {str(e)}")
 
+    def backfill_branch_rollups(self, start_date: str, end_date: str = None,
+                                chunk_days: int = rollups.CHUNK_DAYS) -> dict:
+        """Rebuild the daily rollups from start_date to end_date (default yesterday)"""
+        start = datetime.date.fromisoformat(start_date)
+        end = (datetime.date.fromisoformat(end_date) if end_date
+               else datetime.date.today() - datetime.timedelta(days=1))
+        # Rebuilding archived days would replace their rollups with empty ones
+        self.require_live(start, "rollups can only be rebuilt")
+        result = rollups.backfill(self.db, start, end, chunk_days)
+        logging.info(f"Branch rollups rebuilt for {start_date} to {end}: "
+                     f"{result['branch_days']} branch-days")
+        return result
+
+    def archive_transactions(self):
+        """Move old transactions out of the live tables into the archive"""
+        try:
+            before = input(f"Archive transactions before (YYYY-MM-DD, or press Enter for "
+                           f"{ARCHIVE_AFTER_DAYS} days ago): ").strip() or None
+
+            result = self.execute('archive_transactions', before=before)
+            if result['segment']:
+                print(f"\nArchived {result['transactions']} transactions dated before "
+                      f"{result['before']} to {result['segment']} "
+                      f"({result['bytes'] / 2**20:,.1f} MiB).")
+            else:
+                print(f"\nNothing to archive: transactions before {result['before']} "
+                      f"are already archived.")
+
+        except Exception as e:
+            logging.error(f"Error archiving transactions: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def archive_old_transactions(self, before: str = None) -> dict:
+        """Archive the transactions dated before `before` (default ARCHIVE_AFTER_DAYS ago)"""
+        if not self.archive:
+            raise ValueError("Archival is not configured; set TRANSAXION_ARCHIVE_DIR")
+        cutoff = (datetime.date.fromisoformat(before) if before
+                  else archive.horizon(ARCHIVE_AFTER_DAYS))
+        result = self.archive.archive(self.db, cutoff)
+        self.transfer_graph = None
+        logging.info(f"Archived {result['transactions']} transactions before {result['before']}"
+                     f" to {result['segment']}")
+        return result
+
+    def require_live(self, start: datetime.date, what: str):
+        """Refuse a bulk job over dates whose transactions are no longer live"""
+        archived = self.archive.before() if self.archive else None
+        if archived and start < archived:
+            raise ValueError(f"Transactions before {archived} are archived; {what} "
+                             f"from {archived} on")
+
+    def rebuild_households(self):
+        """Recompute the guardian-dependent links from the custodian of every person"""
+        try:
+            result = self.execute('rebuild_households')
+            print(f"\nLinked {result['people']} people: {result['links']} "
+                  f"guardian-dependent pairs.")
+
+        except Exception as e:
+            logging.error(f"Error rebuilding households: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def rebuild_custodian_closure(self) -> dict:
+        """Replace CustodianClosure with the closure of Person1's custodian relation"""
+        people = households.custodians(self.db)
+        self.db.connection.commit()
+        rows = households.closure(people)
+        households.write(self.db, rows)
+        logging.info(f"Custodian closure rebuilt: {len(rows) - len(people)} links")
+        return {'people': len(people), 'links': len(rows) - len(people)}
+
+    # Diagnostics Functions
+    def view_cache_stats(self):
+        """Show result cache effectiveness"""
+        try:
+            stats = self.execute('cache_stats')
+
+            print("\nResult Cache Statistics:")
+            print(f"Entries: {stats['entries']} of {stats['max_entries']}")
+            print(f"Hits: {stats['hits']}")
+            print(f"Misses: {stats['misses']}")
+            print(f"Hit Rate: {stats['hit_rate']:.1%}")
+            print(f"Evictions: {stats['evictions']}")
+            print(f"Invalidated by Writes: {stats['invalidations']}")
+            print(f"Account Directory: {stats['directory_accounts']} accounts, "
+                  f"{stats['directory_bytes'] / 2**20:,.1f} MiB")
+
+        except Exception as e:
+            logging.error(f"Error viewing cache statistics: {str(e)}")
+            print(f"\nError: {str(e)}")
+
+    def recover_cross_shard(self) -> dict:
+        """Commit or roll back cross-shard transactions a crashed session left prepared"""
+        if not self.shards:
+            raise ValueError("Sharding is not enabled; set TRANSAXION_SHARDS")
+        return self.shards.recover()
+
+    def fetch_cache_stats(self) -> dict:
+        directory = self.directory.stats()
+        return dict(self.result_cache.stats(), directory_accounts=directory['accounts'],
+                    directory_bytes=directory['bytes'])
+
+
+def row_count(result):
+    """Rows returned by an operation, for results that are row lists"""
+    return len(result) if isinstance(result, list) else None
+
+
+# Menu sections as (title, [(choice, BankingSystem method, label), ...])
+MENU = [
+    ("Data Entry Operations", [
+        ('1', 'add_location', "Add New Location"),
+        ('2', 'add_bank', "Add New Bank"),
+        ('3', 'add_branch', "Add New Branch"),
+        ('4', 'add_person', "Add New Person"),
+        ('5', 'add_bank_account', "Add New Bank Account"),
+        ('6', 'add_budget', "Add New Budget"),
+        ('7', 'add_savings_goal', "Add New Savings Goal"),
+    ]),
+    ("Retrieval Operations", [
+        ('8', 'view_user_transactions', "View User Transactions"),
+        ('9', 'view_branch_accounts', "View Branch Accounts"),
+        ('10', 'view_high_income_users', "View High Income Users"),
+        ('11', 'view_bank_branch_count', "View Bank Branch Statistics"),
+        ('12', 'calculate_user_transactions', "Calculate User Transaction Total"),
+        ('13', 'find_max_balance', "Find Maximum Account Balance"),
+        ('14', 'get_country_expenditure', "View Country Expenditure Statistics"),
+        ('15', 'search_users', "Search Users by Name"),
+        ('16', 'search_banks', "Search Banks/Branches"),
+        ('31', 'view_customer_profile', "View Customer Profile"),
+        ('34', 'view_household', "View Household"),
+    ]),
+    ("Analysis Operations", [
+        ('17', 'analyze_expenditure_patterns', "Analyze Expenditure Patterns"),
+        ('18', 'analyze_transaction_patterns', "Analyze Transaction Patterns"),
+        ('26', 'view_leaderboards', "View Leaderboards"),
+        ('29', 'analyze_transfer_graph', "Analyze Transfer Network"),
+        ('32', 'view_branch_activity', "View Branch Activity"),
+        ('38', 'report_status', "Check Deferred Report"),
+    ]),
+    ("Modification Operations", [
+        ('19', 'update_budget_limit', "Update Budget Limit"),
+        ('20', 'remove_expired_goals', "Remove Expired Goals"),
+        ('35', 'rebuild_households', "Rebuild Household Links"),
+    ]),
+    ("Transaction Operations", [
+        ('21', 'make_transaction', "Make Transaction"),
+        ('39', 'transfer_status', "Check Transfer Status"),
+    ]),
+    ("Ledger Operations", [
+        ('23', 'take_balance_snapshot', "Take Balance Snapshot"),
+        ('24', 'view_balance_at_date', "View Balance at Date"),
+        ('25', 'verify_balances', "Verify Balances Against Ledger"),
+        ('28', 'run_period_end', "Run Period-End Interest and Charges"),
+        ('36', 'generate_statements', "Generate Account Statements"),
+        ('30', 'manage_hot_accounts', "Manage Hot Accounts"),
+        ('33', 'backfill_branch_activity', "Backfill Branch Activity"),
+        ('37', 'archive_transactions', "Archive Old Transactions"),
+    ]),
+    ("Diagnostics", [
+        ('27', 'view_cache_stats', "View Cache Statistics"),
+    ]),
+]
+
+
+def render_menu() -> str:
+    lines = ["\n=== Main Menu ==="]
+    for title, entries in MENU:
+        lines.append(f"\n{title}:")
+        for choice, _, label in entries:
+            lines.append(f"{choice + '.':<4}{label}")
+    lines.append("\n22. Logout")
+    return "\n".join(lines)
+
 
 def main():
     banking_system = BankingSystem()
@@ -1133,9 +2725,15 @@ def main():
 
 """
 
+    # Map choices to functions once rather than on every pass of the menu
+    operations = {choice: getattr(banking_system, method)
+                  for _, entries in MENU for choice, method, _ in entries}
+    menu = render_menu()
+
     while True:
         try:
-            sp.call('clear' if os.name == 'posix' else 'cls', shell=True)
+            # Clear the screen with an escape sequence instead of a shell
+            print("\033[2J\033[H", end="")
             print(banner)
 
             username = input("Database Username: ").strip()
@@ -1143,78 +2741,34 @@ def main():
 
             if banking_system.db.connect(username, password):
                 print("\nConnected to the database successfully!")
+                banking_system.last_activity = time.time()
 
-                while True:
-                    try:
-                        banking_system.check_session_timeout()
-
-                        print("\n=== Main Menu ===")
+                if SHARDS:
+                    banking_system.enable_sharding(SHARDS)
+                    print(f"Sharding enabled across {len(banking_system.shards.shards)} shards")
 
-                        print("\nData Entry Operations:")
-                        print("1.  Add New Location")
-                        print("2.  Add New Bank")
-                        print("3.  Add New Branch")
-                        print("4.  Add New Person")
-                        print("5.  Add New Bank Account")
-                        print("6.  Add New Budget")
-                        print("7.  Add New Savings Goal")
+                print(f"Account directory loaded: {banking_system.load_directory()} accounts")
+                banking_system.start_consolidation()
+                banking_system.start_deferred_reports()
 
-                        print("\nRetrieval Operations:")
-                        print("8.  View User Transactions")
-                        print("9.  View Branch Accounts")
-                        print("10. View High Income Users")
-                        print("11. View Bank Branch Statistics")
-                        print("12. Calculate User Transaction Total")
-                        print("13. Find Maximum Account Balance")
-                        print("14. View Country Expenditure Statistics")
-                        print("15. Search Users by Name")
-                        print("16. Search Banks/Branches")
+                journal_path = os.environ.get('TRANSAXION_JOURNAL')
+                if journal_path:
+                    banking_system.enable_journal(journal_path)
+                    print(f"High-throughput ingestion enabled (journal: {journal_path})")
 
-                        print("\nAnalysis Operations:")
-                        print("17. Analyze Expenditure Patterns")
-                        print("18. Analyze Transaction Patterns")
-
-                        print("\nModification Operations:")
-                        print("19. Update Budget Limit")
-                        print("20. Remove Expired Goals")
-
-                        print("\nTransaction Operations:")
-                        print("21. Make Transaction")
+                while True:
+                    try:
+                        banking_system.check_session_timeout()
 
-                        print("\n22. Logout")
+                        print(menu)
 
-                        choice = input("\nEnter your choice (1-22): ").strip()
+                        choice = input("\nEnter your choice (1-39): ").strip()
 
                         if choice == '22':
-                            banking_system.db.disconnect()
+                            banking_system.close()
                             print("\nLogged out successfully!")
                             break
 
-                        # Map choices to functions
-                        operations = {
-                            '1': banking_system.add_location,
-                            '2': banking_system.add_bank,
-                            '3': banking_system.add_branch,
-                            '4': banking_system.add_person,
-                            '5': banking_system.add_bank_account,
-                            '6': banking_system.add_budget,
-                            '7': banking_system.add_savings_goal,
-                            '8': banking_system.view_user_transactions,
-                            '9': banking_system.view_branch_accounts,
-                            '10': banking_system.view_high_income_users,
-                            '11': banking_system.view_bank_branch_count,
-                            '12': banking_system.calculate_user_transactions,
-                            '13': banking_system.find_max_balance,
-                            '14': banking_system.get_country_expenditure,
-                            '15': banking_system.search_users,
-                            '16': banking_system.search_banks,
-                            '17': banking_system.analyze_expenditure_patterns,
-                            '18': banking_system.analyze_transaction_patterns,
-                            '19': banking_system.update_budget_limit,
-                            '20': banking_system.remove_expired_goals,
-                            '21': banking_system.make_transaction
-                        }
-
                         if choice in operations:
                             print("\n" + "="*50)
                             operations[choice]()
@@ -1225,6 +2779,8 @@ def main():
 
                     except SecurityException as se:
                         print(f"\nSecurity Error: {str(se)}")
+                        # Stop the background workers before logging in again
+                        banking_system.close()
                         break
                     except Exception as e:
                         logging.error(f"Operation error: {str(e)}")
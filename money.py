@@ -0,0 +1,153 @@
+"""Exact money amounts as integer minor units
+
+Balances and amounts are DECIMAL(15, 2) in the database. On the transfer,
+journal and analytics paths they are carried as Money, a whole number of
+cents, so arithmetic is plain int math (or NumPy int64 in bulk) and never
+goes through float. Conversion happens at the database boundary: Money is
+written through the connection's encoder as an exact decimal literal, and
+DECIMAL values read back are turned into cents with to_cents().
+"""
+from decimal import Decimal, InvalidOperation
+
+# Minor units per major unit, matching the two decimal places of the columns
+SCALE = 100
+PLACES = 2
+
+# Cents that fit an int64 (and so a NumPy int64 array)
+INT64_MAX = 2**63 - 1
+
+
+def to_cents(value) -> int:
+    """Exact cents of a Decimal, str, int or float amount; ValueError if it has sub-cent digits"""
+    if isinstance(value, Money):
+        return value.cents
+    if isinstance(value, int) and not isinstance(value, bool):
+        cents = value * SCALE
+    else:
+        try:
+            # A float goes through its shortest repr, so 0.1 means 0.10
+            amount = Decimal(value if isinstance(value, (Decimal, str)) else repr(value))
+            scaled = amount.scaleb(PLACES)
+            if not scaled.is_finite() or scaled != scaled.to_integral_value():
+                raise ValueError(f"Amount must be a number with at most {PLACES} decimal "
+                                 f"places, not {value}")
+        except InvalidOperation:
+            raise ValueError(f"Invalid amount: {value}") from None
+        cents = int(scaled)
+    if abs(cents) > INT64_MAX:
+        raise ValueError(f"Amount out of range: {value}")
+    return cents
+
+
+def sql_cents(column: str) -> str:
+    """SQL converting a DECIMAL(15, 2) column to exact integer cents"""
+    return f"CAST({column} * {SCALE} AS SIGNED)"
+
+
+class Money:
+    """An amount of money as a whole number of cents
+
+    Money adds, subtracts and compares with Money, and compares exactly with
+    Decimal and int amounts; mixing it with floats in arithmetic is an error.
+    sum() of Money works (it starts from 0). Formatting uses the Decimal
+    value, so f"{amount:,.2f}" prints as before.
+    """
+    __slots__ = ('cents',)
+
+    def __init__(self, cents: int = 0):
+        self.cents = cents
+
+    @classmethod
+    def of(cls, value) -> 'Money':
+        """Money for a Money, Decimal, str, int or float amount"""
+        return value if isinstance(value, Money) else cls(to_cents(value))
+
+    def decimal(self) -> Decimal:
+        return Decimal(self.cents).scaleb(-PLACES)
+
+    def __str__(self) -> str:
+        sign = '-' if self.cents < 0 else ''
+        units, cents = divmod(abs(self.cents), SCALE)
+        return f"{sign}{units}.{cents:0{PLACES}d}"
+
+    def __repr__(self) -> str:
+        return f"Money('{self}')"
+
+    def __format__(self, spec: str) -> str:
+        return format(self.decimal(), spec) if spec else str(self)
+
+    def __bool__(self) -> bool:
+        return self.cents != 0
+
+    def __hash__(self):
+        # Equal Money and Decimal amounts hash alike, as they compare equal
+        return hash(self.decimal())
+
+    def __add__(self, other):
+        if isinstance(other, Money):
+            return Money(self.cents + other.cents)
+        if other == 0 and isinstance(other, int):
+            return self
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Money):
+            return Money(self.cents - other.cents)
+        return NotImplemented
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __abs__(self):
+        return Money(abs(self.cents))
+
+    def __mul__(self, other):
+        if isinstance(other, int) and not isinstance(other, bool):
+            return Money(self.cents * other)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def _compare(self, other):
+        """(self, other) as comparable numbers, or None for unsupported types"""
+        if isinstance(other, Money):
+            return self.cents, other.cents
+        if isinstance(other, (int, Decimal)) and not isinstance(other, bool):
+            return self.decimal(), other
+        return None
+
+    def __eq__(self, other):
+        pair = self._compare(other)
+        return NotImplemented if pair is None else pair[0] == pair[1]
+
+    def __lt__(self, other):
+        pair = self._compare(other)
+        return NotImplemented if pair is None else pair[0] < pair[1]
+
+    def __le__(self, other):
+        pair = self._compare(other)
+        return NotImplemented if pair is None else pair[0] <= pair[1]
+
+    def __gt__(self, other):
+        pair = self._compare(other)
+        return NotImplemented if pair is None else pair[0] > pair[1]
+
+    def __ge__(self, other):
+        pair = self._compare(other)
+        return NotImplemented if pair is None else pair[0] >= pair[1]
+
+
+def escape_money(value: Money, mapping=None) -> str:
+    """pymysql encoder: Money as an exact decimal literal"""
+    return str(value)
+
+
+def encoders() -> dict:
+    """pymysql conversions with Money added, for pymysql.connect(conv=...)"""
+    import pymysql.converters
+
+    conversions = dict(pymysql.converters.conversions)
+    conversions[Money] = escape_money
+    return conversions
@@ -0,0 +1,247 @@
+import logging
+import re
+
+import rollups
+
+# Phases of a run, in order; each walks every account in AccountNumber chunks
+PHASES = ('interest', 'maintenance', 'maturity', 'done')
+
+# Monthly interest on savings accounts, InterestRate being a yearly percentage
+INTEREST = """
+    SELECT %s, ba.AccountNumber, 'interest', ROUND(ba.Balance * sa.InterestRate / 1200, 2), CURDATE()
+    FROM SavingAccount sa
+    JOIN BankAccount ba ON sa.AccountNumber = ba.AccountNumber
+    WHERE sa.AccountNumber BETWEEN %s AND %s
+        AND ROUND(ba.Balance * sa.InterestRate / 1200, 2) > 0
+"""
+
+# Monthly demat maintenance charge, never taking the balance below zero
+MAINTENANCE = """
+    SELECT %s, ba.AccountNumber, 'maintenance',
+           -LEAST(da.MaintenanceCharges, ba.Balance), CURDATE()
+    FROM DematAccount da
+    JOIN BankAccount ba ON da.AccountNumber = ba.AccountNumber
+    WHERE da.AccountNumber BETWEEN %s AND %s
+        AND da.MaintenanceCharges > 0 AND ba.Balance > 0
+"""
+
+
+class PeriodEndJob:
+    """Monthly interest, maintenance charges and fixed deposit maturity payouts
+
+    Works set-based on chunks of `chunk_size` account numbers: each chunk is
+    one transaction that writes its ledger entries with INSERT ... SELECT,
+    applies them to balances with UPDATE ... JOIN and advances the run's
+    checkpoint in PeriodEndRuns. A run interrupted by a crash resumes after
+    its last committed chunk, and a finished period is never applied twice.
+
+    Interest and charges are Postings; a matured deposit's balance is paid
+    out as an ordinary transaction to the holder's lowest-numbered account
+    that is not a fixed deposit (deposits without one are left until it exists).
+    """
+
+    def __init__(self, db, chunk_size: int = 10000, id_floor: int = 0, reserve_ids=None,
+                 release_ids=None):
+        self.db = db
+        self.chunk_size = chunk_size
+        # Payout transaction IDs stay above this, the highest archived one
+        self.id_floor = id_floor
+        # reserve_ids(count) -> ID before a block of count IDs, e.g. from the
+        # shard catalog's sequence; otherwise IDs follow this database's highest.
+        # release_ids(first) is called once the chunk using them has finished
+        self.reserve_ids = reserve_ids
+        self.release_ids = release_ids
+        self._reserved = None
+
+    def run(self, period: str) -> dict:
+        """Apply period ("YYYY-MM") to every account; returns the run's totals"""
+        if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", period):
+            raise ValueError("Period must be given as YYYY-MM")
+
+        run = self._checkpoint(period)
+        phase, next_account = run['Phase'], run['NextAccount']
+        if phase != PHASES[0] or next_account:
+            logging.info(f"Resuming period-end run {period} at {phase}, account {next_account}")
+
+        self.db.cursor.execute("SELECT COALESCE(MAX(AccountNumber), 0) as max_acc FROM BankAccount")
+        last_account = self.db.cursor.fetchone()['max_acc']
+
+        while phase != 'done':
+            while next_account <= last_account:
+                high = next_account + self.chunk_size - 1
+                self._apply_chunk(period, phase, next_account, high)
+                next_account = high + 1
+
+            phase, next_account = PHASES[PHASES.index(phase) + 1], 0
+            self._advance(period, phase)
+
+        self.db.cursor.execute("SELECT * FROM PeriodEndRuns WHERE Period = %s", (period,))
+        summary = self.db.cursor.fetchone()
+        self.db.connection.commit()
+        return summary
+
+    def _checkpoint(self, period: str) -> dict:
+        try:
+            self.db.cursor.execute("""
+                INSERT IGNORE INTO PeriodEndRuns (Period, Phase, NextAccount, StartedAt)
+                VALUES (%s, %s, 0, NOW())
+            """, (period, PHASES[0]))
+            self.db.cursor.execute(
+                "SELECT Phase, NextAccount FROM PeriodEndRuns WHERE Period = %s", (period,))
+            run = self.db.cursor.fetchone()
+            self.db.connection.commit()
+            return run
+        except Exception:
+            self.db.connection.rollback()
+            raise
+
+    def _advance(self, period: str, phase: str):
+        try:
+            self.db.cursor.execute("""
+                UPDATE PeriodEndRuns
+                SET Phase = %s, NextAccount = 0,
+                    FinishedAt = CASE WHEN %s = 'done' THEN NOW() END
+                WHERE Period = %s
+            """, (phase, phase, period))
+            self.db.connection.commit()
+        except Exception:
+            self.db.connection.rollback()
+            raise
+
+    def _apply_chunk(self, period: str, phase: str, low: int, high: int):
+        self._reserved = None
+        try:
+            self.db.cursor.execute("START TRANSACTION")
+            if phase == 'maturity':
+                count, total = self._pay_matured(low, high)
+            else:
+                count, total = self._post(
+                    period, phase, INTEREST if phase == 'interest' else MAINTENANCE, low, high)
+
+            # Checkpoint in the same transaction as the chunk's effects
+            column = phase.capitalize()
+            self.db.cursor.execute(f"""
+                UPDATE PeriodEndRuns
+                SET NextAccount = %s,
+                    {column}Count = {column}Count + %s,
+                    {column}Total = {column}Total + %s
+                WHERE Period = %s
+            """, (high + 1, count, total, period))
+            self.db.connection.commit()
+        except Exception:
+            self.db.connection.rollback()
+            raise
+        finally:
+            if self._reserved is not None and self.release_ids:
+                self.release_ids(self._reserved)
+
+    def _post(self, period: str, kind: str, entries: str, low: int, high: int) -> tuple:
+        """Write the chunk's postings, then apply exactly those postings to balances"""
+        self.db.cursor.execute(f"""
+            INSERT INTO Postings (Period, AccountNumber, Kind, Amount, PostingDate)
+            {entries}
+        """, (period, low, high))
+
+        self.db.cursor.execute("""
+            UPDATE BankAccount ba
+            JOIN Postings p ON p.AccountNumber = ba.AccountNumber
+            SET ba.Balance = ba.Balance + p.Amount
+            WHERE p.Period = %s AND p.Kind = %s AND p.AccountNumber BETWEEN %s AND %s
+        """, (period, kind, low, high))
+
+        self.db.cursor.execute("""
+            SELECT COUNT(*) as entries, COALESCE(SUM(Amount), 0) as total
+            FROM Postings
+            WHERE Period = %s AND Kind = %s AND AccountNumber BETWEEN %s AND %s
+        """, (period, kind, low, high))
+        result = self.db.cursor.fetchone()
+        return result['entries'], result['total']
+
+    def _pay_matured(self, low: int, high: int) -> tuple:
+        """Transfer every matured deposit's balance in the chunk to its holder's payout account"""
+        if self.reserve_ids:
+            # Locks the matured deposits, so no more of them are paid than reserved
+            self.db.cursor.execute("""
+                SELECT COUNT(*) as matured
+                FROM FixedDepositAccount fd
+                JOIN BankAccount ba ON fd.AccountNumber = ba.AccountNumber
+                WHERE fd.AccountNumber BETWEEN %s AND %s
+                    AND fd.MaturityDate <= CURDATE() AND ba.Balance > 0
+                FOR UPDATE
+            """, (low, high))
+            matured = self.db.cursor.fetchone()['matured']
+            if matured == 0:
+                return 0, 0
+            base = self.reserve_ids(matured)
+            self._reserved = base + 1
+        else:
+            # Locks the end of the TransactionID index so the IDs below stay ours
+            self.db.cursor.execute(
+                "SELECT COALESCE(MAX(TransactionID), 0) as max_id FROM Transaction1 FOR UPDATE")
+            base = max(self.db.cursor.fetchone()['max_id'], self.id_floor)
+
+        self.db.cursor.execute("""
+            INSERT INTO Transaction1 (TransactionID, SenderAccNum, ReceiverAccNum)
+            SELECT %s + ROW_NUMBER() OVER (ORDER BY m.AccountNumber), m.AccountNumber, m.PayoutAccount
+            FROM (
+                SELECT fd.AccountNumber, (
+                    SELECT MIN(other.AccountNumber)
+                    FROM BankAccount other
+                    LEFT JOIN FixedDepositAccount ofd ON other.AccountNumber = ofd.AccountNumber
+                    WHERE other.UserNationality = ba.UserNationality
+                        AND other.UserNationalID = ba.UserNationalID
+                        AND ofd.AccountNumber IS NULL
+                ) as PayoutAccount
+                FROM FixedDepositAccount fd
+                JOIN BankAccount ba ON fd.AccountNumber = ba.AccountNumber
+                WHERE fd.AccountNumber BETWEEN %s AND %s
+                    AND fd.MaturityDate <= CURDATE() AND ba.Balance > 0
+            ) m
+            WHERE m.PayoutAccount IS NOT NULL
+        """, (base, low, high))
+        if self.db.cursor.rowcount == 0:
+            return 0, 0
+        # The payouts are exactly the transactions numbered first..last
+        first, last = base + 1, base + self.db.cursor.rowcount
+
+        self.db.cursor.execute("""
+            INSERT INTO Transaction2 (TransactionID, TransactionDate, TransactionTime, Amount)
+            SELECT t1.TransactionID, CURDATE(), CURTIME(), ba.Balance
+            FROM Transaction1 t1
+            JOIN BankAccount ba ON t1.SenderAccNum = ba.AccountNumber
+            WHERE t1.TransactionID BETWEEN %s AND %s
+        """, (first, last))
+
+        self.db.cursor.execute("""
+            UPDATE BankAccount ba
+            JOIN Transaction1 t1 ON t1.SenderAccNum = ba.AccountNumber
+            JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+            SET ba.Balance = ba.Balance - t2.Amount
+            WHERE t1.TransactionID BETWEEN %s AND %s
+        """, (first, last))
+
+        # Payouts are transactions, so they count towards branch activity
+        rollups.add(self.db, rollups.aggregate(
+            self.db, "t1.TransactionID BETWEEN %s AND %s", (first, last)))
+
+        # A holder may receive several payouts, so credit the sum
+        self.db.cursor.execute("""
+            UPDATE BankAccount ba
+            JOIN (
+                SELECT t1.ReceiverAccNum as AccountNumber, SUM(t2.Amount) as Amount
+                FROM Transaction1 t1
+                JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+                WHERE t1.TransactionID BETWEEN %s AND %s
+                GROUP BY t1.ReceiverAccNum
+            ) payouts ON ba.AccountNumber = payouts.AccountNumber
+            SET ba.Balance = ba.Balance + payouts.Amount
+        """, (first, last))
+
+        self.db.cursor.execute("""
+            SELECT COUNT(*) as payouts, COALESCE(SUM(t2.Amount), 0) as total
+            FROM Transaction1 t1
+            JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+            WHERE t1.TransactionID BETWEEN %s AND %s
+        """, (first, last))
+        result = self.db.cursor.fetchone()
+        return result['payouts'], result['total']
@@ -0,0 +1,193 @@
+# Customers per IN list; each chunk costs the same fixed number of queries
+CHUNK_SIZE = 1000
+
+# Subtype columns reported for each account type
+ACCOUNT_DETAILS = {
+    'current': ('MinBalance', 'MonthlyTransactionLimit'),
+    'saving': ('MinBalance', 'InterestRate', 'MonthlyWithdrawalLimit'),
+    'salary': ('OrganisationID', 'EmployeeID'),
+    'demat': ('DPID', 'TradingAccountLink', 'MaintenanceCharges'),
+    'fixeddeposit': ('LockinPeriod', 'MaturityDate', 'PrematurePenalty'),
+}
+
+
+class Account:
+    """One account of a profile; details holds its subtype columns"""
+    __slots__ = ('account_number', 'kind', 'balance', 'bank_id', 'branch_code',
+                 'creation_date', 'nominee', 'details')
+
+    def __init__(self, row: dict):
+        self.account_number = row['AccountNumber']
+        self.kind = row['Kind']
+        # Credits parked in hot-account buckets belong to the balance
+        self.balance = row['Balance']
+        self.bank_id = row['BankID']
+        self.branch_code = row['BranchCode']
+        self.creation_date = row['CreationDate']
+        self.nominee = ((row['NomineeNationality'], row['NomineeNationalID'])
+                        if row['NomineeNationalID'] else None)
+        self.details = tuple(row[column] for column in ACCOUNT_DETAILS.get(self.kind, ()))
+
+    def to_dict(self) -> dict:
+        return {
+            'AccountNumber': self.account_number,
+            'Type': self.kind,
+            'Balance': self.balance,
+            'BankID': self.bank_id,
+            'BranchCode': self.branch_code,
+            'CreationDate': self.creation_date,
+            'Nominee': self.nominee and {'Nationality': self.nominee[0],
+                                         'NationalID': self.nominee[1]},
+            'Details': dict(zip(ACCOUNT_DETAILS.get(self.kind, ()), self.details)),
+        }
+
+
+class CustomerProfile:
+    """Everything held about one customer, assembled from set-based queries"""
+    __slots__ = ('nationality', 'national_id', 'first', 'middle', 'last', 'date_of_birth',
+                 'phone', 'annual_income', 'annual_expenditure', 'custodian',
+                 'emails', 'accounts', 'budgets', 'goals')
+
+    def __init__(self, row: dict):
+        self.nationality = row['Nationality']
+        self.national_id = row['NationalID']
+        self.first = row['First']
+        self.middle = row['Middle']
+        self.last = row['Last']
+        self.date_of_birth = row['DateOfBirth']
+        self.phone = row['Phone']
+        self.annual_income = row['AnnualIncome']
+        self.annual_expenditure = row['AnnualExpenditure']
+        self.custodian = ((row['CustodianNationality'], row['CustodianNationalID'])
+                          if row['CustodianNationalID'] else None)
+        self.emails = []
+        self.accounts = []
+        # (Category, BudgetLimit, CurrentExpend, DurationDate, DurationTime)
+        self.budgets = []
+        # (GoalName, TargetAmount, CurrentSaving, DeadlineDate, DeadlineTime)
+        self.goals = []
+
+    def to_dict(self) -> dict:
+        return {
+            'Nationality': self.nationality,
+            'NationalID': self.national_id,
+            'First': self.first,
+            'Middle': self.middle,
+            'Last': self.last,
+            'DateOfBirth': self.date_of_birth,
+            'Phone': self.phone,
+            'AnnualIncome': self.annual_income,
+            'AnnualExpenditure': self.annual_expenditure,
+            'Custodian': self.custodian and {'Nationality': self.custodian[0],
+                                             'NationalID': self.custodian[1]},
+            'Emails': list(self.emails),
+            'Accounts': [account.to_dict() for account in self.accounts],
+            'Budgets': [dict(zip(('Category', 'BudgetLimit', 'CurrentExpend',
+                                  'DurationDate', 'DurationTime'), budget))
+                        for budget in self.budgets],
+            'Goals': [dict(zip(('GoalName', 'TargetAmount', 'CurrentSaving',
+                                'DeadlineDate', 'DeadlineTime'), goal))
+                      for goal in self.goals],
+        }
+
+
+def load_profiles(db, customers: list, chunk_size: int = CHUNK_SIZE) -> list:
+    """Profiles of the (nationality, national_id) customers that exist, in the order given
+
+    Five queries per chunk of customers whatever their number of emails,
+    accounts, budgets or goals: person, emails, accounts with their subtype,
+    budgets and goals.
+    """
+    customers = list(dict.fromkeys(tuple(customer) for customer in customers))
+    profiles = {}
+    for start in range(0, len(customers), chunk_size):
+        _load_chunk(db, customers[start:start + chunk_size], profiles)
+    return [profiles[key] for key in customers if key in profiles]
+
+
+def _load_chunk(db, keys: list, profiles: dict):
+    pairs = ', '.join(['(%s, %s)'] * len(keys))
+    params = [value for key in keys for value in key]
+
+    db.cursor.execute(f"""
+        SELECT p1.Nationality, p1.NationalID, p2.First, p2.Middle, p2.Last,
+               p1.DateOfBirth, p1.Phone, p1.AnnualIncome, p1.AnnualExpenditure,
+               p1.CustodianNationality, p1.CustodianNationalID
+        FROM Person1 p1
+        LEFT JOIN Person2 p2 ON p1.Nationality = p2.Nationality
+            AND p1.NationalID = p2.NationalID
+        WHERE (p1.Nationality, p1.NationalID) IN ({pairs})
+    """, params)
+    for row in db.cursor.fetchall():
+        profiles[(row['Nationality'], row['NationalID'])] = CustomerProfile(row)
+
+    db.cursor.execute(f"""
+        SELECT Nationality, NationalID, Email
+        FROM Person3
+        WHERE (Nationality, NationalID) IN ({pairs})
+        ORDER BY Email
+    """, params)
+    for row in db.cursor.fetchall():
+        profiles[(row['Nationality'], row['NationalID'])].emails.append(row['Email'])
+
+    db.cursor.execute(f"""
+        SELECT ba.UserNationality, ba.UserNationalID, ba.AccountNumber,
+               ba.Balance + COALESCE((
+                   SELECT SUM(bb.Amount) FROM BalanceBuckets bb
+                   WHERE bb.AccountNumber = ba.AccountNumber
+               ), 0) as Balance,
+               ba.BankID, ba.BranchCode, ba.CreationDate,
+               ba.NomineeNationality, ba.NomineeNationalID,
+               CASE
+                   WHEN ca.AccountNumber IS NOT NULL THEN 'current'
+                   WHEN sa.AccountNumber IS NOT NULL THEN 'saving'
+                   WHEN sal.AccountNumber IS NOT NULL THEN 'salary'
+                   WHEN da.AccountNumber IS NOT NULL THEN 'demat'
+                   WHEN fd.AccountNumber IS NOT NULL THEN 'fixeddeposit'
+               END as Kind,
+               COALESCE(ca.MinBalance, sa.MinBalance) as MinBalance,
+               ca.MonthlyTransactionLimit, sa.InterestRate, sa.MonthlyWithdrawalLimit,
+               sal.OrganisationID, sal.EmployeeID,
+               da.DPID, da.TradingAccountLink, da.MaintenanceCharges,
+               fd.LockinPeriod, fd.MaturityDate, fd.PrematurePenalty
+        FROM BankAccount ba
+        LEFT JOIN CurrentAccount ca ON ba.AccountNumber = ca.AccountNumber
+        LEFT JOIN SavingAccount sa ON ba.AccountNumber = sa.AccountNumber
+        LEFT JOIN SalaryAccount sal ON ba.AccountNumber = sal.AccountNumber
+        LEFT JOIN DematAccount da ON ba.AccountNumber = da.AccountNumber
+        LEFT JOIN FixedDepositAccount fd ON ba.AccountNumber = fd.AccountNumber
+        WHERE (ba.UserNationality, ba.UserNationalID) IN ({pairs})
+        ORDER BY ba.AccountNumber
+    """, params)
+    for row in db.cursor.fetchall():
+        profiles[(row['UserNationality'], row['UserNationalID'])].accounts.append(Account(row))
+
+    db.cursor.execute(f"""
+        SELECT b1.UserNationality, b1.UserNationalID, b1.Category,
+               b1.BudgetLimit, b1.CurrentExpend, b2.DurationDate, b2.DurationTime
+        FROM Budgets1 b1
+        LEFT JOIN Budgets2 b2 ON b1.Category = b2.Category
+            AND b1.UserNationality = b2.UserNationality
+            AND b1.UserNationalID = b2.UserNationalID
+        WHERE (b1.UserNationality, b1.UserNationalID) IN ({pairs})
+        ORDER BY b1.Category
+    """, params)
+    for row in db.cursor.fetchall():
+        profiles[(row['UserNationality'], row['UserNationalID'])].budgets.append((
+            row['Category'], row['BudgetLimit'], row['CurrentExpend'],
+            row['DurationDate'], row['DurationTime']))
+
+    db.cursor.execute(f"""
+        SELECT g1.UserNationality, g1.UserNationalID, g1.GoalName,
+               g1.TargetAmount, g1.CurrentSaving, g2.DeadlineDate, g2.DeadlineTime
+        FROM SavingsGoals1 g1
+        LEFT JOIN SavingsGoals2 g2 ON g1.GoalName = g2.GoalName
+            AND g1.UserNationality = g2.UserNationality
+            AND g1.UserNationalID = g2.UserNationalID
+        WHERE (g1.UserNationality, g1.UserNationalID) IN ({pairs})
+        ORDER BY g1.GoalName
+    """, params)
+    for row in db.cursor.fetchall():
+        profiles[(row['UserNationality'], row['UserNationalID'])].goals.append((
+            row['GoalName'], row['TargetAmount'], row['CurrentSaving'],
+            row['DeadlineDate'], row['DeadlineTime']))
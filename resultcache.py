@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """LRU cache of read results keyed by operation and parameters
+
+    Every entry records the tables its query read. Writers report the tables
+    they modified and exactly the entries depending on them are dropped. Each
+    table also carries a version number, so a result computed while a
+    concurrent writer committed to one of its tables is never stored.
+    Cached results are shared between callers and must not be modified.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._versions = {}
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @staticmethod
+    def key(operation: str, params: dict):
+        """Hashable cache key, or None when a parameter cannot be hashed"""
+        key = (operation, tuple(sorted(params.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        """Return (True, result) on a hit, otherwise (False, None)"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][0]
+            self.misses += 1
+            return False, None
+
+    def versions(self, tables) -> tuple:
+        """Current version of each table; pass to put() after running the query"""
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def put(self, key, result, tables, versions: tuple):
+        """Store a result unless one of its tables changed since `versions`"""
+        with self._lock:
+            if self.max_entries <= 0:
+                return
+            if tuple(self._versions.get(table, 0) for table in tables) != versions:
+                return
+
+            self._entries[key] = (result, tables)
+            self._entries.move_to_end(key)
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                evicted, (_, evicted_tables) = self._entries.popitem(last=False)
+                self._unlink(evicted, evicted_tables)
+                self.evictions += 1
+
+    def _unlink(self, key, tables):
+        for table in tables:
+            dependents = self._by_table.get(table)
+            if dependents is not None:
+                dependents.discard(key)
+                if not dependents:
+                    del self._by_table[table]
+
+    def invalidate(self, tables) -> int:
+        """Drop every result that read one of `tables`; returns how many"""
+        dropped = 0
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                for key in self._by_table.pop(table, ()):
+                    entry = self._entries.pop(key, None)
+                    if entry is not None:
+                        self._unlink(key, entry[1])
+                        dropped += 1
+            self.invalidations += dropped
+        return dropped
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,182 @@
+import datetime
+import random
+from decimal import Decimal
+
+# Rows per (bank, branch, day): concurrent transfers of a branch update one
+# of them at random, so a busy branch does not serialise on a single row
+SLOTS = 8
+
+# Days rebuilt per backfill transaction
+CHUNK_DAYS = 7
+
+# Start of the period a day belongs to; weeks start on Monday
+PERIODS = {
+    'day': "Day",
+    'week': "DATE_SUB(Day, INTERVAL WEEKDAY(Day) DAY)",
+    'month': "DATE_SUB(Day, INTERVAL DAYOFMONTH(Day) - 1 DAY)",
+}
+
+SIDES = ('Sent', 'Received')
+
+# Adds one aggregate to a rollup row; a side with no transfers has NULL min and max
+UPSERT = """
+    INSERT INTO BranchDailyRollups (BankID, BranchCode, Day, Slot,
+        SentCount, SentAmount, SentMin, SentMax,
+        ReceivedCount, ReceivedAmount, ReceivedMin, ReceivedMax)
+    VALUES (%(bank_id)s, %(branch_code)s, {day}, %(slot)s,
+        %(SentCount)s, %(SentAmount)s, %(SentMin)s, %(SentMax)s,
+        %(ReceivedCount)s, %(ReceivedAmount)s, %(ReceivedMin)s, %(ReceivedMax)s) AS new
+    ON DUPLICATE KEY UPDATE
+        SentCount = SentCount + new.SentCount,
+        SentAmount = SentAmount + new.SentAmount,
+        SentMin = COALESCE(LEAST(SentMin, new.SentMin), SentMin, new.SentMin),
+        SentMax = COALESCE(GREATEST(SentMax, new.SentMax), SentMax, new.SentMax),
+        ReceivedCount = ReceivedCount + new.ReceivedCount,
+        ReceivedAmount = ReceivedAmount + new.ReceivedAmount,
+        ReceivedMin = COALESCE(LEAST(ReceivedMin, new.ReceivedMin), ReceivedMin, new.ReceivedMin),
+        ReceivedMax = COALESCE(GREATEST(ReceivedMax, new.ReceivedMax), ReceivedMax, new.ReceivedMax)
+"""
+
+# Per-branch, per-day totals of one side of the transactions matching {where}
+AGGREGATE = """
+    SELECT ba.BankID, ba.BranchCode, t2.TransactionDate as Day, COUNT(*) as Count,
+           SUM(t2.Amount) as Amount, MIN(t2.Amount) as Min, MAX(t2.Amount) as Max
+    FROM Transaction1 t1
+    JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+    JOIN BankAccount ba ON ba.AccountNumber = t1.{account}
+    WHERE {where} AND ba.BankID IS NOT NULL AND ba.BranchCode IS NOT NULL
+    GROUP BY ba.BankID, ba.BranchCode, t2.TransactionDate
+"""
+
+
+def _empty(bank_id: int, branch_code: int, slot: int) -> dict:
+    row = {'bank_id': bank_id, 'branch_code': branch_code, 'slot': slot}
+    for side in SIDES:
+        row.update({f'{side}Count': 0, f'{side}Amount': Decimal('0.00'),
+                    f'{side}Min': None, f'{side}Max': None})
+    return row
+
+
+def record(db, transaction_id: int, amount: Decimal, sender: dict = None, receiver: dict = None):
+    """Add a transfer to its branches' rollups in db's open transaction
+
+    sender and receiver are find_account() results; pass only the side whose
+    account lives on db. Rows are locked in (bank, branch) order so opposite
+    transfers between two branches cannot deadlock on them.
+    """
+    rows = {}
+    for side, account in zip(SIDES, (sender, receiver)):
+        if not account or account.get('BankID') is None or account.get('BranchCode') is None:
+            continue
+        key = (account['BankID'], account['BranchCode'])
+        row = rows.setdefault(key, _empty(*key, random.randrange(SLOTS)))
+        row.update({f'{side}Count': 1, f'{side}Amount': amount,
+                    f'{side}Min': amount, f'{side}Max': amount})
+
+    # The day is the transaction's own date, which CURDATE() might not be at midnight
+    statement = UPSERT.format(
+        day="(SELECT TransactionDate FROM Transaction2 WHERE TransactionID = %(transaction_id)s)")
+    for key in sorted(rows):
+        db.cursor.execute(statement, dict(rows[key], transaction_id=transaction_id))
+
+
+def aggregate(db, where: str, params: tuple) -> dict:
+    """{(BankID, BranchCode, Day): rollup row} of the transactions matching where"""
+    rows = {}
+    for side, account in zip(SIDES, ('SenderAccNum', 'ReceiverAccNum')):
+        db.cursor.execute(AGGREGATE.format(account=account, where=where), params)
+        for result in db.cursor.fetchall():
+            key = (result['BankID'], result['BranchCode'], result['Day'])
+            row = rows.setdefault(key, dict(_empty(key[0], key[1], 0), day=key[2]))
+            row.update({f'{side}Count': result['Count'], f'{side}Amount': result['Amount'],
+                        f'{side}Min': result['Min'], f'{side}Max': result['Max']})
+    return rows
+
+
+def add(db, rows: dict):
+    """Add aggregate() rows to the rollups in db's open transaction"""
+    if rows:
+        db.cursor.executemany(UPSERT.format(day="%(day)s"), [rows[key] for key in sorted(rows)])
+
+
+def backfill(db, start_date: datetime.date, end_date: datetime.date,
+             chunk_days: int = CHUNK_DAYS) -> dict:
+    """Rebuild the rollups of start_date..end_date from Transaction1/2
+
+    Each chunk of days is read without locks and replaced in one short
+    transaction, so re-running a range is safe and transfers are not held
+    up. Only days before today can be rebuilt: today's transfers are still
+    being added to their rows.
+    """
+    if end_date >= datetime.date.today():
+        raise ValueError("Backfill can only rebuild days before today")
+    if start_date > end_date:
+        raise ValueError("Start date must not be after end date")
+    if chunk_days <= 0:
+        raise ValueError("Chunk size must be positive")
+
+    days = rows_written = 0
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days - 1), end_date)
+        rows = aggregate(db, "t2.TransactionDate BETWEEN %s AND %s", (chunk_start, chunk_end))
+        db.cursor.execute("""
+            SELECT BankID, BranchCode, Day, Slot
+            FROM BranchDailyRollups
+            WHERE Day BETWEEN %s AND %s
+        """, (chunk_start, chunk_end))
+        stale = [(row['BankID'], row['BranchCode'], row['Day'], row['Slot'])
+                 for row in db.cursor.fetchall()]
+        db.connection.commit()
+
+        try:
+            db.cursor.execute("START TRANSACTION")
+            # By primary key, so no gap locks reach today's rows
+            db.cursor.executemany("""
+                DELETE FROM BranchDailyRollups
+                WHERE BankID = %s AND BranchCode = %s AND Day = %s AND Slot = %s
+            """, stale)
+            add(db, rows)
+            db.connection.commit()
+        except Exception:
+            db.connection.rollback()
+            raise
+
+        days += (chunk_end - chunk_start).days + 1
+        rows_written += len(rows)
+        chunk_start = chunk_end + datetime.timedelta(days=1)
+    return {'days': days, 'branch_days': rows_written}
+
+
+def series(db, period: str, start_date: str, end_date: str, bank_id: int = None,
+           branch_code: int = None, run=None) -> list:
+    """Per-branch totals of each day, week or month between two dates
+
+    run(query, params), if given, runs the query instead of db's cursor.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Period must be one of: {', '.join(PERIODS)}")
+
+    conditions, params = ["Day BETWEEN %s AND %s"], [start_date, end_date]
+    if bank_id is not None:
+        conditions.append("BankID = %s")
+        params.append(bank_id)
+    if branch_code is not None:
+        conditions.append("BranchCode = %s")
+        params.append(branch_code)
+
+    query = f"""
+        SELECT BankID, BranchCode, {PERIODS[period]} as PeriodStart,
+               SUM(SentCount) as SentCount, SUM(SentAmount) as SentAmount,
+               MIN(SentMin) as SentMin, MAX(SentMax) as SentMax,
+               SUM(ReceivedCount) as ReceivedCount, SUM(ReceivedAmount) as ReceivedAmount,
+               MIN(ReceivedMin) as ReceivedMin, MAX(ReceivedMax) as ReceivedMax
+        FROM BranchDailyRollups
+        WHERE {' AND '.join(conditions)}
+        GROUP BY BankID, BranchCode, PeriodStart
+        ORDER BY BankID, BranchCode, PeriodStart
+    """
+    if run:
+        return run(query, params)
+    db.cursor.execute(query, params)
+    return db.cursor.fetchall()
@@ -0,0 +1,153 @@
+"""Routing of read-only queries to MySQL replicas
+
+Replicas are given as "host[:port],..." and used in round-robin order. Each
+one's lag is read from SHOW REPLICA STATUS (SHOW SLAVE STATUS on servers
+before 8.0.22), at most once per `lag_check_interval`; a replica that is not
+replicating or is more than `max_lag` seconds behind is skipped until a
+later check finds it fresh again.
+
+Failover is per replica: when opening a replica or checking its lag fails,
+or a read on it hits a connection error, it is closed and left alone for
+`retry_after` seconds, then reconnected on the next choice. When no replica
+qualifies, choose() returns None and the caller reads from the primary;
+writes always go to the primary.
+"""
+import logging
+import threading
+import time
+
+# MySQL client errors meaning the server could not be reached or the
+# connection was lost: can't connect, server gone away, lost connection
+CONNECTION_ERRORS = {2003, 2006, 2013, 2055}
+
+
+def parse_replicas(spec: str) -> list:
+    """Parse "host[:port],host[:port]" into [(host, port), ...]"""
+    replicas = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        host, _, port = item.partition(':')
+        replicas.append((host, int(port or 3306)))
+    return replicas
+
+
+def is_connection_error(error: Exception) -> bool:
+    if type(error).__name__ == 'InterfaceError':
+        return True
+    return bool(error.args) and error.args[0] in CONNECTION_ERRORS
+
+
+class Replica:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.connection = None
+        self.cursor = None
+        self.lag = None
+        self.lag_checked_at = 0.0
+        self.down_until = 0.0
+
+    def __repr__(self):
+        return f"{self.host}:{self.port}"
+
+
+class ReplicaRouter:
+    """Chooses a healthy, sufficiently fresh read replica
+
+    Replica lag comes from SHOW REPLICA STATUS and is re-checked at most once
+    per `lag_check_interval`. A replica that is unreachable, not replicating
+    or more than `max_lag` seconds behind is skipped; one whose connection
+    fails is left alone for `retry_after` seconds before being reconnected.
+    """
+
+    def __init__(self, addresses: list, max_lag: float = 5.0,
+                 lag_check_interval: float = 1.0, retry_after: float = 30.0):
+        self.replicas = [Replica(host, port) for host, port in addresses]
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._next = 0
+
+    @property
+    def addresses(self) -> list:
+        return [(replica.host, replica.port) for replica in self.replicas]
+
+    def connect(self, open_connection):
+        """Open every replica with open_connection(host, port); failures are retried later"""
+        for replica in self.replicas:
+            self._open(replica, open_connection)
+
+    def _open(self, replica: Replica, open_connection) -> bool:
+        try:
+            replica.connection = open_connection(replica.host, replica.port)
+            replica.cursor = replica.connection.cursor()
+            replica.lag_checked_at = 0.0
+            return True
+        except Exception as e:
+            logging.warning(f"Replica {replica} unavailable: {str(e)}")
+            self.mark_down(replica)
+            return False
+
+    def mark_down(self, replica: Replica):
+        replica.down_until = time.time() + self.retry_after
+        replica.lag = None
+        if replica.connection:
+            try:
+                replica.connection.close()
+            except Exception:
+                pass
+        replica.connection = replica.cursor = None
+
+    def _current_lag(self, replica: Replica):
+        now = time.time()
+        if now - replica.lag_checked_at < self.lag_check_interval:
+            return replica.lag
+
+        try:
+            try:
+                replica.cursor.execute("SHOW REPLICA STATUS")
+            except Exception as e:
+                if is_connection_error(e):
+                    raise
+                # Servers before 8.0.22 only know the old spelling
+                replica.cursor.execute("SHOW SLAVE STATUS")
+            status = replica.cursor.fetchone()
+        except Exception as e:
+            logging.warning(f"Replica {replica} lag check failed: {str(e)}")
+            self.mark_down(replica)
+            return None
+
+        if not status:
+            lag = None
+        else:
+            lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        if lag is None:
+            logging.warning(f"Replica {replica} is not replicating")
+
+        replica.lag = lag
+        replica.lag_checked_at = now
+        return lag
+
+    def choose(self, open_connection):
+        """Return a usable replica in round-robin order, or None to use the primary"""
+        with self._lock:
+            count = len(self.replicas)
+            for i in range(count):
+                replica = self.replicas[(self._next + i) % count]
+                if replica.connection is None:
+                    if time.time() < replica.down_until:
+                        continue
+                    if not self._open(replica, open_connection):
+                        continue
+
+                lag = self._current_lag(replica)
+                if lag is not None and lag <= self.max_lag:
+                    self._next = (self._next + i + 1) % count
+                    return replica
+            return None
+
+    def close(self):
+        for replica in self.replicas:
+            if replica.connection:
+                replica.connection.close()
+            replica.connection = replica.cursor = None
@@ -0,0 +1,225 @@
+"""Network front-end: line-delimited JSON over TCP for many concurrent clients
+
+A client sends one request per line, {"command": ..., "params": {...}} with
+an optional "id" echoed back, and receives one line holding the same
+envelope the command line prints. Client connections are served by a single
+asyncio loop; database work runs on a fixed pool of workers, each owning its
+own BankingSystem connection. Requests wait in a bounded queue: when it is
+full a request is refused at once rather than piling up, and a request not
+answered within the timeout gets a timeout error.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cli import run_operation, to_json
+
+# Kinds of operations served over the network: retrieval, analysis and transfers
+SERVED_KINDS = ('read', 'analysis', 'transfer')
+
+# Idle seconds after which a worker checks its connection before using it
+PING_AFTER = 30.0
+
+
+def error(message: str, kind: str) -> dict:
+    return {'ok': False, 'error': message, 'type': kind}
+
+
+class Session:
+    """One connected client"""
+
+    def __init__(self, session_id: int, peer):
+        self.session_id = session_id
+        self.peer = peer
+        self.connected_at = self.last_activity = time.time()
+        self.requests = 0
+
+
+class BankingServer:
+    """Serves `commands` to TCP clients using `workers` BankingSystem connections
+
+    `connect` opens one BankingSystem; it is called once per worker.
+    """
+
+    def __init__(self, connect, commands, workers: int = 8, queue_size: int = 1000,
+                 request_timeout: float = 30.0, idle_timeout: float = 300.0):
+        self.connect = connect
+        self.commands = set(commands)
+        self.workers = workers
+        self.queue_size = queue_size
+        self.request_timeout = request_timeout
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.served = self.refused = self.timed_out = 0
+        self._ids = itertools.count(1)
+        self._systems = []
+        self._executor = None
+        self._queue = None
+        self._tasks = []
+        self._server = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765):
+        loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        try:
+            for _ in range(self.workers):
+                self._systems.append(
+                    await loop.run_in_executor(self._executor, self.connect))
+            # One account directory serves every worker
+            await loop.run_in_executor(self._executor, self._systems[0].load_directory)
+            # ...and one consolidator folds hot-account buckets for all of them
+            await loop.run_in_executor(self._executor, self._systems[0].start_consolidation)
+            # The first worker's session also runs reports deferred to off-peak hours
+            await loop.run_in_executor(self._executor, self._systems[0].start_deferred_reports)
+            for system in self._systems[1:]:
+                system.share_directory(self._systems[0])
+        except Exception:
+            self._close_systems()
+            raise
+
+        self._tasks = [asyncio.create_task(self._worker(system)) for system in self._systems]
+        self._server = await asyncio.start_server(
+            self._handle_client, host, port, backlog=4096)
+        logging.info(f"Server listening on {host}:{port} with {self.workers} workers")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self._close_systems()
+
+    def _close_systems(self):
+        for system in self._systems:
+            try:
+                system.close()
+            except Exception as e:
+                logging.error(f"Error closing worker connection: {str(e)}")
+        self._systems = []
+
+    async def _worker(self, banking_system):
+        loop = asyncio.get_running_loop()
+        last_used = time.time()
+        while True:
+            future, command, params = await self._queue.get()
+            # The client stopped waiting while the request was queued
+            if future.done():
+                continue
+            try:
+                if time.time() - last_used > PING_AFTER:
+                    # Reopen the connection if the server dropped it while idle
+                    await loop.run_in_executor(
+                        self._executor, banking_system.db.connection.ping, True)
+                response = await loop.run_in_executor(
+                    self._executor, run_operation, banking_system, command, params)
+            except Exception as e:
+                logging.error(f"Server worker error: {str(e)}")
+                response = error(str(e), type(e).__name__)
+            last_used = time.time()
+            if not future.done():
+                future.set_result(response)
+
+    async def _submit(self, command: str, params: dict) -> dict:
+        if command == 'server_status':
+            return {'ok': True, 'result': self.status()}
+        if command not in self.commands:
+            return error(f"Command not available over the network: {command}", 'ValueError')
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((future, command, params))
+        except asyncio.QueueFull:
+            self.refused += 1
+            return error("Server busy, retry later", 'Overloaded')
+
+        try:
+            response = await asyncio.wait_for(future, self.request_timeout)
+        except asyncio.TimeoutError:
+            # A transfer may still complete; the client can check its history
+            self.timed_out += 1
+            return error(f"No response within {self.request_timeout:g} seconds", 'Timeout')
+        self.served += 1
+        return response
+
+    async def _handle_client(self, reader, writer):
+        session = Session(next(self._ids), writer.get_extra_info('peername'))
+        self.sessions[session.session_id] = session
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    writer.write(self._encode(error("Session timed out", 'SecurityException')))
+                    break
+                if not line:
+                    break
+
+                session.last_activity = time.time()
+                session.requests += 1
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict) or not isinstance(request.get('params', {}), dict):
+                        raise ValueError("Expected {\"command\": ..., \"params\": {...}}")
+                    response = await self._submit(
+                        str(request.get('command')), request.get('params', {}))
+                    if 'id' in request:
+                        response = dict(response, id=request['id'])
+                except ValueError as e:
+                    response = error(str(e), 'ValueError')
+
+                # Waiting for the client to read its reply is per-client backpressure
+                writer.write(self._encode(response))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            # ValueError: a request line longer than the stream limit
+            logging.warning(f"Client {session.peer} dropped: {str(e)}")
+        finally:
+            del self.sessions[session.session_id]
+            writer.close()
+
+    @staticmethod
+    def _encode(response: dict) -> bytes:
+        return to_json(response).encode('utf-8') + b'\n'
+
+    def status(self) -> dict:
+        return {
+            'sessions': len(self.sessions),
+            'workers': self.workers,
+            'queued': self._queue.qsize() if self._queue else 0,
+            'queue_size': self.queue_size,
+            'served': self.served,
+            'refused': self.refused,
+            'timed_out': self.timed_out,
+        }
+
+
+def serve(host: str = '127.0.0.1', port: int = 8765, workers: int = 8,
+          queue_size: int = 1000, timeout: float = 30.0):
+    """Run the server until interrupted, with credentials from the environment"""
+    from cli import connect
+    from main import OPERATIONS
+
+    commands = [command for command, (_, kind, _) in OPERATIONS.items()
+                if kind in SERVED_KINDS]
+    server = BankingServer(connect, commands, workers=int(workers),
+                           queue_size=int(queue_size), request_timeout=float(timeout))
+
+    async def run():
+        await server.start(host, int(port))
+        print(f"Serving on {host}:{port} with {workers} database connections")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,885 @@
+import logging
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import households
+import rollups
+from idempotency import DuplicateKey
+from money import Money
+
+# Prefix of the XA transaction IDs used for cross-shard writes, so recovery
+# leaves prepared transactions of other applications alone
+XID_PREFIX = 'transaxion-'
+
+# Seconds a prepared transaction must stay without a commit decision before
+# recovery rolls it back; a live coordinator logs its decision well within it
+RECOVERY_GRACE = 60.0
+
+# Operations on one customer, routed by the parameters naming the customer
+CUSTOMER_KEYS = {
+    'view_user_transactions': ('nationality', 'national_id'),
+    'calculate_user_transactions': ('nationality', 'national_id'),
+    'update_budget_limit': ('nationality', 'national_id'),
+    'add_budget': ('user_nationality', 'user_national_id'),
+    'add_savings_goal': ('user_nationality', 'user_national_id'),
+}
+
+# Operations on one account, routed through the shard map
+ACCOUNT_KEYS = {
+    'view_balance_at_date': 'account_number',
+    'flag_hot_account': 'account_number',
+}
+
+# Banks, branches and locations are small reference tables copied to every
+# shard, so reads of them are answered by a single shard
+REFERENCE_READS = {'view_bank_branch_count', 'search_banks'}
+
+
+def parse_shards(spec: str) -> list:
+    """Parse "host[:port][/database],..." into [(host, port, database), ...]"""
+    shards = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        address, _, database = item.partition('/')
+        host, _, port = address.partition(':')
+        shards.append((host, int(port or 3306), database or 'BankingSystem'))
+    return shards
+
+
+def shard_for_customer(nationality: str, national_id: str, count: int) -> int:
+    """Home shard of a customer: a stable hash of the customer key"""
+    return zlib.crc32(f"{nationality}\x00{national_id}".encode('utf-8')) % count
+
+
+def top_with_ties(rows: list, field: str, k: int) -> list:
+    """The k rows with the largest `field`, plus any tied with the k-th"""
+    rows = sorted(rows, key=lambda row: row[field], reverse=True)
+    if len(rows) <= k:
+        return rows
+    cutoff = rows[k - 1][field]
+    return [row for row in rows if row[field] >= cutoff]
+
+
+def merge_averages(partials: list, group: str, total: str, average: str) -> dict:
+    """Combine per-shard (SUM, COUNT) groups into global rows with exact averages"""
+    merged = {}
+    for row in partials:
+        entry = merged.get(row[group])
+        if entry is None:
+            merged[row[group]] = dict(row)
+        else:
+            entry['UserCount'] += row['UserCount']
+            entry[total] += row[total]
+    for entry in merged.values():
+        entry[average] = entry[total] / entry['UserCount']
+    return merged
+
+
+class ShardedBank:
+    """Customers and their accounts spread over several BankingSystem shards
+
+    A customer lives on the shard chosen by hashing (Nationality, NationalID)
+    and every account on its holder's shard. The AccountShards table on the
+    catalog connection maps account numbers to shards; entries never change,
+    so lookups are cached for the life of the process. Global identifiers
+    (account numbers, transaction IDs, bank IDs and branch codes) come from
+    catalog sequences so they stay unique across shards.
+
+    Cross-shard transfers and reference data writes commit with two-phase
+    commit over MySQL XA: every shard prepares its branch, the commit
+    decision is logged on the catalog, then every branch commits.
+    """
+
+    def __init__(self, shards: list, catalog, operations: dict):
+        self.shards = shards
+        self.catalog = catalog
+        self.operations = operations
+        self.transfer_listeners = []
+        # The front session's IdempotencyKeys; keys are stored on the sender's shard
+        self.idempotency_keys = None
+        self.velocity = None
+        self.deferred_reports = None
+        self._catalog_lock = threading.Lock()
+        self._account_shards = {}
+        self._pool = ThreadPoolExecutor(max_workers=len(shards))
+
+        self._handlers = {
+            'add_person': self.add_person,
+            'add_bank_account': self.add_bank_account,
+            'add_location': self.add_location,
+            'add_bank': self.add_bank,
+            'add_branch': self.add_branch,
+            'make_transaction': self.transfer,
+            'view_guardians': self.guardians,
+            'rebuild_households': self.rebuild_households,
+            'recover_shards': self.recover,
+            # Deferred reports are queued by the front session
+            'report_status': lambda report_id: self.deferred_reports.status(report_id),
+        }
+        self._merges = {
+            'get_country_expenditure': self._merge_country_expenditure,
+            'analyze_expenditure_patterns': self._merge_expenditure_patterns,
+            'view_high_income_users': lambda results, params: sorted(
+                self._concat(results), key=lambda row: row['AnnualIncome'], reverse=True),
+            'search_users': lambda results, params: self._concat(results),
+            'view_customer_profiles': self._merge_profiles,
+            'view_dependents': lambda results, params: sorted(
+                self._concat(results),
+                key=lambda row: (row['Depth'], row['Nationality'], row['NationalID'])),
+            'view_household_balance': lambda results, params: {
+                key: sum(result[key] for result in results)
+                for key in ('Members', 'Accounts', 'Balance')},
+            'view_branch_accounts': self._merge_branch_accounts,
+            'analyze_transaction_patterns': lambda results, params: sorted(
+                self._concat(results), key=lambda row: row['TransactionCount'], reverse=True),
+            'find_max_balance': lambda results, params: top_with_ties(
+                self._concat(results), 'Balance', 1),
+            'view_leaderboards': self._merge_leaderboards,
+            'take_balance_snapshot': lambda results, params: sum(results),
+            'verify_balances': self._merge_verification,
+            'generate_statements': lambda results, params: dict(
+                results[0], accounts=sum(result['accounts'] for result in results),
+                entries=sum(result['entries'] for result in results)),
+            'remove_expired_goals': lambda results, params: self._concat(results),
+            'transfer_status': lambda results, params: next(
+                (result for result in results if result), None),
+            'cache_stats': self._merge_cache_stats,
+            'run_period_end': self._merge_period_end,
+            'view_branch_activity': self._merge_branch_activity,
+            'backfill_branch_activity': lambda results, params: {
+                'days': results[0]['days'],
+                'branch_days': sum(result['branch_days'] for result in results)},
+            'archive_transactions': lambda results, params: {
+                'before': max(result['before'] for result in results),
+                'transactions': sum(result['transactions'] for result in results),
+                'segment': ', '.join(result['segment'] for result in results
+                                     if result['segment']) or None,
+                'bytes': sum(result['bytes'] for result in results)},
+            'consolidate_balances': lambda results, params: {
+                'accounts': sum(result['accounts'] for result in results),
+                'amount': sum(result['amount'] for result in results)},
+        }
+
+    def execute(self, operation: str, **params):
+        """Run an operation on the shards it touches and merge their results"""
+        if operation in self._handlers:
+            return self._handlers[operation](**params)
+
+        if operation in CUSTOMER_KEYS:
+            nationality, national_id = (params.get(key) for key in CUSTOMER_KEYS[operation])
+            return self.home_shard(nationality, national_id).execute(operation, **params)
+
+        if operation in ACCOUNT_KEYS:
+            shard = self.account_shard(params.get(ACCOUNT_KEYS[operation]))
+            if shard is None:
+                raise ValueError("Account not found")
+            return self.shards[shard].execute(operation, **params)
+
+        if operation in REFERENCE_READS:
+            return self.shards[0].execute(operation, **params)
+
+        if operation in self._merges:
+            results = self.scatter(lambda shard: shard.execute(operation, **params))
+            return self._merges[operation](results, params)
+
+        raise ValueError(f"Operation not supported with sharding: {operation}")
+
+    def scatter(self, call) -> list:
+        """Run call(shard) on every shard in parallel; results are in shard order"""
+        return list(self._pool.map(call, self.shards))
+
+    def home_shard(self, nationality: str, national_id: str):
+        return self.shards[shard_for_customer(nationality, national_id, len(self.shards))]
+
+    @staticmethod
+    def _query(shard, query: str, params: tuple = ()) -> list:
+        shard.db.cursor.execute(query, params)
+        rows = shard.db.cursor.fetchall()
+        # End the read snapshot so the next query sees other sessions' commits
+        shard.db.connection.commit()
+        return rows
+
+    def _catalog_query(self, query: str, params: tuple = ()) -> list:
+        with self._catalog_lock:
+            try:
+                self.catalog.cursor.execute(query, params)
+                rows = self.catalog.cursor.fetchall()
+                self.catalog.connection.commit()
+                return rows
+            except Exception:
+                self.catalog.connection.rollback()
+                raise
+
+    def _require(self, shard, query: str, params: tuple, message: str):
+        if not self._query(shard, query, params):
+            raise ValueError(message)
+
+    def _highest(self, query: str, params: tuple = ()) -> int:
+        """Largest value `query` (selecting `value`) returns on any shard, or 0"""
+        results = self.scatter(lambda shard: self._query(shard, query, params))
+        return max((rows[0]['value'] or 0 for rows in results if rows), default=0)
+
+    def next_value(self, name: str, seed, count: int = 1, reserve: bool = False) -> int:
+        """Allocate the next number (or the next count numbers) of a catalog sequence
+
+        The sequence is created on first use, starting after seed(), the
+        largest number already in use on the shards. With reserve, the
+        numbers are also recorded in ShardReservations in the same commit.
+        Returns the last number allocated.
+        """
+        advance = """
+            UPDATE ShardSequences SET LastValue = LAST_INSERT_ID(LastValue + %s)
+            WHERE Name = %s
+        """
+        with self._catalog_lock:
+            cursor = self.catalog.cursor
+            try:
+                cursor.execute(advance, (count, name))
+                if cursor.rowcount == 0:
+                    cursor.execute("""
+                        INSERT IGNORE INTO ShardSequences (Name, LastValue) VALUES (%s, %s)
+                    """, (name, seed()))
+                    cursor.execute(advance, (count, name))
+                cursor.execute("SELECT LAST_INSERT_ID() as value")
+                value = cursor.fetchone()['value']
+                if reserve:
+                    cursor.execute("""
+                        INSERT INTO ShardReservations (FirstID, ReservedAt) VALUES (%s, NOW())
+                    """, (value - count + 1,))
+                self.catalog.connection.commit()
+                return value
+            except Exception:
+                self.catalog.connection.rollback()
+                raise
+
+    def _highest_transaction_id(self) -> int:
+        return max(self._highest("SELECT MAX(TransactionID) as value FROM Transaction1"),
+                   *(shard.archived_transaction_id() for shard in self.shards))
+
+    def reserve_transaction_ids(self, count: int) -> int:
+        """Allocate count transaction IDs; returns the number before the first
+
+        The IDs count as unfinished, holding back settled_transaction_id(),
+        until release_transaction_ids() is called with the first of them once
+        their transaction has committed or rolled back.
+        """
+        return self.next_value(
+            'TransactionID', self._highest_transaction_id, count, reserve=True) - count
+
+    def release_transaction_ids(self, first: int):
+        try:
+            self._catalog_query("DELETE FROM ShardReservations WHERE FirstID = %s", (first,))
+        except Exception as e:
+            # Only holds snapshot watermarks back until recover() drops it
+            logging.error(f"Could not release transaction IDs from {first}: {str(e)}")
+
+    def settled_transaction_id(self):
+        """Highest transaction ID at or below which every transfer has finished
+
+        Transaction IDs are allocated before their transfer runs, so a shard
+        can commit a transfer while one with a lower ID is still running. A
+        shard snapshot opened after this is read sees every committed
+        transfer up to it. None until the catalog has handed out an ID.
+        """
+        rows = self._catalog_query("""
+            SELECT s.LastValue, (SELECT MIN(FirstID) FROM ShardReservations) as Unfinished
+            FROM ShardSequences s
+            WHERE s.Name = 'TransactionID'
+        """)
+        if not rows:
+            return None
+        if rows[0]['Unfinished'] is None:
+            return rows[0]['LastValue']
+        return min(rows[0]['LastValue'], rows[0]['Unfinished'] - 1)
+
+    def account_shard(self, account_number: int):
+        """Index of the shard holding an account, or None if it does not exist"""
+        shard = self._account_shards.get(account_number)
+        if shard is not None:
+            return shard
+
+        rows = self._catalog_query(
+            "SELECT ShardID FROM AccountShards WHERE AccountNumber = %s", (account_number,))
+        if rows:
+            shard = rows[0]['ShardID']
+        else:
+            # Accounts created before sharding was enabled are mapped on first use
+            results = self.scatter(lambda system: self._query(system, """
+                SELECT UserNationality, UserNationalID FROM BankAccount
+                WHERE AccountNumber = %s
+            """, (account_number,)))
+            found = [(index, rows[0]) for index, rows in enumerate(results) if rows]
+            if not found:
+                return None
+            shard, holder = found[0]
+            self._catalog_query("""
+                INSERT IGNORE INTO AccountShards (AccountNumber, ShardID, Nationality, NationalID)
+                VALUES (%s, %s, %s, %s)
+            """, (account_number, shard, holder['UserNationality'], holder['UserNationalID']))
+
+        self._account_shards[account_number] = shard
+        return shard
+
+    @contextmanager
+    def _foreign_keys_off(self, shard):
+        """Allow rows referencing customers that live on other shards"""
+        shard.db.cursor.execute("SET SESSION FOREIGN_KEY_CHECKS = 0")
+        try:
+            yield
+        finally:
+            shard.db.cursor.execute("SET SESSION FOREIGN_KEY_CHECKS = 1")
+
+    # Two-phase commit
+    def two_phase(self, xid: str, branches: list, reservation: int = None) -> list:
+        """Run each (shard, work) as a branch of XA transaction xid and commit all or none
+
+        work(shard) runs inside its branch with foreign key checks off, since
+        rows may reference customers placed on other shards. Returns the
+        results of the work functions. The transaction IDs reserved from
+        reservation on are released once every branch has committed or
+        rolled back; a branch left for recover() keeps them reserved.
+        """
+        touched = []
+        finished = True
+        try:
+            results = self._prepare(xid, branches, touched)
+            finished = self._commit_prepared(xid, touched)
+            return results
+        finally:
+            for shard in touched:
+                try:
+                    shard.db.cursor.execute("SET SESSION FOREIGN_KEY_CHECKS = 1")
+                except Exception as e:
+                    logging.error(f"Could not restore foreign key checks: {str(e)}")
+            if reservation is not None and finished:
+                self.release_transaction_ids(reservation)
+
+    def _prepare(self, xid: str, branches: list, touched: list) -> list:
+        states, results = [], []
+        try:
+            for shard, work in branches:
+                cursor = shard.db.cursor
+                # XA START needs the session outside any implicit transaction
+                shard.db.connection.commit()
+                cursor.execute("SET SESSION FOREIGN_KEY_CHECKS = 0")
+                touched.append(shard)
+                cursor.execute("XA START %s", (xid,))
+                branch = [shard, 'active']
+                states.append(branch)
+                results.append(work(shard))
+                cursor.execute("XA END %s", (xid,))
+                branch[1] = 'idle'
+                cursor.execute("XA PREPARE %s", (xid,))
+                branch[1] = 'prepared'
+
+            # The commit point: once this row is durable the transaction commits
+            self._catalog_query("""
+                INSERT INTO ShardDecisions (GlobalID, Decision, DecidedAt)
+                VALUES (%s, 'commit', NOW())
+            """, (xid,))
+            return results
+
+        except Exception:
+            for shard, state in states:
+                try:
+                    if state == 'active':
+                        shard.db.cursor.execute("XA END %s", (xid,))
+                    shard.db.cursor.execute("XA ROLLBACK %s", (xid,))
+                except Exception as e:
+                    logging.error(f"Could not roll back {xid} on a shard: {str(e)}")
+            raise
+
+    def _commit_prepared(self, xid: str, shards: list) -> bool:
+        committed = True
+        for shard in shards:
+            try:
+                shard.db.cursor.execute("XA COMMIT %s", (xid,))
+            except Exception as e:
+                # The decision is logged, so recover() finishes this branch
+                logging.error(f"XA COMMIT of {xid} failed, left for recovery: {str(e)}")
+                committed = False
+        if committed:
+            self._catalog_query("DELETE FROM ShardDecisions WHERE GlobalID = %s", (xid,))
+        return committed
+
+    def _prepared(self) -> list:
+        """Sets of this application's XA transaction IDs prepared on each shard"""
+        prepared = []
+        for shard in self.shards:
+            shard.db.connection.commit()
+            shard.db.cursor.execute("XA RECOVER")
+            xids = set()
+            for row in shard.db.cursor.fetchall():
+                xid = row['data']
+                xid = xid.decode('utf-8') if isinstance(xid, bytes) else xid
+                if xid.startswith(XID_PREFIX):
+                    xids.add(xid)
+            prepared.append(xids)
+        return prepared
+
+    def recover(self, grace: float = RECOVERY_GRACE) -> dict:
+        """Finish cross-shard transactions left prepared by a crashed coordinator
+
+        Branches whose commit decision was logged are committed. A branch
+        without one is rolled back only if it was already prepared `grace`
+        seconds earlier, so transactions other sessions are still preparing
+        are left alone. Transaction IDs reserved more than `grace` seconds
+        ago by a crashed session are released, except those of transfers
+        still prepared. Run explicitly (recover_shards) after a crash.
+        """
+        pending = self._prepared()
+        if any(pending):
+            time.sleep(grace)
+
+        # Decisions are read before the branches: a branch of a logged
+        # decision is then either still prepared, or already committed
+        decisions = {row['GlobalID'] for row in self._catalog_query(
+            "SELECT GlobalID FROM ShardDecisions")}
+        outcome = {'committed': 0, 'rolled_back': 0, 'in_flight': 0}
+
+        unfinished = set()
+        still_prepared = set()
+        for shard, stale, prepared in zip(self.shards, pending, self._prepared()):
+            for xid in prepared:
+                try:
+                    if xid in decisions:
+                        shard.db.cursor.execute("XA COMMIT %s", (xid,))
+                        outcome['committed'] += 1
+                    elif xid in stale:
+                        shard.db.cursor.execute("XA ROLLBACK %s", (xid,))
+                        outcome['rolled_back'] += 1
+                    else:
+                        outcome['in_flight'] += 1
+                        still_prepared.add(xid)
+                        continue
+                except Exception as e:
+                    # Still attached to its coordinator's session
+                    logging.warning(f"Left cross-shard transaction {xid}: {str(e)}")
+                    outcome['in_flight'] += 1
+                    unfinished.add(xid)
+                    still_prepared.add(xid)
+                    continue
+                logging.warning(f"Recovered cross-shard transaction {xid}")
+
+        decisions -= unfinished
+        if decisions:
+            placeholders = ', '.join(['%s'] * len(decisions))
+            self._catalog_query(
+                f"DELETE FROM ShardDecisions WHERE GlobalID IN ({placeholders})", list(decisions))
+
+        transfer_xid = f"{XID_PREFIX}t"
+        held = [int(xid[len(transfer_xid):]) for xid in still_prepared
+                if xid.startswith(transfer_xid)]
+        keep = f"AND FirstID NOT IN ({', '.join(['%s'] * len(held))})" if held else ""
+        self._catalog_query(f"""
+            DELETE FROM ShardReservations
+            WHERE ReservedAt < NOW() - INTERVAL %s SECOND {keep}
+        """, (grace, *held))
+        return outcome
+
+    # Transfers
+    def transfer(self, sender_acc: int, receiver_acc: int, amount,
+                 idempotency_key: str = None) -> dict:
+        """Move money between accounts on the same or different shards"""
+        amount = Money.of(amount)
+        if amount <= 0:
+            raise ValueError("Amount must be positive")
+
+        keys = self.idempotency_keys
+        if idempotency_key is not None:
+            keys.validate(idempotency_key)
+            outcome = keys.recent(idempotency_key, sender_acc, receiver_acc, amount)
+            if outcome:
+                return outcome
+
+        sender_index = self.account_shard(sender_acc)
+        if sender_index is None:
+            raise ValueError("Sender account not found")
+        receiver_index = self.account_shard(receiver_acc)
+        if receiver_index is None:
+            raise ValueError("Receiver account not found")
+
+        transaction_id = self.reserve_transaction_ids(1) + 1
+        sender_shard = self.shards[sender_index]
+        receiver_shard = self.shards[receiver_index]
+
+        # The velocity reservation taken after the claim, released if the transfer fails
+        reserved = []
+        try:
+            if sender_shard is receiver_shard:
+                try:
+                    sender_shard.db.cursor.execute("START TRANSACTION")
+                    if idempotency_key is not None:
+                        keys.claim(sender_shard.db, idempotency_key,
+                                   sender_acc, receiver_acc, amount)
+                    reserved.append(self.velocity.reserve(sender_acc, receiver_acc, amount))
+                    transfer = sender_shard.post_transfer(
+                        sender_acc, receiver_acc, amount, transaction_id)
+                    if idempotency_key is not None:
+                        keys.complete(sender_shard.db, idempotency_key, transaction_id)
+                    sender_shard.db.connection.commit()
+                except Exception:
+                    sender_shard.db.connection.rollback()
+                    raise
+                finally:
+                    self.release_transaction_ids(transaction_id)
+                sender_shard.db.record_write()
+                sender_shard.notify_transfers([transfer])
+            else:
+                transfer = self._cross_shard_transfer(
+                    sender_shard, receiver_shard, sender_acc, receiver_acc, amount,
+                    transaction_id, idempotency_key, reserved)
+        except DuplicateKey:
+            return keys.stored(sender_shard.db, idempotency_key, sender_acc, receiver_acc, amount)
+        except Exception:
+            for reservation in reserved:
+                self.velocity.release(reservation)
+            raise
+
+        if idempotency_key is not None:
+            keys.remember(idempotency_key, {
+                'status': 'completed', 'transaction_id': transaction_id,
+                'sender_acc': sender_acc, 'receiver_acc': receiver_acc, 'amount': amount})
+
+        for listener in self.transfer_listeners:
+            listener(transfer)
+        logging.info(f"Transaction completed: ID {transaction_id}, From {
+            sender_acc} to {receiver_acc}, Amount ${amount:,.2f}",
+            extra={'operation': 'make_transaction', 'event': 'completed',
+                   'transaction_id': transaction_id})
+        return dict(transfer, status='completed')
+
+    def _cross_shard_transfer(self, sender_shard, receiver_shard, sender_acc: int,
+                              receiver_acc: int, amount, transaction_id: int,
+                              idempotency_key: str = None, reserved: list = None) -> dict:
+        # Both shards record the transaction, so each customer's history,
+        # limits and ledger stay answerable from their home shard alone
+        def debit(shard):
+            if idempotency_key is not None:
+                self.idempotency_keys.claim(
+                    shard.db, idempotency_key, sender_acc, receiver_acc, amount)
+                # Foreign key checks are off inside the branch
+                self.idempotency_keys.complete(shard.db, idempotency_key, transaction_id)
+            reservation = self.velocity.reserve(sender_acc, receiver_acc, amount)
+            if reserved is not None:
+                reserved.append(reservation)
+            sender = shard.validate_debit(sender_acc, amount)
+            shard.apply_balance_change(sender_acc, -amount)
+            shard.record_transaction(transaction_id, sender_acc, receiver_acc, amount)
+            rollups.record(shard.db, transaction_id, amount, sender=sender)
+            return sender
+
+        def credit(shard):
+            receiver = shard.find_account(receiver_acc)
+            if not receiver:
+                raise ValueError("Receiver account not found")
+            shard.credit_account(receiver_acc, amount)
+            shard.record_transaction(transaction_id, sender_acc, receiver_acc, amount)
+            rollups.record(shard.db, transaction_id, amount, receiver=receiver)
+            return receiver
+
+        sender, receiver = self.two_phase(
+            f"{XID_PREFIX}t{transaction_id}",
+            [(sender_shard, debit), (receiver_shard, credit)], reservation=transaction_id)
+
+        transfer = {
+            'transaction_id': transaction_id,
+            'sender_acc': sender_acc,
+            'receiver_acc': receiver_acc,
+            'sender': sender,
+            'receiver': receiver,
+            'sender_balance': sender['Balance'] - amount,
+            'receiver_balance': receiver['Balance'] + amount,
+            'amount': amount
+        }
+        # Each shard's caches only track that shard's accounts
+        for shard, account, balance, delta in (
+                (sender_shard, sender_acc, transfer['sender_balance'], -amount),
+                (receiver_shard, receiver_acc, transfer['receiver_balance'], amount)):
+            shard.db.record_write()
+            shard.leaderboard.record_movement(account, balance, delta)
+            shard.invalidate_transfer(transfer)
+        return transfer
+
+    # Customer and account placement
+    def add_person(self, **params):
+        shard = self.home_shard(params.get('nationality'), params.get('national_id'))
+        custodian = (params.get('custodian_nationality'), params.get('custodian_national_id'))
+        if not all(custodian) or self.home_shard(*custodian) is shard:
+            return shard.execute('add_person', **params)
+
+        # The custodian's row is on another shard, out of the foreign key's reach
+        custodian_shard = self.home_shard(*custodian)
+        self._require(custodian_shard, """
+            SELECT 1 FROM Person1 WHERE Nationality = %s AND NationalID = %s
+        """, custodian, "Custodian not found")
+        with self._foreign_keys_off(shard):
+            result = shard.execute('add_person', **params)
+
+            # add_person only linked the custodian; their guardians are linked
+            # on the custodian's shard
+            person = (params['nationality'], params['national_id'])
+            above = [(row['Nationality'], row['NationalID']) + person + (row['Depth'] + 1,)
+                     for row in self._query(custodian_shard, """
+                         SELECT AncestorNationality as Nationality,
+                                AncestorNationalID as NationalID, Depth
+                         FROM CustodianClosure
+                         WHERE DescendantNationality = %s AND DescendantNationalID = %s
+                             AND Depth > 0
+                     """, custodian)]
+            if above:
+                shard.db.cursor.executemany(households.INSERT, above)
+                shard.db.connection.commit()
+                shard.db.record_write()
+                shard.result_cache.invalidate(('CustodianClosure',))
+        return result
+
+    # Households: a person's closure rows live on their home shard, with
+    # their accounts, so dependents and household balances are per-shard sums
+    def guardians(self, nationality: str, national_id: str) -> list:
+        rows = [dict(row) for row in self.home_shard(nationality, national_id).execute(
+            'view_guardians', nationality=nationality, national_id=national_id)]
+        # Names of guardians placed on other shards are not joined on the home shard
+        for row in rows:
+            if row['First'] is None:
+                names = self._query(self.home_shard(row['Nationality'], row['NationalID']), """
+                    SELECT First, Middle, Last FROM Person2
+                    WHERE Nationality = %s AND NationalID = %s
+                """, (row['Nationality'], row['NationalID']))
+                if names:
+                    row.update(names[0])
+        return rows
+
+    def rebuild_households(self) -> dict:
+        people = {}
+        for rows in self.scatter(lambda shard: self._query(shard, """
+            SELECT Nationality, NationalID, CustodianNationality, CustodianNationalID
+            FROM Person1
+        """)):
+            for row in rows:
+                custodian = (row['CustodianNationality'], row['CustodianNationalID'])
+                people[(row['Nationality'], row['NationalID'])] = (
+                    custodian if all(custodian) else None)
+
+        placed = [[] for _ in self.shards]
+        for row in households.closure(people):
+            placed[shard_for_customer(row[2], row[3], len(self.shards))].append(row)
+
+        def write(shard):
+            with self._foreign_keys_off(shard):
+                households.write(shard.db, placed[self.shards.index(shard)])
+            shard.db.record_write()
+            shard.result_cache.invalidate(self.operations['rebuild_households'][2])
+
+        self.scatter(write)
+        links = sum(len(rows) for rows in placed) - len(people)
+        return {'people': len(people), 'links': links}
+
+    def add_bank_account(self, **params) -> int:
+        index = shard_for_customer(
+            params.get('nationality'), params.get('national_id'), len(self.shards))
+        account_number = self.next_value('AccountNumber', lambda: self._highest(
+            "SELECT MAX(AccountNumber) as value FROM BankAccount"))
+
+        # Map first, so the account is never reachable without a map entry
+        self._catalog_query("""
+            INSERT INTO AccountShards (AccountNumber, ShardID, Nationality, NationalID)
+            VALUES (%s, %s, %s, %s)
+        """, (account_number, index, params.get('nationality'), params.get('national_id')))
+        try:
+            self.shards[index].execute(
+                'add_bank_account', account_number=account_number, **params)
+        except Exception:
+            self._catalog_query(
+                "DELETE FROM AccountShards WHERE AccountNumber = %s", (account_number,))
+            raise
+
+        self._account_shards[account_number] = index
+        return account_number
+
+    # Reference data, copied to every shard
+    def _broadcast(self, operation: str, statements: list):
+        """Apply (query, params) statements on every shard in one XA transaction"""
+        def apply(shard):
+            for query, params in statements:
+                shard.db.cursor.execute(query, params)
+
+        self.two_phase(f"{XID_PREFIX}{uuid.uuid4().hex}",
+                       [(shard, apply) for shard in self.shards])
+        tables = self.operations[operation][2]
+        for shard in self.shards:
+            shard.db.record_write()
+            shard.result_cache.invalidate(tables)
+
+    def _require_person(self, nationality: str, national_id: str, message: str):
+        self._require(self.home_shard(nationality, national_id), """
+            SELECT 1 FROM Person1 WHERE Nationality = %s AND NationalID = %s
+        """, (nationality, national_id), message)
+
+    def _require_location(self, country: str, pincode: str):
+        self._require(self.shards[0], """
+            SELECT 1 FROM Locations WHERE Country = %s AND Pincode = %s
+        """, (country, pincode), "Location not found")
+
+    def add_location(self, country: str, pincode: str, state: str, city: str):
+        self._broadcast('add_location', [("""
+            INSERT INTO Locations (Country, Pincode, State, City)
+            VALUES (%s, %s, %s, %s)
+        """, (country, pincode, state, city))])
+
+    def add_bank(self, bank_name: str, head_nationality: str, head_national_id: str,
+                 country: str, pincode: str) -> int:
+        # Foreign keys are off on the shards, so check references here
+        self._require_person(head_nationality, head_national_id, "Bank head not found")
+        self._require_location(country, pincode)
+
+        bank_id = self.next_value('BankID', lambda: self._highest(
+            "SELECT MAX(BankID) as value FROM RegisteredBank1"))
+        self._broadcast('add_bank', [
+            ("""
+                INSERT INTO RegisteredBank1 (BankID, BankName, GlobalHeadNationality, GlobalHeadNationalID)
+                VALUES (%s, %s, %s, %s)
+            """, (bank_id, bank_name, head_nationality, head_national_id)),
+            ("""
+                INSERT INTO RegisteredBank2 (BankID, Country, Pincode)
+                VALUES (%s, %s, %s)
+            """, (bank_id, country, pincode)),
+        ])
+        return bank_id
+
+    def add_branch(self, bank_id: int, manager_nationality: str, manager_national_id: str,
+                   country: str, pincode: str) -> int:
+        self._require(self.shards[0], "SELECT 1 FROM RegisteredBank1 WHERE BankID = %s",
+                      (bank_id,), "Bank not found")
+        self._require_person(manager_nationality, manager_national_id, "Branch manager not found")
+        self._require_location(country, pincode)
+
+        branch_code = self.next_value(f"BranchCode:{bank_id}", lambda: self._highest(
+            "SELECT MAX(BranchCode) as value FROM BankBranch1 WHERE BankID = %s", (bank_id,)))
+        self._broadcast('add_branch', [
+            ("""
+                INSERT INTO BankBranch1 (BranchCode, BankID, BranchManagerNationality, BranchManagerNationalID)
+                VALUES (%s, %s, %s, %s)
+            """, (branch_code, bank_id, manager_nationality, manager_national_id)),
+            ("""
+                INSERT INTO BankBranch2 (BranchCode, BankID, Country, Pincode)
+                VALUES (%s, %s, %s, %s)
+            """, (branch_code, bank_id, country, pincode)),
+        ])
+        return branch_code
+
+    # Merging scattered results
+    @staticmethod
+    def _concat(results: list) -> list:
+        return [row for rows in results for row in rows]
+
+    def _merge_country_expenditure(self, results: list, params: dict) -> list:
+        merged = merge_averages(self._concat(results), 'Nationality',
+                                'TotalExpenditure', 'AvgExpenditure')
+        return sorted(merged.values(), key=lambda row: row['AvgExpenditure'], reverse=True)
+
+    def _merge_expenditure_patterns(self, results: list, params: dict) -> list:
+        merged = merge_averages(self._concat(results), 'Location',
+                                'TotalExpendPercent', 'AvgExpendPercent')
+        return sorted(merged.values(), key=lambda row: row['UserCount'], reverse=True)
+
+    def _merge_branch_accounts(self, results: list, params: dict) -> list:
+        rows = sorted(self._concat(results), key=lambda row: row['AccountNumber'])
+        if all(row['ManagerFirst'] is not None for row in rows):
+            return rows
+
+        # Only the manager's home shard can join the manager's name
+        branch = self._query(self.shards[0], """
+            SELECT BranchManagerNationality, BranchManagerNationalID FROM BankBranch1
+            WHERE BranchCode = %s AND BankID = %s
+        """, (params.get('branch_code'), params.get('bank_id')))
+        manager = {}
+        if branch:
+            key = (branch[0]['BranchManagerNationality'], branch[0]['BranchManagerNationalID'])
+            names = self._query(self.home_shard(*key), """
+                SELECT First, Last FROM Person2 WHERE Nationality = %s AND NationalID = %s
+            """, key)
+            manager = names[0] if names else {}
+        # Rows may be shared with a shard's result cache, so copy them
+        return [row if row['ManagerFirst'] is not None else
+                dict(row, ManagerFirst=manager.get('First'), ManagerLast=manager.get('Last'))
+                for row in rows]
+
+    def _merge_leaderboards(self, results: list, params: dict) -> list:
+        rows, k = self._concat(results), params.get('k')
+        if params.get('board') == 'richest':
+            return top_with_ties(rows, 'Balance', k)
+        if params.get('board') == 'incomes':
+            return top_with_ties(rows, 'AnnualIncome', k)
+
+        # A customer's sends are all on their home shard, so per-customer
+        # totals are complete; only the ranking is recomputed
+        ranked = top_with_ties(rows, 'TotalSent', k)
+        ranked.sort(key=lambda row: (-row['TotalSent'], row['UserNationality'],
+                                     row['UserNationalID']))
+        merged = []
+        for i, row in enumerate(ranked):
+            if i and row['TotalSent'] == ranked[i - 1]['TotalSent']:
+                position = merged[-1]['Position']
+            else:
+                position = i + 1
+            merged.append(dict(row, Position=position))
+        return merged
+
+    def _merge_verification(self, results: list, params: dict) -> dict:
+        merged = {'checked': 0, 'mismatched': 0, 'unverified': 0, 'mismatches': []}
+        for summary in results:
+            for key in ('checked', 'mismatched', 'unverified'):
+                merged[key] += summary[key]
+            merged['mismatches'].extend(summary['mismatches'])
+        del merged['mismatches'][params.get('max_reported', 1000):]
+        return merged
+
+    def _merge_profiles(self, results: list, params: dict) -> list:
+        # Each customer exists on its home shard only; restore the requested order
+        order = {customer: i for i, customer in enumerate(params['customers'])}
+        return sorted(self._concat(results), key=lambda profile: order.get(
+            f"{profile['Nationality']}:{profile['NationalID']}", len(order)))
+
+    def _merge_period_end(self, results: list, params: dict) -> dict:
+        merged = dict(results[0])
+        for key in ('InterestCount', 'InterestTotal', 'MaintenanceCount', 'MaintenanceTotal',
+                    'MaturityCount', 'MaturityTotal'):
+            merged[key] = sum(summary[key] for summary in results)
+        return merged
+
+    def _merge_branch_activity(self, results: list, params: dict) -> list:
+        # A branch's accounts may sit on every shard
+        merged = {}
+        for row in self._concat(results):
+            key = (row['BankID'], row['BranchCode'], row['PeriodStart'])
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = dict(row)
+                continue
+            for side in ('Sent', 'Received'):
+                entry[f'{side}Count'] += row[f'{side}Count']
+                entry[f'{side}Amount'] += row[f'{side}Amount']
+                entry[f'{side}Min'] = min(filter(lambda value: value is not None, (
+                    entry[f'{side}Min'], row[f'{side}Min'])), default=None)
+                entry[f'{side}Max'] = max(filter(lambda value: value is not None, (
+                    entry[f'{side}Max'], row[f'{side}Max'])), default=None)
+        return [merged[key] for key in sorted(merged)]
+
+    def _merge_cache_stats(self, results: list, params: dict) -> dict:
+        merged = {key: sum(stats[key] for stats in results)
+                  for key in ('entries', 'max_entries', 'hits', 'misses',
+                              'evictions', 'invalidations',
+                              'directory_accounts', 'directory_bytes')}
+        lookups = merged['hits'] + merged['misses']
+        merged['hit_rate'] = merged['hits'] / lookups if lookups else 0.0
+        return merged
+
+    def close(self):
+        self._pool.shutdown()
+        for shard in self.shards:
+            shard.close()
+        self.catalog.disconnect()
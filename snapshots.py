@@ -0,0 +1,272 @@
+import datetime
+from decimal import Decimal
+
+from hotaccounts import PENDING_CREDITS
+
+# Signed ledger movements per account: credits positive, debits negative.
+# Transfers carry a TransactionID, single-account postings (interest,
+# charges) a PostingID; the other ID is NULL.
+LEDGER_MOVEMENTS = """
+    SELECT t1.ReceiverAccNum AS AccountNumber, t1.TransactionID, NULL AS PostingID,
+           t2.TransactionDate, t2.Amount AS Delta
+    FROM Transaction1 t1
+    JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+    UNION ALL
+    SELECT t1.SenderAccNum AS AccountNumber, t1.TransactionID, NULL AS PostingID,
+           t2.TransactionDate, -t2.Amount AS Delta
+    FROM Transaction1 t1
+    JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+    UNION ALL
+    SELECT p.AccountNumber, NULL AS TransactionID, p.PostingID,
+           p.PostingDate AS TransactionDate, p.Amount AS Delta
+    FROM Postings p
+"""
+
+# Accounts read and checkpointed per statement by take_snapshot
+SNAPSHOT_BATCH = 1000
+
+LATEST_SNAPSHOTS = """
+    SELECT bs.AccountNumber, bs.Balance, bs.LastTransactionID, bs.LastPostingID
+    FROM BalanceSnapshots bs
+    JOIN (
+        SELECT AccountNumber, MAX(SnapshotDate) AS SnapshotDate
+        FROM BalanceSnapshots
+        GROUP BY AccountNumber
+    ) latest ON bs.AccountNumber = latest.AccountNumber
+        AND bs.SnapshotDate = latest.SnapshotDate
+"""
+
+
+class BalanceLedger:
+    """Daily balance checkpoints and ledger-based balance reconstruction
+
+    A snapshot row holds an account's balance after every transaction up to
+    and including LastTransactionID and every posting up to LastPostingID, so
+    any historic balance is the nearest snapshot adjusted by the ledger
+    entries on either side of those watermarks. Transactions moved to the
+    archive are read from its segments instead of the database.
+    """
+
+    def __init__(self, db, archive=None):
+        self.db = db
+        self.archive = archive
+        # Set with sharding: returns the transaction ID at or below which every
+        # transfer has finished, since IDs are then allocated before the
+        # transfer runs and need not commit in order
+        self.settled_transaction_id = None
+
+    def take_snapshot(self) -> int:
+        """Checkpoint every account balance for today; returns rows written"""
+        # Read before the snapshot opens, so it sees every transfer up to here
+        settled = self.settled_transaction_id() if self.settled_transaction_id else None
+        try:
+            self.db.cursor.execute(
+                "START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            self.db.cursor.execute(
+                "SELECT COALESCE(MAX(TransactionID), 0) as max_id FROM Transaction1")
+            max_id = self.db.cursor.fetchone()['max_id']
+            watermark = max(max_id if settled is None else min(max_id, settled),
+                            self.archive.last_transaction() if self.archive else 0)
+            # Transfers visible above the watermark committed ahead of a lower
+            # one; they are taken back out so the checkpoint holds exactly the
+            # transfers up to the watermark
+            later, later_params = "", ()
+            if watermark < max_id:
+                later = """
+                    - COALESCE((
+                        SELECT SUM(CASE WHEN t1.ReceiverAccNum = ba.AccountNumber
+                                        THEN t2.Amount ELSE 0 END)
+                             - SUM(CASE WHEN t1.SenderAccNum = ba.AccountNumber
+                                        THEN t2.Amount ELSE 0 END)
+                        FROM Transaction1 t1
+                        JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+                        WHERE t1.TransactionID > %s
+                            AND (t1.SenderAccNum = ba.AccountNumber
+                                 OR t1.ReceiverAccNum = ba.AccountNumber)
+                    ), 0)"""
+                later_params = (watermark,)
+            self.db.cursor.execute(
+                "SELECT COALESCE(MAX(PostingID), 0) as max_id FROM Postings")
+            posting_watermark = self.db.cursor.fetchone()['max_id']
+
+            # Plain SELECTs are consistent reads of the snapshot the watermarks
+            # came from; INSERT ... SELECT would lock and read the latest rows
+            rows = 0
+            last_account = 0
+            while True:
+                self.db.cursor.execute(f"""
+                    SELECT ba.AccountNumber, ba.Balance + COALESCE((
+                               SELECT SUM(Amount) FROM BalanceBuckets bb
+                               WHERE bb.AccountNumber = ba.AccountNumber
+                           ), 0) {later} as Balance
+                    FROM BankAccount ba
+                    WHERE ba.AccountNumber > %s
+                    ORDER BY ba.AccountNumber
+                    LIMIT %s
+                """, later_params + (last_account, SNAPSHOT_BATCH))
+                balances = self.db.cursor.fetchall()
+                if not balances:
+                    break
+
+                self.db.cursor.executemany("""
+                    INSERT INTO BalanceSnapshots (
+                        AccountNumber, SnapshotDate, Balance, LastTransactionID, LastPostingID
+                    )
+                    VALUES (%s, CURDATE(), %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        Balance = VALUES(Balance),
+                        LastTransactionID = VALUES(LastTransactionID),
+                        LastPostingID = VALUES(LastPostingID)
+                """, [(row['AccountNumber'], row['Balance'], watermark, posting_watermark)
+                      for row in balances])
+                rows += len(balances)
+                last_account = balances[-1]['AccountNumber']
+
+            self.db.connection.commit()
+            return rows
+        except Exception:
+            self.db.connection.rollback()
+            raise
+
+    def record_opening_balance(self, account_number: int, balance):
+        """Checkpoint a new account so its full history is reconstructible"""
+        self.db.cursor.execute("""
+            INSERT INTO BalanceSnapshots (AccountNumber, SnapshotDate, Balance, LastTransactionID)
+            VALUES (%s, CURDATE(), %s, 0)
+        """, (account_number, balance))
+
+    def _net_movement(self, account_number: int, condition: str, params: tuple,
+                      posting_condition: str, posting_params: tuple,
+                      archived_condition) -> Decimal:
+        """Net of the matching ledger entries; archived_condition tests archived Movements"""
+        archived = self.archive.before() if self.archive else None
+        if archived:
+            condition += " AND t2.TransactionDate >= %s"
+            params += (archived,)
+        self.db.cursor.execute(f"""
+            SELECT COALESCE(SUM(CASE WHEN t1.ReceiverAccNum = %s THEN t2.Amount ELSE 0 END), 0)
+                 - COALESCE(SUM(CASE WHEN t1.SenderAccNum = %s THEN t2.Amount ELSE 0 END), 0)
+                   as Delta
+            FROM Transaction1 t1
+            JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+            WHERE (t1.SenderAccNum = %s OR t1.ReceiverAccNum = %s)
+                AND {condition}
+        """, (account_number, account_number, account_number, account_number) + params)
+        delta = self.db.cursor.fetchone()['Delta']
+        if archived:
+            delta += self.archive.net(account_number, archived_condition).decimal()
+
+        self.db.cursor.execute(f"""
+            SELECT COALESCE(SUM(Amount), 0) as Delta FROM Postings
+            WHERE AccountNumber = %s AND {posting_condition}
+        """, (account_number,) + posting_params)
+        return delta + self.db.cursor.fetchone()['Delta']
+
+    def balance_at(self, account_number: int, as_of):
+        """Return the balance at the end of as_of, or None if the account did not exist"""
+        self.db.cursor.execute("""
+            SELECT ba.Balance + COALESCE((
+                       SELECT SUM(Amount) FROM BalanceBuckets bb
+                       WHERE bb.AccountNumber = ba.AccountNumber
+                   ), 0) as Balance, ba.CreationDate
+            FROM BankAccount ba
+            WHERE ba.AccountNumber = %s
+        """, (account_number,))
+        account = self.db.cursor.fetchone()
+
+        if not account:
+            raise ValueError("Account not found")
+        if account['CreationDate'] and str(account['CreationDate']) > str(as_of):
+            return None
+        day = datetime.date.fromisoformat(str(as_of))
+
+        # Nearest checkpoint on or before the date: roll forward
+        self.db.cursor.execute("""
+            SELECT Balance, LastTransactionID, LastPostingID FROM BalanceSnapshots
+            WHERE AccountNumber = %s AND SnapshotDate <= %s
+            ORDER BY SnapshotDate DESC
+            LIMIT 1
+        """, (account_number, as_of))
+        snapshot = self.db.cursor.fetchone()
+        if snapshot:
+            return snapshot['Balance'] + self._net_movement(
+                account_number, "t1.TransactionID > %s AND t2.TransactionDate <= %s",
+                (snapshot['LastTransactionID'], as_of),
+                "PostingID > %s AND PostingDate <= %s", (snapshot['LastPostingID'], as_of),
+                lambda movement: (movement.transaction_id > snapshot['LastTransactionID']
+                                  and movement.date <= day))
+
+        # Otherwise the nearest checkpoint after it: roll backward
+        self.db.cursor.execute("""
+            SELECT Balance, LastTransactionID, LastPostingID FROM BalanceSnapshots
+            WHERE AccountNumber = %s AND SnapshotDate > %s
+            ORDER BY SnapshotDate ASC
+            LIMIT 1
+        """, (account_number, as_of))
+        snapshot = self.db.cursor.fetchone()
+        if snapshot:
+            return snapshot['Balance'] - self._net_movement(
+                account_number, "t1.TransactionID <= %s AND t2.TransactionDate > %s",
+                (snapshot['LastTransactionID'], as_of),
+                "PostingID <= %s AND PostingDate > %s", (snapshot['LastPostingID'], as_of),
+                lambda movement: (movement.transaction_id <= snapshot['LastTransactionID']
+                                  and movement.date > day))
+
+        # No checkpoints yet: roll the live balance backward
+        return account['Balance'] - self._net_movement(
+            account_number, "t2.TransactionDate > %s", (as_of,),
+            "PostingDate > %s", (as_of,), lambda movement: movement.date > day)
+
+    def verify_balances(self, on_mismatch=None) -> dict:
+        """Check every Balance against its latest snapshot plus later ledger entries
+
+        Runs as a single query streamed through an unbuffered cursor, so memory
+        stays flat regardless of the number of accounts. Archived transfers
+        after an account's snapshot are added from the archive's segments.
+        """
+        import pymysql.cursors
+
+        archived = self.archive.before() if self.archive else None
+        last_archived = self.archive.last_transaction() if archived else 0
+        # Transfers already in a segment are only counted from there
+        live, params = ("", ()) if not archived else (
+            "AND (m.TransactionID IS NULL OR m.TransactionDate >= %s)", (archived,))
+
+        summary = {'checked': 0, 'mismatched': 0, 'unverified': 0}
+        cursor = self.db.connection.cursor(pymysql.cursors.SSDictCursor)
+        try:
+            cursor.execute(f"""
+                SELECT ba.AccountNumber, ba.Balance + COALESCE(pc.Pending, 0) as Balance,
+                       s.Balance as SnapshotBalance, s.LastTransactionID,
+                       COALESCE(d.Delta, 0) as Delta
+                FROM BankAccount ba
+                LEFT JOIN ({PENDING_CREDITS}) pc ON ba.AccountNumber = pc.AccountNumber
+                LEFT JOIN ({LATEST_SNAPSHOTS}) s ON ba.AccountNumber = s.AccountNumber
+                LEFT JOIN (
+                    SELECT m.AccountNumber, SUM(m.Delta) as Delta
+                    FROM ({LEDGER_MOVEMENTS}) m
+                    JOIN ({LATEST_SNAPSHOTS}) ls ON m.AccountNumber = ls.AccountNumber
+                    WHERE (m.TransactionID > ls.LastTransactionID
+                        OR m.PostingID > ls.LastPostingID) {live}
+                    GROUP BY m.AccountNumber
+                ) d ON ba.AccountNumber = d.AccountNumber
+                ORDER BY ba.AccountNumber
+            """, params or None)
+            for row in cursor:
+                summary['checked'] += 1
+                if row['SnapshotBalance'] is None:
+                    summary['unverified'] += 1
+                    continue
+                expected = row['SnapshotBalance'] + row['Delta']
+                if row['LastTransactionID'] < last_archived:
+                    expected += self.archive.net(
+                        row['AccountNumber'],
+                        lambda movement: movement.transaction_id > row['LastTransactionID']
+                    ).decimal()
+                if expected != row['Balance']:
+                    summary['mismatched'] += 1
+                    if on_mismatch:
+                        on_mismatch(row['AccountNumber'], row['Balance'], expected)
+        finally:
+            cursor.close()
+        return summary
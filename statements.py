@@ -0,0 +1,257 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+
+from hotaccounts import PENDING_CREDITS
+from money import Money, sql_cents
+
+FORMATS = ('csv', 'jsonl')
+
+# Writer threads, and messages queued per writer before the database scan waits
+WRITERS = 4
+QUEUE_SIZE = 10000
+
+# Statements per subdirectory, so millions of accounts do not share one directory
+ACCOUNTS_PER_DIRECTORY = 1000
+
+# Signed movements per account with their counterparty: transfers carry a
+# TransactionID and the other account, postings a PostingID and their kind
+MOVEMENTS = """
+    SELECT t1.ReceiverAccNum AS AccountNumber, t2.TransactionDate, t1.TransactionID,
+           NULL AS PostingID, t1.SenderAccNum AS Counterparty, 'transfer' AS Kind,
+           t2.Amount AS Delta
+    FROM Transaction1 t1
+    JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+    WHERE {dates}
+    UNION ALL
+    SELECT t1.SenderAccNum AS AccountNumber, t2.TransactionDate, t1.TransactionID,
+           NULL AS PostingID, t1.ReceiverAccNum AS Counterparty, 'transfer' AS Kind,
+           -t2.Amount AS Delta
+    FROM Transaction1 t1
+    JOIN Transaction2 t2 ON t1.TransactionID = t2.TransactionID
+    WHERE {dates}
+    UNION ALL
+    SELECT p.AccountNumber, p.PostingDate AS TransactionDate, NULL AS TransactionID,
+           p.PostingID, NULL AS Counterparty, p.Kind, p.Amount AS Delta
+    FROM Postings p
+    WHERE {posting_dates}
+"""
+
+
+def _movements(dates: str) -> str:
+    return MOVEMENTS.format(dates=dates.format(column='t2.TransactionDate'),
+                            posting_dates=dates.format(column='p.PostingDate'))
+
+
+PERIOD_MOVEMENTS = _movements("{column} BETWEEN %(start)s AND %(end)s")
+LATER_MOVEMENTS = _movements("{column} > %(end)s")
+
+# Every account that existed by the end of the period, with its opening and
+# closing balance, followed by its movements in the period, in account order.
+# Closing balances are the live balance less everything dated after the period.
+# Amounts come back as integer cents.
+STATEMENT_ROWS = f"""
+    SELECT a.AccountNumber, {sql_cents('a.Closing - COALESCE(n.Net, 0)')} as Opening,
+           {sql_cents('a.Closing')} as Closing, m.TransactionDate, m.TransactionID,
+           m.PostingID, m.Counterparty, m.Kind, {sql_cents('m.Delta')} as Delta
+    FROM (
+        SELECT ba.AccountNumber,
+               ba.Balance + COALESCE(pc.Pending, 0) - COALESCE(later.Delta, 0) as Closing
+        FROM BankAccount ba
+        LEFT JOIN ({PENDING_CREDITS}) pc ON ba.AccountNumber = pc.AccountNumber
+        LEFT JOIN (
+            SELECT AccountNumber, SUM(Delta) as Delta
+            FROM ({LATER_MOVEMENTS}) after_end
+            GROUP BY AccountNumber
+        ) later ON ba.AccountNumber = later.AccountNumber
+        WHERE ba.CreationDate IS NULL OR ba.CreationDate <= %(end)s
+    ) a
+    LEFT JOIN (
+        SELECT AccountNumber, SUM(Delta) as Net
+        FROM ({PERIOD_MOVEMENTS}) net
+        GROUP BY AccountNumber
+    ) n ON a.AccountNumber = n.AccountNumber
+    LEFT JOIN ({PERIOD_MOVEMENTS}) m
+        ON a.AccountNumber = m.AccountNumber
+    ORDER BY a.AccountNumber, m.TransactionDate, m.TransactionID, m.PostingID
+"""
+
+
+def month_bounds(period: str) -> tuple:
+    """First and last day of a "YYYY-MM" period"""
+    try:
+        start = datetime.datetime.strptime(period, '%Y-%m').date()
+    except ValueError:
+        raise ValueError("Period must be given as YYYY-MM")
+    following = (start + datetime.timedelta(days=31)).replace(day=1)
+    return start, following - datetime.timedelta(days=1)
+
+
+def statement_path(directory: str, account_number: int, file_format: str) -> str:
+    return os.path.join(directory, f"{account_number // ACCOUNTS_PER_DIRECTORY:06d}",
+                        f"{account_number}.{file_format}")
+
+
+class CsvStatement:
+    """One statement as CSV: an opening row, one row per movement, a closing row
+
+    The opening row's Reference is the account number, the closing row's the
+    number of movements.
+    """
+
+    def __init__(self, file):
+        self.writer = csv.writer(file)
+        self.writer.writerow(['Date', 'Entry', 'Reference', 'Counterparty', 'Amount', 'Balance'])
+
+    def opening(self, account_number: int, start, end, balance):
+        self.writer.writerow([start, 'opening', account_number, '', '', balance])
+
+    def entry(self, date, kind: str, reference: str, counterparty, amount, balance):
+        self.writer.writerow([date, kind, reference,
+                              '' if counterparty is None else counterparty, amount, balance])
+
+    def closing(self, end, count: int, balance):
+        self.writer.writerow([end, 'closing', count, '', '', balance])
+
+
+class JsonlStatement:
+    """One statement as JSON lines: header, one line per movement, footer"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def _write(self, record: dict):
+        self.file.write(json.dumps(record) + '\n')
+
+    def opening(self, account_number: int, start, end, balance):
+        self._write({'account_number': account_number, 'period_start': str(start),
+                     'period_end': str(end), 'opening_balance': str(balance)})
+
+    def entry(self, date, kind: str, reference: str, counterparty, amount, balance):
+        self._write({'date': str(date), 'kind': kind, 'reference': reference,
+                     'counterparty': counterparty, 'amount': str(amount),
+                     'balance': str(balance)})
+
+    def closing(self, end, count: int, balance):
+        self._write({'entries': count, 'closing_balance': str(balance)})
+
+
+STATEMENT_FORMATS = {'csv': CsvStatement, 'jsonl': JsonlStatement}
+
+
+class StatementWriters:
+    """A fixed pool of threads writing statement files from bounded queues
+
+    An account's messages always go to the same writer, in order, and
+    accounts arrive sorted, so each writer has at most one file open. A
+    statement is written under a temporary name and renamed when complete,
+    so a rerun never leaves a half-written file in place.
+    """
+
+    def __init__(self, directory: str, file_format: str, start, end,
+                 writers: int = WRITERS, queue_size: int = QUEUE_SIZE):
+        if file_format not in STATEMENT_FORMATS:
+            raise ValueError(f"Format must be one of: {', '.join(FORMATS)}")
+        if writers <= 0:
+            raise ValueError("Writer count must be positive")
+        self.directory = directory
+        self.file_format = file_format
+        self.start, self.end = start, end
+        self.error = None
+        self._queues = [queue.Queue(queue_size) for _ in range(writers)]
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=f"statement-writer-{i}",
+                             daemon=True)
+            for i, q in enumerate(self._queues)]
+        for thread in self._threads:
+            thread.start()
+
+    def send(self, account_number: int, message: tuple):
+        if self.error is not None:
+            raise self.error
+        self._queues[account_number % len(self._queues)].put((account_number,) + message)
+
+    def finish(self):
+        """Wait for every queued statement to be written"""
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self, messages: queue.Queue):
+        file = statement = path = None
+        while True:
+            message = messages.get()
+            if message is None:
+                break
+            if self.error is not None:
+                continue    # Keep draining so the scan can notice and stop
+            try:
+                account_number, kind, *values = message
+                if kind == 'open':
+                    path = statement_path(self.directory, account_number, self.file_format)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    file = open(path + '.tmp', 'w', newline='')
+                    statement = STATEMENT_FORMATS[self.file_format](file)
+                    statement.opening(account_number, self.start, self.end, *values)
+                elif kind == 'entry':
+                    statement.entry(*values)
+                else:
+                    statement.closing(self.end, *values)
+                    file.close()
+                    os.replace(path + '.tmp', path)
+                    file = None
+            except Exception as e:
+                logging.error(f"Error writing statement {path}: {str(e)}")
+                self.error = e
+        if file is not None:
+            file.close()
+
+
+def generate(db, start, end, directory: str, file_format: str = 'csv',
+             writers: int = WRITERS) -> dict:
+    """Write a statement of start..end for every account into directory
+
+    The whole run is one query streamed through an unbuffered cursor in
+    account order, so memory stays flat however many accounts there are;
+    each account's running balance is carried from its opening balance.
+    """
+    import pymysql.cursors
+
+    pool = StatementWriters(directory, file_format, start, end, writers)
+    summary = {'accounts': 0, 'entries': 0}
+    current = balance = None
+    count = 0
+    cursor = db.connection.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        cursor.execute(STATEMENT_ROWS, {'start': start, 'end': end})
+        for row in cursor:
+            account_number = row['AccountNumber']
+            if account_number != current:
+                if current is not None:
+                    pool.send(current, ('close', count, balance))
+                current, balance, count = account_number, Money(int(row['Opening'])), 0
+                pool.send(account_number, ('open', balance))
+                summary['accounts'] += 1
+
+            if row['Delta'] is not None:
+                delta = Money(int(row['Delta']))
+                balance += delta
+                count += 1
+                summary['entries'] += 1
+                reference = (f"T{row['TransactionID']}" if row['TransactionID'] is not None
+                             else f"P{row['PostingID']}")
+                pool.send(account_number, ('entry', row['TransactionDate'], row['Kind'],
+                                           reference, row['Counterparty'], delta, balance))
+        if current is not None:
+            pool.send(current, ('close', count, balance))
+    finally:
+        cursor.close()
+        pool.finish()
+    return summary
@@ -0,0 +1,153 @@
+import datetime
+import threading
+import unittest
+
+from admission import (QUERY_TIMEOUT, AdmissionGates, Gate, Overloaded, ReportDeferred,
+                       ReportPolicy, in_window, parse_limits, parse_window, time_limited)
+
+
+def at(hour):
+    return datetime.datetime(2024, 1, 1, hour, 30)
+
+
+class WindowTest(unittest.TestCase):
+    def test_parse_window(self):
+        self.assertEqual(parse_window("22-6"), (22, 6))
+        self.assertEqual(parse_window("1-5"), (1, 5))
+        self.assertIsNone(parse_window(""))
+        for spec in ("22", "6-6", "24-2", "a-b", "-3"):
+            with self.assertRaises(ValueError, msg=spec):
+                parse_window(spec)
+
+    def test_in_window(self):
+        self.assertEqual([hour for hour in range(24) if in_window((1, 5), at(hour))],
+                         [1, 2, 3, 4])
+
+    def test_in_window_wraps_past_midnight(self):
+        self.assertEqual([hour for hour in range(24) if in_window((22, 6), at(hour))],
+                         [0, 1, 2, 3, 4, 5, 22, 23])
+        self.assertFalse(in_window(None, at(3)))
+
+    def test_parse_limits(self):
+        self.assertEqual(parse_limits("oltp:64, analytics:2"), {'oltp': 64, 'analytics': 2})
+        for spec in ("batch:1", "oltp:-1", "oltp"):
+            with self.assertRaises(ValueError, msg=spec):
+                parse_limits(spec)
+
+
+class GateTest(unittest.TestCase):
+    def hold(self, gate):
+        """Occupy a slot of gate from another thread until the returned event is set"""
+        entered, release = threading.Event(), threading.Event()
+
+        def occupy():
+            with gate.enter():
+                entered.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=occupy)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        self.assertTrue(entered.wait(5))
+        return release
+
+    def test_waiting_operation_runs_when_a_slot_frees(self):
+        gate = Gate('analytics', 1, 5, 5.0)
+        release = self.hold(gate)
+        threading.Timer(0.05, release.set).start()
+        with gate.enter():
+            self.assertEqual(gate.active, 1)
+        stats = gate.stats()
+        self.assertEqual((stats['admitted'], stats['queued'], stats['active']), (2, 1, 0))
+
+    def test_times_out(self):
+        gate = Gate('analytics', 1, 5, 0.05)
+        self.hold(gate)
+        with self.assertRaisesRegex(Overloaded, "No analytics capacity within 0.05s"):
+            with gate.enter():
+                pass
+        self.assertEqual(gate.stats()['timed_out'], 1)
+        self.assertEqual(gate.waiting, 0)
+
+    def test_rejects_when_the_queue_is_full(self):
+        gate = Gate('oltp', 1, 0, 5.0)
+        self.hold(gate)
+        with self.assertRaisesRegex(Overloaded, "Too many oltp operations waiting"):
+            with gate.enter():
+                pass
+        self.assertEqual(gate.stats()['rejected'], 1)
+
+    def test_zero_limit_admits_everything(self):
+        gate = Gate('oltp', 0, 0, 0.0)
+        with gate.enter(), gate.enter():
+            pass
+        self.assertEqual(gate.stats()['admitted'], 0)
+
+    def test_admission_gates_by_kind(self):
+        gates = AdmissionGates({'analytics': 1}, 0, 0.0)
+        with gates.admit('analysis'):
+            # Transfers are not held up by a report
+            with gates.admit('write'):
+                pass
+            with self.assertRaises(Overloaded):
+                with gates.admit('analysis'):
+                    pass
+
+
+class FakeCursor:
+    def __init__(self, plan, error=None):
+        self.plan = plan
+        self.error = error
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+        if not query.startswith("EXPLAIN") and self.error:
+            raise self.error
+
+    def fetchall(self):
+        return self.plan if self.executed[-1].startswith("EXPLAIN") else [{'ok': 1}]
+
+
+class FakeDatabase:
+    def __init__(self, plan=(), error=None):
+        self.cursor = FakeCursor(list(plan), error)
+
+
+class ReportPolicyTest(unittest.TestCase):
+    QUERY = "SELECT * FROM Transaction2"
+    # 1000 rows examined, 10% of them joined to 50 rows each: 6000
+    PLAN = [{'rows': 1000, 'filtered': 10}, {'rows': 50, 'filtered': 100}]
+
+    def test_time_limited(self):
+        self.assertEqual(time_limited("\n  select a FROM t", 500),
+                         "\n  select /*+ MAX_EXECUTION_TIME(500) */ a FROM t")
+
+    def test_admitted_report_is_time_limited(self):
+        db = FakeDatabase(self.PLAN)
+        self.assertEqual(ReportPolicy(6000, 500).run(db, self.QUERY, None), [{'ok': 1}])
+        self.assertEqual(db.cursor.executed, [
+            "EXPLAIN " + self.QUERY, "SELECT /*+ MAX_EXECUTION_TIME(500) */ * FROM Transaction2"])
+
+    def test_report_over_the_estimate_is_refused_or_deferred(self):
+        with self.assertRaisesRegex(Overloaded, "6,000 rows, over the 5,999 row limit"):
+            ReportPolicy(5999, 0).run(FakeDatabase(self.PLAN), self.QUERY, None)
+        with self.assertRaises(ReportDeferred) as deferred:
+            ReportPolicy(5999, 0, (22, 6)).run(FakeDatabase(self.PLAN), self.QUERY, None)
+        self.assertEqual(deferred.exception.estimate, 6000)
+
+    def test_off_peak_runs_unlimited(self):
+        db = FakeDatabase(self.PLAN)
+        ReportPolicy(1, 500).run(db, self.QUERY, None, off_peak=True)
+        self.assertEqual(db.cursor.executed, [self.QUERY])
+
+    def test_time_limit_inside_a_limited_block_raises_overloaded(self):
+        db = FakeDatabase(error=Exception(QUERY_TIMEOUT, "Query execution was interrupted"))
+        with self.assertRaisesRegex(Overloaded, "500 ms time limit"):
+            with ReportPolicy(0, 500).limited(db, self.QUERY, None) as query:
+                db.cursor.execute(query)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import archive
+from archive import Segment, SegmentWriter, TransactionArchive
+from money import Money
+
+DAY = datetime.date(2024, 1, 1)
+
+
+def movements(transfers):
+    """Both sides of (transaction ID, sender, receiver, day offset, cents) transfers,
+    in segment order"""
+    rows = []
+    for transaction_id, sender, receiver, days, cents in transfers:
+        date = DAY + datetime.timedelta(days=days)
+        rows.append((sender, transaction_id, receiver, date, 3600, -cents))
+        rows.append((receiver, transaction_id, sender, date, 3600, cents))
+    return sorted(rows, key=lambda row: (row[0], row[1]))
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, transfers, before, last):
+        writer = SegmentWriter(os.path.join(self.directory, name + archive.SUFFIX))
+        for row in movements(transfers):
+            writer.add(*row)
+        writer.finish(before, last)
+        return writer
+
+
+class SegmentTest(ArchiveTestCase):
+    def test_round_trip_across_blocks(self):
+        # Enough transfers for several compressed blocks per segment
+        transfers = [(i, i % 50, 50 + i % 7, i % 30, 100 + i) for i in range(1, 2001)]
+        with mock.patch.object(archive, 'BLOCK_RECORDS', 64):
+            self.write('a', transfers, DAY + datetime.timedelta(days=30), 2000)
+        segment = Segment(os.path.join(self.directory, 'a' + archive.SUFFIX))
+        self.addCleanup(segment.close)
+
+        self.assertEqual(segment.records, 4000)
+        self.assertEqual(segment.last_transaction, 2000)
+        self.assertEqual(segment.before, DAY + datetime.timedelta(days=30))
+        for account in (0, 17, 49, 50, 56):
+            expected = [(account, transaction_id, counterparty, day.toordinal(), seconds, cents)
+                        for account_, transaction_id, counterparty, day, seconds, cents
+                        in movements(transfers) if account_ == account]
+            self.assertEqual(list(segment.movements(account)), expected)
+        self.assertEqual(list(segment.movements(999)), [])
+        self.assertEqual(list(segment.movements(-1)), [])
+
+    def test_writer_refuses_unsorted_movements(self):
+        writer = SegmentWriter(os.path.join(self.directory, 'b' + archive.SUFFIX))
+        writer.add(2, 1, 3, DAY, 0, 100)
+        with self.assertRaises(ValueError):
+            writer.add(1, 2, 3, DAY, 0, 100)
+        writer.abort()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_rejects_other_files(self):
+        path = os.path.join(self.directory, 'c' + archive.SUFFIX)
+        with open(path, 'wb') as f:
+            f.write(bytes(archive.HEADER.size))
+        with self.assertRaises(ValueError):
+            Segment(path)
+
+
+class TransactionArchiveTest(ArchiveTestCase):
+    def test_reads_across_segments(self):
+        self.write('20240105-0000000002', [(1, 10, 20, 0, 500), (2, 20, 10, 3, 200)],
+                   DAY + datetime.timedelta(days=4), 2)
+        history = TransactionArchive(self.directory)
+        self.addCleanup(history.close)
+        self.assertEqual(history.before(), DAY + datetime.timedelta(days=4))
+        self.assertEqual(history.last_transaction(), 2)
+
+        # A segment written later, e.g. by another process, is picked up
+        self.write('20240110-0000000005', [(5, 10, 30, 6, 50)],
+                   DAY + datetime.timedelta(days=9), 5)
+        self.assertEqual(history.before(), DAY + datetime.timedelta(days=9))
+        self.assertEqual(history.last_transaction(), 5)
+
+        self.assertEqual([m.transaction_id for m in history.movements(10)], [1, 2, 5])
+        self.assertEqual([m.transaction_id for m in history.movements(
+            10, DAY + datetime.timedelta(days=1), DAY + datetime.timedelta(days=3))], [2])
+        self.assertEqual(history.net(10, lambda movement: True), Money(-500 + 200 - 50))
+        self.assertEqual(history.net(10, lambda movement: movement.transaction_id > 1),
+                         Money(200 - 50))
+
+        rows = history.transfers([10, 20])
+        self.assertEqual([row['TransactionID'] for row in rows], [5, 2, 1])
+        self.assertEqual(rows[1]['SenderAccount'], 20)
+        self.assertEqual(rows[1]['ReceiverAccount'], 10)
+        self.assertEqual(rows[1]['Amount'], Money(200))
+
+    def test_empty_directory(self):
+        history = TransactionArchive(os.path.join(self.directory, 'missing'))
+        self.assertIsNone(history.before())
+        self.assertEqual(history.last_transaction(), 0)
+        self.assertEqual(list(history.movements(1)), [])
+
+    def test_horizon_keeps_current_month_live(self):
+        today = datetime.date(2024, 3, 20)
+        self.assertEqual(archive.horizon(365, today), datetime.date(2023, 3, 21))
+        self.assertEqual(archive.horizon(5, today), datetime.date(2024, 3, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from money import Money
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if np is not None:
+    from graph import TransferGraph
+
+# (sender, receiver, cents): 10 -> 20 -> 30 -> 10 is a cycle with a parallel
+# transfer and a shortcut, 40 -> 50 a one-way pair, 60 pays itself
+TRANSFERS = [(10, 20, 100), (10, 20, 50), (10, 30, 10), (20, 30, 5), (30, 10, 7),
+             (40, 50, 1000), (60, 60, 3)]
+
+
+def graph(transfers):
+    edges = np.array(transfers, dtype=np.int64).reshape(-1, 3)
+    return TransferGraph(edges[:, 0], edges[:, 1], edges[:, 2])
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class TransferGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = graph(TRANSFERS)
+
+    def test_parallel_transfers_merge_into_one_edge(self):
+        self.assertEqual(self.graph.vertex_count, 6)
+        self.assertEqual(self.graph.edge_count, 6)
+        self.assertEqual(self.graph.direct_flow(self.graph.vertices([10]),
+                                                self.graph.vertices([20])), (2, Money(150)))
+        self.assertEqual(self.graph.direct_flow(self.graph.vertices([20]),
+                                                self.graph.vertices([10])), (0, Money()))
+
+    def test_fan_out(self):
+        self.assertEqual(self.graph.top_fan(2, 'out'), [
+            {'AccountNumber': 10, 'Counterparties': 2, 'Transfers': 3, 'Amount': Money(160)},
+            # Ties on the degree rank by amount
+            {'AccountNumber': 40, 'Counterparties': 1, 'Transfers': 1, 'Amount': Money(1000)}])
+
+    def test_fan_in(self):
+        self.assertEqual(self.graph.top_fan(1, 'in'), [
+            {'AccountNumber': 30, 'Counterparties': 2, 'Transfers': 2, 'Amount': Money(15)}])
+
+    def test_shortest_path(self):
+        vertices = self.graph.vertices
+        self.assertEqual(self.graph.shortest_path(vertices([20]), vertices([10])), [20, 30, 10])
+        self.assertEqual(self.graph.shortest_path(vertices([10]), vertices([30])), [10, 30])
+        self.assertIsNone(self.graph.shortest_path(vertices([10]), vertices([50])))
+        self.assertIsNone(self.graph.shortest_path(vertices([999]), vertices([10])))
+
+    def test_cycles(self):
+        self.assertEqual(self.graph.cycles(), [
+            {'Size': 3, 'Accounts': [10, 20, 30], 'Transfers': 5, 'Amount': Money(172)},
+            {'Size': 1, 'Accounts': [60], 'Transfers': 1, 'Amount': Money(3)}])
+
+    def test_components(self):
+        components = self.graph.components()
+        self.assertEqual(components['Components'], 3)
+        self.assertEqual([(group['Size'], sorted(group['Accounts']))
+                          for group in components['Largest']],
+                         [(3, [10, 20, 30]), (2, [40, 50]), (1, [60])])
+
+    def test_empty_graph(self):
+        empty = graph([])
+        self.assertEqual(empty.vertex_count, 0)
+        self.assertEqual(len(empty.vertices([10])), 0)
+        self.assertEqual(empty.top_fan(5), [])
+        self.assertEqual(empty.cycles(), [])
+        self.assertEqual(empty.components()['Components'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
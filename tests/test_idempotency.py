@@ -0,0 +1,134 @@
+import unittest
+
+from idempotency import DUPLICATE_KEY, MAX_KEY_LENGTH, DuplicateKey, IdempotencyKeys
+from money import Money
+
+
+def outcome(transaction_id, sender_acc=1, receiver_acc=2, amount=Money(100)):
+    return {'status': 'completed', 'transaction_id': transaction_id, 'sender_acc': sender_acc,
+            'receiver_acc': receiver_acc, 'amount': amount}
+
+
+class FakeCursor:
+    def __init__(self, rows=None, error=None):
+        self.rows = rows or {}
+        self.error = error
+        self._row = None
+
+    def execute(self, sql, params=None):
+        if self.error:
+            raise self.error
+        if 'FROM TransferKeys' in sql:
+            self._row = self.rows.get(params[0])
+
+    def fetchone(self):
+        return self._row
+
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakeDatabase:
+    def __init__(self, rows=None, error=None):
+        self.cursor = FakeCursor(rows, error)
+        self.connection = FakeConnection()
+
+
+class RecentKeysTest(unittest.TestCase):
+    def test_validate(self):
+        IdempotencyKeys.validate('k' * MAX_KEY_LENGTH)
+        for key in ('', None, 'k' * (MAX_KEY_LENGTH + 1)):
+            with self.assertRaises(ValueError):
+                IdempotencyKeys.validate(key)
+
+    def test_recent_returns_the_original_outcome(self):
+        keys = IdempotencyKeys()
+        self.assertIsNone(keys.recent('a', 1, 2, Money(100)))
+        keys.remember('a', outcome(5))
+        self.assertEqual(keys.recent('a', 1, 2, Money(100)),
+                         dict(outcome(5), idempotency_key='a', duplicate=True))
+        self.assertEqual(keys.hits, 1)
+
+    def test_least_recently_used_key_is_evicted(self):
+        keys = IdempotencyKeys(capacity=2)
+        keys.remember('a', outcome(1))
+        keys.remember('b', outcome(2))
+        # Touching 'a' makes 'b' the least recently used
+        keys.recent('a', 1, 2, Money(100))
+        keys.remember('c', outcome(3))
+        self.assertIsNotNone(keys.recent('a', 1, 2, Money(100)))
+        self.assertIsNone(keys.recent('b', 1, 2, Money(100)))
+        self.assertIsNotNone(keys.recent('c', 1, 2, Money(100)))
+
+    def test_zero_capacity_remembers_nothing(self):
+        keys = IdempotencyKeys(capacity=0)
+        keys.remember('a', outcome(1))
+        self.assertIsNone(keys.recent('a', 1, 2, Money(100)))
+        self.assertIsNone(keys.remember_first('a', outcome(1), 1, 2, Money(100)))
+
+    def test_reused_key_with_a_different_transfer_fails(self):
+        keys = IdempotencyKeys()
+        keys.remember('a', outcome(1))
+        for sender_acc, receiver_acc, amount in ((3, 2, Money(100)), (1, 3, Money(100)),
+                                                 (1, 2, Money(101))):
+            with self.assertRaisesRegex(ValueError, "already used for a different transfer"):
+                keys.recent('a', sender_acc, receiver_acc, amount)
+
+    def test_remember_first_keeps_the_earlier_outcome(self):
+        keys = IdempotencyKeys()
+        journaled = dict(outcome(None), status='journaled', transfer_id='t1')
+        self.assertIsNone(keys.remember_first('a', journaled, 1, 2, Money(100)))
+        again = keys.remember_first('a', dict(journaled, transfer_id='t2'), 1, 2, Money(100))
+        self.assertEqual(again['transfer_id'], 't1')
+        self.assertTrue(again['duplicate'])
+        with self.assertRaises(ValueError):
+            keys.remember_first('a', journaled, 1, 2, Money(5))
+
+    def test_forget_only_drops_the_named_transfer(self):
+        keys = IdempotencyKeys()
+        keys.remember('a', dict(outcome(None), status='journaled', transfer_id='t1'))
+        keys.forget('a', 't0')
+        self.assertIsNotNone(keys.recent('a', 1, 2, Money(100)))
+        keys.forget('a', 't1')
+        self.assertIsNone(keys.recent('a', 1, 2, Money(100)))
+        keys.forget('a')
+
+
+class StoredKeysTest(unittest.TestCase):
+    ROW = {'TransactionID': 9, 'SenderAccNum': 1, 'ReceiverAccNum': 2, 'Amount': '1.00'}
+
+    def test_claim_raises_duplicate_key(self):
+        db = FakeDatabase(error=Exception(DUPLICATE_KEY, "Duplicate entry"))
+        with self.assertRaises(DuplicateKey):
+            IdempotencyKeys().claim(db, 'a', 1, 2, Money(100))
+
+    def test_claim_passes_other_errors_on(self):
+        db = FakeDatabase(error=Exception(1205, "Lock wait timeout"))
+        with self.assertRaisesRegex(Exception, "Lock wait"):
+            IdempotencyKeys().claim(db, 'a', 1, 2, Money(100))
+
+    def test_lookup_reads_and_remembers_the_committed_outcome(self):
+        keys = IdempotencyKeys()
+        db = FakeDatabase(rows={'a': self.ROW})
+        self.assertIsNone(keys.lookup(db, 'b', 1, 2, Money(100)))
+        result = keys.lookup(db, 'a', 1, 2, Money(100))
+        self.assertEqual(result['transaction_id'], 9)
+        self.assertTrue(result['duplicate'])
+        self.assertEqual(db.connection.commits, 2)
+        # Answered from memory from now on
+        self.assertEqual(keys.recent('a', 1, 2, Money(100))['transaction_id'], 9)
+        with self.assertRaises(ValueError):
+            keys.lookup(db, 'a', 1, 2, Money(200))
+
+    def test_stored_requires_the_row(self):
+        with self.assertRaisesRegex(ValueError, "could not be read back"):
+            IdempotencyKeys().stored(FakeDatabase(), 'a', 1, 2, Money(100))
+
+
+if __name__ == '__main__':
+    unittest.main()
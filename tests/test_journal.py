@@ -0,0 +1,248 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from idempotency import DUPLICATE_KEY, IdempotencyKeys
+from journal import RECORD_HEADER, JournalApplier, TransferJournal
+from money import Money
+from velocity import VelocityRules, parse_rules
+
+
+class FakeCursor:
+    """Answers the applier's AppliedTransfers and TransferKeys statements and
+    records every statement"""
+
+    def __init__(self, applied_ids, transfer_keys):
+        self.applied_ids = applied_ids
+        # Idempotency key -> TransferKeys row
+        self.transfer_keys = transfer_keys
+        self.statements = []
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((' '.join(sql.split()), params))
+        if 'FROM AppliedTransfers' in sql:
+            self._rows = [{'TransferID': transfer_id} for transfer_id in params
+                          if transfer_id in self.applied_ids]
+        elif 'INSERT INTO TransferKeys' in sql:
+            if params[0] in self.transfer_keys:
+                raise Exception(DUPLICATE_KEY, "Duplicate entry")
+            self.transfer_keys[params[0]] = {
+                'TransactionID': None, 'SenderAccNum': params[1],
+                'ReceiverAccNum': params[2], 'Amount': params[3]}
+        elif 'UPDATE TransferKeys' in sql:
+            self.transfer_keys[params[1]]['TransactionID'] = params[0]
+        elif 'FROM TransferKeys' in sql:
+            row = self.transfer_keys.get(params[0])
+            self._rows = [row] if row else []
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeDatabase:
+    def __init__(self, applied_ids=(), transfer_keys=None):
+        self.cursor = FakeCursor(set(applied_ids), transfer_keys or {})
+        self.connection = FakeConnection()
+
+
+class FakeBankingSystem:
+    def __init__(self, db, rejected_senders=(), velocity=None):
+        self.db = db
+        self.velocity = velocity or VelocityRules([])
+        self.idempotency_keys = IdempotencyKeys()
+        self.rejected_senders = set(rejected_senders)
+        self.posted = []
+        self.notified = []
+
+    def post_transfer(self, sender_acc, receiver_acc, amount):
+        if sender_acc in self.rejected_senders:
+            raise ValueError("Insufficient funds")
+        self.posted.append((sender_acc, receiver_acc, amount))
+        return {'transaction_id': len(self.posted), 'sender_acc': sender_acc,
+                'receiver_acc': receiver_acc, 'amount': amount}
+
+    def notify_transfers(self, transfers):
+        self.notified.extend(transfers)
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'transfers.journal')
+
+    def open(self):
+        journal = TransferJournal(self.path)
+        self.addCleanup(journal.close)
+        return journal
+
+
+class TransferJournalTest(JournalTestCase):
+    def test_round_trip(self):
+        journal = self.open()
+        first = journal.append(1, 2, Money.of('10.50'))
+        second, third = journal.append_many([(2, 3, Money(1), 'key-2', None),
+                                             (3, 1, Money(2), None, None)])
+        self.assertEqual(second, 'key-2')
+
+        records, offset = journal.read(0, 10)
+        self.assertEqual([record['transfer_id'] for record in records], [first, second, third])
+        self.assertEqual(records[0]['amount'], Money(1050))
+        self.assertEqual(offset, journal.end_offset)
+        self.assertEqual(journal.read(offset, 10), ([], offset))
+
+    def test_torn_tail_is_truncated_on_open(self):
+        journal = self.open()
+        journal.append(1, 2, Money(100), 'a')
+        intact = journal.end_offset
+        journal.append(2, 3, Money(200), 'b')
+        journal.close()
+        # A crash part way through the second record
+        with open(self.path, 'r+b') as f:
+            f.truncate(intact + RECORD_HEADER.size + 3)
+
+        with self.assertLogs(level='WARNING'):
+            journal = self.open()
+        self.assertEqual(journal.end_offset, intact)
+        self.assertEqual(os.path.getsize(self.path), intact)
+        records, _ = journal.read(0, 10)
+        self.assertEqual([record['transfer_id'] for record in records], ['a'])
+
+    def test_corrupt_record_ends_the_scan(self):
+        journal = self.open()
+        journal.append(1, 2, Money(100), 'a')
+        intact = journal.end_offset
+        journal.append_many([(2, 3, Money(200), 'b', None), (3, 4, Money(300), 'c', None)])
+        journal.close()
+        # Flip a payload byte of the second record; the CRC no longer matches
+        with open(self.path, 'r+b') as f:
+            f.seek(intact + RECORD_HEADER.size + 5)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xFF]))
+
+        with self.assertLogs(level='WARNING'):
+            journal = self.open()
+        records, offset = journal.read(0, 10)
+        self.assertEqual([record['transfer_id'] for record in records], ['a'])
+        self.assertEqual(offset, intact)
+
+    def test_discard_through_waits_for_the_end(self):
+        journal = self.open()
+        journal.append(1, 2, Money(100))
+        _, offset = journal.read(0, 10)
+        journal.append(2, 3, Money(100))
+        self.assertFalse(journal.discard_through(offset))
+        self.assertTrue(journal.discard_through(journal.end_offset))
+        self.assertEqual(journal.end_offset, 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_second_journal_on_the_same_file_is_refused(self):
+        journal = self.open()
+        with self.assertRaisesRegex(ValueError, "already in use"):
+            TransferJournal(self.path)
+        journal.close()
+        self.open()
+
+
+class JournalApplierTest(JournalTestCase):
+    def records(self, *transfers):
+        journal = self.open()
+        journal.append_many(transfer if len(transfer) == 5 else transfer + (None,)
+                            for transfer in transfers)
+        return journal, journal.read(0, 100)[0]
+
+    def applied(self, db):
+        return [params for sql, params in db.cursor.statements
+                if sql.startswith('INSERT INTO AppliedTransfers')]
+
+    def test_skips_transfers_already_applied(self):
+        db = FakeDatabase(applied_ids={'a'})
+        system = FakeBankingSystem(db)
+        journal, records = self.records((1, 2, Money(100), 'a'), (1, 2, Money(200), 'b'),
+                                        (1, 2, Money(200), 'b'))
+        JournalApplier(journal, system).apply_batch(records)
+
+        # 'a' was applied by an earlier batch and 'b' is replayed twice in this one
+        self.assertEqual(system.posted, [(1, 2, Money(200))])
+        self.assertEqual(len(system.notified), 1)
+        self.assertEqual(self.applied(db), [('b', 1, 'applied', None)])
+        self.assertEqual(db.connection.commits, 1)
+
+    def test_rejected_transfer_rolls_back_to_its_savepoint(self):
+        db = FakeDatabase()
+        system = FakeBankingSystem(db, rejected_senders={9})
+        journal, records = self.records((9, 2, Money(100), 'a'), (1, 2, Money(100), 'b'))
+        JournalApplier(journal, system).apply_batch(records)
+
+        statements = [sql for sql, _ in db.cursor.statements]
+        self.assertIn('ROLLBACK TO SAVEPOINT journal_entry', statements)
+        self.assertEqual(self.applied(db), [('a', None, 'rejected', 'Insufficient funds'),
+                                            ('b', 1, 'applied', None)])
+        self.assertEqual(system.posted, [(1, 2, Money(100))])
+
+    def test_claims_idempotency_keys(self):
+        db = FakeDatabase(transfer_keys={'direct': {
+            'TransactionID': 7, 'SenderAccNum': 1, 'ReceiverAccNum': 2, 'Amount': Money(100)}})
+        system = FakeBankingSystem(db)
+        journal, records = self.records(
+            (1, 2, Money(100), 't1', 'k1'),
+            # The same key journaled again, e.g. by a retry after a restart
+            (1, 2, Money(100), 't2', 'k1'),
+            (1, 2, Money(100), 't3', 'direct'),
+            (1, 3, Money(100), 't4', 'direct'))
+        JournalApplier(journal, system).apply_batch(records)
+
+        self.assertEqual(system.posted, [(1, 2, Money(100))])
+        self.assertEqual(db.cursor.transfer_keys['k1']['TransactionID'], 1)
+        self.assertEqual(self.applied(db), [
+            ('t1', 1, 'applied', None),
+            ('t2', 1, 'duplicate', None),
+            ('t3', 7, 'duplicate', None),
+            ('t4', None, 'rejected',
+             "Idempotency key direct was already used for a different transfer")])
+
+    def test_rejected_key_can_be_used_again(self):
+        system = FakeBankingSystem(FakeDatabase(), rejected_senders={9})
+        keys = system.idempotency_keys
+        keys.remember('k1', {'status': 'journaled', 'transfer_id': 't1', 'sender_acc': 9,
+                             'receiver_acc': 2, 'amount': Money(100)})
+        journal, records = self.records((9, 2, Money(100), 't1', 'k1'))
+        JournalApplier(journal, system).apply_batch(records)
+        self.assertIsNone(keys.recent('k1', 9, 2, Money(100)))
+
+    def test_settles_velocity_reservations(self):
+        velocity = VelocityRules(parse_rules("count:1h:3"))
+        system = FakeBankingSystem(FakeDatabase(), rejected_senders={9}, velocity=velocity)
+        # Reserved when journaled; 'c' was journaled before a restart and was not
+        velocity.reserve(9, 2, Money(100), key='a')
+        velocity.reserve(1, 2, Money(100), key='b')
+        journal, records = self.records((9, 2, Money(100), 'a'), (1, 2, Money(100), 'b'),
+                                        (1, 3, Money(100), 'c'))
+        JournalApplier(journal, system).apply_batch(records)
+
+        self.assertIsNone(velocity.take('a'))
+        self.assertIsNone(velocity.take('b'))
+        # The rejected transfer no longer counts; both applied ones do
+        self.assertEqual(velocity._accounts[9].windows[3600].count, 0)
+        self.assertEqual(velocity._accounts[1].windows[3600].count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+from decimal import Decimal
+
+from money import INT64_MAX, Money, escape_money, sql_cents, to_cents
+
+try:
+    import pymysql
+except ImportError:
+    pymysql = None
+
+
+class ToCentsTest(unittest.TestCase):
+    def test_exact_amounts(self):
+        self.assertEqual(to_cents(Decimal('12.34')), 1234)
+        self.assertEqual(to_cents('0.5'), 50)
+        self.assertEqual(to_cents('-7.01'), -701)
+        self.assertEqual(to_cents(3), 300)
+        self.assertEqual(to_cents(Money(42)), 42)
+
+    def test_float_uses_shortest_repr(self):
+        # 0.1 and 1.15 are not exact binary floats, but mean 10 and 115 cents
+        self.assertEqual(to_cents(0.1), 10)
+        self.assertEqual(to_cents(1.15), 115)
+
+    def test_refuses_sub_cent_digits(self):
+        for value in ('0.001', Decimal('1.005'), 1.125):
+            with self.assertRaises(ValueError):
+                to_cents(value)
+
+    def test_trailing_zeros_are_not_sub_cent(self):
+        self.assertEqual(to_cents('1.2300'), 123)
+
+    def test_refuses_invalid_and_non_finite(self):
+        for value in ('abc', '', 'NaN', 'Infinity', float('inf')):
+            with self.assertRaises(ValueError):
+                to_cents(value)
+
+    def test_refuses_out_of_range(self):
+        self.assertEqual(to_cents(INT64_MAX // 100), INT64_MAX // 100 * 100)
+        with self.assertRaises(ValueError):
+            to_cents(INT64_MAX)
+
+    def test_sql_cents(self):
+        self.assertEqual(sql_cents('t2.Amount'), 'CAST(t2.Amount * 100 AS SIGNED)')
+
+
+class MoneyTest(unittest.TestCase):
+    def test_arithmetic_is_exact(self):
+        self.assertEqual(sum(Money.of('0.10') for _ in range(10)), Money.of('1.00'))
+        self.assertEqual(Money(150) - Money(200), Money(-50))
+        self.assertEqual(-Money(5), Money(-5))
+        self.assertEqual(abs(Money(-5)), Money(5))
+        self.assertEqual(Money(7) * 3, Money(21))
+        self.assertEqual(3 * Money(7), Money(21))
+
+    def test_refuses_floats(self):
+        with self.assertRaises(TypeError):
+            Money(100) + 1.5
+        with self.assertRaises(TypeError):
+            Money(100) * 1.5
+
+    def test_compares_with_decimal_and_int(self):
+        self.assertEqual(Money(1050), Decimal('10.50'))
+        self.assertEqual(Money(1000), 10)
+        self.assertLess(Money(999), Decimal('10.00'))
+        self.assertGreater(Money(1), 0)
+        self.assertNotEqual(Money(1), 0.01)
+
+    def test_hash_matches_decimal(self):
+        self.assertEqual(hash(Money(1050)), hash(Decimal('10.50')))
+        self.assertEqual(len({Money(1050), Decimal('10.50')}), 1)
+
+    def test_formatting(self):
+        self.assertEqual(str(Money(123456)), '1234.56')
+        self.assertEqual(str(Money(-5)), '-0.05')
+        self.assertEqual(f"{Money(123456789):,.2f}", '1,234,567.89')
+        self.assertEqual(repr(Money(5)), "Money('0.05')")
+
+    def test_of_and_decimal_round_trip(self):
+        amount = Money.of(Decimal('99.99'))
+        self.assertIs(Money.of(amount), amount)
+        self.assertEqual(amount.decimal(), Decimal('99.99'))
+        self.assertFalse(Money(0))
+
+
+class EncoderTest(unittest.TestCase):
+    def test_escape_money_is_exact_literal(self):
+        self.assertEqual(escape_money(Money(1)), '0.01')
+        self.assertEqual(escape_money(Money(-123456)), '-1234.56')
+
+    @unittest.skipIf(pymysql is None, "pymysql is not installed")
+    def test_encoders_add_money(self):
+        from money import encoders
+
+        conversions = encoders()
+        self.assertIs(conversions[Money], escape_money)
+        self.assertIn(Decimal, conversions)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from resultcache import ResultCache
+
+
+class ResultCacheTest(unittest.TestCase):
+    def put(self, cache, operation, tables, result='rows'):
+        key = ResultCache.key(operation, {})
+        cache.put(key, result, tables, cache.versions(tables))
+        return key
+
+    def test_key(self):
+        self.assertEqual(ResultCache.key('op', {'b': 2, 'a': 1}),
+                         ResultCache.key('op', {'a': 1, 'b': 2}))
+        self.assertIsNone(ResultCache.key('op', {'ids': [1, 2]}))
+
+    def test_hit_and_miss(self):
+        cache = ResultCache()
+        key = self.put(cache, 'accounts', ('BankAccount',), [1, 2])
+        self.assertEqual(cache.get(key), (True, [1, 2]))
+        self.assertEqual(cache.get(ResultCache.key('other', {})), (False, None))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+
+    def test_invalidate_drops_only_dependent_results(self):
+        cache = ResultCache()
+        accounts = self.put(cache, 'accounts', ('BankAccount', 'Person1'))
+        banks = self.put(cache, 'banks', ('Bank',))
+        self.assertEqual(cache.invalidate(('Person1',)), 1)
+        self.assertFalse(cache.get(accounts)[0])
+        self.assertTrue(cache.get(banks)[0])
+        # The dropped result no longer hangs off its other table
+        self.assertEqual(cache.invalidate(('BankAccount',)), 0)
+
+    def test_result_read_across_a_write_is_not_stored(self):
+        cache = ResultCache()
+        key = ResultCache.key('accounts', {})
+        versions = cache.versions(('BankAccount', 'Person1'))
+        # A writer commits to one of the tables while the query runs
+        cache.invalidate(('Person1',))
+        cache.put(key, 'stale', ('BankAccount', 'Person1'), versions)
+        self.assertEqual(cache.get(key), (False, None))
+
+        # Writes to unrelated tables do not hold a result back
+        versions = cache.versions(('BankAccount',))
+        cache.invalidate(('Bank',))
+        cache.put(key, 'fresh', ('BankAccount',), versions)
+        self.assertEqual(cache.get(key), (True, 'fresh'))
+
+    def test_least_recently_used_result_is_evicted(self):
+        cache = ResultCache(max_entries=2)
+        first = self.put(cache, 'first', ('A',))
+        second = self.put(cache, 'second', ('B',))
+        cache.get(first)
+        third = self.put(cache, 'third', ('A',))
+        self.assertFalse(cache.get(second)[0])
+        self.assertTrue(cache.get(first)[0])
+        self.assertTrue(cache.get(third)[0])
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.invalidate(('B',)), 0)
+        self.assertEqual(cache.invalidate(('A',)), 2)
+
+    def test_zero_size_stores_nothing(self):
+        cache = ResultCache(max_entries=0)
+        key = self.put(cache, 'accounts', ('BankAccount',))
+        self.assertEqual(cache.get(key), (False, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+from unittest import mock
+
+import velocity
+from money import Money
+from velocity import VelocityRules, parse_rules
+
+NOW = 1_000_000.0
+
+
+class ParseRulesTest(unittest.TestCase):
+    def test_parses_windows_and_limits(self):
+        rules = parse_rules("count:1m:10, amount:24h:500.50,receivers:2d:3")
+        self.assertEqual([(rule.kind, rule.window, rule.limit, rule.label) for rule in rules],
+                         [('count', 60, 10, '1m'), ('amount', 86400, 50050, '24h'),
+                          ('receivers', 172800, 3, '2d')])
+        self.assertEqual(parse_rules(''), [])
+
+    def test_refuses_malformed_rules(self):
+        for spec in ("count:1x:3", "foo:1m:2", "count:0m:1", "count:1m", "amount:1h:0.001"):
+            with self.assertRaises(ValueError, msg=spec):
+                parse_rules(spec)
+
+
+class VelocityRulesTest(unittest.TestCase):
+    def transfer(self, rules, sender, receiver, amount, at):
+        rules.check(sender, receiver, Money.of(amount), at)
+        rules.record(sender, receiver, Money.of(amount), at)
+
+    def test_count_window_slides(self):
+        rules = VelocityRules(parse_rules("count:1m:2"))
+        self.transfer(rules, 1, 2, '1', NOW)
+        self.transfer(rules, 1, 2, '1', NOW + 1)
+        with self.assertRaisesRegex(ValueError, "2 transfers per 1m"):
+            rules.check(1, 2, Money.of('1'), NOW + 2)
+        # Other senders have their own windows
+        rules.check(3, 2, Money.of('1'), NOW + 2)
+        # Once the first transfers slide out, there is room again
+        self.transfer(rules, 1, 2, '1', NOW + 62)
+
+    def test_amount_window_counts_cents_exactly(self):
+        rules = VelocityRules(parse_rules("amount:1h:100"))
+        for i in range(10):
+            self.transfer(rules, 1, 2, '9.99', NOW + i)
+        # 99.90 sent: 0.10 more fits, 0.11 does not
+        rules.check(1, 2, Money.of('0.10'), NOW + 10)
+        with self.assertRaisesRegex(ValueError, r"\$100\.00 sent per 1h"):
+            rules.check(1, 2, Money.of('0.11'), NOW + 10)
+
+    def test_record_accepts_int_cents(self):
+        rules = VelocityRules(parse_rules("amount:1h:1"))
+        rules.record(1, 2, 60, NOW)
+        with self.assertRaises(ValueError):
+            rules.check(1, 2, Money(41), NOW + 1)
+
+    def test_receivers_window(self):
+        rules = VelocityRules(parse_rules("receivers:1h:2"))
+        self.transfer(rules, 1, 10, '1', NOW)
+        self.transfer(rules, 1, 11, '1', NOW + 1)
+        # Paying a receiver already in the window is always allowed
+        self.transfer(rules, 1, 10, '1', NOW + 2)
+        with self.assertRaisesRegex(ValueError, "2 receivers per 1h"):
+            rules.check(1, 12, Money.of('1'), NOW + 3)
+        rules.check(1, 12, Money.of('1'), NOW + 3602)
+
+    def test_idle_accounts_are_swept(self):
+        rules = VelocityRules(parse_rules("count:1m:5"))
+        rules.record(1, 2, Money(1), NOW)
+        with mock.patch.object(velocity, 'SWEEP_INTERVAL', 1):
+            rules.record(3, 2, Money(1), NOW + 120)
+        self.assertNotIn(1, rules._accounts)
+        self.assertIn(3, rules._accounts)
+
+    def test_reserve_counts_before_commit(self):
+        rules = VelocityRules(parse_rules("count:1m:2,amount:1m:10,receivers:1m:1"))
+        rules.reserve(1, 2, Money.of('4'), NOW)
+        rules.reserve(1, 2, Money.of('4'), NOW + 1)
+        # Neither reservation has committed, yet both count
+        with self.assertRaisesRegex(ValueError, "2 transfers per 1m"):
+            rules.reserve(1, 2, Money.of('1'), NOW + 2)
+
+    def test_release_gives_the_reservation_back(self):
+        rules = VelocityRules(parse_rules("amount:1m:10,receivers:1m:1"))
+        reservation = rules.reserve(1, 2, Money.of('8'), NOW)
+        with self.assertRaises(ValueError):
+            rules.check(1, 2, Money.of('3'), NOW + 1)
+        with self.assertRaisesRegex(ValueError, "1 receivers per 1m"):
+            rules.check(1, 3, Money.of('1'), NOW + 1)
+        rules.release(reservation)
+        rules.reserve(1, 3, Money.of('10'), NOW + 1)
+
+    def test_release_after_the_window_slid_is_harmless(self):
+        rules = VelocityRules(parse_rules("count:1m:1"))
+        reservation = rules.reserve(1, 2, Money(1), NOW)
+        rules.reserve(1, 2, Money(1), NOW + 61)
+        rules.release(reservation)
+        with self.assertRaises(ValueError):
+            rules.check(1, 2, Money(1), NOW + 62)
+
+    def test_keyed_reservations_are_taken_once(self):
+        rules = VelocityRules(parse_rules("count:1m:5"))
+        reservation = rules.reserve(1, 2, Money(1), NOW, key='t1')
+        self.assertIsNone(rules.take('other'))
+        self.assertEqual(rules.take('t1'), reservation)
+        self.assertIsNone(rules.take('t1'))
+
+    def test_no_rules_allow_everything(self):
+        rules = VelocityRules([])
+        rules.record(1, 2, Money(10**12), NOW)
+        rules.check(1, 2, Money(10**12), NOW)
+        self.assertIsNone(rules.reserve(1, 2, Money(10**12), NOW, key='t1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,283 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from money import Money, sql_cents, to_cents
+
+KINDS = ('count', 'amount', 'receivers')
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Buckets per window: a count or amount window forgets its oldest
+# 1/BUCKETS at a time, so it covers between (1 - 1/BUCKETS) and 1 window
+BUCKETS = 60
+
+# Committed transfers between sweeps for accounts idle longer than every window
+SWEEP_INTERVAL = 10000
+
+# At most `limit` transfers, cents sent or distinct receivers per `window` seconds
+Rule = namedtuple('Rule', ['kind', 'window', 'limit', 'label'])
+
+# A transfer counted against its sender's windows before it commits
+Reservation = namedtuple('Reservation', ['sender_acc', 'receiver_acc', 'cents', 'at', 'key'])
+
+
+def parse_rules(spec: str) -> list:
+    """Parse "count:1m:10,amount:24h:50000,receivers:1h:5" into Rules"""
+    rules = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        kind, _, rest = item.partition(':')
+        label, _, limit = rest.partition(':')
+        if kind not in KINDS or not label or not limit:
+            raise ValueError(f"Velocity rule must be {'|'.join(KINDS)}:WINDOW:LIMIT, not {item}")
+        if label[-1] not in UNITS or not label[:-1].isdigit() or not int(label[:-1]):
+            raise ValueError(f"Velocity window must be a number of s, m, h or d, not {label}")
+        window = int(label[:-1]) * UNITS[label[-1]]
+        rules.append(Rule(kind, window, to_cents(limit) if kind == 'amount' else int(limit),
+                          label))
+    return rules
+
+
+class Window:
+    """Transfer count and cents sent by one account over a sliding window, in a ring of buckets"""
+    __slots__ = ('width', 'counts', 'amounts', 'head', 'count', 'amount')
+
+    def __init__(self, window: int):
+        self.width = window / BUCKETS
+        self.counts = [0] * BUCKETS
+        self.amounts = [0] * BUCKETS
+        self.head = 0
+        self.count = 0
+        self.amount = 0
+
+    def advance(self, now: float):
+        """Drop the buckets that have slid out of the window ending at now"""
+        bucket = int(now // self.width)
+        if bucket <= self.head:
+            return
+        if bucket - self.head >= BUCKETS:
+            self.counts = [0] * BUCKETS
+            self.amounts = [0] * BUCKETS
+            self.count = self.amount = 0
+        else:
+            for expired in range(self.head + 1, bucket + 1):
+                slot = expired % BUCKETS
+                self.count -= self.counts[slot]
+                self.amount -= self.amounts[slot]
+                self.counts[slot] = self.amounts[slot] = 0
+        self.head = bucket
+
+    def add(self, at: float, cents: int):
+        self.advance(at)
+        bucket = int(at // self.width)
+        if bucket <= self.head - BUCKETS:
+            return    # Already outside the window
+        slot = bucket % BUCKETS
+        self.counts[slot] += 1
+        self.amounts[slot] += cents
+        self.count += 1
+        self.amount += cents
+
+    def remove(self, at: float, cents: int):
+        bucket = int(at // self.width)
+        if bucket <= self.head - BUCKETS:
+            return    # Already slid out of the window
+        slot = bucket % BUCKETS
+        self.counts[slot] -= 1
+        self.amounts[slot] -= cents
+        self.count -= 1
+        self.amount -= cents
+
+
+class AccountVelocity:
+    """One sender's windows, keyed by length, and receivers by last transfer time"""
+    __slots__ = ('windows', 'receivers', 'last')
+
+    def __init__(self, windows: set):
+        self.windows = {window: Window(window) for window in windows}
+        self.receivers = OrderedDict()
+        self.last = 0.0
+
+
+class VelocityRules:
+    """Per-account sliding-window transfer limits, checked in memory
+
+    check() compares the sender's windows plus the new transfer against
+    every rule without touching the database. reserve() checks and adds the
+    transfer to the windows under one lock, so concurrent transfers from one
+    account cannot each pass a check the pair together would fail; a
+    transfer that then rolls back or is rejected gives its reservation back
+    with release(). Receivers are kept in order of their latest transfer, so
+    the ones that left the window are dropped from the front. load()
+    rebuilds the windows from the last day(s) of committed history.
+
+    A reservation made with a key, e.g. for a journaled transfer applied
+    later by another session, is found again with take().
+    """
+
+    def __init__(self, rules: list):
+        self.rules = rules
+        self.horizon = max((rule.window for rule in rules), default=0)
+        self._windows = {rule.window for rule in rules if rule.kind != 'receivers'}
+        self._receiver_window = max(
+            (rule.window for rule in rules if rule.kind == 'receivers'), default=0)
+        self._accounts = {}
+        self._reservations = {}
+        self._lock = threading.Lock()
+        self._since_sweep = 0
+
+    def check(self, sender_acc: int, receiver_acc: int, amount: Money, now: float = None):
+        """Raise ValueError if the transfer would break a rule"""
+        if not self.rules:
+            return
+        cents = to_cents(amount)
+        now = time.time() if now is None else now
+        with self._lock:
+            self._check(sender_acc, receiver_acc, cents, now)
+
+    def _check(self, sender_acc: int, receiver_acc: int, cents: int, now: float):
+        account = self._accounts.get(sender_acc)
+        if account is None:
+            windows, receivers = {}, {}
+        else:
+            for window in account.windows.values():
+                window.advance(now)
+            windows, receivers = account.windows, account.receivers
+
+        for rule in self.rules:
+            if rule.kind == 'receivers':
+                if receiver_acc in receivers and receivers[receiver_acc] > now - rule.window:
+                    continue
+                used = 0
+                for last in reversed(receivers.values()):
+                    if last <= now - rule.window:
+                        break
+                    used += 1
+                if used + 1 > rule.limit:
+                    raise ValueError(
+                        f"Transfer limit exceeded: {rule.limit} receivers per {rule.label}")
+                continue
+
+            window = windows.get(rule.window)
+            if rule.kind == 'count':
+                if (window.count if window else 0) + 1 > rule.limit:
+                    raise ValueError(
+                        f"Transfer limit exceeded: {rule.limit} transfers per {rule.label}")
+            elif (window.amount if window else 0) + cents > rule.limit:
+                raise ValueError(f"Transfer limit exceeded: ${Money(rule.limit):,.2f} "
+                                 f"sent per {rule.label}")
+
+    def reserve(self, sender_acc: int, receiver_acc: int, amount: Money,
+                now: float = None, key: str = None) -> Reservation:
+        """Check the transfer and count it against its sender's windows in one step
+
+        Raises ValueError if the transfer would break a rule. Returns the
+        reservation to release() should the transfer not commit, or None
+        when there are no rules.
+        """
+        if not self.rules:
+            return None
+        cents = to_cents(amount)
+        now = time.time() if now is None else now
+        reservation = Reservation(sender_acc, receiver_acc, cents, now, key)
+        with self._lock:
+            self._check(sender_acc, receiver_acc, cents, now)
+            self._record(sender_acc, receiver_acc, cents, now)
+            if key is not None:
+                self._reservations[key] = reservation
+        return reservation
+
+    def release(self, reservation: Reservation):
+        """Take back a reserved transfer that rolled back or was rejected
+
+        The receiver is dropped from the window if this transfer was its
+        latest, even if an earlier transfer to it is still inside.
+        """
+        if reservation is None:
+            return
+        with self._lock:
+            if reservation.key is not None:
+                self._reservations.pop(reservation.key, None)
+            account = self._accounts.get(reservation.sender_acc)
+            if account is None:
+                return
+            for window in account.windows.values():
+                window.remove(reservation.at, reservation.cents)
+            if account.receivers.get(reservation.receiver_acc) == reservation.at:
+                del account.receivers[reservation.receiver_acc]
+
+    def take(self, key: str) -> Reservation:
+        """Return and forget the reservation made with key, if there is one"""
+        with self._lock:
+            return self._reservations.pop(key, None)
+
+    def record(self, sender_acc: int, receiver_acc: int, amount, at: float = None):
+        """Add a committed transfer (Money, or int cents) to its sender's windows"""
+        if not self.rules:
+            return
+        cents = amount if isinstance(amount, int) else to_cents(amount)
+        at = time.time() if at is None else at
+        with self._lock:
+            self._record(sender_acc, receiver_acc, cents, at)
+
+    def _record(self, sender_acc: int, receiver_acc: int, cents: int, at: float):
+        account = self._accounts.get(sender_acc)
+        if account is None:
+            account = self._accounts[sender_acc] = AccountVelocity(self._windows)
+        for window in account.windows.values():
+            window.add(at, cents)
+        if self._receiver_window:
+            receivers = account.receivers
+            if at >= receivers.get(receiver_acc, 0):
+                receivers[receiver_acc] = at
+                receivers.move_to_end(receiver_acc)
+            while receivers and next(iter(receivers.values())) <= at - self._receiver_window:
+                receivers.popitem(last=False)
+        account.last = max(account.last, at)
+
+        self._since_sweep += 1
+        if self._since_sweep >= SWEEP_INTERVAL:
+            self._sweep(at)
+
+    def record_transfer(self, transfer: dict):
+        self.record(transfer['sender_acc'], transfer['receiver_acc'], transfer['amount'])
+
+    def _sweep(self, now: float):
+        """Forget accounts with nothing left in any window"""
+        self._since_sweep = 0
+        idle = [number for number, account in self._accounts.items()
+                if account.last <= now - self.horizon]
+        for number in idle:
+            del self._accounts[number]
+
+    def load(self, db) -> int:
+        """Add the committed transfers of the longest window to the windows
+
+        Only transfers whose sender account is on db are read, so loading
+        every shard counts a cross-shard transfer once. Returns the number of
+        transfers read.
+        """
+        if not self.rules:
+            return 0
+        import pymysql.cursors
+
+        since = time.time() - self.horizon
+        cursor = db.connection.cursor(pymysql.cursors.SSCursor)
+        loaded = 0
+        try:
+            cursor.execute(f"""
+                SELECT t1.SenderAccNum, t1.ReceiverAccNum, {sql_cents('t2.Amount')},
+                       UNIX_TIMESTAMP(TIMESTAMP(t2.TransactionDate, t2.TransactionTime)) as At
+                FROM Transaction2 t2
+                JOIN Transaction1 t1 ON t1.TransactionID = t2.TransactionID
+                JOIN BankAccount ba ON ba.AccountNumber = t1.SenderAccNum
+                WHERE t2.TransactionDate >= DATE(FROM_UNIXTIME(%s))
+                    AND TIMESTAMP(t2.TransactionDate, t2.TransactionTime) > FROM_UNIXTIME(%s)
+                ORDER BY At
+            """, (int(since), since))
+            for sender_acc, receiver_acc, cents, at in cursor:
+                self.record(sender_acc, receiver_acc, cents, float(at))
+                loaded += 1
+        finally:
+            cursor.close()
+        return loaded
@@ -0,0 +1,307 @@
+"""Workload capture to a compact binary trace, and replay of a trace
+
+A trace starts with MAGIC and holds two kinds of records:
+
+  b'N' id:varint len:varint utf-8    names an operation or parameter
+  b'R' time:f64 latency_us:u32 ok:u8 operation:varint count:varint
+       (parameter:varint value)*    one executed operation
+
+Values are tagged: None, True, False, int (zigzag varint), float, str,
+Decimal (as text, so it stays exact) and lists of values. Names are
+written once per recording session and referred to by id afterwards, so a
+typical transfer record takes a few dozen bytes. Sessions append to an
+existing trace, each declaring its names again; one process at a time
+should write a given file.
+"""
+import atexit
+import io
+import queue
+import struct
+import threading
+import time
+from decimal import Decimal
+
+from money import Money
+
+MAGIC = b'TXWL\x01'
+
+_RECORD = struct.Struct('<dIB')
+_FLOAT = struct.Struct('<d')
+
+_NONE, _TRUE, _FALSE, _INT, _FLOAT_TAG, _STR, _DECIMAL, _LIST = range(8)
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _encode(value, out: bytearray):
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        out += _varint(value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        out.append(_FLOAT_TAG)
+        out += _FLOAT.pack(value)
+    elif isinstance(value, (Decimal, Money)):
+        # Money is replayed as its Decimal amount, which operations convert back
+        text = str(value).encode('ascii')
+        out.append(_DECIMAL)
+        out += _varint(len(text)) + text
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        out += _varint(len(value))
+        for item in value:
+            _encode(item, out)
+    else:
+        text = str(value).encode('utf-8')
+        out.append(_STR)
+        out += _varint(len(text)) + text
+
+
+class WorkloadRecorder:
+    """Appends executed operations to a trace file; shared by every session of a process"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'ab', buffering=1 << 16)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def _name(self, name: str, out: bytearray) -> int:
+        name_id = self._names.get(name)
+        if name_id is None:
+            name_id = self._names[name] = len(self._names)
+            encoded = name.encode('utf-8')
+            out += b'N' + _varint(name_id) + _varint(len(encoded)) + encoded
+        return name_id
+
+    def record(self, operation: str, params: dict, started: float, latency: float, ok: bool):
+        """Add one operation: started is a time.time() value, latency in seconds"""
+        with self._lock:
+            if self._file.closed:
+                return
+            out = bytearray()
+            operation_id = self._name(operation, out)
+            keys = [self._name(key, out) for key in params]
+            out += b'R' + _RECORD.pack(started, min(int(latency * 1e6), 2**32 - 1), ok)
+            out += _varint(operation_id) + _varint(len(params))
+            for key, value in zip(keys, params.values()):
+                out += _varint(key)
+                _encode(value, out)
+            self._file.write(out)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def recorder(path: str) -> WorkloadRecorder:
+    """The process-wide recorder for a trace file"""
+    with _recorders_lock:
+        if path not in _recorders:
+            if not _recorders:
+                atexit.register(close_recorders)
+            _recorders[path] = WorkloadRecorder(path)
+        return _recorders[path]
+
+
+def close_recorders():
+    """Write out and close every open trace"""
+    with _recorders_lock:
+        for open_recorder in _recorders.values():
+            open_recorder.close()
+        _recorders.clear()
+
+
+class TraceReader:
+    """Iterates a trace as (started, operation, params, latency_seconds, ok)"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            stream = io.BufferedReader(f, 1 << 16)
+            if stream.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a workload trace")
+            names = {}
+            while True:
+                kind = stream.read(1)
+                if not kind:
+                    return
+                if kind == b'N':
+                    name_id = self._varint(stream)
+                    # A later recording session reuses ids from 0
+                    names[name_id] = self._exact(stream, self._varint(stream)).decode('utf-8')
+                elif kind == b'R':
+                    started, latency, ok = _RECORD.unpack(self._exact(stream, _RECORD.size))
+                    operation = names[self._varint(stream)]
+                    params = {}
+                    for _ in range(self._varint(stream)):
+                        key = names[self._varint(stream)]
+                        params[key] = self._value(stream)
+                    yield started, operation, params, latency / 1e6, bool(ok)
+                else:
+                    raise ValueError(f"Corrupt trace {self.path} at byte {stream.tell() - 1}")
+
+    @staticmethod
+    def _exact(stream, size: int) -> bytes:
+        data = stream.read(size)
+        if len(data) != size:
+            raise ValueError("Truncated trace")
+        return data
+
+    def _varint(self, stream) -> int:
+        value = shift = 0
+        while True:
+            byte = self._exact(stream, 1)[0]
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def _value(self, stream):
+        tag = self._exact(stream, 1)[0]
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _INT:
+            value = self._varint(stream)
+            return value // 2 if value % 2 == 0 else -(value + 1) // 2
+        if tag == _FLOAT_TAG:
+            return _FLOAT.unpack(self._exact(stream, _FLOAT.size))[0]
+        if tag == _STR:
+            return self._exact(stream, self._varint(stream)).decode('utf-8')
+        if tag == _DECIMAL:
+            return Decimal(self._exact(stream, self._varint(stream)).decode('ascii'))
+        if tag == _LIST:
+            return [self._value(stream) for _ in range(self._varint(stream))]
+        raise ValueError(f"Unknown value tag {tag} in trace")
+
+
+def percentiles(latencies: list) -> dict:
+    """count, p50, p90, p99 and max of latencies given in seconds, reported in ms"""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {'count': 0}
+    summary = {'count': len(ordered)}
+    for name, quantile in (('p50', 0.50), ('p90', 0.90), ('p99', 0.99)):
+        summary[name] = round(ordered[min(len(ordered) - 1, int(len(ordered) * quantile))] * 1000, 3)
+    summary['max'] = round(ordered[-1] * 1000, 3)
+    return summary
+
+
+def replay(path: str, connect, speed: float = 1.0, concurrency: int = 8,
+           operations: set = None) -> dict:
+    """Re-run a trace through connect()-ed BankingSystems
+
+    speed 1 keeps the captured pacing, N runs it N times faster and 0 sends
+    every operation as soon as a session is free. Returns the captured and
+    replayed latency distributions per operation, errors and throughput.
+    """
+    pending = queue.Queue(concurrency * 4)
+    captured, replayed, errors, lag = {}, {}, {}, []
+    lock = threading.Lock()
+
+    def worker(banking_system):
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            due, operation, params = item
+            start = time.perf_counter()
+            try:
+                banking_system.execute(operation, **params)
+                ok = True
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                lag.append(max(0.0, start - due))
+                if ok:
+                    replayed.setdefault(operation, []).append(elapsed)
+                else:
+                    errors[operation] = errors.get(operation, 0) + 1
+
+    systems = []
+    try:
+        for _ in range(concurrency):
+            systems.append(connect())
+            # Never capture the replay itself
+            systems[-1].recorder = None
+    except Exception:
+        for system in systems:
+            system.close()
+        raise
+    threads = [threading.Thread(target=worker, args=(system,), daemon=True) for system in systems]
+    for thread in threads:
+        thread.start()
+
+    origin = first = None
+    try:
+        for started, operation, params, latency, ok in TraceReader(path):
+            if operations and operation not in operations:
+                continue
+            if ok:
+                captured.setdefault(operation, []).append(latency)
+            if first is None:
+                first, origin = started, time.perf_counter()
+            due = origin + (started - first) / speed if speed else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pending.put((due, operation, params))
+    finally:
+        for _ in threads:
+            pending.put(None)
+        for thread in threads:
+            thread.join()
+        for system in systems:
+            system.close()
+    elapsed = time.perf_counter() - origin if origin else 0.0
+
+    total = sum(len(latencies) for latencies in replayed.values()) + sum(errors.values())
+    return {
+        'operations': total,
+        'elapsed_s': round(elapsed, 3),
+        'throughput': round(total / elapsed, 1) if elapsed else 0.0,
+        'schedule_lag': percentiles(lag),
+        'errors': errors,
+        'by_operation': {
+            operation: {'captured': percentiles(captured.get(operation, [])),
+                        'replayed': percentiles(replayed.get(operation, []))}
+            for operation in sorted(set(captured) | set(replayed) | set(errors))
+        },
+    }
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Per-operation change in replayed latency, in percent, against an earlier report"""
+    changes = {}
+    for operation, latencies in report['by_operation'].items():
+        before = baseline['by_operation'].get(operation, {}).get('replayed', {})
+        after = latencies['replayed']
+        changes[operation] = {
+            name: round((after[name] - before[name]) / before[name] * 100, 1)
+            for name in ('p50', 'p90', 'p99', 'max')
+            if before.get(name) and name in after
+        }
+    return changes